@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+"""
+This benchmark compares the standard library against the JSON codec
+(which uses orjson when it is installed), parsing and rendering the
+JSON documents and schemas from the test-data corpora, replicated
+in order to resemble a large batch
+"""
+
+import sys, os
+import argparse
+import glob
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libs.codec import JSONCodec
+
+DEFAULT_CORPORA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'test-data')
+
+def load_corpus(corpora_dir):
+	"""
+	It returns the raw contents of all the JSON files in the corpora
+	"""
+	corpus = []
+	for json_path in sorted(glob.glob(os.path.join(corpora_dir, '**', '*.json'), recursive=True)):
+		with open(json_path, mode='rb') as jh:
+			corpus.append(jh.read())
+	
+	return corpus
+
+def build_results(documents):
+	"""
+	It mimics the validation results rendered by the batch endpoints
+	"""
+	return [ {'file': '(inline{})'.format(i_doc), 'validated': False, 'schema_id': 'https://example.org/schema.json', 'schema_hash': 'f' * 40, 'errors': [{'reason': 'schema_error', 'description': 'Some error', 'path': '/properties/x', 'schema_path': '/a/b', 'document': document}]}  for i_doc, document in enumerate(documents) ]
+
+def time_it(func, repetitions):
+	timings = []
+	for _ in range(repetitions):
+		start = time.perf_counter()
+		func()
+		timings.append(time.perf_counter() - start)
+	
+	timings.sort()
+	return {
+		'min': timings[0],
+		'median': timings[len(timings) // 2],
+		'max': timings[-1]
+	}
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description="Standard library versus JSON codec benchmark")
+	ap.add_argument('-n', '--repetitions', type=int, default=5, help="Number of repetitions of each measurement")
+	ap.add_argument('-s', '--scale', type=int, default=200, help="Number of times the corpora are replicated")
+	ap.add_argument('corpora', nargs='?', default=DEFAULT_CORPORA_DIR, help="Directory with the JSON corpora")
+	args = ap.parse_args()
+	
+	corpus = load_corpus(args.corpora) * args.scale
+	# One request body holding all the documents, like the array endpoint gets
+	batch = b'[' + b','.join(corpus) + b']'
+	documents = json.loads(batch)
+	results = build_results(documents)
+	
+	if json.loads(batch) != JSONCodec.loads(batch):
+		raise AssertionError("The JSON codec does not parse the batch as the standard library does")
+	if json.loads(JSONCodec.dumps(results)) != results:
+		raise AssertionError("The JSON codec does not render the results as the standard library does")
+	
+	measures = {
+		'parse_documents': (lambda: [ json.loads(raw)  for raw in corpus ], lambda: [ JSONCodec.loads(raw)  for raw in corpus ]),
+		'parse_batch': (lambda: json.loads(batch), lambda: JSONCodec.loads(batch)),
+		'render_results': (lambda: json.dumps(results).encode('utf-8'), lambda: JSONCodec.dumpb(results)),
+	}
+	
+	report = {
+		'backend': JSONCodec.Backend,
+		'documents': len(corpus),
+		'batch_size': len(batch),
+		'repetitions': args.repetitions,
+		'measures': {}
+	}
+	for measure, (stdlib_func, codec_func) in measures.items():
+		stdlib_timings = time_it(stdlib_func, args.repetitions)
+		codec_timings = time_it(codec_func, args.repetitions)
+		report['measures'][measure] = {
+			'stdlib': stdlib_timings,
+			'codec': codec_timings,
+			'speedup': stdlib_timings['median'] / codec_timings['median']
+		}
+	
+	print(json.dumps(report, indent=4))
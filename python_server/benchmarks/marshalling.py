@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+"""
+This microbenchmark compares flask-restx marshalling against the fast
+marshaller, rendering the validation results of a synthetic archive
+whose documents have several errors each
+"""
+
+import sys, os
+import argparse
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask_restx import marshal
+
+from libs.res.ftv_models import validation_model
+from libs.res.marshalling import FastMarshaller
+
+def build_results(num_documents, errors_per_document):
+	"""
+	The errors mimic the ones reported by the validator
+	"""
+	results = []
+	for i_doc in range(num_documents):
+		result = {
+			'file': 'archive/{:06d}.json'.format(i_doc),
+			'validated': False,
+			'schema_id': 'https://w3id.org/ft/v1/fairtracks_track.schema.json',
+			'schema_hash': '1f084a4fe55d57da4d47060aaf0b9edcf14407b3',
+			'errors': []
+		}
+		for i_error in range(errors_per_document):
+			result['errors'].append({
+				'reason': 'schema_error',
+				'description': "'term_{}' is not one of the allowed values".format(i_error),
+				'path': '/properties/experiments/{}/term_id'.format(i_error),
+				'schema_path': '/properties/experiments/items/properties/term_id/enum',
+			})
+		results.append(result)
+	
+	return results
+
+def time_it(func, repetitions):
+	timings = []
+	output = None
+	for _ in range(repetitions):
+		start = time.perf_counter()
+		output = func()
+		timings.append(time.perf_counter() - start)
+	
+	timings.sort()
+	return {
+		'min': timings[0],
+		'median': timings[len(timings) // 2],
+		'max': timings[-1]
+	}, output
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description="flask-restx versus fast marshalling microbenchmark")
+	ap.add_argument('-n', '--repetitions', type=int, default=5, help="Number of repetitions of each measurement")
+	ap.add_argument('-d', '--documents', type=int, default=10000, help="Number of validation results")
+	ap.add_argument('-e', '--errors', type=int, default=5, help="Number of errors of each validation result")
+	args = ap.parse_args()
+	
+	results = build_results(args.documents, args.errors)
+	fast_marshaller = FastMarshaller.Get(validation_model, skip_none=True)
+	
+	restx_timings, restx_output = time_it(lambda: marshal(results, validation_model, skip_none=True), args.repetitions)
+	fast_timings, fast_output = time_it(lambda: fast_marshaller(results), args.repetitions)
+	
+	# Same output, and also the same serialization
+	if json.dumps(restx_output) != json.dumps(fast_output):
+		raise AssertionError("The fast marshaller does not render what flask-restx does")
+	
+	print(json.dumps({
+		'documents': args.documents,
+		'errors_per_document': args.errors,
+		'repetitions': args.repetitions,
+		'flask_restx': restx_timings,
+		'fast': fast_timings,
+		'speedup': restx_timings['median'] / fast_timings['median']
+	}, indent=4))
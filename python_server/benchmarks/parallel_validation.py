@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+"""
+This benchmark validates a synthetic archive of documents with primary
+and foreign keys, serially and on pools of increasing size, checking
+the parallel results match the serial ones. The pool is started (and
+its workers restore the schema set) on an untimed first validation,
+which is reported apart. The recommended pool size is the fastest one
+beating the serial validation by the given margin, if any, as
+parallel_validation should stay disabled otherwise
+"""
+
+import sys, os
+import argparse
+import io
+import json
+import random
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fairtracks_validator.extensions.curie_search import CurieSearch
+
+from libs.archive_reader import ArchiveReader
+from libs.parallel_validation import ParallelValidation
+
+from snapshot_startup import load_schemas
+
+DEFAULT_SCHEMAS_DIRS = [
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'test-data', 'foreign_key_example', 'schemas'),
+]
+
+def build_archive(num_documents, seed):
+	"""
+	Half of the documents declare compound primary keys, and the other
+	half reference them, some of them with schema errors or dangling
+	references
+	"""
+	rnd = random.Random(seed)
+	num_pks = max(num_documents // 2, 1)
+	
+	raw_archive = io.BytesIO()
+	with zipfile.ZipFile(raw_archive, mode='w', compression=zipfile.ZIP_DEFLATED) as outzip:
+		for i_doc in range(num_documents):
+			if i_doc < num_pks:
+				doc = {
+					'@schema': 'compound_pk_example/1.0',
+					'local_id': 'local_{}'.format(i_doc),
+					'other_id': 'other_{}'.format(i_doc)
+				}
+				member_name = 'pk/{:06d}.json'.format(i_doc)
+			else:
+				i_ref = rnd.randrange(num_pks)
+				doc = {
+					'@schema': 'foreign_key_example/1.0',
+					'something': {
+						'ref_local_id': 'local_{}'.format(i_ref),
+						'ref_other_id': 'other_{}'.format(i_ref)
+					}
+				}
+				dice = rnd.random()
+				if dice < 0.01:
+					doc['something']['ref_other_id'] = 'dangling_{}'.format(i_doc)
+				elif dice < 0.02:
+					doc['unexpected'] = True
+				member_name = 'fk/{:06d}.json'.format(i_doc)
+			
+			outzip.writestr(member_name, json.dumps(doc))
+	
+	return raw_archive.getvalue()
+
+def read_archive(raw_archive):
+	"""
+	It mimics what the archive endpoint feeds the validator with
+	"""
+	return [ {'file': member_path, 'json': json_doc, 'errors': []}  for member_path, json_doc, _ in ArchiveReader(raw_archive, ArchiveReader.ZIP_MIME_TYPE) ]
+
+def summarize(report):
+	return [ (jsonObj['file'], jsonObj.get('schema_id'), jsonObj['errors'])  for jsonObj in report ]
+
+def time_it(validate, raw_archive, repetitions):
+	timings = []
+	report = None
+	for _ in range(repetitions):
+		start = time.perf_counter()
+		report = validate(*read_archive(raw_archive))
+		timings.append(time.perf_counter() - start)
+	
+	timings.sort()
+	return {
+		'min': timings[0],
+		'median': timings[len(timings) // 2],
+		'max': timings[-1]
+	}, summarize(report)
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description="Serial versus parallel validation benchmark")
+	ap.add_argument('-n', '--repetitions', type=int, default=3, help="Number of repetitions of each measurement")
+	ap.add_argument('-d', '--documents', type=int, default=10000, help="Number of documents in the synthetic archive")
+	ap.add_argument('-p', '--processes', type=int, nargs='+', default=[2, 4, 8], help="Pool sizes to measure")
+	ap.add_argument('--seed', type=int, default=42, help="Seed of the synthetic archive")
+	ap.add_argument('--min-speedup', type=float, default=1.2, help="Speedup a pool size must reach to be recommended")
+	ap.add_argument('schemas', nargs='*', default=DEFAULT_SCHEMAS_DIRS, help="JSON Schema files or directories to load")
+	args = ap.parse_args()
+	
+	raw_archive = build_archive(args.documents, args.seed)
+	with tempfile.TemporaryDirectory(prefix='ftv', suffix='bench') as cacheDir:
+		config = {'cacheDir': cacheDir}
+		fgv, _ = load_schemas(config, args.schemas)
+		# The second pass needs it, as it happens in the server
+		CurieSearch.GetCurieCache(cachePath=cacheDir, warmUp=True)
+		
+		serial_timings, serial_report = time_it(fgv.jsonValidate, raw_archive, args.repetitions)
+		results = {
+			'documents': args.documents,
+			'archive_size': len(raw_archive),
+			'cpus': os.cpu_count(),
+			'repetitions': args.repetitions,
+			'serial': serial_timings,
+			'parallel': {}
+		}
+		
+		for processes in args.processes:
+			parallel_validation = ParallelValidation(processes, min_documents=1)
+			parallel_validation.reset(fgv)
+			try:
+				startup_timings, _ = time_it(parallel_validation.jsonValidate, raw_archive, 1)
+				parallel_timings, parallel_report = time_it(parallel_validation.jsonValidate, raw_archive, args.repetitions)
+			finally:
+				parallel_validation.close()
+			
+			if parallel_report != serial_report:
+				raise AssertionError("Parallel validation with {} processes does not match the serial one".format(processes))
+			
+			results['parallel'][processes] = parallel_timings
+			results['parallel'][processes]['first'] = startup_timings['median']
+			results['parallel'][processes]['speedup'] = serial_timings['median'] / parallel_timings['median']
+		
+		faster = [ processes  for processes, timings in results['parallel'].items()  if timings['speedup'] >= args.min_speedup ]
+		results['recommended_processes'] = max(faster, key=lambda processes: results['parallel'][processes]['speedup'])  if faster  else None
+		
+		print(json.dumps(results, indent=4))
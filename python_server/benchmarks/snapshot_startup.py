@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+"""
+This benchmark compares the time spent by a new process loading the
+schema set through loadJSONSchemas against the time spent restoring
+it from a validator snapshot
+"""
+
+import sys, os
+import argparse
+import json
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fairtracks_validator.fairtracks_validator import FairGTracksValidator
+
+from libs.snapshot import ValidatorSnapshot
+
+DEFAULT_SCHEMAS_DIRS = [
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'test-data', 'fairtracks_simple', 'schemas'),
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'test-data', 'foreign_key_example', 'schemas'),
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'test-data', 'foreignProperty_simple', 'schemas'),
+]
+
+def read_curated_schemas(schema_paths):
+	"""
+	It mimics what init_cache leaves in the server instance
+	"""
+	curated_schemas = {}
+	pending = list(schema_paths)
+	while len(pending) > 0:
+		schema_path = pending.pop(0)
+		if os.path.isdir(schema_path):
+			pending.extend(os.path.join(schema_path, rel_path)  for rel_path in sorted(os.listdir(schema_path))  if rel_path[0] != '.')
+		elif '.json' in schema_path:
+			with open(schema_path, mode='r', encoding='utf-8') as sh:
+				jss = json.load(sh)
+			schema_hash = FairGTracksValidator.GetNormalizedJSONHash(jss)
+			curated_schemas[schema_hash] = {
+				'source': jss,
+				'info': {
+					'source_urls': [ 'file://' + os.path.abspath(schema_path) ],
+					'schema_hash': schema_hash,
+					'errors': []
+				}
+			}
+	
+	return curated_schemas
+
+def load_schemas(config, schema_paths):
+	curated_schemas = read_curated_schemas(schema_paths)
+	fgv = FairGTracksValidator(config=config, isRW=False)
+	cached_schemas = map(lambda curated_schema: {'schema': curated_schema.get('source'), 'file': curated_schema['info']['source_urls'][0], 'errors': curated_schema['info'].setdefault('errors',[])}, curated_schemas.values())
+	fgv.loadJSONSchemas(*cached_schemas)
+	
+	return fgv, curated_schemas
+
+def restore_schemas(config, schema_paths, snapshot_dir):
+	curated_schemas = read_curated_schemas(schema_paths)
+	fgv = FairGTracksValidator(config=config, isRW=False)
+	state = ValidatorSnapshot.Load(snapshot_dir, curated_schemas)
+	if state is None:
+		raise AssertionError("The snapshot does not match the schemas")
+	ValidatorSnapshot.Restore(fgv, state, curated_schemas)
+	
+	return fgv, curated_schemas
+
+def time_it(method, repetitions, *args):
+	timings = []
+	for _ in range(repetitions):
+		start = time.perf_counter()
+		method(*args)
+		timings.append(time.perf_counter() - start)
+	
+	timings.sort()
+	return {
+		'min': timings[0],
+		'median': timings[len(timings) // 2],
+		'max': timings[-1]
+	}
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description="Schema set load versus snapshot restore benchmark")
+	ap.add_argument('-n', '--repetitions', type=int, default=20, help="Number of repetitions of each measurement")
+	ap.add_argument('schemas', nargs='*', default=DEFAULT_SCHEMAS_DIRS, help="JSON Schema files or directories to load")
+	args = ap.parse_args()
+	
+	with tempfile.TemporaryDirectory(prefix='ftv', suffix='bench') as cacheDir:
+		config = {'cacheDir': cacheDir}
+		
+		# The snapshot is written once, as the rebuilding process does
+		fgv, curated_schemas = load_schemas(config, args.schemas)
+		snapshot = ValidatorSnapshot.Capture(fgv, curated_schemas)
+		snapshot.save(cacheDir)
+		
+		load_timings = time_it(load_schemas, args.repetitions, config, args.schemas)
+		restore_timings = time_it(restore_schemas, args.repetitions, config, args.schemas, cacheDir)
+		
+		print(json.dumps({
+			'schemas': len(fgv.getValidSchemas()),
+			'snapshot_size': len(snapshot.payload),
+			'repetitions': args.repetitions,
+			'load': load_timings,
+			'restore': restore_timings,
+			'speedup': load_timings['median'] / restore_timings['median']
+		}, indent=4))
@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+"""
+Benchmark suite of the validation server, over synthetic corpora
+generated from the test-data schemas
+"""
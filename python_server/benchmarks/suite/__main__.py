@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+"""
+It runs the benchmark suite over a synthetic corpus, reporting as JSON
+the documents per second, the latency percentiles and the peak RSS of
+each measure. Run it from the benchmarks directory:
+
+	python -m suite --documents 100000 --output report.json
+"""
+
+import sys, os
+import argparse
+import datetime
+import io
+import json
+import platform
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import yaml
+
+from fairtracks_validator.extensions.curie_search import CurieSearch
+
+from libs.app import init_validator_app
+from libs.codec import JSONCodec
+from libs.ft_validator import FAIRTracksValidatorSingleton
+
+from .corpus import add_corpus_arguments, corpus_from_arguments
+from .measures import Measure, run_isolated
+
+def measure_startup(config):
+	"""
+	The first start populates an empty cache, and the second one
+	reuses it, as a restarted server does
+	"""
+	with tempfile.TemporaryDirectory(prefix='ftv', suffix='bench') as cache_dir:
+		startup_config = dict(config)
+		startup_config['cacheDir'] = cache_dir
+		report = {}
+		for startup in ('cold_seconds', 'warm_seconds'):
+			start = time.perf_counter()
+			FAIRTracksValidatorSingleton(dict(startup_config))
+			report[startup] = time.perf_counter() - start
+	
+	return report
+
+def measure_init_cache(ftv, repetitions):
+	def init_cache():
+		with ftv.SchemaCacheLock.exclusive_blocking_lock():
+			ftv.init_cache()
+		return 0, True
+	
+	measure = Measure()
+	for _ in range(repetitions):
+		measure.call(init_cache)
+	
+	return measure.report()
+
+def measure_validate(ftv, batches, repetitions):
+	failed_documents = []
+	def validate(batch):
+		results = ftv.validate(*batch)
+		if isinstance(results, tuple):
+			return len(batch), False
+		
+		# The first pass tells how many injected errors were found
+		if len(failed_documents) < len(batches):
+			failed_documents.append(sum(map(lambda result: 0  if result['validated']  else 1, results)))
+		return len(batch), True
+	
+	measure = Measure()
+	for _ in range(repetitions):
+		for batch in batches:
+			measure.call(validate, batch)
+	
+	report = measure.report()
+	report['failed_documents'] = sum(failed_documents)
+	return report
+
+def measure_requests(client, requests, repetitions):
+	"""
+	Each request is a tuple of the number of documents, the method,
+	the path and the keyword arguments of the test client
+	"""
+	def request(num_documents, method, path, kwargs):
+		if 'data' in kwargs and isinstance(kwargs['data'], dict):
+			# Multipart uploads are consumed
+			kwargs = dict(kwargs, data={ field: (io.BytesIO(raw), filename)  for field, (raw, filename) in kwargs['data'].items() })
+		response = client.open(path, method=method, **kwargs)
+		# Streamed responses are fully read
+		response.get_data()
+		return num_documents, response.status_code == 200
+	
+	measure = Measure()
+	for _ in range(repetitions):
+		for num_documents, method, path, kwargs in requests:
+			measure.call(request, num_documents, method, path, kwargs)
+	
+	return measure.report()
+
+def http_measures(corpus, members, batches, single_requests):
+	single_docs = [ doc  for _, doc in members[:max(1, single_requests)] ]
+	archives = [ corpus.archive(batch)  for batch in batches ]
+	
+	return {
+		'GET /info': [ (0, 'GET', '/info', {}) ] * single_requests,
+		'GET /schemas': [ (0, 'GET', '/schemas', {}) ] * single_requests,
+		'POST /validate': [ (1, 'POST', '/validate', {'json': doc})  for doc in single_docs ],
+		'POST /validate/array': [ (len(batch), 'POST', '/validate/array', {'json': [ doc  for _, doc in batch ]})  for batch in batches ],
+		'POST /validate/archive': [ (len(batch), 'POST', '/validate/archive', {'data': archive, 'content_type': 'application/zip'})  for batch, archive in zip(batches, archives) ],
+		'POST /validate/multipart': [ (len(batch), 'POST', '/validate/multipart', {'data': {'file': (archive, 'corpus.zip')}, 'content_type': 'multipart/form-data'})  for batch, archive in zip(batches, archives) ],
+		'POST /validate/stream': [ (len(batch), 'POST', '/validate/stream', {'data': archive, 'content_type': 'application/zip'})  for batch, archive in zip(batches, archives) ],
+	}
+
+MEASURES = [
+	'startup',
+	'init_cache',
+	'validate',
+	'GET /info',
+	'GET /schemas',
+	'POST /validate',
+	'POST /validate/array',
+	'POST /validate/archive',
+	'POST /validate/multipart',
+	'POST /validate/stream',
+]
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(prog='python -m suite', description="FAIRtracks validator benchmark suite")
+	add_corpus_arguments(ap)
+	ap.add_argument('-n', '--repetitions', type=int, default=3, help="Number of repetitions of each measure")
+	ap.add_argument('-b', '--batch-size', type=int, default=0, help="Documents in each batch. By default, all of them are validated at once, as cross-document references span the whole corpus")
+	ap.add_argument('-s', '--single-requests', type=int, default=100, help="Number of requests of the single document and query endpoints")
+	ap.add_argument('-m', '--measures', nargs='+', choices=MEASURES, default=MEASURES, help="Measures to run")
+	ap.add_argument('-c', '--config', help="YAML file with server configuration blocks to use (e.g. validation_cache, parallel_validation)")
+	ap.add_argument('-o', '--output', help="File where the JSON report is written. By default, it is printed")
+	args = ap.parse_args()
+	
+	extra_config = {}
+	if args.config is not None:
+		with open(args.config, mode='r', encoding='utf-8') as ch:
+			extra_config = yaml.safe_load(ch) or {}
+	
+	corpus = corpus_from_arguments(args)
+	members = list(corpus)
+	batch_size = args.batch_size  if args.batch_size > 0  else len(members)
+	batches = [ members[i_member:i_member + batch_size]  for i_member in range(0, len(members), batch_size) ]
+	
+	report = {
+		'started': datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat(),
+		'environment': {
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'cpus': os.cpu_count(),
+			'json_backend': JSONCodec.Backend
+		},
+		'corpus': corpus.manifest(),
+		'repetitions': args.repetitions,
+		'batch_size': batch_size,
+		'config': extra_config,
+		'measures': {}
+	}
+	
+	with tempfile.TemporaryDirectory(prefix='ftv', suffix='bench') as cache_dir:
+		config = dict(extra_config)
+		config['cacheDir'] = cache_dir
+		config['schemas'] = corpus.schema_urls
+		# The validations need it, as it happens in the server
+		CurieSearch.GetCurieCache(cachePath=cache_dir, warmUp=True)
+		
+		# Measures are forked from the loaded server, so they share it
+		app, ftv = init_validator_app(dict(config))
+		requests = http_measures(corpus, members, batches, args.single_requests)
+		for measure_name in args.measures:
+			if measure_name == 'startup':
+				measure_report = run_isolated(measure_startup, config)
+			elif measure_name == 'init_cache':
+				measure_report = run_isolated(measure_init_cache, ftv, args.repetitions)
+			elif measure_name == 'validate':
+				measure_report = run_isolated(measure_validate, ftv, batches, args.repetitions)
+			else:
+				measure_report = run_isolated(measure_requests, app.test_client(), requests[measure_name], args.repetitions)
+			report['measures'][measure_name] = measure_report
+	
+	if args.output is not None:
+		with open(args.output, mode='w', encoding='utf-8') as oh:
+			json.dump(report, oh, indent=4)
+	else:
+		print(json.dumps(report, indent=4))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+"""
+It compares two reports from the benchmark suite, telling for each
+common measure the ratios of the new values to the baseline ones
+"""
+
+import argparse
+import json
+
+COMPARED_VALUES = [
+	('documents_per_second',),
+	('latency_seconds', 'p50'),
+	('latency_seconds', 'p90'),
+	('latency_seconds', 'p99'),
+	('peak_rss_kb',),
+	('cold_seconds',),
+	('warm_seconds',),
+]
+
+def get_value(measure_report, value_path):
+	value = measure_report
+	for step in value_path:
+		if not isinstance(value, dict):
+			return None
+		value = value.get(step)
+	
+	return value
+
+def compare(baseline, report):
+	comparison = {}
+	for measure_name, measure_report in report.get('measures', {}).items():
+		baseline_report = baseline.get('measures', {}).get(measure_name)
+		if baseline_report is None:
+			continue
+		
+		ratios = {}
+		for value_path in COMPARED_VALUES:
+			baseline_value = get_value(baseline_report, value_path)
+			value = get_value(measure_report, value_path)
+			if isinstance(baseline_value, (int, float)) and isinstance(value, (int, float)) and baseline_value != 0:
+				ratios['.'.join(value_path)] = value / baseline_value
+		comparison[measure_name] = ratios
+	
+	return comparison
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description="Benchmark suite reports comparison")
+	ap.add_argument('baseline', help="The report of the baseline run")
+	ap.add_argument('report', help="The report of the run to compare")
+	args = ap.parse_args()
+	
+	with open(args.baseline, mode='r', encoding='utf-8') as bh:
+		baseline = json.load(bh)
+	with open(args.report, mode='r', encoding='utf-8') as rh:
+		report = json.load(rh)
+	
+	print(json.dumps({
+		'corpus': report.get('corpus'),
+		'same_corpus': baseline.get('corpus') == report.get('corpus'),
+		'ratios': compare(baseline, report)
+	}, indent=4))
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+"""
+Synthetic corpora, scaled from the test-data schemas. The schemas are
+inspected to find their keys (unique, primary_key) and their references
+(foreign_keys, foreignProperty), so the generated documents reference
+existing ones, and the injected errors are the ones the validator
+has to find
+"""
+
+import sys, os
+import argparse
+import glob
+import io
+import json
+import random
+import zipfile
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'test-data')
+
+# The schemas of each dataset (some directories have broken ones on purpose)
+DATASETS = {
+	'unique_simple': ['unique_simple/unique_schema.json'],
+	'compound_pk': ['compound_pk/compound_pk_schema.json'],
+	'compound_unique': ['compound_unique/compound_unique_schema.json'],
+	'multiple_unique': ['multiple_unique/multiple_unique_schema.json'],
+	'foreign_key_example': ['foreign_key_example/schemas'],
+	'foreignProperty_simple': ['foreignProperty_simple/schemas'],
+	'fairtracks_simple': ['fairtracks_simple/schemas'],
+}
+
+DEFAULT_DATASET = 'foreign_key_example'
+
+class SchemaModel(object):
+	"""
+	What the generator needs to know from a JSON Schema. Only objects
+	whose leaves are plain strings are understood
+	"""
+	def __init__(self, jss):
+		self.schema_id = jss.get('$id')
+		self.string_paths = []
+		self.keys = []
+		self.references = []
+		self.supported = (jss.get('type') == 'object') and (self.schema_id is not None)
+		if self.supported:
+			self._walk(jss, ())
+	
+	def _walk(self, jss, prefix):
+		properties = jss.get('properties', {})
+		for prop_name, prop in properties.items():
+			path = prefix + (prop_name,)
+			prop_type = prop.get('type')
+			if prop_name == '@schema':
+				continue
+			elif prop_type == 'object':
+				self._walk(prop, path)
+			elif (prop_type == 'string') and (set(prop.keys()) <= {'type', 'description', 'unique', 'foreignProperty'}):
+				self.string_paths.append(path)
+				if prop.get('unique') is True:
+					self.keys.append([ path ])
+				if 'foreignProperty' in prop:
+					target_schema_id, _, target_member = prop['foreignProperty'].partition('#')
+					self.references.append(([ path ], target_schema_id, [ target_member ]))
+			else:
+				self.supported = False
+		
+		for key_keyword in ('unique', 'primary_key'):
+			members = jss.get(key_keyword)
+			if isinstance(members, list):
+				self.keys.append([ prefix + (member,)  for member in members ])
+		
+		for foreign_key in jss.get('foreign_keys', []):
+			# Members are matched against the primary key of the target
+			self.references.append(([ prefix + (member,)  for member in foreign_key['members'] ], foreign_key['schema_id'], None))
+	
+	@property
+	def primary_key(self):
+		return self.keys[0]  if len(self.keys) > 0  else []
+
+class SyntheticCorpus(object):
+	"""
+	It generates num_documents documents for the schemas of a dataset.
+	When some schemas reference other ones, the referenced documents are
+	num_documents / (fanout + 1), so each one is referenced by fanout
+	documents on average. The members of compound keys take
+	key_cardinality distinct values each, while their combinations are
+	still unique. A fraction error_rate of the documents get an error:
+	a wrong type, a duplicated key or a dangling reference.
+	
+	Datasets whose schemas are not understood (like the ones using
+	ontology terms) are scaled replicating their fixtures, taking the
+	bad ones with error_rate probability.
+	"""
+	def __init__(self, dataset=DEFAULT_DATASET, num_documents=1000, key_cardinality=100, fanout=4, error_rate=0.01, seed=42, test_data_dir=TEST_DATA_DIR):
+		self.dataset = dataset
+		self.num_documents = num_documents
+		self.key_cardinality = max(2, key_cardinality)
+		self.fanout = fanout
+		self.error_rate = error_rate
+		self.seed = seed
+		self.test_data_dir = test_data_dir
+		self.schema_paths = self._schema_paths()
+		self.models = []
+		for schema_path in self.schema_paths:
+			with open(schema_path, mode='r', encoding='utf-8') as sh:
+				self.models.append(SchemaModel(json.load(sh)))
+		self.mode = 'synthetic'  if all(map(lambda model: model.supported, self.models))  else 'replicated'
+		self.injected = {}
+	
+	def _schema_paths(self):
+		schema_paths = []
+		for rel_path in DATASETS[self.dataset]:
+			schema_path = os.path.join(self.test_data_dir, rel_path)
+			if os.path.isdir(schema_path):
+				schema_paths.extend(sorted(glob.glob(os.path.join(schema_path, '*.json'))))
+			else:
+				schema_paths.append(schema_path)
+		
+		return [ os.path.abspath(schema_path)  for schema_path in schema_paths ]
+	
+	@property
+	def schema_urls(self):
+		return [ 'file://' + schema_path  for schema_path in self.schema_paths ]
+	
+	def manifest(self):
+		return {
+			'dataset': self.dataset,
+			'mode': self.mode,
+			'documents': self.num_documents,
+			'key_cardinality': self.key_cardinality,
+			'fanout': self.fanout,
+			'error_rate': self.error_rate,
+			'seed': self.seed,
+			'schemas': [ model.schema_id  for model in self.models ],
+			'injected_errors': dict(self.injected)
+		}
+	
+	def _key_value(self, path, i_member, num_members, i_doc):
+		"""
+		The members of a compound key are the digits of the document
+		index in base key_cardinality, the last one being unbounded
+		"""
+		if num_members == 1:
+			digit = i_doc
+		elif i_member < num_members - 1:
+			digit = (i_doc // (self.key_cardinality ** i_member)) % self.key_cardinality
+		else:
+			digit = i_doc // (self.key_cardinality ** i_member)
+		
+		return '{}_{}'.format(path[-1], digit)
+	
+	def _values(self, model, i_doc):
+		values = { path: '{}_{}'.format(path[-1], i_doc)  for path in model.string_paths }
+		for key in model.keys:
+			for i_member, path in enumerate(key):
+				values[path] = self._key_value(path, i_member, len(key), i_doc)
+		
+		return values
+	
+	@staticmethod
+	def _document(model, values):
+		doc = {'@schema': model.schema_id}
+		for path, value in values.items():
+			parent = doc
+			for step in path[:-1]:
+				parent = parent.setdefault(step, {})
+			parent[path[-1]] = value
+		
+		return doc
+	
+	def _count(self, kind):
+		self.injected[kind] = self.injected.get(kind, 0) + 1
+	
+	def __iter__(self):
+		"""
+		It yields the (member path, document) pairs
+		"""
+		self.injected = {}
+		rnd = random.Random(self.seed)
+		if self.mode == 'synthetic':
+			yield from self._iter_synthetic(rnd)
+		else:
+			yield from self._iter_replicated(rnd)
+	
+	def _iter_synthetic(self, rnd):
+		models_by_id = { model.schema_id: model  for model in self.models }
+		sources = list(filter(lambda model: len(model.references) > 0, self.models))
+		targets = list(filter(lambda model: len(model.references) == 0, self.models))
+		if len(sources) > 0 and len(targets) > 0:
+			num_targets = max(1, round(self.num_documents / (self.fanout + 1)))
+		else:
+			sources = []
+			targets = self.models
+			num_targets = self.num_documents
+		
+		# Documents are evenly spread among the schemas of each role
+		num_target_docs = { model.schema_id: (num_targets // len(targets)) + (1  if i_model < (num_targets % len(targets))  else 0)  for i_model, model in enumerate(targets) }
+		counts = {}
+		for i_doc in range(self.num_documents):
+			models = targets  if i_doc < num_targets  else sources
+			model = models[i_doc % len(models)]
+			i_model_doc = counts.get(model.schema_id, 0)
+			counts[model.schema_id] = i_model_doc + 1
+			
+			values = self._values(model, i_model_doc)
+			for paths, target_schema_id, target_members in model.references:
+				target = models_by_id[target_schema_id]
+				target_values = self._values(target, rnd.randrange(max(1, num_target_docs.get(target_schema_id, 0))))
+				target_paths = target.primary_key  if target_members is None  else [ (member,)  for member in target_members ]
+				for path, target_path in zip(paths, target_paths):
+					values[path] = target_values[target_path]
+			
+			if rnd.random() < self.error_rate:
+				kinds = ['type']
+				if len(model.references) > 0:
+					kinds.append('dangling')
+				elif (len(model.keys) > 0) and (i_model_doc > 0):
+					kinds.append('duplicate')
+				
+				kind = rnd.choice(kinds)
+				if kind == 'type':
+					values[rnd.choice(model.string_paths)] = i_doc
+				elif kind == 'dangling':
+					for path in model.references[0][0]:
+						values[path] = 'dangling_{}'.format(i_doc)
+				else:
+					duplicated_values = self._values(model, i_model_doc - 1)
+					for path in model.keys[0]:
+						values[path] = duplicated_values[path]
+				self._count(kind)
+			
+			yield '{}/{:07d}.json'.format(model.schema_id.replace('/', '_'), i_model_doc), self._document(model, values)
+	
+	def _iter_replicated(self, rnd):
+		fixtures = {}
+		for fixture_kind in ('good_validation', 'bad_validation'):
+			fixtures[fixture_kind] = []
+			for fixture_path in sorted(glob.glob(os.path.join(self.test_data_dir, self.dataset, fixture_kind, '*.json'))):
+				with open(fixture_path, mode='r', encoding='utf-8') as fh:
+					fixtures[fixture_kind].append(json.load(fh))
+		
+		for i_doc in range(self.num_documents):
+			fixture_kind = 'bad_validation'  if (rnd.random() < self.error_rate) and (len(fixtures['bad_validation']) > 0)  else 'good_validation'
+			if fixture_kind == 'bad_validation':
+				self._count('fixture')
+			pool = fixtures[fixture_kind]
+			
+			yield 'replica/{:07d}.json'.format(i_doc), pool[i_doc % len(pool)]
+	
+	def archive(self, members=None):
+		"""
+		It returns the zip archive of the documents (or the given ones)
+		"""
+		raw_archive = io.BytesIO()
+		with zipfile.ZipFile(raw_archive, mode='w', compression=zipfile.ZIP_DEFLATED) as outzip:
+			for member_path, doc in (self  if members is None  else members):
+				outzip.writestr(member_path, json.dumps(doc))
+		
+		return raw_archive.getvalue()
+
+def add_corpus_arguments(ap):
+	ap.add_argument('--dataset', choices=sorted(DATASETS.keys()), default=DEFAULT_DATASET, help="The test-data schemas the corpus is generated from")
+	ap.add_argument('-d', '--documents', type=int, default=1000, help="Number of documents in the corpus")
+	ap.add_argument('--key-cardinality', type=int, default=100, help="Distinct values of each member of the compound keys")
+	ap.add_argument('--fanout', type=float, default=4, help="Average number of documents referencing each referenced one")
+	ap.add_argument('--error-rate', type=float, default=0.01, help="Fraction of documents with an injected error")
+	ap.add_argument('--seed', type=int, default=42, help="Seed of the corpus")
+
+def corpus_from_arguments(args):
+	return SyntheticCorpus(
+		dataset=args.dataset,
+		num_documents=args.documents,
+		key_cardinality=args.key_cardinality,
+		fanout=args.fanout,
+		error_rate=args.error_rate,
+		seed=args.seed
+	)
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description="Synthetic corpus generator, scaled from the test-data schemas")
+	add_corpus_arguments(ap)
+	ap.add_argument('output', help="The zip archive to write. The manifest of the corpus is written next to it")
+	args = ap.parse_args()
+	
+	corpus = corpus_from_arguments(args)
+	with open(args.output, mode='wb') as oh:
+		oh.write(corpus.archive())
+	with open(args.output + '.manifest.json', mode='w', encoding='utf-8') as mh:
+		json.dump(corpus.manifest(), mh, indent=4)
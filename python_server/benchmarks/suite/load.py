@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+"""
+It load tests the validation server over a synthetic corpus. The
+server is started on a local port from the local schema files (so no
+network is needed), and concurrent clients send it a weighted mix of
+requests. For each concurrency level, the report tells as JSON the
+throughput, the latency percentiles and the 503 rate. Run it from the
+benchmarks directory:
+
+	python -m suite.load --concurrency 1 4 16 --duration 30 --invalidate-at 10
+"""
+
+import sys, os
+import argparse
+import datetime
+import glob
+import http.client
+import json
+import platform
+import random
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import yaml
+
+from fairtracks_validator.extensions.curie_search import CurieSearch
+
+from libs.codec import JSONCodec
+
+from .corpus import add_corpus_arguments, corpus_from_arguments
+from .measures import percentile
+
+DEFAULT_MIX = {
+	'validate': 4,
+	'array': 2,
+	'archive': 1,
+	'multipart': 1,
+	'schemas': 2,
+}
+
+LOAD_INVALIDATION_KEY = 'load-test'
+
+class ServerProcess(object):
+	"""
+	It serves the validator app from a forked process, restarting it
+	when it exits, as the FCGI process manager does when hot reloads
+	are disabled, and a cache rebuild broadcasts its shutdown message
+	"""
+	RESTART_DELAY = 0.1
+	
+	def __init__(self, config, host='127.0.0.1', port=0, workers=1):
+		self.config = config
+		self.host = host
+		self.port = port  if port > 0  else self._free_port(host)
+		self.workers = workers
+		self.pid = None
+		self.restarts = []
+		self.keep_going = False
+		self.supervisor = None
+	
+	@staticmethod
+	def _free_port(host):
+		with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+			sock.bind((host, 0))
+			return sock.getsockname()[1]
+	
+	def _serve(self):
+		# Imported here, so the clients do not pay for them
+		from libs.app import init_validator_app
+		
+		exit_code = 0
+		try:
+			app, ftv = init_validator_app(dict(self.config))
+			if self.workers > 1:
+				from libs.prefork import PreforkWSGIServer, freeze_shared_state
+				freeze_shared_state(ftv)
+				PreforkWSGIServer(app, self.host, self.port, self.workers).run()
+			else:
+				from werkzeug.serving import make_server
+				make_server(self.host, self.port, app).serve_forever()
+		except SystemExit as se:
+			exit_code = se.code  if isinstance(se.code, int)  else 0
+		except BaseException:
+			import traceback
+			traceback.print_exc()
+			exit_code = 1
+		finally:
+			# Skipping the cleanups inherited from the load tester
+			os._exit(exit_code)
+	
+	def _spawn(self):
+		pid = os.fork()
+		if pid == 0:
+			self._serve()
+		self.pid = pid
+	
+	def _supervise(self):
+		while self.keep_going:
+			try:
+				pid, _ = os.waitpid(self.pid, 0)
+			except ChildProcessError:
+				break
+			
+			if self.keep_going:
+				self.restarts.append(time.monotonic())
+				time.sleep(self.RESTART_DELAY)
+				self._spawn()
+	
+	def start(self):
+		self.keep_going = True
+		self._spawn()
+		self.supervisor = threading.Thread(name='server-supervisor', target=self._supervise, daemon=True)
+		self.supervisor.start()
+	
+	def wait_ready(self, timeout=60):
+		deadline = time.monotonic() + timeout
+		while time.monotonic() < deadline:
+			try:
+				conn = http.client.HTTPConnection(self.host, self.port, timeout=5)
+				try:
+					conn.request('GET', '/info')
+					if conn.getresponse().status == 200:
+						return True
+				finally:
+					conn.close()
+			except OSError:
+				pass
+			time.sleep(0.2)
+		
+		return False
+	
+	def stop(self):
+		self.keep_going = False
+		if self.pid is not None:
+			try:
+				os.kill(self.pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+		if self.supervisor is not None:
+			self.supervisor.join(30)
+
+def multipart_body(raw, filename, field='file'):
+	boundary = 'ftvload{:016x}'.format(random.getrandbits(64))
+	body = b''.join([
+		'--{}\r\n'.format(boundary).encode('ascii'),
+		'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'.format(field, filename).encode('utf-8'),
+		b'Content-Type: application/zip\r\n\r\n',
+		raw,
+		'\r\n--{}--\r\n'.format(boundary).encode('ascii'),
+	])
+	
+	return body, 'multipart/form-data; boundary={}'.format(boundary)
+
+def load_requests(corpus, members, batch_size):
+	"""
+	For each kind of request, the list of prepared ones, as tuples of
+	the number of documents, the method, the path, the body and the
+	content type
+	"""
+	batches = [ members[i_member:i_member + batch_size]  for i_member in range(0, len(members), batch_size) ]
+	archives = [ corpus.archive(batch)  for batch in batches ]
+	multiparts = [ multipart_body(archive, 'corpus.zip')  for archive in archives ]
+	
+	return {
+		'validate': [ (1, 'POST', '/validate', json.dumps(doc).encode('utf-8'), 'application/json')  for _, doc in members ],
+		'array': [ (len(batch), 'POST', '/validate/array', json.dumps([ doc  for _, doc in batch ]).encode('utf-8'), 'application/json')  for batch in batches ],
+		'archive': [ (len(batch), 'POST', '/validate/archive', archive, 'application/zip')  for batch, archive in zip(batches, archives) ],
+		'multipart': [ (len(batch), 'POST', '/validate/multipart', body, content_type)  for batch, (body, content_type) in zip(batches, multiparts) ],
+		'schemas': [ (0, 'GET', '/schemas', None, None) ],
+	}
+
+def send_request(host, port, method, path, body=None, content_type=None, timeout=300):
+	"""
+	It returns the status code, or None when the server could not
+	be reached (as it happens while it is restarted)
+	"""
+	headers = {}
+	if content_type is not None:
+		headers['Content-Type'] = content_type
+	
+	conn = http.client.HTTPConnection(host, port, timeout=timeout)
+	try:
+		conn.request(method, path, body=body, headers=headers)
+		response = conn.getresponse()
+		# Streamed responses are fully read
+		response.read()
+		return response.status
+	except (OSError, http.client.HTTPException):
+		return None
+	finally:
+		conn.close()
+
+class LoadLevel(object):
+	"""
+	It runs the clients of a concurrency level for a while, gathering
+	for each request its start time, kind, latency, status and documents
+	"""
+	def __init__(self, server, requests, mix, concurrency, duration, seed=42):
+		self.server = server
+		self.requests = requests
+		self.kinds = [ kind  for kind, weight in mix.items()  if weight > 0 ]
+		self.weights = [ mix[kind]  for kind in self.kinds ]
+		self.concurrency = concurrency
+		self.duration = duration
+		self.seed = seed
+		self.samples = []
+		self.samples_lock = threading.Lock()
+		self.invalidations = []
+	
+	def _client(self, i_client, started, deadline):
+		rnd = random.Random(self.seed + i_client)
+		samples = []
+		while time.monotonic() < deadline:
+			kind = rnd.choices(self.kinds, weights=self.weights)[0]
+			num_documents, method, path, body, content_type = rnd.choice(self.requests[kind])
+			start = time.monotonic()
+			status = send_request(self.server.host, self.server.port, method, path, body, content_type)
+			samples.append((start - started, kind, time.monotonic() - start, status, num_documents))
+			if status is None:
+				# Not hammering a restarting server
+				time.sleep(0.05)
+		
+		with self.samples_lock:
+			self.samples.extend(samples)
+	
+	def _invalidate(self, started, invalidate_at):
+		time.sleep(invalidate_at)
+		status = send_request(
+			self.server.host,
+			self.server.port,
+			'DELETE',
+			'/schemas/invalidate',
+			json.dumps({'invalidation_key': self.server.config.get('invalidation_key')}).encode('utf-8'),
+			'application/json'
+		)
+		self.invalidations.append((time.monotonic() - started, status))
+	
+	def run(self, invalidate_at=None):
+		started = time.monotonic()
+		deadline = started + self.duration
+		threads = [ threading.Thread(target=self._client, args=(i_client, started, deadline))  for i_client in range(self.concurrency) ]
+		if invalidate_at is not None:
+			threads.append(threading.Thread(target=self._invalidate, args=(started, invalidate_at)))
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		
+		self.elapsed = time.monotonic() - started
+		self.restarts = [ restart - started  for restart in self.server.restarts  if restart >= started ]
+		
+		return self.report()
+	
+	@staticmethod
+	def summary(samples, seconds):
+		latencies = sorted(map(lambda sample: sample[2], samples))
+		statuses = {}
+		for sample in samples:
+			status = 'unreachable'  if sample[3] is None  else str(sample[3])
+			statuses[status] = statuses.get(status, 0) + 1
+		num_requests = len(samples)
+		documents = sum(map(lambda sample: sample[4], filter(lambda sample: sample[3] == 200, samples)))
+		
+		return {
+			'requests': num_requests,
+			'requests_per_second': (num_requests / seconds)  if seconds > 0  else None,
+			'documents_per_second': (documents / seconds)  if seconds > 0  else None,
+			'statuses': statuses,
+			'rate_503': (statuses.get('503', 0) / num_requests)  if num_requests > 0  else None,
+			'rate_unreachable': (statuses.get('unreachable', 0) / num_requests)  if num_requests > 0  else None,
+			'latency_seconds': {
+				'p50': percentile(latencies, 0.5),
+				'p95': percentile(latencies, 0.95),
+				'p99': percentile(latencies, 0.99),
+				'max': latencies[-1]  if len(latencies) > 0  else None
+			}
+		}
+	
+	def report(self):
+		samples = sorted(self.samples)
+		report = self.summary(samples, self.elapsed)
+		report['concurrency'] = self.concurrency
+		report['seconds'] = self.elapsed
+		report['kinds'] = { kind: self.summary(list(filter(lambda sample: sample[1] == kind, samples)), self.elapsed)  for kind in self.kinds }
+		
+		if len(self.invalidations) > 0:
+			invalidated_at, invalidation_status = self.invalidations[0]
+			before = list(filter(lambda sample: sample[0] < invalidated_at, samples))
+			after = list(filter(lambda sample: sample[0] >= invalidated_at, samples))
+			# The server is recovered since the first answered request
+			# after the last one which was not
+			unavailable = list(filter(lambda sample: sample[3] in (None, 503), after))
+			recovered_at = None
+			if len(unavailable) > 0:
+				last_unavailable = max(map(lambda sample: sample[0] + sample[2], unavailable))
+				recovered = list(filter(lambda sample: (sample[0] >= last_unavailable) and (sample[3] == 200), after))
+				if len(recovered) > 0:
+					recovered_at = recovered[0][0]
+			
+			report['invalidation'] = {
+				'at_seconds': invalidated_at,
+				'status': invalidation_status,
+				'server_restarts_at_seconds': self.restarts,
+				'before': self.summary(before, invalidated_at),
+				'after': self.summary(after, self.elapsed - invalidated_at),
+				'first_unavailable_at_seconds': unavailable[0][0]  if len(unavailable) > 0  else None,
+				'recovered_at_seconds': recovered_at,
+				# Requests answered each second, to see the availability along time
+				'timeline': self.timeline(samples)
+			}
+		
+		return report
+	
+	def timeline(self, samples):
+		timeline = []
+		for sample in samples:
+			i_second = int(sample[0])
+			while len(timeline) <= i_second:
+				timeline.append({'second': len(timeline), 'ok': 0, '503': 0, 'unreachable': 0, 'other': 0})
+			if sample[3] == 200:
+				timeline[i_second]['ok'] += 1
+			elif sample[3] == 503:
+				timeline[i_second]['503'] += 1
+			elif sample[3] is None:
+				timeline[i_second]['unreachable'] += 1
+			else:
+				timeline[i_second]['other'] += 1
+		
+		return timeline
+
+def wait_rebuild(cache_dir, timeout=120):
+	"""
+	The background rebuild is detached from the server, so it is waited
+	for before its directories are removed
+	"""
+	deadline = time.monotonic() + timeout
+	while os.path.exists(cache_dir + '_transient') and time.monotonic() < deadline:
+		time.sleep(0.2)
+
+def parse_mix(mix_spec):
+	mix = {}
+	for pair in mix_spec.split(','):
+		kind, _, weight = pair.partition('=')
+		kind = kind.strip()
+		if kind not in DEFAULT_MIX:
+			raise argparse.ArgumentTypeError("Unknown request kind {}. Valid ones are {}".format(kind, ', '.join(DEFAULT_MIX.keys())))
+		mix[kind] = float(weight)  if weight != ''  else 1.0
+	
+	return mix
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(prog='python -m suite.load', description="FAIRtracks validator load tester")
+	add_corpus_arguments(ap)
+	ap.add_argument('-b', '--batch-size', type=int, default=100, help="Documents in each array, archive and multipart request")
+	ap.add_argument('-C', '--concurrency', type=int, nargs='+', default=[1, 4, 16], help="Concurrency levels, i.e. number of simultaneous clients")
+	ap.add_argument('-t', '--duration', type=float, default=10, help="Seconds each concurrency level lasts")
+	ap.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help="Weights of the request kinds, like validate=4,array=2,archive=1,multipart=1,schemas=2")
+	ap.add_argument('-i', '--invalidate-at', type=float, help="When it is set, the cached schemas are invalidated that number of seconds after each level starts, so the rebuild is measured")
+	ap.add_argument('-w', '--workers', type=int, default=1, help="Number of pre-forked server workers")
+	ap.add_argument('-p', '--port', type=int, default=0, help="Port of the server. By default, a free one")
+	ap.add_argument('-c', '--config', help="YAML file with server configuration blocks to use (e.g. validation_cache, backchannel)")
+	ap.add_argument('-o', '--output', help="File where the JSON report is written. By default, it is printed")
+	args = ap.parse_args()
+	
+	extra_config = {}
+	if args.config is not None:
+		with open(args.config, mode='r', encoding='utf-8') as ch:
+			extra_config = yaml.safe_load(ch) or {}
+	
+	corpus = corpus_from_arguments(args)
+	members = list(corpus)
+	requests = load_requests(corpus, members, max(1, args.batch_size))
+	
+	report = {
+		'started': datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat(),
+		'environment': {
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'cpus': os.cpu_count(),
+			'json_backend': JSONCodec.Backend
+		},
+		'corpus': corpus.manifest(),
+		'batch_size': args.batch_size,
+		'workers': args.workers,
+		'mix': args.mix,
+		'duration': args.duration,
+		'invalidate_at': args.invalidate_at,
+		'config': extra_config,
+		'levels': []
+	}
+	
+	cache_dir = tempfile.mkdtemp(prefix='ftv', suffix='load')
+	try:
+		config = dict(extra_config)
+		config['cacheDir'] = cache_dir
+		config['schemas'] = corpus.schema_urls
+		config.setdefault('invalidation_key', LOAD_INVALIDATION_KEY)
+		# The validations need it, as it happens in the server
+		CurieSearch.GetCurieCache(cachePath=cache_dir, warmUp=True)
+		
+		server = ServerProcess(config, port=args.port, workers=args.workers)
+		server.start()
+		try:
+			for concurrency in args.concurrency:
+				if not server.wait_ready():
+					report['error'] = 'The server did not start'
+					break
+				level = LoadLevel(server, requests, args.mix, concurrency, args.duration, seed=args.seed)
+				report['levels'].append(level.run(invalidate_at=args.invalidate_at))
+				if args.invalidate_at is not None:
+					wait_rebuild(cache_dir)
+		finally:
+			server.stop()
+	finally:
+		wait_rebuild(cache_dir)
+		# Also the old and transient directories, and their lock files
+		for leftover in glob.glob(cache_dir + '*'):
+			if os.path.isdir(leftover):
+				shutil.rmtree(leftover, ignore_errors=True)
+			else:
+				os.remove(leftover)
+	
+	if args.output is not None:
+		with open(args.output, mode='w', encoding='utf-8') as oh:
+			json.dump(report, oh, indent=4)
+	else:
+		print(json.dumps(report, indent=4))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os
+import json
+import resource
+import time
+import traceback
+
+def percentile(sorted_values, fraction):
+	"""
+	Nearest rank percentile
+	"""
+	if len(sorted_values) == 0:
+		return None
+	
+	return sorted_values[min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))]
+
+def peak_rss_kb():
+	"""
+	Peak resident set size of this process, in kilobytes
+	"""
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class Measure(object):
+	"""
+	It times a sequence of calls, which return the number of documents
+	they processed and whether they succeeded
+	"""
+	def __init__(self):
+		self.latencies = []
+		self.documents = 0
+		self.failures = 0
+	
+	def call(self, func, *args):
+		start = time.perf_counter()
+		documents, succeeded = func(*args)
+		self.latencies.append(time.perf_counter() - start)
+		self.documents += documents
+		if not succeeded:
+			self.failures += 1
+	
+	def report(self):
+		latencies = sorted(self.latencies)
+		seconds = sum(latencies)
+		return {
+			'requests': len(latencies),
+			'failures': self.failures,
+			'documents': self.documents,
+			'seconds': seconds,
+			'documents_per_second': (self.documents / seconds)  if seconds > 0  else None,
+			'latency_seconds': {
+				'mean': (seconds / len(latencies))  if len(latencies) > 0  else None,
+				'p50': percentile(latencies, 0.5),
+				'p90': percentile(latencies, 0.9),
+				'p99': percentile(latencies, 0.99),
+				'max': latencies[-1]  if len(latencies) > 0  else None
+			}
+		}
+
+def run_isolated(func, *args):
+	"""
+	It runs the function in a forked process, so each measure starts
+	from the same state, and its peak RSS is its own one. The function
+	returns a JSON serializable report
+	"""
+	rfd, wfd = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(rfd)
+		exit_code = 0
+		try:
+			report = func(*args)
+			report['peak_rss_kb'] = peak_rss_kb()
+		except:
+			report = {'error': traceback.format_exc()}
+			exit_code = 1
+		try:
+			with os.fdopen(wfd, mode='w', encoding='utf-8') as wh:
+				json.dump(report, wh)
+		finally:
+			# Skipping the cleanups inherited from the parent
+			os._exit(exit_code)
+	
+	os.close(wfd)
+	with os.fdopen(rfd, mode='r', encoding='utf-8') as rh:
+		raw_report = rh.read()
+	os.waitpid(pid, 0)
+	
+	return json.loads(raw_report)  if raw_report  else {'error': 'The measure process died'}
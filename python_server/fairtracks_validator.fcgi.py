@@ -28,11 +28,30 @@ config_file = basis + '.yaml'
 with open(config_file,"r",encoding="utf-8") as cf:
 	local_config = yaml.load(cf,Loader=YAMLLoader)
 
+DEFAULT_LOGGING_FORMAT = '%(asctime)-15s - [%(process)d][%(levelname)s] %(message)s'
+
+# This verb is used to do an offline integrity sweep of the cached
+# schemas, so there is no need to start the server
+if (__name__ == '__main__') and (len(sys.argv) > 1) and (sys.argv[1] == 'verify'):
+	import json
+	from libs.ft_validator import FAIRTracksValidatorSingleton
+	
+	logging.basicConfig(level=logging.ERROR, format=DEFAULT_LOGGING_FORMAT)
+	reports = FAIRTracksValidatorSingleton.VerifySchemaCache(local_config)
+	num_failed = 0
+	for report in reports:
+		print(json.dumps(report))
+		if report['status'] != 'ok':
+			num_failed += 1
+	
+	sys.exit(1  if num_failed > 0  else 0)
+
 #print(f"JAO {os.environ.get('WERKZEUG_RUN_MAIN')}", file=sys.stderr)
 #sys.stderr.flush()
-app, ftv = libs.app.init_validator_app(local_config)
-
-DEFAULT_LOGGING_FORMAT = '%(asctime)-15s - [%(process)d][%(levelname)s] %(message)s'
+# The processes of the parallel validation pool import this script as
+# __mp_main__, and they must not start another server
+if __name__ != '__mp_main__':
+	app, ftv = libs.app.init_validator_app(local_config)
 
 if __name__ == '__main__':
 	if len(sys.argv) > 1:
@@ -43,6 +62,7 @@ if __name__ == '__main__':
 		
 		host = local_config.get('host', "0.0.0.0")
 		port = local_config.get('port', 5000)
+		workers = int(local_config.get('workers', 1))
 		debug = sys.argv[1] != 'standalone'
 		if debug:
 			logLevel = logging.DEBUG
@@ -63,8 +83,14 @@ if __name__ == '__main__':
 		#	'filename': 'debug-traces.txt',
 		}
 		logging.basicConfig(**loggingConfig)
-
-		app.run(debug=debug, port=port, host=host, threaded=False, processes=1)
+		
+		if debug or workers <= 1:
+			app.run(debug=debug, port=port, host=host, threaded=False, processes=1)
+		else:
+			from libs.prefork import PreforkWSGIServer, freeze_shared_state
+			
+			freeze_shared_state(ftv)
+			PreforkWSGIServer(app, host, port, workers, metrics=ftv.metrics).run()
 	else:
 		loggingConfig = {
 			'level': logging.ERROR,
@@ -72,6 +98,15 @@ if __name__ == '__main__':
 		#	'filename': 'debug-traces.txt',
 		}
 		logging.basicConfig(**loggingConfig)
-		from flup.server.fcgi import WSGIServer
-
-		WSGIServer(app).run()
+		workers = int(local_config.get('workers', 1))
+		if workers <= 1:
+			from flup.server.fcgi import WSGIServer
+			
+			WSGIServer(app).run()
+		else:
+			# flup pre-fork server keeps the pool of workers
+			from flup.server.fcgi_fork import WSGIServer
+			from libs.prefork import freeze_shared_state
+			
+			freeze_shared_state(ftv)
+			WSGIServer(app, minSpare=workers, maxSpare=workers, maxChildren=workers).run()
@@ -3,25 +3,38 @@
 # coding: utf-8
 
 import sys, os
+import time
 
-from flask import Flask, Blueprint
+from flask import Flask, Blueprint, make_response, current_app, request, g
 from flask_restx import Api, Namespace, Resource
 from flask_cors import CORS
 from flask_compress import Compress
+try:
+	from flask.json.provider import DefaultJSONProvider
+except ImportError:
+	# Flask releases before 2.2
+	DefaultJSONProvider = None
 
 from .ft_validator import FAIRTracksValidatorSingleton
+from .upload_spool import SpoolingRequest
+from .codec import JSONCodec
 
 from .res.ns import ROUTES as ROOT_ROUTES
 from .res.schemas import ROUTES as SCHEMAS_ROUTES
 from .res.validate import ROUTES as VALIDATE_ROUTES
+from .res.jobs import ROUTES as JOBS_ROUTES
 
 ROUTE_SETS = [
 	ROOT_ROUTES,
 	SCHEMAS_ROUTES,
-	VALIDATE_ROUTES
+	VALIDATE_ROUTES,
+	JOBS_ROUTES
 ]
 
 DEFAULT_MAX_FILE_SIZE_IN_MB = 16
+DEFAULT_UPLOAD_SPOOL_SIZE_IN_MB = 1
+DEFAULT_ARCHIVE_MAX_MEMBER_SIZE_IN_MB = 64
+DEFAULT_ARCHIVE_MAX_TOTAL_SIZE_IN_MB = 512
 
 def _register_ft_namespaces(api,res_kwargs):
 	for route_set in ROUTE_SETS:
@@ -30,17 +43,103 @@ def _register_ft_namespaces(api,res_kwargs):
 		for route in route_set['routes']:
 			ns.add_resource(route[0],route[1],resource_class_kwargs=res_kwargs)
 
+if DefaultJSONProvider is not None:
+	class CodecJSONProvider(DefaultJSONProvider):
+		"""
+		From Flask 2.2 on, the JSON parsed by Flask itself goes through
+		the provider of the app, instead of through the json module
+		"""
+		def loads(self, s, **kwargs):
+			return JSONCodec.loads(s)
+else:
+	CodecJSONProvider = None
+
+# API responses are rendered through the JSON codec
+def output_json(data, code, headers=None):
+	with current_app.extensions['ftv_metrics'].phase('render'):
+		dumped = JSONCodec.dumpb(data, indent=current_app.debug) + b'\n'
+	
+	resp = make_response(dumped, code)
+	resp.headers.extend(headers or {})
+	return resp
+
+def _start_request_timer():
+	g.ftv_request_start = time.perf_counter()
+
+# Streamed responses are timed until they start
+def _record_request_metrics(response):
+	metrics = current_app.extensions['ftv_metrics']
+	start = g.pop('ftv_request_start', None)
+	if start is not None:
+		endpoint = request.url_rule.rule  if request.url_rule is not None  else 'unmatched'
+		metrics.observe('ftv_http_request_duration_seconds', time.perf_counter() - start, endpoint=endpoint, method=request.method, status=response.status_code)
+		if request.content_length:
+			metrics.inc('ftv_http_request_bytes_total', request.content_length, endpoint=endpoint)
+	metrics.flush()
+	
+	return response
+
+# Each request pins the schema set it started with
+def _begin_hot_reload():
+	current_app.extensions['ftv_hot_reloader'].begin_request()
+
+def _end_hot_reload(exc):
+	current_app.extensions['ftv_hot_reloader'].end_request()
+
+def _begin_request_profile():
+	profiler = current_app.extensions['ftv_profiler']
+	request_id = profiler.begin(request.headers.get(profiler.REQUEST_ID_HEADER), request.headers.get(profiler.PROFILE_HEADER))
+	if request_id is not None:
+		g.ftv_profile_start = time.perf_counter()
+		g.ftv_request_id = request_id
+
+def _end_request_profile(response):
+	profiler = current_app.extensions['ftv_profiler']
+	timings = profiler.end()
+	if timings is not None:
+		timings['total'] = time.perf_counter() - g.pop('ftv_profile_start')
+		response.headers['Server-Timing'] = profiler.ServerTiming(timings)
+		response.headers[profiler.REQUEST_ID_HEADER] = g.pop('ftv_request_id')
+	
+	return response
+
 def init_validator_app(local_config):
 	# This is the singleton instance shared by all the resources
 	# This is done early, so it fails before setting all
 	FTValidator = FAIRTracksValidatorSingleton(local_config)
 	
 	app = Flask('fairtracks_validator')
+	# Uploaded files are spooled to disk above the threshold
+	app.request_class = SpoolingRequest
+	# JSON bodies are parsed through the codec, whatever the Flask release
+	if CodecJSONProvider is not None:
+		app.json = CodecJSONProvider(app)
 	
 	# Setting up the temp upload folder size
 	app.config['MAX_CONTENT_LENGTH'] = round(float(local_config.get('max_file_size',DEFAULT_MAX_FILE_SIZE_IN_MB)) * 1024 * 1024)
+	app.config['UPLOAD_SPOOL_SIZE'] = round(float(local_config.get('upload_spool_size',DEFAULT_UPLOAD_SPOOL_SIZE_IN_MB)) * 1024 * 1024)
+	# The members of uploaded archives are read in memory, so their decompressed size is capped
+	archive_config = local_config.get('archive', {})
+	app.config['ARCHIVE_MAX_MEMBER_SIZE'] = round(float(archive_config.get('max-member-size',DEFAULT_ARCHIVE_MAX_MEMBER_SIZE_IN_MB)) * 1024 * 1024)
+	app.config['ARCHIVE_MAX_TOTAL_SIZE'] = round(float(archive_config.get('max-total-size',DEFAULT_ARCHIVE_MAX_TOTAL_SIZE_IN_MB)) * 1024 * 1024)
 	app.config.SWAGGER_UI_DOC_EXPANSION = 'list'
 	
+	# Request metrics, which are recorded only when they are enabled
+	app.extensions['ftv_metrics'] = FTValidator.metrics
+	app.before_request(_start_request_timer)
+	app.after_request(_record_request_metrics)
+	# Profiling hooks are only set up when it is enabled
+	if FTValidator.profiler is not None:
+		app.extensions['ftv_profiler'] = FTValidator.profiler
+		app.before_request(_begin_request_profile)
+		app.after_request(_end_request_profile)
+	
+	# Schema sets are reloaded in place after cache rebuilds, unless it is disabled
+	if FTValidator.hot_reloader is not None:
+		app.extensions['ftv_hot_reloader'] = FTValidator.hot_reloader
+		app.before_request(_begin_hot_reload)
+		app.teardown_request(_end_hot_reload)
+	
 	blueprint = Blueprint('api','fairtracks_validator_api')
 	#blueprint = Blueprint('api','fairtracks_validator_api',static_url_path='/',static_folder='static')
 	
@@ -49,7 +148,7 @@ def init_validator_app(local_config):
 	
 	# This enables compression
 	compress = Compress(app)
-
+	
 	# Attaching the API to the app 
 	api = Api(
 		app=blueprint,
@@ -60,6 +159,7 @@ def init_validator_app(local_config):
 		license='AGPL-3',
 		default_label='FAIRtracks validator queries'
 	)
+	api.representations['application/json'] = output_json
 	
 	# This is the singleton instance shared by all the resources
 	FTValidator.set_api_instance(api)
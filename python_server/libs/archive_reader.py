@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import io
+import posixpath
+import tarfile
+import zipfile
+import zlib
+
+from .codec import JSONCodec
+
+class ArchiveError(Exception):
+	pass
+
+class ArchiveLimitError(ArchiveError):
+	pass
+
+class ArchiveReader(object):
+	"""
+	It reads the JSON members of an uploaded zip or tar (optionally
+	gzip or bzip2 compressed) archive, either from memory or from a
+	seekable file handle (like the spooled uploads), so archives do not
+	have to be extracted to a temporary directory. Members are chosen
+	the same way the validator walks a directory: hidden entries are
+	skipped, and only the files whose name contains '.json' are read.
+	
+	The decompressed size of each member and the total one are capped,
+	in order to defend against decompression bombs.
+	"""
+	ZIP_MIME_TYPE = 'application/zip'
+	TAR_MIME_TYPES = ('application/x-tar','application/x-gtar','application/x-gtar-compressed','application/gzip','application/x-bzip2')
+	
+	DEFAULT_MAX_MEMBER_SIZE = 64 * 1024 * 1024
+	DEFAULT_MAX_TOTAL_SIZE = 512 * 1024 * 1024
+	
+	def __init__(self, archive, mime_type, max_member_size=DEFAULT_MAX_MEMBER_SIZE, max_total_size=DEFAULT_MAX_TOTAL_SIZE):
+		"""
+		The archive is either the raw bytes or a seekable file handle,
+		which is not closed
+		"""
+		self.archive_fh = io.BytesIO(archive)  if isinstance(archive, (bytes, bytearray))  else archive
+		self.mime_type = mime_type
+		self.max_member_size = max_member_size
+		self.max_total_size = max_total_size
+		self.total_size = 0
+	
+	@classmethod
+	def IsArchive(cls, mime_type):
+		return (mime_type == cls.ZIP_MIME_TYPE) or (mime_type in cls.TAR_MIME_TYPES)
+	
+	@classmethod
+	def IsCandidate(cls, member_path):
+		"""
+		It tells whether the member would have been validated
+		from an extracted copy of the archive
+		"""
+		path_components = member_path.split('/')
+		for path_component in path_components:
+			if path_component.startswith('.'):
+				return False
+		
+		return '.json' in path_components[-1]
+	
+	@classmethod
+	def NormalizeMemberPath(cls, member_name):
+		member_path = posixpath.normpath(member_name.replace('\\', '/')).lstrip('/')
+		
+		return None  if member_path in ('', '.')  or member_path.startswith('../')  else member_path
+	
+	def _read_member(self, member_path, declared_size, opener):
+		"""
+		It returns the tuple to be yielded for the member
+		"""
+		if declared_size > self.max_member_size:
+			return member_path, None, {'reason': 'fatal', 'description': 'Archive member is larger than {} bytes'.format(self.max_member_size)}
+		
+		with opener() as mh:
+			# Declared sizes are not trusted
+			raw_member = mh.read(self.max_member_size + 1)
+		
+		if len(raw_member) > self.max_member_size:
+			return member_path, None, {'reason': 'fatal', 'description': 'Archive member is larger than {} bytes'.format(self.max_member_size)}
+		
+		self.total_size += len(raw_member)
+		if self.total_size > self.max_total_size:
+			raise ArchiveLimitError('Archive contents are larger than {} bytes'.format(self.max_total_size))
+		
+		try:
+			return member_path, JSONCodec.loads(raw_member), None
+		except ValueError:
+			return member_path, None, {'reason': 'fatal', 'description': 'Unable to open/parse JSON file'}
+	
+	def _iter_zip(self):
+		try:
+			inzip = zipfile.ZipFile(self.archive_fh)
+		except zipfile.BadZipFile as bzf:
+			raise ArchiveError('There were problems processing incoming zip archive (is it a valid one?)') from bzf
+		
+		with inzip:
+			for zinfo in inzip.infolist():
+				if zinfo.is_dir():
+					continue
+				
+				member_path = self.NormalizeMemberPath(zinfo.filename)
+				if (member_path is None) or not self.IsCandidate(member_path):
+					continue
+				
+				try:
+					yield self._read_member(member_path, zinfo.file_size, lambda: inzip.open(zinfo))
+				except (zipfile.BadZipFile, NotImplementedError, RuntimeError, OSError, EOFError, zlib.error) as e:
+					raise ArchiveError('There were problems processing incoming zip archive (is it a valid one?)') from e
+	
+	def _iter_tar(self):
+		try:
+			intar = tarfile.open(fileobj=self.archive_fh, mode='r:*')
+		except (tarfile.TarError, EOFError, OSError, zlib.error) as te:
+			raise ArchiveError('There were problems processing incoming tar archive (is it a valid one?)') from te
+		
+		with intar:
+			try:
+				# Members are read as they are found, so the
+				# archive is decompressed only once
+				for tinfo in intar:
+					# Links are not followed, as they could
+					# point outside the archive
+					if not tinfo.isfile():
+						continue
+					
+					member_path = self.NormalizeMemberPath(tinfo.name)
+					if (member_path is None) or not self.IsCandidate(member_path):
+						continue
+					
+					yield self._read_member(member_path, tinfo.size, lambda: intar.extractfile(tinfo))
+			except (tarfile.TarError, EOFError, OSError, zlib.error) as e:
+				raise ArchiveError('There were problems processing incoming tar archive (is it a valid one?)') from e
+	
+	def _size(self):
+		position = self.archive_fh.tell()
+		size = self.archive_fh.seek(0, io.SEEK_END)
+		self.archive_fh.seek(position)
+		
+		return size
+	
+	def __iter__(self):
+		"""
+		It yields a (member path, JSON document, error) tuple for each
+		candidate member, where either the document or the error is None.
+		It raises ArchiveError when the archive cannot be processed
+		"""
+		if self.mime_type == self.ZIP_MIME_TYPE:
+			return self._iter_zip()
+		elif self.mime_type in self.TAR_MIME_TYPES:
+			return self._iter_tar()
+		else:
+			raise ArchiveError('Unsupported or mis-identified input archive (mime {}, size {})'.format(self.mime_type,self._size()))
@@ -33,7 +33,7 @@ class BackgroundMulticastReceiver(metaclass=SingletonMeta):
 	# DEFAULT_LOG_LEVEL = logging.INFO
 	
 	@staticmethod
-	def commands_mcast_listener(mcast_grp=DEFAULT_MCAST_GRP, mcast_port=DEFAULT_MCAST_PORT, is_all_groups=False):
+	def commands_mcast_listener(mcast_grp=DEFAULT_MCAST_GRP, mcast_port=DEFAULT_MCAST_PORT, is_all_groups=False, on_reload=None):
 		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
 		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 		if is_all_groups:
@@ -55,6 +55,10 @@ class BackgroundMulticastReceiver(metaclass=SingletonMeta):
 				# sys.stdout.flush()
 				_thread.interrupt_main()
 				break
+			elif (mess == b'reload') and (on_reload is not None):
+				# The cache directory was replaced, and the
+				# schema set is reloaded without restarting
+				on_reload()
 	
 	@staticmethod
 	def default_sigint_handler(signum, stack_frame):
@@ -78,6 +82,7 @@ class BackgroundMulticastReceiver(metaclass=SingletonMeta):
 		self.mcast_grp = back_setup.get('multicast-group' , self.DEFAULT_MCAST_GRP)
 		self.mcast_port = back_setup.get('multicast-port' , self.DEFAULT_MCAST_PORT)
 		self.is_all_groups = back_setup.get('is-all-groups' , False)
+		self.reload_listeners = []
 		self.mcast_thread = threading.Thread(
 			name="background-mcast",
 			target=self.commands_mcast_listener,
@@ -86,97 +91,145 @@ class BackgroundMulticastReceiver(metaclass=SingletonMeta):
 				'mcast_grp': self.mcast_grp,
 				'mcast_port': self.mcast_port,
 				'is_all_groups': self.is_all_groups,
+				'on_reload': self._notify_reload,
 			},
 			daemon=True
 		)
 		self.mcast_thread.start()
 	
+	def add_reload_listener(self, listener):
+		self.reload_listeners.append(listener)
+	
+	def _notify_reload(self):
+		for listener in self.reload_listeners:
+			try:
+				listener()
+			except Exception:
+				self.logger.exception("Reload listener failed")
+	
 	def getRebuildLock(self, newCacheDir):
 		serverLockFile = os.path.join(newCacheDir, 'rebuild.lock')
 		return RWFileLock(serverLockFile)
 	
-	def background_rebuild_caches(self, new_local_config, oldftv, stdout=None, stderr=None):
+	def background_rebuild_caches(self, new_local_config, oldftv, stdout=None, stderr=None, reload=False):
 		"""
 		This method creates a detached background process which
-		rebuilds caches in a separate directory
+		rebuilds caches in a separate directory. When reload is true,
+		the server processes are told to reload the schema set from
+		the replaced directory, instead of shutting down
 		"""
 		
 		# Am I the new server process?
 		if os.fork() == 0:
-			newCacheDir = new_local_config['cacheDir']
-			if (stdout is None) or (stderr is None):
-				os.makedirs(newCacheDir, mode=0o750, exist_ok=True)
-				logstream = open(os.path.join(newCacheDir, 'background-update.log'), mode='w', encoding='utf-8')
-				if stdout is None:
-					stdout = logstream
-				if stderr is None:
-					stderr = logstream
-			with daemon.DaemonContext(detach_process=True,umask=0o027,stdout=stdout,stderr=stderr) as context:
-				# Let's reset the logging setup in order to gather clues
-				logging.basicConfig(
-					format=self.DEFAULT_LOGGING_FORMAT,
-					level=self.DEFAULT_LOG_LEVEL,
-					stream=stderr,
-					force=True
-				)
-				
-				os.makedirs(newCacheDir, mode=0o750, exist_ok=True)
-				slock = self.getRebuildLock(newCacheDir)
-				try:
-					try:
-						slock.w_lock()
-					except LockError:
-						# Other one controls all
-						# Gracefully exit
-						if stderr is not None:
-							stderr.write(str(time.time())+"\nLOCKED\n")
-						sys.exit(1)
+			exit_code = 1
+			try:
+				newCacheDir = new_local_config['cacheDir']
+				if (stdout is None) or (stderr is None):
+					os.makedirs(newCacheDir, mode=0o750, exist_ok=True)
+					logstream = open(os.path.join(newCacheDir, 'background-update.log'), mode='w', encoding='utf-8')
+					if stdout is None:
+						stdout = logstream
+					if stderr is None:
+						stderr = logstream
+				with daemon.DaemonContext(detach_process=True,umask=0o027,stdout=stdout,stderr=stderr) as context:
+					# Let's reset the logging setup in order to gather clues
+					logging.basicConfig(
+						format=self.DEFAULT_LOGGING_FORMAT,
+						level=self.DEFAULT_LOG_LEVEL,
+						stream=stderr,
+						force=True
+					)
 					
+					os.makedirs(newCacheDir, mode=0o750, exist_ok=True)
+					slock = self.getRebuildLock(newCacheDir)
 					try:
-						# Rebuild the caches in a new instance
-						tftv = oldftv.__class__(new_local_config, isRW=True)
+						try:
+							slock.w_lock()
+						except LockError:
+							# Other one controls all
+							# Gracefully exit
+							if stderr is not None:
+								stderr.write(str(time.time())+"\nLOCKED\n")
+							sys.exit(1)
 						
-						# Acquire the exclusive locks of old directories
-						oldftv._init_locks()
-						with oldftv.SchemaCacheLock.exclusive_blocking_lock(), \
-							oldftv.ExtensionsCacheLock.exclusive_blocking_lock():
-							
-							# Broadcast the shutdown message
-							self.broadcast_shutdown()
-							
-							# Interchange the directories
-							oldCacheDir = oldftv.cacheDir + '_old'
+						try:
+							# Rebuild the caches in a new instance, which also
+							# leaves the validator snapshot next to the manifest.
+							# The files it writes in place are detached from the
+							# cache directory they were snapshotted from
+							tftv = oldftv.__class__(new_local_config, isRW=True)
 							
-							if os.path.exists(oldCacheDir):
-								shutil.rmtree(oldCacheDir)
+							# Acquire the exclusive locks of old directories.
+							# The descriptors of the inherited locks were closed
+							# by the daemon context, and their numbers can be
+							# reused by the new locks, so they must not be
+							# closed again when the inherited ones are disposed
+							for inherited_lock in (oldftv.SchemaCacheLock, oldftv.ExtensionsCacheLock):
+								inherited_lock.should_close = False
+							oldftv._init_locks()
+							with oldftv.SchemaCacheLock.exclusive_blocking_lock(), \
+								oldftv.ExtensionsCacheLock.exclusive_blocking_lock(), \
+								oldftv.generation.write():
+								# Validations wait (or they are repeated) until the
+								# directories are interchanged
+								
+								# Broadcast the shutdown message
+								if not reload:
+									self.broadcast_shutdown()
+								
+								# Interchange the directories
+								oldCacheDir = oldftv.cacheDir + '_old'
+								
+								if os.path.exists(oldCacheDir):
+									shutil.rmtree(oldCacheDir)
+								
+								os.rename(oldftv.cacheDir, oldCacheDir)
+								os.rename(tftv.cacheDir, oldftv.cacheDir)
+								
+								# Release the exclusive locks
 							
-							os.rename(oldftv.cacheDir, oldCacheDir)
-							os.rename(tftv.cacheDir, oldftv.cacheDir)
-							
-							# Release the exclusive locks
-					except:
-						if stderr is not None:
-							import traceback
-							stderr.write(str(time.time())+"\n")
-							traceback.print_exc(None,stderr)
-							stderr.flush()
-				finally:
-					if(slock.isLocked):
-						slock.unlock()
-					del slock
-				
-				sys.exit(0)
+							# The servers reload from the replaced directory
+							# once the locks are released
+							if reload:
+								self.broadcast_reload()
+						except:
+							if stderr is not None:
+								import traceback
+								stderr.write(str(time.time())+"\n")
+								traceback.print_exc(None,stderr)
+								stderr.flush()
+					finally:
+						if(slock.isLocked):
+							slock.unlock()
+						del slock
+					
+					sys.exit(0)
+			except SystemExit as se:
+				exit_code = se.code
+			except:
+				import traceback
+				traceback.print_exc()
+			finally:
+				# The forked process must never unwind into the stack of
+				# the caller, which was attending a request
+				os._exit(exit_code)
 		
 		return True
 	
 	def broadcast_shutdown(self):
+		self._broadcast('shutdown')
+	
+	def broadcast_reload(self):
+		self._broadcast('reload')
+	
+	def _broadcast(self, message):
 		# for all packets sent, after two hops on the network the packet will not 
 		# be re-sent/broadcast (see https://www.tldp.org/HOWTO/Multicast-HOWTO-6.html)
 		MULTICAST_TTL = 2
 
 		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
 		sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
-		sock.sendto('shutdown'.encode('utf-8'), (self.mcast_grp, self.mcast_port))
+		sock.sendto(message.encode('utf-8'), (self.mcast_grp, self.mcast_port))
 #
 #def otra_hebra():
 #    counter = 0
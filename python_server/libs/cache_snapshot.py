@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import errno
+import fcntl
+import fnmatch
+import logging
+import os
+import shutil
+import tempfile
+
+class CacheSnapshot(object):
+	"""
+	It populates the transient directory of a rebuild from the cache
+	directory without duplicating the contents of the files, so it can
+	be done holding the locks of the cache directory for a moment.
+	Files are cloned through reflinks where the filesystem supports
+	them (which are copy-on-write by themselves), or hardlinked
+	otherwise, falling back to plain copies.
+	
+	Hardlinked files share their contents with the cache directory, so
+	the ones which are going to be written in place by the rebuild (the
+	databases of the extensions it warms up) must be detached before,
+	which is done by the rebuild process, out of the locks. The rest of
+	files (the ones only replaced through renames, like the cached
+	schemas, and the caches of the extensions which are not warmed up)
+	keep being shared. Lock files and logs are never shared.
+	"""
+	# ioctl from linux/fs.h
+	FICLONE = 0x40049409
+	
+	REFLINK = 'reflink'
+	HARDLINK = 'hardlink'
+	COPY = 'copy'
+	
+	# Relative paths of the files which are not carried to the snapshot
+	SkippedPatterns = ('*.lock', 'background-update.log')
+	
+	UnsupportedCloneErrors = { errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM, errno.EBADF }
+	UnsupportedLinkErrors = { errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOSYS }
+	
+	def __init__(self, src_dir, dst_dir):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		self.src_dir = src_dir
+		self.dst_dir = dst_dir
+		self.method = None
+		self.counts = {}
+	
+	@classmethod
+	def _matches(cls, rel_path, patterns):
+		return any(map(lambda pattern: fnmatch.fnmatch(rel_path, pattern), patterns))
+	
+	@classmethod
+	def Reflink(cls, src_path, dst_path):
+		with open(src_path, 'rb') as sh:
+			dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+			try:
+				fcntl.ioctl(dst_fd, cls.FICLONE, sh.fileno())
+			except:
+				os.close(dst_fd)
+				os.unlink(dst_path)
+				raise
+			os.close(dst_fd)
+		shutil.copystat(src_path, dst_path)
+	
+	def _clone_file(self, src_path, dst_path):
+		"""
+		It tries the methods from the cheapest one, remembering which
+		ones the filesystem does not support
+		"""
+		if self.method in (None, self.REFLINK):
+			try:
+				self.Reflink(src_path, dst_path)
+				self.method = self.REFLINK
+				return self.REFLINK
+			except OSError as ose:
+				if ose.errno not in self.UnsupportedCloneErrors:
+					raise
+				self.method = self.HARDLINK
+		
+		if self.method == self.HARDLINK:
+			try:
+				os.link(src_path, dst_path)
+				return self.HARDLINK
+			except OSError as ose:
+				if ose.errno not in self.UnsupportedLinkErrors:
+					raise
+				self.method = self.COPY
+		
+		shutil.copy2(src_path, dst_path)
+		return self.COPY
+	
+	def create(self):
+		"""
+		The destination directory must not exist. Afterwards, counts
+		tells how many files were populated through each method
+		"""
+		for dirpath, dirnames, filenames in os.walk(self.src_dir):
+			rel_dir = os.path.relpath(dirpath, self.src_dir)
+			dst_dirpath = os.path.normpath(os.path.join(self.dst_dir, rel_dir))
+			os.makedirs(dst_dirpath)
+			shutil.copystat(dirpath, dst_dirpath)
+			
+			for name in dirnames + filenames:
+				src_path = os.path.join(dirpath, name)
+				if not os.path.islink(src_path):
+					continue
+				# Symbolic links are kept as such
+				os.symlink(os.readlink(src_path), os.path.join(dst_dirpath, name))
+				if name in dirnames:
+					dirnames.remove(name)
+			
+			for filename in filenames:
+				src_path = os.path.join(dirpath, filename)
+				rel_path = os.path.normpath(os.path.join(rel_dir, filename))
+				if os.path.islink(src_path) or self._matches(rel_path, self.SkippedPatterns):
+					continue
+				
+				used_method = self._clone_file(src_path, os.path.join(dst_dirpath, filename))
+				self.counts[used_method] = self.counts.get(used_method, 0) + 1
+		
+		self.logger.debug("Snapshot of {} into {}: {}".format(self.src_dir, self.dst_dir, self.counts))
+	
+	@classmethod
+	def Detach(cls, snapshot_dir, name_patterns):
+		"""
+		It gives their own copy to the hardlinked files whose name matches
+		any of the patterns, i.e. the ones which are going to be written
+		in place, so the cache directory they were linked from is not
+		modified. It returns the number of detached files
+		"""
+		num_detached = 0
+		for dirpath, dirnames, filenames in os.walk(snapshot_dir):
+			for filename in filenames:
+				path = os.path.join(dirpath, filename)
+				if os.path.islink(path) or not cls._matches(filename, name_patterns):
+					continue
+				if os.stat(path).st_nlink <= 1:
+					continue
+				
+				tmp_fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix='.detach-')
+				os.close(tmp_fd)
+				try:
+					shutil.copy2(path, tmp_path)
+					os.replace(tmp_path, path)
+				except:
+					os.unlink(tmp_path)
+					raise
+				num_detached += 1
+		
+		return num_detached
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import json
+import math
+import re
+
+# We have preference for an accelerated JSON backend, but the code
+# should fallback to the standard library when it is not installed
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+class JSONCodec(object):
+	"""
+	It parses and renders JSON through orjson when it is installed,
+	and through the standard library otherwise. Its loads and dumps
+	can stand for the json module (i.e. as the json_module of the
+	requests).
+	
+	The accelerated backend is stricter (NaN and Infinity literals,
+	integers beyond 64 bits, non UTF-8 input, non string keys...),
+	so whatever it rejects (or it would parse differently) goes
+	through the standard library. The rendering through the standard
+	library follows the accelerated one: non-ASCII characters are not
+	escaped, non-finite floats (which have no JSON representation) are
+	rendered as null, and indented output uses two spaces. So, the
+	parsed and rendered values do not depend on the installed backend,
+	although the exponents of some floats are written differently
+	(i.e. 1e-7 and 1e-07).
+	
+	Parsed objects keep the order of their keys with both backends, so
+	OrderedDict is not needed, and the hashes of the schemas are computed
+	from the canonical (sorted keys) serialization anyway.
+	"""
+	Backend = 'json'  if orjson is None  else 'orjson'
+	
+	INDENT = 2
+	
+	# The accelerated backend parses the integers beyond 64 bits as
+	# floats, so the contents with long runs of digits are not given to it
+	LongDigitsPattern = re.compile('[0-9]{19}')
+	LongDigitsBytesPattern = re.compile(b'[0-9]{19}')
+	
+	@classmethod
+	def loads(cls, data):
+		"""
+		data is either a string or encoded bytes
+		"""
+		long_digits_pattern = cls.LongDigitsPattern  if isinstance(data, str)  else cls.LongDigitsBytesPattern
+		if (orjson is not None) and (long_digits_pattern.search(data) is None):
+			try:
+				return orjson.loads(data)
+			except orjson.JSONDecodeError:
+				# The standard library is more lenient,
+				# and it raises the same exception
+				pass
+		
+		if isinstance(data, memoryview):
+			data = data.tobytes()
+		
+		return json.loads(data)
+	
+	@classmethod
+	def load(cls, fh):
+		return cls.loads(fh.read())
+	
+	@classmethod
+	def _finite(cls, obj):
+		"""
+		A copy of the object where the non-finite floats are None
+		"""
+		if isinstance(obj, float):
+			return obj  if math.isfinite(obj)  else None
+		if isinstance(obj, dict):
+			return { key: cls._finite(value)  for key, value in obj.items() }
+		if isinstance(obj, (list, tuple)):
+			return [ cls._finite(value)  for value in obj ]
+		
+		return obj
+	
+	@classmethod
+	def _std_dumps(cls, obj, indent=None, **kwargs):
+		"""
+		The rendering through the standard library, as the accelerated one does it
+		"""
+		kwargs.setdefault('ensure_ascii', False)
+		kwargs.setdefault('separators', None  if indent  else (',',':'))
+		kwargs.setdefault('allow_nan', False)
+		indent = cls.INDENT  if indent  else None
+		try:
+			return json.dumps(obj, indent=indent, **kwargs)
+		except ValueError:
+			if kwargs['allow_nan']:
+				raise
+			# There are non-finite floats
+			return json.dumps(cls._finite(obj), indent=indent, **kwargs)
+	
+	@classmethod
+	def dumpb(cls, obj, indent=None):
+		"""
+		It returns the compact serialization as UTF-8 bytes
+		"""
+		if orjson is not None:
+			try:
+				return orjson.dumps(obj, option=orjson.OPT_INDENT_2  if indent  else 0)
+			except TypeError:
+				pass
+		
+		return cls._std_dumps(obj, indent=indent).encode('utf-8')
+	
+	@classmethod
+	def dumps(cls, obj, indent=None, **kwargs):
+		"""
+		Other keyword parameters accepted by json.dumps (like
+		sort_keys) are honoured through the standard library
+		"""
+		if kwargs:
+			return cls._std_dumps(obj, indent=indent, **kwargs)
+		
+		return cls.dumpb(obj, indent=indent).decode('utf-8')
+	
+	@classmethod
+	def dump(cls, obj, fh, **kwargs):
+		fh.write(cls.dumps(obj, **kwargs))
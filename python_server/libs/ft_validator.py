@@ -11,20 +11,49 @@ import datetime
 
 from urllib import request
 from urllib.error import *
+import urllib.parse
 import http,socket
 import time
+import threading
+import concurrent.futures
 
 import collections
+import contextlib
+import copy
+import functools
+import hashlib
 
 import atexit
 import shutil
 
 from fairtracks_validator.fairtracks_validator import FairGTracksValidator
+from fairtracks_validator.extensions.curie_search import CurieSearch
+from fairtracks_validator.extensions.ontology_term import OntologyTerm
 
 from RWFileLock import RWFileLock , LockError
 
 from .singleton import SingletonMeta
 from .background import BackgroundMulticastReceiver
+from .snapshot import ValidatorSnapshot
+from .generation import CacheGeneration
+from .validation_cache import ValidationResultCache
+from .phased_validation import PhasedValidation
+from .parallel_validation import ParallelValidation
+from .validation_sessions import ValidationSessions, SessionLimitError
+from .validation_jobs import ValidationJobs, JobQueueFullError
+from .codec import JSONCodec
+from .metrics import Metrics
+from .profiling import RequestProfiler
+from .hot_reload import HotReloader, PinnedAttribute
+from .cache_snapshot import CacheSnapshot
+from .schema_store import SchemaStore
+from .term_index import IndexedFairGTracksValidator, IndexedOntologyTerm
+
+class DownloadTooLargeError(Exception):
+	pass
+
+class IncompleteCacheError(Exception):
+	pass
 
 #class FAIRTracksValidatorSingleton(metaclass=SingletonMeta):
 class FAIRTracksValidatorSingleton(object):
@@ -33,8 +62,19 @@ class FAIRTracksValidatorSingleton(object):
 	CacheManifestFile = 'manifest.json'
 	
 	DEFAULT_MAX_RETRIES = 5
+	DEFAULT_FETCH_MAX_WORKERS = 8
+	DEFAULT_FETCH_MAX_PER_HOST = 2
+	DEFAULT_FETCH_DEADLINE = 300
+	DEFAULT_FETCH_MAX_SIZE_IN_MB = 64
+	DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+	ContentRangePattern = re.compile(r'^bytes\s+([0-9]+)-')
+	DEFAULT_REBUILD_WAIT = 5
 	DEFAULT_INVALIDATION_KEY = "InvalidateCachePleasePleasePlease!!!"
 	DEFAULT_SHUTDOWN_KEY = "sudo kill -9 -1"
+	# It is only set on the configuration of the process rebuilding the
+	# caches on targeted invalidations, so only the extension caches
+	# used by the changed schemas are warmed up again
+	IncrementalRebuildKey = 'incremental_rebuild'
 	
 	def __init__(self, local_config, api=None, isRW=False):
 		self.logger = logging.getLogger(self.__class__.__name__)
@@ -47,6 +87,36 @@ class FAIRTracksValidatorSingleton(object):
 		self.isRW = isRW
 		self.max_retries = self.DEFAULT_MAX_RETRIES
 		
+		# Knobs of the concurrent fetch of JSON Schemas
+		fetch_config = local_config.get('schema_fetch', {})
+		self.fetch_max_workers = int(fetch_config.get('max-workers', self.DEFAULT_FETCH_MAX_WORKERS))
+		self.fetch_max_per_host = int(fetch_config.get('max-per-host', self.DEFAULT_FETCH_MAX_PER_HOST))
+		self.fetch_deadline = float(fetch_config.get('deadline', self.DEFAULT_FETCH_DEADLINE))
+		self.fetch_max_size = round(float(fetch_config.get('max-size', self.DEFAULT_FETCH_MAX_SIZE_IN_MB)) * 1024 * 1024)
+		
+		# When the cache is trusted, cached schemas whose fingerprint
+		# matches the recorded one are not double-checked
+		cache_config = local_config.get('schema_cache', {})
+		self.trusted_cache = bool(cache_config.get('trusted', False))
+		# When it is true, the loaded schema set is persisted next to
+		# the manifest, so next processes do not have to load it again
+		self.use_snapshot = bool(cache_config.get('snapshot', False))
+		# Max time a validation waits for the cache directory to be replaced
+		self.rebuild_wait = float(cache_config.get('rebuild-wait', self.DEFAULT_REBUILD_WAIT))
+		# Validation results of documents, only when it is enabled
+		self.validation_cache = ValidationResultCache.FromConfig(local_config)
+		# Large batches are validated on a pool of processes, only when enabled
+		self.parallel_validation = ParallelValidation.FromConfig(local_config)
+		
+		# Temporary files are created with restrictive permissions,
+		# so the usual ones are restored when they are renamed
+		umask = os.umask(0)
+		os.umask(umask)
+		self.cache_file_mode = 0o666 & ~umask
+		# When it is true, cached schemas are revalidated against their
+		# source URLs through conditional requests
+		self.revalidate = bool(fetch_config.get('revalidate', False))
+		
 		# This variable should be honoured by the API
 		# so no query is allowed meanwhile we are offline
 		self.offline = True
@@ -68,13 +138,35 @@ class FAIRTracksValidatorSingleton(object):
 		
 		if not os.path.isdir(self.schemaCacheDir):
 			os.makedirs(self.schemaCacheDir)
+		self.schema_store = SchemaStore(self.schemaCacheDir, file_mode=self.cache_file_mode)
+		
+		# Validation sessions, only when they are enabled. They live
+		# outside the cache directory, as it is replaced on rebuilds
+		self.validation_sessions = ValidationSessions.FromConfig(local_config, self.cacheDir + '.sessions')
+		# Asynchronous validation jobs, only when they are enabled
+		self.validation_jobs = ValidationJobs.FromConfig(local_config, self.cacheDir + '.jobs')
+		# Metrics from all the processes, which record nothing when disabled
+		self.metrics = Metrics.FromConfig(local_config, self.cacheDir + '.metrics')
+		# Debug profiling of requests, only when it is enabled
+		self.profiler = RequestProfiler.FromConfig(local_config, self.cacheDir + '.profiles')
+		self.metrics.tracer = self.profiler
 		
 		self._init_locks()
+		# The generation lives outside the cache directory, as the
+		# directory is replaced on rebuilds, so it is not reopened
+		# along with the locks
+		self.generation = CacheGeneration(self.cacheDir + '.generation')
 		
 		self.invalidation_key = local_config.get('invalidation_key', self.DEFAULT_INVALIDATION_KEY)
 		self.shutdown_key = local_config.get('shutdown_key', self.DEFAULT_SHUTDOWN_KEY)
 		
 		self.init_server()
+		
+		# Once the caches are rebuilt, the schema set is reloaded in
+		# place, unless it is disabled
+		self.hot_reloader = HotReloader.FromConfig(local_config, self)
+		if self.hot_reloader is not None:
+			bmr.add_reload_listener(self.hot_reloader.check)
 	
 	def _init_locks(self):
 		schemaCacheLockFile = os.path.join(self.cacheDir,'schema_cache.lock')
@@ -95,11 +187,77 @@ class FAIRTracksValidatorSingleton(object):
 			#traceback.print_stack()
 			#sys.stderr.flush()
 			if self.isRW:
-				self.fgv.invalidateCaches()
-				self.fgv.warmUpCaches()
+				if self.config.get(self.IncrementalRebuildKey, False):
+					changed_extensions = self._changed_schemas_extensions()
+					# An empty list would warm up all of them
+					if len(changed_extensions) > 0:
+						self._detach_extension_caches(changed_extensions)
+						self.fgv.warmUpCaches(dynValList=changed_extensions)
+				else:
+					self._detach_extension_caches(self._schemas_extensions())
+					self.fgv.invalidateCaches()
+					self.fgv.warmUpCaches()
 		
 		self.offline = False
 	
+	def _schemas_extensions(self, schema_hashes=None):
+		"""
+		It returns the extension instances of the loaded schemas,
+		only from the given ones (when they are given)
+		"""
+		extensions = []
+		for schemaObj in self.fgv.getValidSchemas().values():
+			if (schema_hashes is None) or (schemaObj.get('schema_hash') in schema_hashes):
+				extensions.extend(schemaObj['customFormatInstances'])
+		
+		return extensions
+	
+	def _changed_schemas_extensions(self):
+		"""
+		It returns the extension instances of the loaded schemas which
+		were not in the cache manifest, i.e. the new or changed ones
+		"""
+		changed_hashes = set(self._schemas.keys()) - self.previous_schema_hashes
+		self.logger.info("Incremental rebuild with {} changed schemas".format(len(changed_hashes)))
+		
+		return self._schemas_extensions(changed_hashes)
+	
+	# The names of the files which the warm-up of each extension writes
+	# in place. The ontology ones are formatted with the IRI hash
+	CurieInPlacePatterns = ('CURIE_cache.sqlite3*',)
+	OntologyInPlacePatterns = ('owlready2_{0}.sqlite3*', 'metadata_{0}.json', 'ontology_{0}.owl*')
+	
+	def _detach_extension_caches(self, extensions):
+		"""
+		The cache directory of the rebuild is a snapshot, which can share
+		files with the cache directory being used through hardlinks. Only
+		the files the warm-up of the extensions is going to write in place
+		get their own copy, so the large databases of the extensions which
+		are not warmed up keep being shared
+		"""
+		name_patterns = set()
+		for dynVal in extensions:
+			if isinstance(dynVal, CurieSearch):
+				name_patterns.update(self.CurieInPlacePatterns)
+			elif isinstance(dynVal, OntologyTerm):
+				for ontology in dynVal.ontologies:
+					iri_hash = IndexedOntologyTerm.GetIRIHash(ontology)
+					name_patterns.update(map(lambda pattern: pattern.format(iri_hash), self.OntologyInPlacePatterns))
+		
+		if len(name_patterns) > 0:
+			num_detached = CacheSnapshot.Detach(self.cacheDir, name_patterns)
+			if num_detached > 0:
+				self.logger.debug("Detached {} shared files from {}".format(num_detached, self.cacheDir))
+	
+	def warm_up(self):
+		"""
+		It warms up the caches of the extensions, which otherwise
+		happens on the first validation. It is used by the pre-fork
+		master, so the workers share the warmed caches
+		"""
+		with self.ExtensionsCacheLock.shared_blocking_lock():
+			self.fgv.warmUpCaches()
+	
 	def request_shutdown(self, shutdown_key):
 		"""
 		This method is called from a route, that's the reason
@@ -117,16 +275,120 @@ class FAIRTracksValidatorSingleton(object):
 	
 	def _init_server(self):
 		# The server is initialized
-		self.fgv = FairGTracksValidator(config=self.config, isRW=self.isRW)
+		self.fgv = IndexedFairGTracksValidator(config=self.config, isRW=self.isRW)
 		
 		# Do this in a separate thread
 		self.init_cache()
-		self.validateCachedJSONSchemas()
+		if self.isRW:
+			self.collect_store_garbage()
+		# The process rebuilding the caches always loads the schemas,
+		# leaving the snapshot for the processes to be started
+		if self.isRW or not self.restoreValidatorSnapshot():
+			self.validateCachedJSONSchemas()
+			if self.use_snapshot:
+				self.saveValidatorSnapshot()
+		
+		# Cached results from the previous schema set are not valid anymore
+		if self.validation_cache is not None:
+			self.validation_cache.reset(self.fgv)
+		# Neither the workers holding it
+		if self.parallel_validation is not None:
+			self.parallel_validation.reset(self.fgv)
+		if self.validation_jobs is not None:
+			self.validation_jobs.reset(self)
 	
-	def init_cache(self):
+	# The attributes holding the loaded schema set, which are replaced
+	# as a whole on hot reloads
+	ReloadedAttributes = ('fgv', 'manifest', '_schemas', 'initial_source_urls', 'schema_store_stats')
+	# The extensions whose warm-up only opens the caches built by the
+	# rebuild, when they are not writable. The other ones (i.e. primary
+	# keys fetched from remote providers) are warmed up on first use
+	ReadOnlyWarmUpExtensions = (CurieSearch, OntologyTerm)
+	
+	def load_state(self):
+		"""
+		It loads the schema set from the cache directory on a shallow
+		copy of this instance, so the one attending the requests is not
+		touched. It returns the copy and the epoch of the cache directory
+		it was loaded from. As the copy could be used from a background
+		thread, the file locks (which are held per process) are not used,
+		and the load is repeated when the directory was replaced meanwhile.
+		
+		The load is read-only, as other processes are reading the same
+		files: nothing is fetched, neither the cache nor the extension
+		caches are written, and it fails when anything is missing
+		"""
+		for _ in range(self.MAX_VALIDATION_RETRIES):
+			seq = self.generation.read_begin(timeout=self.rebuild_wait)
+			if seq is None:
+				break
+			
+			epoch = self.generation.epoch
+			try:
+				state = copy.copy(self)
+				state.isRW = False
+				state.fgv = IndexedFairGTracksValidator(config=self.config, isRW=state.isRW)
+				# The manifest was just saved by the rebuild
+				state.init_cache(read_only=True)
+				if not state.restoreValidatorSnapshot():
+					state.validateCachedJSONSchemas()
+				read_only_extensions = state._read_only_warm_up_extensions()
+				# An empty list would warm up all of them
+				if len(read_only_extensions) > 0:
+					state.fgv.warmUpCaches(dynValList=read_only_extensions)
+			except Exception:
+				if self.generation.read_retry(seq):
+					continue
+				raise
+			
+			if not self.generation.read_retry(seq):
+				return state, epoch
+		
+		raise LockError("The cache directory is being replaced, so the schema set cannot be loaded")
+	
+	def _read_only_warm_up_extensions(self):
+		read_only_extensions = []
+		for schemaObj in self.fgv.getValidSchemas().values():
+			read_only_extensions.extend(filter(lambda dynVal: isinstance(dynVal, self.ReadOnlyWarmUpExtensions), schemaObj['customFormatInstances']))
+		
+		return read_only_extensions
+	
+	def adopt_state(self, state, lock=None):
+		"""
+		It switches to the schema set loaded by load_state. The requests
+		in flight keep the one they pinned when they started. The
+		attributes are replaced while holding lock, when it is given, so
+		no request pins half of them
+		"""
+		with lock  if lock is not None  else contextlib.nullcontext():
+			for attr_name in self.ReloadedAttributes:
+				setattr(self, attr_name, getattr(state, attr_name))
+		
+		# The locks were opened on the files of the replaced cache
+		# directory, so they would not coordinate with the next rebuilds
+		self._init_locks()
+		
+		# As it happens when the server is initialized
+		if self.validation_cache is not None:
+			self.validation_cache.reset(self.fgv)
+		if self.parallel_validation is not None:
+			self.parallel_validation.reset(self.fgv)
+		if self.validation_jobs is not None:
+			self.validation_jobs.reset(self)
+	
+	def init_cache(self, read_only=False):
+		"""
+		It curates the JSON Schemas from the cache, fetching the missing
+		ones, and it saves the updated manifest. When read_only is true,
+		nothing is fetched or written: the fetches which failed when the
+		cache was built keep on being failures, and IncompleteCacheError
+		is raised when any other JSON Schema is not in the cache
+		"""
 		# 1. Cache directory should exist at this point
 		# These variables are dictionaries to check whether we are reading something twice
 		schemas = []
+		# The fetches which failed when the cache was built
+		failed_schemas_by_url = {}
 		
 		# 2. Read previous cache manifest
 		manifest_path = os.path.join(self.schemaCacheDir,self.CacheManifestFile)
@@ -134,7 +396,7 @@ class FAIRTracksValidatorSingleton(object):
 		if os.path.isfile(manifest_path):
 			try:
 				with open(manifest_path,'r',encoding='utf-8') as mh:
-					manifest = json.load(mh,object_pairs_hook=collections.OrderedDict)
+					manifest = JSONCodec.load(mh)
 			except OSError as err:
 				# The manifest is unreadable, skip it
 				pass
@@ -149,6 +411,12 @@ class FAIRTracksValidatorSingleton(object):
 					source_urls = schema.get('source_urls',[])
 					if (schema_hash is not None) and len(source_urls) > 0:
 						schemas.append(schema)
+					elif len(schema.get('errors',[])) > 0:
+						for source_url in source_urls:
+							failed_schemas_by_url[source_url] = schema
+		
+		# The schemas cached so far, to tell the changed ones
+		self.previous_schema_hashes = set(map(lambda schema: schema['schema_hash'], schemas))
 		
 		# Setting the timestamp of the manifest generation
 		manifest['updated'] = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
@@ -166,6 +434,15 @@ class FAIRTracksValidatorSingleton(object):
 		curated_schemas = []
 		
 		# 5. Curation loop
+		# 5.a. First, gather what is already cached and what has to be
+		# fetched. The order of the entries is kept, as it rules which
+		# entry claims each source URL on the registration step
+		curation_plan = []
+		cached_schemas_by_hash = {}
+		claimed_source_urls = set()
+		# Each element is a source URL and, when it is being
+		# revalidated, its cached curated schema
+		source_urls_to_fetch = []
 		for schema_info in schemas:
 			# Skipping defective entries
 			if 'source_urls' not in schema_info:
@@ -173,165 +450,59 @@ class FAIRTracksValidatorSingleton(object):
 			
 			source_urls = schema_info['source_urls']
 			
-			# 5.a. Does it already have its JSON Schema hash?
+			# Does it already have its JSON Schema hash?
 			schema_hash = schema_info.get('schema_hash')
 			
 			# Files which do not seem a hash are skipped
 			curated_schema = None
+			revalidated_schema = None
 			if (schema_hash is not None) and self.HexSHAPattern.search(schema_hash):
-				curated_schema = curated_schemas_by_hash.get(schema_hash)
+				curated_schema = cached_schemas_by_hash.get(schema_hash)
 				# The schema has not been curated yet
 				if curated_schema is None:
-					jsc_path = schema_hash
-					full_jsc_path = os.path.join(self.schemaCacheDir,jsc_path)
-					
-					if os.path.isfile(full_jsc_path):
-						# If it is a file, let's parse it
-						try:
-							with open(full_jsc_path,'r',encoding='utf-8') as jssh:
-								jss = json.load(jssh,object_pairs_hook=collections.OrderedDict)
-						except OSError as err:
-							# The JSON Schema is unreadable, invalidate it
-							schema_hash = None
-						except json.JSONDecodeError as jde:
-							# The JSON Schema is either empty or corrupted, invalidate it
-							schema_hash = None
+					curated_schema = self._read_cached_schema(schema_info)
+					if curated_schema is not None:
+						cached_schemas_by_hash[schema_hash] = curated_schema
+						if self.revalidate and not read_only:
+							# The cached copy is kept only when the
+							# conditional requests tell it is not modified
+							revalidated_schema = curated_schema
+							curated_schema = None
 						else:
-							# The double-check of the cache
-							computed_schema_hash = FairGTracksValidator.GetNormalizedJSONHash(jss)
-							if schema_hash == computed_schema_hash:
-								curated_schema_info = {
-									'fetched_at': schema_info.get('fetched_at'),
-									'schema_hash': schema_hash,
-									'source_urls': source_urls
-								}
-								curated_schema = {
-									'info': curated_schema_info,
-									'source': jss
-								}
-								errors = schema_info.get('errors',[])
-								schema_id = schema_info.get('schema_id')
-								
-								if schema_id is not None:
-									curated_schema_info['schema_id'] = schema_id
-								#elif len(errors) == 0:
-								#	errors.append({
-								#		'reason': 'no_schema_id',
-								#		'description': "The JSON does not have either an 'id' or '$id'"
-								#	})
-								
-								if len(errors) > 0:
-									curated_schema_info['errors'] = errors
-							else:
-								# Hashes do not match, invalidate it
-								schema_hash = None
+							claimed_source_urls.update(source_urls)
 			
-			# We are here when it is either invalidated or fresh
-			curated_schemas_to_populate = []
-			if curated_schema is None:
+			if curated_schema is not None:
+				curation_plan.append(curated_schema)
+			else:
+				# We are here when it is either invalidated or fresh.
+				# Source URLs already claimed by a previous entry are
+				# not fetched again, as the fetched content would be discarded
+				plan_source_urls = []
 				for source_url in source_urls:
-					# Time to try fetching it
-					errors = []
-					schema_hash = None
-					schema_id = None
-					jss = None
-					theRequest = request.Request(source_url)
-					try:
-						theRawData = self.retriable_full_http_read(theRequest)
-					except HTTPError as e:
-						errors.append({
-							'reason': 'network',
-							'description': str(e)
-						})
-					except socket.timeout as e:
-						errors.append({
-							'reason': 'network',
-							'description': str(e)
-						})
-					except Exception as e:
-						errors.append({
-							'reason': 'unexpected',
-							'description': str(e)
-						})
-					else:
-						try:
-							jss = json.loads(theRawData.decode('utf-8'),object_pairs_hook=collections.OrderedDict)
-						except UnicodeError as ue:
-							errors.append({
-								'reason': 'decode',
-								'description': str(ue)
-							})
-						except json.JSONDecodeError as jde:
-							# The JSON Schema is either empty or corrupted, invalidate it
-							errors.append({
-								'reason': 'json',
-								'description': str(jde)
-							})
-						except Exception as e:
-							errors.append({
-								'reason': 'unexpected',
-								'description': str(e)
-							})
-						else:
-							schema_hash = FairGTracksValidator.GetNormalizedJSONHash(jss)
-							
-							# Is this an schema?
-							#if jss.get('$schema') is not None:
-							#	id_key = '$id'  if '$id' in jss else 'id'
-							#	schema_id = jss.get(id_key)
-							#	if schema_id is None:
-							#		errors.append({
-							#			'reason': 'no_id',
-							#			'description': "JSON Schema attribute '$id' or 'id' are missing"
-							#		})
-							#else:
-							#	errors.append({
-							#		'reason': 'no_schema',
-							#		'description': "JSON Schema attribute '$schema' is missing"
-							#	})
-							
-							# Only here it is saved to the caching dir
-							jsc_path = schema_hash
-							full_jsc_path = os.path.join(self.schemaCacheDir,jsc_path)
-							try:
-								# Save it!
-								with open(full_jsc_path,'wb') as jssh:
-									jssh.write(theRawData)
-							except OSError as err:
-								errors.append({
-									'reason': 'cache_save',
-									'description': str(err)
-								})
-								# The JSON Schema is unreadable, invalidate it
-								schema_hash = None
-					
-					curated_schema_info = {
-						'fetched_at': datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat(),
-						'source_urls': [ source_url ]
-					}
-					
-					curated_schema = {
-						'info': curated_schema_info
-					}
-					
-					if jss is not None:
-						curated_schema['source'] = jss
-					
-					if schema_hash is not None:
-						curated_schema_info['schema_hash'] = schema_hash
-					
-					if schema_id is not None:
-						curated_schema_info['schema_id'] = schema_id
-					
-					if len(errors) > 0:
-						curated_schema_info['errors'] = errors
-					
-					# Store it for the last step
-					curated_schemas_to_populate.append(curated_schema)
+					if source_url not in claimed_source_urls:
+						claimed_source_urls.add(source_url)
+						plan_source_urls.append(source_url)
+						source_urls_to_fetch.append((source_url, revalidated_schema))
+				curation_plan.append(plan_source_urls)
+		
+		# 5.b. All the pending fetches are done concurrently
+		if read_only:
+			fetched_schemas = {}
+			for source_url, _ in source_urls_to_fetch:
+				failed_schema = failed_schemas_by_url.get(source_url)
+				if failed_schema is None:
+					raise IncompleteCacheError("JSON Schema from {} is not in the cache".format(source_url))
+				fetched_schemas[source_url] = self._new_curated_schema(source_url, errors=list(failed_schema['errors']), fetched_at=failed_schema.get('fetched_at'))
+		else:
+			fetched_schemas = self._fetch_schemas(source_urls_to_fetch)
+		
+		for curation_step in curation_plan:
+			if isinstance(curation_step,list):
+				curated_schemas_to_populate = list(map(lambda source_url: fetched_schemas[source_url], curation_step))
 			else:
-				curated_schemas_to_populate.append(curated_schema)
+				curated_schemas_to_populate = [ curation_step ]
 			
-			# 5.b. Register each schema (if possible)
+			# 5.c. Register each schema (if possible)
 			for curated_schema in curated_schemas_to_populate:
 				curated_schema_info = curated_schema['info']
 				schema_hash = curated_schema_info.get('schema_hash')
@@ -349,11 +520,14 @@ class FAIRTracksValidatorSingleton(object):
 					if source_url not in curated_schemas_by_url:
 						curated_source_urls.append(source_url)
 						curated_schemas_by_url[source_url] = target_curated_schema
-					
+				
 				if len(curated_source_urls) > 0:
 					if candidate_to_store:
 						# Store the JSON Schema source
 						curated_schema_info['source_urls'] = curated_source_urls
+						http_validators = curated_schema_info.get('http_validators')
+						if http_validators is not None:
+							curated_schema_info['http_validators'] = { source_url: http_validators[source_url]  for source_url in curated_source_urls  if source_url in http_validators }
 						
 						# Now, record the curated schema
 						curated_schemas_by_hash[schema_hash] = curated_schema
@@ -361,6 +535,11 @@ class FAIRTracksValidatorSingleton(object):
 					else:
 						# We only update the list of source_urls
 						prev_curated_schema['info'].setdefault('source_urls',[]).extend(curated_source_urls)
+						# and their HTTP validators
+						http_validators = curated_schema_info.get('http_validators',{})
+						for source_url in curated_source_urls:
+							if source_url in http_validators:
+								prev_curated_schema['info'].setdefault('http_validators',{})[source_url] = http_validators[source_url]
 		
 		# Saving the populated hashes
 		self._schemas = curated_schemas_by_hash
@@ -368,47 +547,612 @@ class FAIRTracksValidatorSingleton(object):
 		# 6. Save the updated manifest
 		self.manifest['schemas'] = list(filter(lambda si: si is not None, map(lambda cs: cs.get('info'), curated_schemas)))
 		
-		with open(manifest_path,'w',encoding='utf-8') as mh:
-			json.dump(self.manifest, mh)
+		if not read_only:
+			self._save_manifest(manifest_path, self.manifest)
+		
+		self.schema_store_stats = self.schema_store.stats(self._referenced_schema_hashes())
+	
+	def _referenced_schema_hashes(self):
+		return set(filter(lambda schema_hash: schema_hash is not None, map(lambda si: si.get('schema_hash'), self.manifest['schemas'])))
+	
+	def collect_store_garbage(self):
+		"""
+		It removes from the store the objects not referenced from the
+		manifest. It is only called by the process rebuilding the caches,
+		once its fetches are over, as it is the only one writing to the
+		store of its transient directory. The processes initialized
+		from a cache directory could be sharing it with other ones
+		still fetching into it
+		"""
+		referenced_hashes = self._referenced_schema_hashes()
+		self.schema_store.collect_garbage(referenced_hashes)
+		self.schema_store_stats = self.schema_store.stats(referenced_hashes)
+	
+	def _save_manifest(self, manifest_path, manifest):
+		"""
+		The manifest is atomically replaced, so concurrent readers either
+		see the previous one or the new one, and the snapshots of the
+		cache directory sharing it through a hardlink are not modified
+		"""
+		tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(manifest_path), prefix='.manifest-', suffix='.json')
+		try:
+			with os.fdopen(tmp_fd, 'w', encoding='utf-8') as mh:
+				json.dump(manifest, mh)
+			os.chmod(tmp_path, self.cache_file_mode)
+			os.replace(tmp_path, manifest_path)
+		except:
+			os.unlink(tmp_path)
+			raise
+	
+	def _read_cached_schema(self, schema_info):
+		"""
+		This method reads and double-checks a JSON Schema from the
+		cache, returning None when it is not usable
+		"""
+		schema_hash = schema_info['schema_hash']
+		full_jsc_path = self.schema_store.lookup(schema_hash)
+		
+		if full_jsc_path is None:
+			return None
+		
+		# When the cache is trusted, the fingerprint recorded in the
+		# manifest saves the double-check of the normalized hash
+		cache_fingerprint = schema_info.get('cache_fingerprint')
+		fingerprint_matches = False
+		try:
+			if cache_fingerprint is not None:
+				fingerprint_matches = self._matches_cache_fingerprint(full_jsc_path, cache_fingerprint, check_digest=self.trusted_cache)
+		except OSError as err:
+			# The JSON Schema is unreadable, invalidate it
+			return None
+		
+		# If it is a file, let's parse it
+		try:
+			with open(full_jsc_path,'r',encoding='utf-8') as jssh:
+				jss = JSONCodec.load(jssh)
+		except OSError as err:
+			# The JSON Schema is unreadable, invalidate it
+			return None
+		except json.JSONDecodeError as jde:
+			# The JSON Schema is either empty or corrupted, invalidate it
+			return None
+		
+		if not (self.trusted_cache and fingerprint_matches):
+			# The double-check of the cache
+			computed_schema_hash = FairGTracksValidator.GetNormalizedJSONHash(jss)
+			if schema_hash != computed_schema_hash:
+				# Hashes do not match, invalidate it
+				return None
+		
+		# Keeping the fingerprint up to date
+		if not fingerprint_matches:
+			try:
+				cache_fingerprint = self._cache_fingerprint(full_jsc_path)
+			except OSError as err:
+				return None
+		
+		curated_schema_info = {
+			'fetched_at': schema_info.get('fetched_at'),
+			'schema_hash': schema_hash,
+			'source_urls': schema_info['source_urls']
+		}
+		curated_schema = {
+			'info': curated_schema_info,
+			'source': jss
+		}
+		errors = schema_info.get('errors',[])
+		schema_id = schema_info.get('schema_id')
+		
+		if schema_id is not None:
+			curated_schema_info['schema_id'] = schema_id
+		#elif len(errors) == 0:
+		#	errors.append({
+		#		'reason': 'no_schema_id',
+		#		'description': "The JSON does not have either an 'id' or '$id'"
+		#	})
+		
+		http_validators = schema_info.get('http_validators')
+		if http_validators:
+			curated_schema_info['http_validators'] = http_validators
+		
+		curated_schema_info['cache_fingerprint'] = cache_fingerprint
+		
+		if len(errors) > 0:
+			curated_schema_info['errors'] = errors
+		
+		return curated_schema
+	
+	@classmethod
+	def _file_raw_digest(cls, full_path):
+		raw_digest = hashlib.sha256()
+		with open(full_path,'rb') as fh:
+			for chunk in iter(lambda: fh.read(cls.DOWNLOAD_CHUNK_SIZE), b''):
+				raw_digest.update(chunk)
+		
+		return raw_digest.hexdigest()
+	
+	@classmethod
+	def _cache_fingerprint(cls, full_path, raw_digest=None):
+		"""
+		The fingerprint of a cached file is cheap to check: its size,
+		its modification time and the digest of its raw bytes
+		"""
+		st = os.stat(full_path)
+		if raw_digest is None:
+			raw_digest = cls._file_raw_digest(full_path)
+		
+		return {
+			'size': st.st_size,
+			'mtime_ns': st.st_mtime_ns,
+			'raw_sha256': raw_digest
+		}
+	
+	@classmethod
+	def _matches_cache_fingerprint(cls, full_path, cache_fingerprint, check_digest=True):
+		"""
+		Size and modification time are enough when the digest of the
+		raw bytes is not checked. When it is, files rewritten keeping
+		both are caught, and the fingerprint of the ones whose
+		modification time changed (i.e. they were copied) is updated
+		"""
+		st = os.stat(full_path)
+		if cache_fingerprint.get('size') != st.st_size:
+			return False
+		
+		if not check_digest:
+			return cache_fingerprint.get('mtime_ns') == st.st_mtime_ns
+		
+		if cache_fingerprint.get('raw_sha256') == cls._file_raw_digest(full_path):
+			cache_fingerprint['mtime_ns'] = st.st_mtime_ns
+			return True
+		
+		return False
+	
+	def _fetch_schemas(self, source_urls):
+		"""
+		This method fetches the JSON Schemas from their source URLs
+		using a bounded pool of threads, with a limit of concurrent
+		connections per host and a total deadline. Each element of
+		the input is a tuple of the source URL and its cached curated
+		schema, when it is being revalidated. It returns a
+		dictionary from each source URL to its curated schema
+		"""
+		fetched_schemas = {}
+		if len(source_urls) == 0:
+			return fetched_schemas
+		
+		deadline = time.monotonic() + self.fetch_deadline
+		
+		# One semaphore per host, so no host is hammered
+		host_semaphores = {}
+		for source_url, _ in source_urls:
+			host = urllib.parse.urlsplit(source_url).netloc
+			if host not in host_semaphores:
+				host_semaphores[host] = threading.BoundedSemaphore(self.fetch_max_per_host)
+		
+		def _host_bounded_fetch(source_url, cached_schema):
+			with host_semaphores[urllib.parse.urlsplit(source_url).netloc]:
+				start = time.perf_counter()
+				curated_schema = self._fetch_schema(source_url, deadline=deadline, cached_schema=cached_schema)
+				self.metrics.observe('ftv_schema_fetch_duration_seconds', time.perf_counter() - start, outcome='error'  if curated_schema['info'].get('errors')  else 'ok')
+				return curated_schema
+		
+		max_workers = max(1, min(self.fetch_max_workers, len(source_urls)))
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='schema-fetch')
+		try:
+			future_to_url = {}
+			for source_url, cached_schema in source_urls:
+				future_to_url[executor.submit(_host_bounded_fetch, source_url, cached_schema)] = source_url
+			
+			done, not_done = concurrent.futures.wait(future_to_url.keys(), timeout=max(0, deadline - time.monotonic()))
+			for future in done:
+				source_url = future_to_url[future]
+				try:
+					fetched_schemas[source_url] = future.result()
+				except Exception as e:
+					fetched_schemas[source_url] = self._new_curated_schema(source_url, errors=[{
+						'reason': 'unexpected',
+						'description': str(e)
+					}])
+			
+			for future in not_done:
+				future.cancel()
+				source_url = future_to_url[future]
+				self.logger.error("Fetch of {0} did not finish within the {1} seconds deadline".format(source_url, self.fetch_deadline))
+				fetched_schemas[source_url] = self._new_curated_schema(source_url, errors=[{
+					'reason': 'network',
+					'description': 'Fetch did not finish within the {} seconds deadline'.format(self.fetch_deadline)
+				}])
+		finally:
+			# The running fetches abort once the deadline is reached, and
+			# they are joined, so nothing is written to the cache directory
+			# after this point (i.e. while it is saved or replaced)
+			executor.shutdown(wait=True)
+		
+		# The process rebuilding the caches does not attend requests
+		self.metrics.flush(force=True)
+		
+		return fetched_schemas
+	
+	def _new_curated_schema(self, source_url, jss=None, schema_hash=None, schema_id=None, errors=[], fetched_at=None, http_validators=None, cache_fingerprint=None):
+		if fetched_at is None:
+			fetched_at = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+		
+		curated_schema_info = {
+			'fetched_at': fetched_at,
+			'source_urls': [ source_url ]
+		}
+		
+		curated_schema = {
+			'info': curated_schema_info
+		}
+		
+		if jss is not None:
+			curated_schema['source'] = jss
+		
+		if schema_hash is not None:
+			curated_schema_info['schema_hash'] = schema_hash
+		
+		if schema_id is not None:
+			curated_schema_info['schema_id'] = schema_id
+		
+		if len(errors) > 0:
+			curated_schema_info['errors'] = errors
+		
+		if http_validators is not None:
+			curated_schema_info['http_validators'] = { source_url: http_validators }
+		
+		if cache_fingerprint is not None:
+			curated_schema_info['cache_fingerprint'] = cache_fingerprint
+		
+		return curated_schema
+	
+	def _revalidated_curated_schema(self, source_url, cached_schema, http_validators):
+		"""
+		The cached copy is still valid for this source URL
+		"""
+		cached_info = cached_schema['info']
+		return self._new_curated_schema(
+			source_url,
+			jss=cached_schema['source'],
+			schema_hash=cached_info['schema_hash'],
+			schema_id=cached_info.get('schema_id'),
+			errors=list(cached_info.get('errors',[])),
+			fetched_at=cached_info.get('fetched_at'),
+			http_validators=http_validators,
+			cache_fingerprint=cached_info.get('cache_fingerprint')
+		)
+	
+	MaxAgePattern = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?([0-9]+)')
+	
+	@classmethod
+	def _http_validators_from_headers(cls, headers, prev_http_validators=None):
+		"""
+		It gathers the HTTP cache validators from the response headers.
+		As 304 responses can omit them, the previous ones are the defaults
+		"""
+		http_validators = {}
+		if prev_http_validators:
+			http_validators.update(prev_http_validators)
+		http_validators['checked_at'] = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+		
+		if headers is not None:
+			etag = headers.get('ETag')
+			if etag is not None:
+				http_validators['etag'] = etag
+			
+			last_modified = headers.get('Last-Modified')
+			if last_modified is not None:
+				http_validators['last_modified'] = last_modified
+			
+			cache_control = headers.get('Cache-Control')
+			if cache_control is not None:
+				http_validators.pop('max_age', None)
+				cache_control = cache_control.lower()
+				if ('no-cache' not in cache_control) and ('no-store' not in cache_control):
+					max_age_match = cls.MaxAgePattern.search(cache_control)
+					if max_age_match:
+						http_validators['max_age'] = int(max_age_match.group(1))
+		
+		return http_validators
+	
+	@staticmethod
+	def _are_http_validators_fresh(http_validators):
+		"""
+		Within the max-age declared by the server, there is no need
+		to ask it again
+		"""
+		if (http_validators is None) or ('max_age' not in http_validators) or ('checked_at' not in http_validators):
+			return False
+		
+		try:
+			checked_at = datetime.datetime.fromisoformat(http_validators['checked_at'])
+		except ValueError:
+			return False
+		
+		now = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
+		return now < checked_at + datetime.timedelta(seconds=http_validators['max_age'])
+	
+	def _fetch_schema(self, source_url, deadline=None, cached_schema=None):
+		"""
+		It fetches a JSON Schema. When there is a cached copy, a
+		conditional request is issued, and the cached copy is kept
+		when it was not modified, or the server could not be reached
+		"""
+		# Time to try fetching it
+		errors = []
+		schema_hash = None
+		schema_id = None
+		jss = None
+		theRequest = request.Request(source_url)
+		
+		prev_http_validators = None
+		if cached_schema is not None:
+			prev_http_validators = cached_schema['info'].get('http_validators',{}).get(source_url)
+			if self._are_http_validators_fresh(prev_http_validators):
+				return self._revalidated_curated_schema(source_url, cached_schema, prev_http_validators)
+			
+			if prev_http_validators is not None:
+				if 'etag' in prev_http_validators:
+					theRequest.add_header('If-None-Match', prev_http_validators['etag'])
+				if 'last_modified' in prev_http_validators:
+					theRequest.add_header('If-Modified-Since', prev_http_validators['last_modified'])
+		
+		http_validators = None
+		cache_fingerprint = None
+		
+		# The contents are streamed to a hidden temporary file in the
+		# cache directory, which is renamed once its hash is known
+		try:
+			tmp_fd, tmp_path = tempfile.mkstemp(dir=self.schemaCacheDir, prefix='.fetch-', suffix='.json')
+		except OSError as err:
+			errors.append({
+				'reason': 'cache_save',
+				'description': str(err)
+			})
+			return self._new_curated_schema(source_url, errors=errors)
+		
+		try:
+			with os.fdopen(tmp_fd, 'w+b') as tmph:
+				theHeaders, _, raw_digest = self.retriable_streamed_http_download(theRequest, tmph, deadline=deadline, max_size=self.fetch_max_size)
+		except HTTPError as e:
+			if cached_schema is not None:
+				if e.code == 304:
+					return self._revalidated_curated_schema(source_url, cached_schema, self._http_validators_from_headers(e.headers, prev_http_validators))
+				elif e.code >= 500:
+					self.logger.warning("Keeping cached copy of {0}, as revalidation failed: {1}".format(source_url, str(e)))
+					return self._revalidated_curated_schema(source_url, cached_schema, prev_http_validators)
+			
+			errors.append({
+				'reason': 'network',
+				'description': str(e)
+			})
+		except (socket.timeout, http.client.IncompleteRead, ConnectionError) as e:
+			if cached_schema is not None:
+				self.logger.warning("Keeping cached copy of {0}, as revalidation failed: {1}".format(source_url, str(e)))
+				return self._revalidated_curated_schema(source_url, cached_schema, prev_http_validators)
+			
+			errors.append({
+				'reason': 'network',
+				'description': str(e)
+			})
+		except DownloadTooLargeError as e:
+			errors.append({
+				'reason': 'too_large',
+				'description': str(e)
+			})
+		except Exception as e:
+			errors.append({
+				'reason': 'unexpected',
+				'description': str(e)
+			})
+		else:
+			http_validators = self._http_validators_from_headers(theHeaders)
+			try:
+				with open(tmp_path,'r',encoding='utf-8') as jssh:
+					jss = JSONCodec.load(jssh)
+			except UnicodeError as ue:
+				errors.append({
+					'reason': 'decode',
+					'description': str(ue)
+				})
+			except json.JSONDecodeError as jde:
+				# The JSON Schema is either empty or corrupted, invalidate it
+				errors.append({
+					'reason': 'json',
+					'description': str(jde)
+				})
+			except Exception as e:
+				errors.append({
+					'reason': 'unexpected',
+					'description': str(e)
+				})
+			else:
+				schema_hash = FairGTracksValidator.GetNormalizedJSONHash(jss)
+				
+				# Is this an schema?
+				#if jss.get('$schema') is not None:
+				#	id_key = '$id'  if '$id' in jss else 'id'
+				#	schema_id = jss.get(id_key)
+				#	if schema_id is None:
+				#		errors.append({
+				#			'reason': 'no_id',
+				#			'description': "JSON Schema attribute '$id' or 'id' are missing"
+				#		})
+				#else:
+				#	errors.append({
+				#		'reason': 'no_schema',
+				#		'description': "JSON Schema attribute '$schema' is missing"
+				#	})
+				
+				# Only here it is saved to the caching dir
+				try:
+					# Save it! (atomically)
+					full_jsc_path = self.schema_store.put(tmp_path, schema_hash)
+					tmp_path = None
+					cache_fingerprint = self._cache_fingerprint(full_jsc_path, raw_digest)
+				except OSError as err:
+					errors.append({
+						'reason': 'cache_save',
+						'description': str(err)
+					})
+					# The JSON Schema is unreadable, invalidate it
+					schema_hash = None
+		finally:
+			if tmp_path is not None:
+				try:
+					os.unlink(tmp_path)
+				except OSError:
+					pass
+		
+		return self._new_curated_schema(source_url, jss=jss, schema_hash=schema_hash, schema_id=schema_id, errors=errors, http_validators=http_validators, cache_fingerprint=cache_fingerprint)
 	
 	def validateCachedJSONSchemas(self):
 		cached_schemas = map(lambda curated_schema: {'schema': curated_schema.get('source'), 'file': curated_schema['info']['source_urls'][0], 'errors': curated_schema['info'].setdefault('errors',[])}, self._schemas.values())
 		self.fgv.loadJSONSchemas(*cached_schemas)
+	
+	def saveValidatorSnapshot(self):
+		"""
+		It saves the just loaded schema set next to the manifest.
+		Failing to do it is not fatal
+		"""
+		try:
+			snapshot = ValidatorSnapshot.Capture(self.fgv, self._schemas)
+			snapshot.save(self.schemaCacheDir, file_mode=self.cache_file_mode)
+		except Exception as e:
+			self.logger.exception("Unable to save the validator snapshot")
+	
+	def restoreValidatorSnapshot(self):
+		"""
+		It restores the schema set from the snapshot, when it exists
+		and it matches the cached schemas. It returns whether it was done
+		"""
+		if not self.use_snapshot:
+			return False
 		
+		try:
+			state = ValidatorSnapshot.Load(self.schemaCacheDir, self._schemas)
+			if state is None:
+				return False
+			
+			num_schemas = ValidatorSnapshot.Restore(self.fgv, state, self._schemas)
+		except Exception as e:
+			self.logger.exception("Unable to restore the validator snapshot, so schemas are going to be loaded")
+			# Starting from scratch, as the restore could be half done
+			self.fgv = IndexedFairGTracksValidator(config=self.config, isRW=self.isRW)
+			return False
+		
+		self.logger.debug("Restored {} schemas from the validator snapshot".format(num_schemas))
+		return True
 	
-	# This method is borrowed from
+	
+	# This method is derived from the one borrowed from
 	# https://github.com/inab/opeb-enrichers/blob/533b6f6aa93acc7f1f950bf4a37ee4d740a2965a/pubEnricher/libs/skeleton_pub_enricher.py#L603
-	# This method does the different reads and retries
-	# in case of partial contents
-	def retriable_full_http_read(self,theRequest,timeout=300,debug_url=None):
+	# It streams the contents into the destination handle, hashing
+	# them on the fly, and in case of partial contents it resumes the
+	# download through range requests. It returns the response headers,
+	# the size of the contents and the SHA-256 of the raw contents
+	def retriable_streamed_http_download(self,theRequest,dest_handle,timeout=300,debug_url=None,deadline=None,max_size=None):
 		retries = 0
 		
 		last_exception = None
+		headers = None
+		received = 0
+		expected_size = None
+		range_validator = None
+		raw_digest = hashlib.sha256()
 		while retries <= self.max_retries:
 			try:
-				# The original bytes
-				response = b''
-				with request.urlopen(theRequest,timeout=timeout) as req:
+				# No attempt goes beyond the deadline (if any)
+				attempt_timeout = timeout
+				if deadline is not None:
+					attempt_timeout = min(timeout, deadline - time.monotonic())
+					if attempt_timeout <= 0:
+						raise socket.timeout('Deadline reached before fetching {}'.format(theRequest.full_url))
+				
+				attemptRequest = theRequest
+				if received > 0:
+					# Resuming the download from the last received byte
+					attemptRequest = request.Request(theRequest.full_url, headers=dict(theRequest.header_items()))
+					attemptRequest.add_header('Range', 'bytes={}-'.format(received))
+					if range_validator is not None:
+						attemptRequest.add_header('If-Range', range_validator)
+				
+				with request.urlopen(attemptRequest,timeout=attempt_timeout) as req:
+					resumed = False
+					if received > 0:
+						content_range = self.ContentRangePattern.search(req.headers.get('Content-Range',''))
+						if (req.status == 206) and content_range and (int(content_range.group(1)) == received):
+							resumed = True
+						else:
+							# The server did not honour the range request,
+							# so the contents are fetched again from scratch
+							self.logger.debug("Restarting download of {0}".format(theRequest.full_url))
+							dest_handle.seek(0)
+							dest_handle.truncate()
+							received = 0
+							raw_digest = hashlib.sha256()
+					
+					if not resumed:
+						headers = req.headers
+						range_validator = headers.get('ETag')
+						if (range_validator is None) or range_validator.startswith('W/'):
+							range_validator = headers.get('Last-Modified')
+						
+						content_length = headers.get('Content-Length')
+						expected_size = int(content_length)  if (content_length is not None) and content_length.isdigit()  else None
+						if (max_size is not None) and (expected_size is not None) and (expected_size > max_size):
+							raise DownloadTooLargeError('{0} is {1} bytes long, over the limit of {2} bytes'.format(theRequest.full_url, expected_size, max_size))
+					
 					while True:
+						# The fetches still running when the deadline is
+						# reached abort by themselves
+						if (deadline is not None) and (time.monotonic() >= deadline):
+							raise socket.timeout('Deadline reached while fetching {}'.format(theRequest.full_url))
+						
 						try:
-							# Try getting it
-							responsePart = req.read()
+							# Try getting what has already arrived, so
+							# slow servers do not hold the deadline check
+							chunk = req.read1(self.DOWNLOAD_CHUNK_SIZE)
 						except http.client.IncompleteRead as icread:
-							# Getting at least the partial content
-							response += icread.partial
-							continue
-						else:
-							# In this case, saving all
-							response += responsePart
-						break
+							# Saving at least the partial content before resuming
+							chunk = icread.partial
+							if len(chunk) > 0:
+								received += len(chunk)
+								dest_handle.write(chunk)
+								raw_digest.update(chunk)
+							raise
+						
+						if len(chunk) == 0:
+							break
+						
+						received += len(chunk)
+						if (max_size is not None) and (received > max_size):
+							raise DownloadTooLargeError('{0} is over the limit of {1} bytes'.format(theRequest.full_url, max_size))
+						
+						dest_handle.write(chunk)
+						raw_digest.update(chunk)
+					
+					# Was the connection closed before the end?
+					if (expected_size is not None) and (received < expected_size):
+						raise http.client.IncompleteRead(b'', expected_size - received)
 				
-				return response
+				dest_handle.flush()
+				return headers, received, raw_digest.hexdigest()
 			except HTTPError as e:
-				if e.code >= 500 and retries < self.max_retries:
+				if (e.code == 416) and (received > 0):
+					# The range is not satisfiable, so start again from scratch
+					dest_handle.seek(0)
+					dest_handle.truncate()
+					received = 0
+					raw_digest = hashlib.sha256()
+					retries += 1
+					last_exception = e
+				elif e.code >= 500 and retries < self.max_retries and self._can_backoff(retries + 1, deadline):
 					# Using a backoff time of 2 seconds when 500 or 502 errors are hit
 					retries += 1
 					
-					self.logger.debug("Retry {0} , due code {1}".format(retries,e.code),file=sys.stderr)
+					self.logger.debug("Retry {0} , due code {1}".format(retries,e.code))
 					
 					time.sleep(2**retries)
 					last_exception = e
@@ -416,11 +1160,15 @@ class FAIRTracksValidatorSingleton(object):
 					if debug_url is not None:
 						self.logger.error("URL with ERROR: "+debug_url)
 					raise e
-			except socket.timeout as e:
-				# Using also a backoff time of 2 seconds when read timeouts occur
+			except (socket.timeout, http.client.IncompleteRead, ConnectionError) as e:
+				if not self._can_backoff(retries + 1, deadline):
+					raise e
+				
+				# Using also a backoff time of 2 seconds when read timeouts
+				# or truncated contents occur
 				retries += 1
 				
-				self.logger.debug("Retry {0} , due timeout".format(retries),file=sys.stderr)
+				self.logger.debug("Retry {0} , due {1} (resuming from byte {2})".format(retries,e.__class__.__name__,received))
 				
 				time.sleep(2**retries)
 				last_exception = e
@@ -428,20 +1176,180 @@ class FAIRTracksValidatorSingleton(object):
 		# If we reach this point, there is an exception in betweenm
 		raise last_exception
 	
+	@staticmethod
+	def _can_backoff(retries, deadline=None):
+		"""
+		Sleeping for the backoff makes sense only when there is
+		still time for another attempt before the deadline
+		"""
+		return (deadline is None) or (time.monotonic() + 2**retries < deadline)
+	
+	@classmethod
+	def VerifySchemaCache(cls, local_config):
+		"""
+		This method does a full integrity sweep of the cached schemas
+		recorded in the manifest, without needing a running server.
+		It returns a list of reports, one per recorded schema, and
+		one per stray file in the cache
+		"""
+		cacheDir = local_config.get('cacheDir')
+		reports = []
+		if cacheDir is None:
+			return reports
+		
+		schemaCacheDir = os.path.join(cacheDir,'schema_cache')
+		manifest_path = os.path.join(schemaCacheDir,cls.CacheManifestFile)
+		
+		lock = RWFileLock(os.path.join(cacheDir,'schema_cache.lock'))
+		with lock.shared_lock():
+			try:
+				with open(manifest_path,'r',encoding='utf-8') as mh:
+					manifest = JSONCodec.load(mh)
+			except (OSError, json.JSONDecodeError) as err:
+				reports.append({
+					'file': manifest_path,
+					'status': 'unreadable_manifest',
+					'description': str(err)
+				})
+				return reports
+			
+			store = SchemaStore(schemaCacheDir)
+			recorded = set([cls.CacheManifestFile, ValidatorSnapshot.SnapshotFile])
+			for schema_info in manifest.get('schemas',[]):
+				schema_hash = schema_info.get('schema_hash')
+				if schema_hash is None:
+					continue
+				
+				recorded.add(schema_hash)
+				full_jsc_path = store.lookup(schema_hash)
+				if full_jsc_path is None:
+					full_jsc_path = store.path(schema_hash)
+				report = {
+					'file': full_jsc_path,
+					'schema_hash': schema_hash,
+					'source_urls': schema_info.get('source_urls',[]),
+					'status': 'ok'
+				}
+				reports.append(report)
+				try:
+					with open(full_jsc_path,'r',encoding='utf-8') as jssh:
+						jss = JSONCodec.load(jssh)
+				except OSError as err:
+					report['status'] = 'unreadable'
+					report['description'] = str(err)
+					continue
+				except json.JSONDecodeError as jde:
+					report['status'] = 'corrupted'
+					report['description'] = str(jde)
+					continue
+				
+				computed_schema_hash = FairGTracksValidator.GetNormalizedJSONHash(jss)
+				if computed_schema_hash != schema_hash:
+					report['status'] = 'hash_mismatch'
+					report['description'] = 'Normalized hash is {}'.format(computed_schema_hash)
+					continue
+				
+				cache_fingerprint = schema_info.get('cache_fingerprint')
+				if cache_fingerprint is None:
+					report['status'] = 'no_fingerprint'
+					report['description'] = 'The contents are right, but the manifest does not record a fingerprint'
+				elif cache_fingerprint.get('raw_sha256') != cls._file_raw_digest(full_jsc_path):
+					report['status'] = 'fingerprint_mismatch'
+					report['description'] = 'The contents are right, but the recorded fingerprint does not match'
+			
+			stray_paths = []
+			for elem in os.scandir(path=schemaCacheDir):
+				if elem.name in recorded:
+					continue
+				if elem.is_dir() and SchemaStore.ShardPattern.search(elem.name):
+					# The contents of the subdirectories of the store
+					stray_paths.extend(map(lambda shard_elem: shard_elem.path, filter(lambda shard_elem: shard_elem.name not in recorded, os.scandir(path=elem.path))))
+				else:
+					stray_paths.append(elem.path)
+			
+			for stray_path in stray_paths:
+				reports.append({
+					'file': stray_path,
+					'status': 'stray',
+					'description': 'This file is not recorded in the manifest'
+				})
+		
+		return reports
+	
 	def set_api_instance(self,api):
 		self.api = api
 	
 	# Next methods are called from the different endpoint implementations
 	# (indeed, they are the endpoint implementations!)
 	
-	def invalidate_cache(self,invalidation_key,invalidateExtensionsCache=False):
+	@staticmethod
+	def _is_targeted(schema_info, schema_hashes, source_urls):
+		return (schema_info.get('schema_hash') in schema_hashes) or any(map(lambda source_url: source_url in source_urls, schema_info.get('source_urls', [])))
+	
+	def _forget_cached_schemas(self, schema_cache_dir, schema_hashes, source_urls):
+		"""
+		It removes the cached copies of the targeted schemas, so they
+		are fetched again, keeping the rest of the cache as it is
+		"""
+		manifest_path = os.path.join(schema_cache_dir, self.CacheManifestFile)
+		with open(manifest_path, 'r', encoding='utf-8') as mh:
+			manifest = JSONCodec.load(mh)
+		
+		store = SchemaStore(schema_cache_dir, file_mode=self.cache_file_mode)
+		for schema_info in manifest.get('schemas', []):
+			if self._is_targeted(schema_info, schema_hashes, source_urls):
+				schema_hash = schema_info.get('schema_hash')
+				if schema_hash is not None:
+					store.remove(schema_hash)
+				# Conditional requests would keep the cached copy
+				schema_info.pop('http_validators', None)
+		
+		self._save_manifest(manifest_path, manifest)
+	
+	def invalidate_cache(self,invalidation_key,invalidateExtensionsCache=False,revalidate=False,schema_hashes=None,source_urls=None):
+		"""
+		It rebuilds the caches in background. When revalidate is true
+		the cached schemas are kept, and they are only fetched again
+		when the conditional requests tell they were modified. When
+		schema hashes or source URLs are given, only the matching cached
+		schemas are fetched again, and only the extension caches used
+		by the changed ones are warmed up again
+		"""
 		# Cleaning up the cached schemas
 		if self.invalidation_key == invalidation_key:
-			self.offline = True
+			schema_hashes = set(schema_hashes or [])
+			source_urls = set(source_urls or [])
+			targeted = (len(schema_hashes) > 0) or (len(source_urls) > 0)
+			if targeted:
+				if not any(map(lambda schema_info: self._is_targeted(schema_info, schema_hashes, source_urls), self.manifest.get('schemas', []))):
+					self.api.abort(404, 'No cached JSON Schema matches the given hashes or source URLs')
+				# Neither the extension caches nor the rest of schemas are invalidated
+				invalidateExtensionsCache = False
+				revalidate = False
+			
+			# On hot reloads, the current schema set is used until
+			# the new one is loaded
+			if self.hot_reloader is None:
+				self.offline = True
+				if self.validation_cache is not None:
+					self.validation_cache.clear()
 			
 			transient_local_config = self.config.copy()
 			transient_cache_dir = self.cacheDir + '_transient'
 			transient_local_config['cacheDir'] = transient_cache_dir
+			# The metrics from the rebuild are gathered with the other ones
+			if self.metrics.enabled:
+				transient_metrics_config = dict(self.config.get('metrics', {}))
+				transient_metrics_config['dir'] = self.metrics.metrics_dir
+				transient_local_config['metrics'] = transient_metrics_config
+			if revalidate:
+				transient_fetch_config = dict(self.config.get('schema_fetch', {}))
+				transient_fetch_config['revalidate'] = True
+				transient_local_config['schema_fetch'] = transient_fetch_config
+				# Revalidation is only about the schemas
+				invalidateExtensionsCache = False
+			if targeted:
+				transient_local_config[self.IncrementalRebuildKey] = True
 			
 			retval = not os.path.exists(transient_cache_dir)
 			if not retval:
@@ -465,17 +1373,25 @@ class FAIRTracksValidatorSingleton(object):
 				if not invalidateExtensionsCache:
 					with self.SchemaCacheLock.exclusive_blocking_lock(), \
 						self.ExtensionsCacheLock.exclusive_blocking_lock():
-					
-						# First, copy everything
-						shutil.copytree(self.cacheDir, transient_cache_dir)
-						# Second, remove what we are not interested in
-						for elem in os.scandir(path=os.path.join(transient_cache_dir, 'schema_cache')):
-							if elem.is_dir() and not elem.is_symlink():
-								shutil.rmtree(elem.path, ignore_errors=True)
-							else:
-								os.remove(elem.path)
+						
+						# First, snapshot everything, which does not
+						# duplicate the contents of the files
+						start = time.perf_counter()
+						snapshot = CacheSnapshot(self.cacheDir, transient_cache_dir)
+						snapshot.create()
+						self.metrics.observe('ftv_cache_snapshot_seconds', time.perf_counter() - start, method=snapshot.method or CacheSnapshot.COPY)
+						# Second, remove what we are not interested in,
+						# unless the cached schemas are going to be revalidated
+						if targeted:
+							self._forget_cached_schemas(os.path.join(transient_cache_dir, 'schema_cache'), schema_hashes, source_urls)
+						elif not revalidate:
+							for elem in os.scandir(path=os.path.join(transient_cache_dir, 'schema_cache')):
+								if elem.is_dir() and not elem.is_symlink():
+									shutil.rmtree(elem.path, ignore_errors=True)
+								else:
+									os.remove(elem.path)
 				
-				self.bmr.background_rebuild_caches(transient_local_config, self)
+				self.bmr.background_rebuild_caches(transient_local_config, self, reload=self.hot_reloader is not None)
 			
 			self.offline = False
 			
@@ -485,73 +1401,436 @@ class FAIRTracksValidatorSingleton(object):
 	
 	BEING_UPDATED_RESPONSE=(['Server temporarily'], 503, {'Retry-After': '60'})
 	
+	def _unavailable(self, reason):
+		self.metrics.inc('ftv_unavailable_total', reason=reason)
+		return self.BEING_UPDATED_RESPONSE
+	
+	# Next methods only read the in-memory state of this process, so
+	# they do not need to coordinate with other processes
 	def ftv_info(self):
-		try:
-			with self.SchemaCacheLock.shared_lock():
-				return { 'version': self.APIVersion, 'config': {'schemas': self.initial_source_urls } }
-		except LockError:
-			return self.BEING_UPDATED_RESPONSE
+		if self.offline:
+			return self._unavailable('offline')
+		
+		info = { 'version': self.APIVersion, 'config': {'schemas': self.initial_source_urls } }
+		if self.validation_cache is not None:
+			info['validation_cache'] = self.validation_cache.stats()
+		info['schema_store'] = self.schema_store_stats
+		
+		return info
+	
+	def get_metrics(self):
+		"""
+		Metrics are available even when the server is offline
+		"""
+		if not self.metrics.enabled:
+			self.api.abort(404, 'Metrics are not enabled')
 		
+		return self.metrics.render()
 	
 	def list_schemas(self):
-		try:
-			with self.SchemaCacheLock.shared_lock():
-				return self.manifest['schemas']
-		except LockError:
-			return self.BEING_UPDATED_RESPONSE
+		if self.offline:
+			return self._unavailable('offline')
+		
+		return self.manifest['schemas']
 	
 	def get_schema_info(self,schema_hash):
+		if self.offline:
+			return self._unavailable('offline')
+		
+		_schema = self._schemas.get(schema_hash)
+		if _schema is None:
+			self.api.abort(404, 'JSON Schema whose hash is {} is not recorded'.format(schema_hash))
+		
+		return _schema['info']
+	
+	def get_schema(self,schema_hash):
+		if self.offline:
+			return self._unavailable('offline')
+		
+		_schema = self._schemas.get(schema_hash)
+		_schema_source = None  if _schema is None else _schema.get('source')
+		if _schema_source is None:
+			self.api.abort(404, 'JSON Schema source whose hash is {} is not recorded'.format(schema_hash))
+		
+		return _schema_source
+	
+	MAX_VALIDATION_RETRIES = 2
+	
+	def validate(self,*json_data):
+		"""
+		Validations use the extension caches, which live in the cache
+		directory. So, they wait while the directory is being replaced,
+		and they are repeated when it happened in the middle
+		"""
+		if self.offline:
+			return self._unavailable('offline')
+		
+		for _ in range(self.MAX_VALIDATION_RETRIES):
+			with self.metrics.timer('ftv_lock_wait_seconds', lock='generation'):
+				seq = self.generation.read_begin(timeout=self.rebuild_wait)
+			if seq is None:
+				break
+			
+			with self.metrics.phase('validate'):
+				validated = self._validate(*json_data)
+			if not self.generation.read_retry(seq):
+				return self._count_documents(validated)
+		
+		# Slow path, which also deals with writers which died
+		# in the middle, as they do not hold the locks anymore
 		try:
-			with self.SchemaCacheLock.shared_lock():
-				_schema = self._schemas.get(schema_hash)
-				if _schema is None:
-					self.api.abort(404, 'JSON Schema whose hash is {} is not recorded'.format(schema_hash))
-				
-				return _schema['info']
+			with self.SchemaCacheLock.shared_lock(), self.ExtensionsCacheLock.shared_lock():
+				self.generation.recover()
+				with self.metrics.phase('validate'):
+					return self._count_documents(self._validate(*json_data))
 		except LockError:
-			return self.BEING_UPDATED_RESPONSE
+			return self._unavailable('lock')
 	
-	def get_schema(self,schema_hash):
+	def validate_stream(self,*json_data):
+		"""
+		It returns either an iterator over the results, in phases, or
+		the usual response when the service is not available. The
+		shared locks are held until the iteration finishes, as the
+		validation cannot be repeated once the results have been sent,
+		so a cache rebuild waits for the running streams
+		"""
+		if self.offline:
+			return self._unavailable('offline')
+		
+		stream = self._validate_stream(*json_data)
+		# The generator is started, so the locks are either not held
+		# or released when it is closed, even when it is not consumed
 		try:
-			with self.SchemaCacheLock.shared_lock():
-				_schema = self._schemas.get(schema_hash)
-				_schema_source = None  if _schema is None else _schema.get('source')
-				if _schema_source is None:
-					self.api.abort(404, 'JSON Schema source whose hash is {} is not recorded'.format(schema_hash))
-				
-				return _schema_source
+			next(stream)
 		except LockError:
-			return self.BEING_UPDATED_RESPONSE
+			return self._unavailable('lock')
+		
+		return stream
 	
-	def validate(self,*json_data):
+	def _validate_stream(self,*json_data):
+		with self.SchemaCacheLock.shared_lock(), self.ExtensionsCacheLock.shared_lock():
+			self.generation.recover()
+			# Locks are held
+			yield None
+			
+			yield from self._iter_validation_results(*json_data)
+	
+	def iter_job_results(self,*json_data):
+		"""
+		It is used by the validation jobs, which run in background,
+		so they wait for the cache directory to be replaced
+		"""
+		start = time.perf_counter()
+		with self.SchemaCacheLock.shared_blocking_lock(), self.ExtensionsCacheLock.shared_blocking_lock():
+			self.metrics.observe('ftv_lock_wait_seconds', time.perf_counter() - start, lock='cache')
+			self.generation.recover()
+			yield from self._iter_validation_results(*json_data)
+	
+	@staticmethod
+	def _cached_jsons(json_data):
+		"""
+		Inline documents are labelled, and paths are kept as they are
+		"""
+		cached_jsons = []
+		for i_json, loaded_json_piece in enumerate(json_data):
+			if isinstance(loaded_json_piece,tuple):
+				loaded_json_path , loaded_json = loaded_json_piece
+			else:
+				loaded_json_path = '(inline'+str(i_json)+')'
+				loaded_json = loaded_json_piece
+			
+			if loaded_json is None:
+				cached_jsons.append(loaded_json_path)
+			else:
+				cached_jsons.append({'json': loaded_json, 'file': loaded_json_path, 'errors': []})
+		
+		return cached_jsons
+	
+	def _iter_validation_results(self,*json_data):
+		cached_jsons = self._cached_jsons(json_data)
+		
+		num_documents = 0
+		failed_files = set()
+		for phase, jsonObj in PhasedValidation(self.fgv).iter_validate(*cached_jsons):
+			result = self._validation_result(jsonObj)
+			result['phase'] = phase
+			if phase == PhasedValidation.DOCUMENT_PHASE:
+				num_documents += 1
+			if not result['validated']:
+				failed_files.add(result['file'])
+			
+			yield result
+		
+		self.metrics.inc('ftv_documents_total', num_documents - len(failed_files), outcome='validated')
+		self.metrics.inc('ftv_documents_total', len(failed_files), outcome='failed')
+		yield {
+			'phase': 'summary',
+			'documents': num_documents,
+			'validated': num_documents - len(failed_files),
+			'failed': len(failed_files)
+		}
+	
+	def _validate(self,*json_data):
+		cached_jsons = self._cached_jsons(json_data)
+		
+		# Paths can be directories, so there is no one to one
+		# correspondence between the input and the output
+		if self.validation_cache is not None and all(map(lambda cached_json: isinstance(cached_json, dict), cached_jsons)):
+			return self._cached_validate(cached_jsons)
+		
+		# As the input may be a directory full of JSONs, the output
+		# from this method is the only authorizative source of what
+		# happened inside the validation
+		parsed_jsons = self._json_validate(*cached_jsons)
+		
+		return list(map(self._validation_result, parsed_jsons))
+	
+	def _count_documents(self, results):
+		num_failed = sum(map(lambda result: 0  if result['validated']  else 1, results))
+		self.metrics.inc('ftv_documents_total', len(results) - num_failed, outcome='validated')
+		self.metrics.inc('ftv_documents_total', num_failed, outcome='failed')
+		
+		return results
+	
+	@staticmethod
+	def _validation_result(jsonObj):
+		return {
+			'file': jsonObj['file'],
+			'validated': len(jsonObj['errors'])==0,
+			'errors': jsonObj['errors'],
+			'schema_id': jsonObj.get('schema_id'),
+			'schema_hash': jsonObj.get('schema_hash')
+		}
+	
+	def _json_validate(self, *cached_jsons):
+		if self.parallel_validation is not None:
+			# The schema set pinned by the request, which is not the
+			# one of the pool when a hot reload happened meanwhile
+			json_validate = functools.partial(self.parallel_validation.jsonValidate, fgv=self.fgv)
+		else:
+			json_validate = self.fgv.jsonValidate
+		
+		if self.profiler is not None:
+			return self.profiler.profile_call(json_validate, *cached_jsons)
+		
+		return json_validate(*cached_jsons)
+	
+	# A document without schema id, which jsonValidate reports after the
+	# other documents failing the first pass, and before the ones which
+	# went through the second pass
+	FirstPassBoundary = {
+		'file': '(first pass boundary)',
+		'json': {},
+	}
+	
+	def _cached_validate(self, cached_jsons):
+		"""
+		Documents whose result is in the validation cache are not
+		validated again. The remaining ones are validated together,
+		as the ones with cross-document constraints are checked
+		against the rest of the documents from the request.
+		
+		The report from jsonValidate lists first the documents which
+		failed the first pass, and then the ones which went through the
+		second pass (only when any schema has extensions), each group in
+		request order. So, the group of each validated document is taken
+		from its position in the report, and it is kept along with the
+		cached results, in order to merge them in the same order
+		"""
+		results = [None] * len(cached_jsons)
+		first_pass_failed = [False] * len(cached_jsons)
+		keys = [None] * len(cached_jsons)
+		pending = []
+		for i_json, cached_json in enumerate(cached_jsons):
+			key = self.validation_cache.key(self.fgv, cached_json['json'])
+			if key is None:
+				self.validation_cache.count_bypassed()
+				self.metrics.inc('ftv_validation_cache_requests_total', result='bypass')
+			else:
+				cached_entry = self.validation_cache.get(key)
+				if cached_entry is not None:
+					self.metrics.inc('ftv_validation_cache_requests_total', result='hit')
+					first_pass_failed[i_json], cached_result = cached_entry
+					result = dict(cached_result)
+					result['file'] = cached_json['file']
+					result['errors'] = list(cached_result['errors'])
+					results[i_json] = result
+					continue
+				self.metrics.inc('ftv_validation_cache_requests_total', result='miss')
+				keys[i_json] = key
+			
+			pending.append(i_json)
+		
+		if len(pending) > 0:
+			boundary = dict(self.FirstPassBoundary, errors=[])
+			report = self._json_validate(*[ cached_jsons[i_json]  for i_json in pending ], boundary)
+			first_pass_report = report[0:list(map(id, report)).index(id(boundary))]
+			failed_ids = set(map(id, first_pass_report))
+			# jsonValidate fills in the given documents, and the ones
+			# which passed the second pass might not be in the report
+			for i_json in pending:
+				cached_json = cached_jsons[i_json]
+				result = self._validation_result(cached_json)
+				results[i_json] = result
+				first_pass_failed[i_json] = id(cached_json) in failed_ids
+				if keys[i_json] is not None:
+					self.validation_cache.put(keys[i_json], (first_pass_failed[i_json], { k: v  for k, v in result.items()  if k != 'file' }))
+		
+		# The documents which went through the first pass are only
+		# reported when there was any extension involved
+		schemaHash = self.fgv.schemaHash
+		second_pass = any(map(lambda result: (result['schema_id'] in schemaHash) and len(schemaHash[result['schema_id']]['customFormatInstances']) > 0, results))
+		failed = []
+		survivors = []
+		for i_json, result in enumerate(results):
+			if first_pass_failed[i_json]:
+				failed.append(result)
+			elif second_pass:
+				survivors.append(result)
+		
+		return failed + survivors
+	
+	def _session_call(self, method, *args):
+		"""
+		Validation sessions keep their documents, so their validations
+		cannot be repeated when the cache directory is replaced in the
+		middle. Then, the shared locks are held
+		"""
+		if self.offline:
+			return self._unavailable('offline')
+		
+		if self.validation_sessions is None:
+			self.api.abort(404, 'Validation sessions are not enabled')
+		
 		try:
 			with self.SchemaCacheLock.shared_lock(), self.ExtensionsCacheLock.shared_lock():
-				cached_jsons = []
-				for i_json, loaded_json_piece in enumerate(json_data):
-					if isinstance(loaded_json_piece,tuple):
-						loaded_json_path , loaded_json = loaded_json_piece
-					else:
-						loaded_json_path = '(inline'+str(i_json)+')'
-						loaded_json = loaded_json_piece
-					
-					if loaded_json is None:
-						cached_jsons.append(loaded_json_path)
-					else:
-						cached_jsons.append({'json': loaded_json, 'file': loaded_json_path, 'errors': []})
-				
-				# As the input may be a directory full of JSONs, the output
-				# from this method is the only authorizative source of what
-				# happened inside the validation
-				parsed_jsons = self.fgv.jsonValidate(*cached_jsons)
-				
-				return list(map(lambda jsonObj: {
-					'file': jsonObj['file'],
-					'validated': len(jsonObj['errors'])==0,
-					'errors': jsonObj['errors'],
-					'schema_id': jsonObj.get('schema_id'),
-					'schema_hash': jsonObj.get('schema_hash')
-				}, parsed_jsons))
+				self.generation.recover()
+				return method(*args)
 		except LockError:
-			return self.BEING_UPDATED_RESPONSE
+			return self._unavailable('lock')
+	
+	def _validation_session_response(self, session, changed=None, removed=None):
+		"""
+		All the results are returned, unless the labels of the
+		changed ones are provided
+		"""
+		results = list(map(self._validation_result, session.report))
+		num_failed = sum(map(lambda result: 0  if result['validated']  else 1, results))
+		if changed is not None:
+			changed = set(changed)
+			results = self._count_documents(list(filter(lambda result: result['file'] in changed, results)))
+		
+		return {
+			'session_id': session.session_id,
+			'documents': len(session.entries),
+			'validated': len(session.entries) - num_failed,
+			'failed': num_failed,
+			'results': results,
+			'removed': removed
+		}
+	
+	def create_validation_session(self, upserts):
+		return self._session_call(self._create_validation_session, upserts)
+	
+	def _create_validation_session(self, upserts):
+		try:
+			session, changed = self.validation_sessions.create(self.fgv, upserts)
+		except SessionLimitError as sle:
+			self.api.abort(413, str(sle))
+		
+		return self._validation_session_response(session, changed), 201
+	
+	def get_validation_session(self, session_id):
+		return self._session_call(self._get_validation_session, session_id)
 	
+	def _get_validation_session(self, session_id):
+		session = self.validation_sessions.get(self.fgv, session_id)
+		if session is None:
+			self.api.abort(404, 'Validation session {} does not exist'.format(session_id))
+		
+		return self._validation_session_response(session)
+	
+	def update_validation_session(self, session_id, upserts, removals):
+		return self._session_call(self._update_validation_session, session_id, upserts, removals)
+	
+	def _update_validation_session(self, session_id, upserts, removals):
+		try:
+			updated = self.validation_sessions.update(self.fgv, session_id, upserts, removals)
+		except SessionLimitError as sle:
+			self.api.abort(413, str(sle))
+		
+		if updated is None:
+			self.api.abort(404, 'Validation session {} does not exist'.format(session_id))
 		
+		session, changed, removed = updated
+		return self._validation_session_response(session, changed, removed)
+	
+	def delete_validation_session(self, session_id):
+		return self._session_call(self._delete_validation_session, session_id)
+	
+	def _delete_validation_session(self, session_id):
+		if not self.validation_sessions.delete(session_id):
+			self.api.abort(404, 'Validation session {} does not exist'.format(session_id))
+		
+		return [], 204
+	
+	def _jobs_call(self):
+		if self.offline:
+			return self._unavailable('offline')
+		
+		if self.validation_jobs is None:
+			self.api.abort(404, 'Validation jobs are not enabled')
+		
+		return None
+	
+	JOB_QUEUE_FULL_RESPONSE=(['Too many pending validation jobs'], 503, {'Retry-After': '60'})
+	
+	def submit_validation_job(self, inputs, max_member_size, max_total_size):
+		not_available = self._jobs_call()
+		if not_available is not None:
+			return not_available
+		
+		try:
+			job = self.validation_jobs.submit(inputs, max_member_size=max_member_size, max_total_size=max_total_size)
+		except JobQueueFullError:
+			return self.JOB_QUEUE_FULL_RESPONSE
+		
+		return job, 202
+	
+	def get_validation_job(self, job_id):
+		not_available = self._jobs_call()
+		if not_available is not None:
+			return not_available
+		
+		job = self.validation_jobs.get(job_id)
+		if job is None:
+			self.api.abort(404, 'Validation job {} does not exist'.format(job_id))
+		
+		return job
+	
+	def get_validation_job_results(self, job_id, offset, limit):
+		not_available = self._jobs_call()
+		if not_available is not None:
+			return not_available
+		
+		job, page = self.validation_jobs.results(job_id, offset=offset, limit=limit)
+		if job is None:
+			self.api.abort(404, 'Validation job {} does not exist'.format(job_id))
+		if page is None:
+			self.api.abort(409, 'Validation job {} is {}, so its results are not available'.format(job_id, job['status']))
+		
+		return page
+	
+	def delete_validation_job(self, job_id):
+		not_available = self._jobs_call()
+		if not_available is not None:
+			return not_available
+		
+		if not self.validation_jobs.delete(job_id):
+			self.api.abort(404, 'Validation job {} does not exist'.format(job_id))
+		
+		return [], 204
+
+# The attributes replaced by the hot reloads are pinned by each request
+for attr_name in FAIRTracksValidatorSingleton.ReloadedAttributes:
+	setattr(FAIRTracksValidatorSingleton, attr_name, PinnedAttribute(attr_name))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import contextlib
+import mmap
+import os
+import struct
+import time
+
+class CacheGeneration(object):
+	"""
+	A sequence lock shared by all the processes using the same cache
+	directory, through a small memory mapped file. Readers check it
+	without any syscall, and they only wait while the sequence is odd,
+	which means a writer is changing the cache directory. The writers
+	must still be coordinated through the cache file locks.
+	
+	The epoch is increased each time a write finishes, so it tells
+	how many times the cache directory has been replaced.
+	"""
+	Layout = struct.Struct('=QQ')
+	SEQUENCE_OFFSET = 0
+	EPOCH_OFFSET = 8
+	POLL_INTERVAL = 0.01
+	
+	def __init__(self, filename):
+		self.filename = filename
+		fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			if os.fstat(fd).st_size < self.Layout.size:
+				os.ftruncate(fd, self.Layout.size)
+			self._map = mmap.mmap(fd, self.Layout.size)
+		finally:
+			# The mapping does not need the descriptor
+			os.close(fd)
+	
+	def _read(self, offset):
+		return struct.unpack_from('=Q', self._map, offset)[0]
+	
+	def _write(self, offset, value):
+		struct.pack_into('=Q', self._map, offset, value)
+	
+	@property
+	def sequence(self):
+		return self._read(self.SEQUENCE_OFFSET)
+	
+	@property
+	def epoch(self):
+		return self._read(self.EPOCH_OFFSET)
+	
+	def read_begin(self, timeout=0):
+		"""
+		It returns the sequence to be checked at the end of the read,
+		waiting up to timeout seconds for an in-progress write.
+		It returns None when the write did not finish in time
+		"""
+		seq = self._read(self.SEQUENCE_OFFSET)
+		if seq & 1:
+			deadline = time.monotonic() + timeout
+			while seq & 1:
+				if time.monotonic() >= deadline:
+					return None
+				time.sleep(self.POLL_INTERVAL)
+				seq = self._read(self.SEQUENCE_OFFSET)
+		
+		return seq
+	
+	def read_retry(self, seq):
+		"""
+		It tells whether a write happened since read_begin returned seq
+		"""
+		return self._read(self.SEQUENCE_OFFSET) != seq
+	
+	def recover(self):
+		"""
+		It should only be called when it is known there is no writer,
+		as it finishes a write from a writer which died in the middle
+		"""
+		seq = self._read(self.SEQUENCE_OFFSET)
+		if seq & 1:
+			self._write(self.SEQUENCE_OFFSET, seq + 1)
+	
+	@contextlib.contextmanager
+	def write(self):
+		seq = self._read(self.SEQUENCE_OFFSET)
+		# A previous writer could have died in the middle
+		if seq & 1:
+			seq += 1
+		self._write(self.SEQUENCE_OFFSET, seq + 1)
+		try:
+			yield
+		finally:
+			self._write(self.EPOCH_OFFSET, self._read(self.EPOCH_OFFSET) + 1)
+			self._write(self.SEQUENCE_OFFSET, seq + 2)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import logging
+import os
+import threading
+import time
+
+class PinnedAttribute(object):
+	"""
+	A data descriptor for the attributes of the validator which are
+	replaced by the hot reloads. While a thread attends a request, it
+	reads the values pinned when the request started, so a request is
+	attended by only one schema set, even when it is replaced meanwhile
+	"""
+	_Pins = threading.local()
+	
+	def __init__(self, name):
+		self.name = name
+	
+	def __get__(self, obj, objtype=None):
+		if obj is None:
+			return self
+		
+		pin = getattr(self._Pins, 'pin', None)
+		if (pin is not None) and (pin[0] is obj) and (self.name in pin[1]):
+			return pin[1][self.name]
+		
+		try:
+			return obj.__dict__[self.name]
+		except KeyError:
+			raise AttributeError(self.name)
+	
+	def __set__(self, obj, value):
+		obj.__dict__[self.name] = value
+	
+	@classmethod
+	def Pin(cls, obj, attr_names):
+		cls._Pins.pin = (obj, { attr_name: obj.__dict__[attr_name]  for attr_name in attr_names  if attr_name in obj.__dict__ })
+	
+	@classmethod
+	def Unpin(cls):
+		cls._Pins.pin = None
+
+# A process forked while attending a request (i.e. the workers of the
+# validation jobs) must follow the reloads, instead of that request
+os.register_at_fork(after_in_child=PinnedAttribute.Unpin)
+
+class HotReloader(object):
+	"""
+	It reloads the schema set of a server process once a background
+	rebuild has replaced the cache directory, instead of restarting the
+	process. The new validator is loaded in a background thread, while
+	the current one keeps attending the requests, and it is adopted as
+	soon as it is loaded. Each request pins the schema set it started
+	with (see PinnedAttribute), so the requests in flight finish with
+	the previous one, and the new requests get the new one.
+	
+	Replacements are noticed through the epoch of the cache generation,
+	which is shared by all the processes, so forked workers (which do
+	not inherit the multicast listener thread) also notice them on their
+	next request. The reload message from the back channel only starts
+	the reload earlier.
+	"""
+	RETRY_INTERVAL = 10
+	
+	def __init__(self, ftv):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		self.ftv = ftv
+		self._init_process_state()
+		# The epoch of the cache directory the current validator was loaded from
+		self.loaded_epoch = ftv.generation.epoch
+	
+	def _init_process_state(self):
+		# Neither the lock nor the reload thread survive a fork
+		self._pid = os.getpid()
+		self._lock = threading.Lock()
+		self._reloading = False
+		self._last_failure = None
+	
+	@classmethod
+	def FromConfig(cls, local_config, ftv):
+		"""
+		It returns None when hot reloads are disabled, so the processes
+		are shut down after each rebuild
+		"""
+		cache_config = local_config.get('schema_cache', {})
+		if not cache_config.get('hot-reload', True):
+			return None
+		
+		return cls(ftv)
+	
+	def _check_process(self):
+		if self._pid != os.getpid():
+			self._init_process_state()
+	
+	def check(self):
+		"""
+		It starts loading the new schema set in background, when the
+		cache directory was replaced since the current one was loaded
+		"""
+		self._check_process()
+		if self.ftv.generation.epoch == self.loaded_epoch:
+			return
+		
+		with self._lock:
+			if self._reloading:
+				return
+			# Failed reloads are not retried on each request
+			if (self._last_failure is not None) and (time.monotonic() - self._last_failure < self.RETRY_INTERVAL):
+				return
+			self._reloading = True
+		
+		threading.Thread(name='hot-reload', target=self._reload, daemon=True).start()
+	
+	def _reload(self):
+		start = time.perf_counter()
+		try:
+			state, epoch = self.ftv.load_state()
+		except Exception:
+			self.logger.exception("Unable to reload the schema set, the previous one is kept")
+			self.ftv.metrics.inc('ftv_hot_reloads_total', outcome='error')
+			with self._lock:
+				self._reloading = False
+				self._last_failure = time.monotonic()
+			return
+		
+		self.ftv.metrics.observe('ftv_hot_reload_seconds', time.perf_counter() - start)
+		# The requests in flight keep the pinned schema set
+		self.ftv.adopt_state(state, lock=self._lock)
+		with self._lock:
+			self._reloading = False
+			self._last_failure = None
+			self.loaded_epoch = epoch
+		
+		self.ftv.metrics.inc('ftv_hot_reloads_total', outcome='ok')
+		self.logger.info("Schema set reloaded from cache epoch {}".format(epoch))
+	
+	def begin_request(self):
+		self._check_process()
+		# The lock keeps half adopted schema sets from being pinned
+		with self._lock:
+			PinnedAttribute.Pin(self.ftv, self.ftv.ReloadedAttributes)
+		
+		self.check()
+	
+	def end_request(self):
+		PinnedAttribute.Unpin()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import copy
+
+from extended_json_schema_validator.extensions.unique_check import UniqueKey
+from extended_json_schema_validator.extensions.pk_check import PrimaryKey
+
+from .snapshot import ValidatorSnapshot
+
+class KeyIndex(object):
+	"""
+	Helpers to gather the values recorded by the extensions doing
+	cross-document checks (unique and primary keys, foreign keys,
+	foreign properties) while some documents are validated against
+	their JSON Schemas, and to merge them back into the extensions of
+	a FairGTracksValidator instance, so the second pass can be run once
+	for all the documents.
+	
+	Duplicated unique or primary key values are reported while the
+	documents are validated, and the errors depend on the order the
+	documents were seen. So, whenever they appear, the documents must
+	be validated again, all of them together.
+	"""
+	DuplicateReasons = (UniqueKey.SchemaErrorReason, PrimaryKey.SchemaErrorReason)
+	
+	@staticmethod
+	def DynamicValidators(fgv):
+		return [ customFormatInstance  for schemaObj in fgv.schemaHash.values()  for customFormatInstance in schemaObj['customFormatInstances'] ]
+	
+	@classmethod
+	def CanMerge(cls, fgv):
+		"""
+		Primary keys populated from remote sources are not
+		gathered from the documents
+		"""
+		return fgv.config.get(PrimaryKey.KeyAttributeName) is None
+	
+	@classmethod
+	def HasDuplicates(cls, errors):
+		return any(map(lambda error: error.get('reason') in cls.DuplicateReasons, errors))
+	
+	@classmethod
+	def DefValues(cls, world_def):
+		"""
+		Definitions hold their gathered values either directly (unique
+		and primary keys, foreign properties) or through their location
+		(foreign keys)
+		"""
+		fkLoc = getattr(world_def, 'fkLoc', None)
+		if fkLoc is not None:
+			return fkLoc.values
+		
+		return world_def.values
+	
+	@classmethod
+	def _PrunedCopy(cls, world):
+		"""
+		It returns a copy of the world with only the definitions
+		holding values, or None when there is none
+		"""
+		pruned = {}
+		for world_key, world_val in world.items():
+			if isinstance(world_val, dict):
+				world_val = cls._PrunedCopy(world_val)
+				if world_val is not None:
+					pruned[world_key] = world_val
+			elif len(cls.DefValues(world_val)) > 0:
+				pruned[world_key] = copy.deepcopy(world_val)
+		
+		return pruned  if len(pruned) > 0  else None
+	
+	@classmethod
+	def Gather(cls, fgv, copied=False):
+		"""
+		It returns the worlds of the extensions, keyed by the schema
+		and the position of each extension instance. When copied is
+		true, only the definitions holding values are copied, so
+		the result survives the reset of the extensions
+		"""
+		gathered = {}
+		for jsonSchemaURI, schemaObj in fgv.schemaHash.items():
+			for i_cFI, customFormatInstance in enumerate(schemaObj['customFormatInstances']):
+				worlds = ValidatorSnapshot.GetExtensionWorlds(customFormatInstance)
+				if copied:
+					worlds = [ cls._PrunedCopy(world) or {}  for world in worlds ]
+					if not any(worlds):
+						continue
+				if worlds:
+					gathered[(jsonSchemaURI, i_cFI)] = worlds
+		
+		return gathered
+	
+	@classmethod
+	def MergeWorld(cls, world, other_world):
+		"""
+		It returns False when a value which must be unique
+		was already gathered
+		"""
+		for world_key, other_val in other_world.items():
+			world_val = world.get(world_key)
+			if world_val is None:
+				# Merged worlds must not share anything
+				world[world_key] = copy.deepcopy(other_val)
+			elif isinstance(other_val, dict):
+				if not cls.MergeWorld(world_val, other_val):
+					return False
+			else:
+				world_values = cls.DefValues(world_val)
+				other_values = cls.DefValues(other_val)
+				if isinstance(world_values, list):
+					world_values.extend(other_values)
+				else:
+					for value, where in other_values.items():
+						if value in world_values:
+							return False
+						world_values[value] = where
+		
+		return True
+	
+	@classmethod
+	def Merge(cls, fgv, gathered_list):
+		"""
+		It merges, in order, what was gathered into the extensions of
+		the validator instance, which should have been reset. It returns
+		False when a duplicated value was found
+		"""
+		customFormatInstances = {}
+		for jsonSchemaURI, schemaObj in fgv.schemaHash.items():
+			for i_cFI, customFormatInstance in enumerate(schemaObj['customFormatInstances']):
+				customFormatInstances[(jsonSchemaURI, i_cFI)] = customFormatInstance
+		
+		for gathered in gathered_list:
+			for cFI_key, worlds in gathered.items():
+				for world, other_world in zip(ValidatorSnapshot.GetExtensionWorlds(customFormatInstances[cFI_key]), worlds):
+					if not cls.MergeWorld(world, other_world):
+						return False
+		
+		return True
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os
+import re
+import atexit
+import json
+import bisect
+import contextlib
+import logging
+import tempfile
+import threading
+import time
+
+from RWFileLock import RWFileLock
+
+class Metrics(object):
+	"""
+	It keeps counters and histograms about where the time goes, which
+	are exposed in Prometheus text format. Each process keeps its own
+	values, and it dumps them to a file named after its pid in the
+	metrics directory, at most once per flush interval (and always
+	before rendering them). The rendered values are the aggregation
+	of the files from all the processes. As counters must not go
+	backwards, the files from dead processes are folded into an
+	archive file.
+	
+	When there is no metrics directory nothing is recorded.
+	"""
+	COUNTER = 'counter'
+	HISTOGRAM = 'histogram'
+	
+	DurationBuckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+	
+	Definitions = {
+		'ftv_http_request_duration_seconds': (HISTOGRAM, 'Time spent attending requests, until the response is ready to be sent'),
+		'ftv_http_request_bytes_total': (COUNTER, 'Bytes received in request bodies'),
+		'ftv_phase_duration_seconds': (HISTOGRAM, 'Time spent on each phase of the validation requests (receive, sniff, extract, parse, validate, marshal, render)'),
+		'ftv_documents_total': (COUNTER, 'Validated documents, by outcome'),
+		'ftv_archive_bytes_total': (COUNTER, 'Decompressed bytes read from the members of uploaded archives'),
+		'ftv_lock_wait_seconds': (HISTOGRAM, 'Time spent waiting for the cache directory to be available'),
+		'ftv_unavailable_total': (COUNTER, 'Requests answered with 503, by reason'),
+		'ftv_validation_cache_requests_total': (COUNTER, 'Lookups in the validation result cache, by result (hit, miss, bypass)'),
+		'ftv_schema_fetch_duration_seconds': (HISTOGRAM, 'Time spent fetching each JSON Schema, by outcome'),
+		'ftv_hot_reloads_total': (COUNTER, 'Schema set reloads after the cache directory was replaced, by outcome'),
+		'ftv_hot_reload_seconds': (HISTOGRAM, 'Time spent loading the schema set on each reload, in background'),
+		'ftv_cache_snapshot_seconds': (HISTOGRAM, 'Time spent populating the transient directory of a rebuild, holding the cache locks, by method (reflink, hardlink, copy)'),
+	}
+	
+	MetricsFilePattern = re.compile(r'^([0-9]+)\.json$')
+	ArchiveFile = 'archive.json'
+	LockFile = 'metrics.lock'
+	
+	DEFAULT_FLUSH_INTERVAL = 5
+	
+	def __init__(self, metrics_dir=None, flush_interval=DEFAULT_FLUSH_INTERVAL):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		self.metrics_dir = metrics_dir
+		self.flush_interval = flush_interval
+		self._lock = threading.Lock()
+		self._pid = None
+		self._counters = {}
+		self._histograms = {}
+		self._last_flush = 0
+		# The profiler of the requests, which also gets the timings
+		self.tracer = None
+	
+	@classmethod
+	def FromConfig(cls, local_config, default_metrics_dir):
+		"""
+		It returns an instance which records nothing when the
+		metrics are not enabled
+		"""
+		metrics_config = local_config.get('metrics', {})
+		if not metrics_config.get('enabled', False):
+			return cls()
+		
+		metrics_dir = metrics_config.get('dir', default_metrics_dir)
+		os.makedirs(metrics_dir, exist_ok=True)
+		
+		metrics = cls(
+			metrics_dir,
+			flush_interval=float(metrics_config.get('flush-interval', cls.DEFAULT_FLUSH_INTERVAL))
+		)
+		# Processes which end through os._exit lose at most one
+		# flush interval of values, unless they flush before (as
+		# the workers of PreforkWSGIServer do)
+		atexit.register(metrics.flush, force=True)
+		
+		return metrics
+	
+	@property
+	def enabled(self):
+		return self.metrics_dir is not None
+	
+	def _own_values(self):
+		"""
+		It must be called holding the lock. Forked processes do not
+		report the values inherited from their parent
+		"""
+		pid = os.getpid()
+		if self._pid != pid:
+			self._pid = pid
+			self._counters = {}
+			self._histograms = {}
+			self._last_flush = 0
+	
+	@staticmethod
+	def _key(name, labels):
+		return (name, tuple(sorted(labels.items())))
+	
+	def inc(self, name, amount=1, **labels):
+		if self.metrics_dir is None:
+			return
+		
+		key = self._key(name, labels)
+		with self._lock:
+			self._own_values()
+			self._counters[key] = self._counters.get(key, 0) + amount
+	
+	def observe(self, name, value, **labels):
+		if self.metrics_dir is None:
+			return
+		
+		key = self._key(name, labels)
+		with self._lock:
+			self._own_values()
+			histogram = self._histograms.get(key)
+			if histogram is None:
+				# The last bucket is +Inf
+				histogram = [ [0] * (len(self.DurationBuckets) + 1), 0.0, 0 ]
+				self._histograms[key] = histogram
+			histogram[0][bisect.bisect_left(self.DurationBuckets, value)] += 1
+			histogram[1] += value
+			histogram[2] += 1
+	
+	def timer(self, name, **labels):
+		# Nothing is timed when nobody is listening
+		if (self.metrics_dir is None) and (self.tracer is None):
+			return contextlib.nullcontext()
+		
+		return self._timer(name, labels)
+	
+	@contextlib.contextmanager
+	def _timer(self, name, labels):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			self.observe(name, elapsed, **labels)
+			if self.tracer is not None:
+				self.tracer.record_metric(name, elapsed, labels)
+	
+	def phase(self, phase):
+		return self.timer('ftv_phase_duration_seconds', phase=phase)
+	
+	def _dump(self):
+		"""
+		It must be called holding the lock
+		"""
+		return {
+			'counters': [ [name, list(labels), value]  for (name, labels), value in self._counters.items() ],
+			'histograms': [ [name, list(labels)] + histogram  for (name, labels), histogram in self._histograms.items() ]
+		}
+	
+	def _atomic_write(self, filename, values):
+		fd, tmp_filename = tempfile.mkstemp(dir=self.metrics_dir, prefix='.', suffix='.tmp')
+		try:
+			with os.fdopen(fd, mode='w', encoding='utf-8') as th:
+				json.dump(values, th)
+			os.replace(tmp_filename, filename)
+		except:
+			os.unlink(tmp_filename)
+			raise
+	
+	def flush(self, force=False):
+		if self.metrics_dir is None:
+			return
+		
+		with self._lock:
+			self._own_values()
+			if not force and (time.monotonic() - self._last_flush < self.flush_interval):
+				return
+			
+			values = self._dump()
+			self._last_flush = time.monotonic()
+		
+		try:
+			self._atomic_write(os.path.join(self.metrics_dir, '{}.json'.format(self._pid)), values)
+		except OSError as e:
+			self.logger.error("Unable to save the metrics: {}".format(e))
+	
+	@staticmethod
+	def _is_alive(pid):
+		try:
+			os.kill(pid, 0)
+		except ProcessLookupError:
+			return False
+		except PermissionError:
+			pass
+		
+		return True
+	
+	@classmethod
+	def _read_values(cls, filename):
+		try:
+			with open(filename, mode='r', encoding='utf-8') as mh:
+				return json.load(mh)
+		except (OSError, ValueError):
+			return None
+	
+	@classmethod
+	def _merge(cls, counters, histograms, values):
+		for name, labels, value in values.get('counters', []):
+			key = (name, tuple(map(tuple, labels)))
+			counters[key] = counters.get(key, 0) + value
+		
+		for name, labels, buckets, total, count in values.get('histograms', []):
+			key = (name, tuple(map(tuple, labels)))
+			histogram = histograms.get(key)
+			if histogram is None:
+				histograms[key] = [ list(buckets), total, count ]
+			else:
+				histogram[0] = [ a + b  for a, b in zip(histogram[0], buckets) ]
+				histogram[1] += total
+				histogram[2] += count
+	
+	def collect(self):
+		"""
+		It returns the counters and the histograms aggregated
+		from all the processes
+		"""
+		self.flush(force=True)
+		
+		counters = {}
+		histograms = {}
+		with RWFileLock(os.path.join(self.metrics_dir, self.LockFile)).exclusive_blocking_lock():
+			archive_filename = os.path.join(self.metrics_dir, self.ArchiveFile)
+			archive_values = self._read_values(archive_filename)
+			if archive_values is not None:
+				self._merge(counters, histograms, archive_values)
+			
+			dead_filenames = []
+			for entry in os.scandir(self.metrics_dir):
+				match = self.MetricsFilePattern.search(entry.name)
+				if match is None:
+					continue
+				
+				values = self._read_values(entry.path)
+				if values is None:
+					continue
+				
+				self._merge(counters, histograms, values)
+				if not self._is_alive(int(match.group(1))):
+					dead_filenames.append(entry.path)
+			
+			if dead_filenames:
+				# The archive is rewritten before the files
+				# from the dead processes are removed
+				archived_counters = {}
+				archived_histograms = {}
+				if archive_values is not None:
+					self._merge(archived_counters, archived_histograms, archive_values)
+				for dead_filename in dead_filenames:
+					self._merge(archived_counters, archived_histograms, self._read_values(dead_filename) or {})
+				
+				self._atomic_write(archive_filename, {
+					'counters': [ [name, list(labels), value]  for (name, labels), value in archived_counters.items() ],
+					'histograms': [ [name, list(labels)] + histogram  for (name, labels), histogram in archived_histograms.items() ]
+				})
+				for dead_filename in dead_filenames:
+					os.unlink(dead_filename)
+		
+		return counters, histograms
+	
+	@staticmethod
+	def _format_labels(labels):
+		if len(labels) == 0:
+			return ''
+		
+		return '{' + ','.join(map(lambda label: '{}="{}"'.format(label[0], str(label[1]).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')), labels)) + '}'
+	
+	@staticmethod
+	def _format_value(value):
+		return repr(float(value))  if isinstance(value, float)  else str(value)
+	
+	def render(self):
+		"""
+		It returns the aggregated metrics in Prometheus text format
+		"""
+		counters, histograms = self.collect()
+		
+		lines = []
+		for name in sorted(self.Definitions.keys()):
+			metric_type, metric_help = self.Definitions[name]
+			lines.append('# HELP {} {}'.format(name, metric_help))
+			lines.append('# TYPE {} {}'.format(name, metric_type))
+			if metric_type == self.COUNTER:
+				for (c_name, labels), value in sorted(counters.items()):
+					if c_name == name:
+						lines.append('{}{} {}'.format(name, self._format_labels(labels), self._format_value(value)))
+			else:
+				for (h_name, labels), (buckets, total, count) in sorted(histograms.items()):
+					if h_name != name:
+						continue
+					
+					cumulative = 0
+					for upper_bound, bucket_count in zip(self.DurationBuckets + ('+Inf',), buckets):
+						cumulative += bucket_count
+						lines.append('{}_bucket{} {}'.format(name, self._format_labels(labels + (('le', str(upper_bound)),)), cumulative))
+					lines.append('{}_sum{} {}'.format(name, self._format_labels(labels), self._format_value(total)))
+					lines.append('{}_count{} {}'.format(name, self._format_labels(labels), count))
+		
+		return '\n'.join(lines) + '\n'
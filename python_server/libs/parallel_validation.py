@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os
+import logging
+import multiprocessing
+import pickle
+
+from .key_index import KeyIndex
+from .phased_validation import PhasedValidation
+from .snapshot import ValidatorSnapshot
+
+# The validator instance used by the pool workers, restored from the
+# snapshot of the one from the server process, and the translation
+# of the addresses of its schema fragments to the server ones
+_WorkerFGV = None
+_WorkerAddresses = None
+
+def _init_worker(fgv_class, config, payload):
+	"""
+	The pool workers are started from scratch, so they restore
+	the schema set of the server process, without writing any cache
+	"""
+	global _WorkerFGV, _WorkerAddresses
+	# Failed workers would be restarted forever, so the
+	# failure is reported by the validations
+	try:
+		state = pickle.loads(payload)
+		fgv = fgv_class(config=config, isRW=False)
+		ValidatorSnapshot.Restore(fgv, state, {})
+		_WorkerAddresses = { id(fragment): address  for address, fragment in state['anchors'].items() }
+		_WorkerFGV = fgv
+	except Exception:
+		logging.getLogger(__name__).exception("Unable to restore the schema set in the pool worker")
+
+def _gather(fgv):
+	"""
+	The values gathered by the extensions, keyed by the addresses
+	of the schema fragments in the server process
+	"""
+	gathered = {}
+	for cFI_key in KeyIndex.Gather(fgv).keys():
+		jsonSchemaURI, i_cFI = cFI_key
+		customFormatInstance = fgv.schemaHash[jsonSchemaURI]['customFormatInstances'][i_cFI]
+		gathered[cFI_key] = ValidatorSnapshot.RemapExtensionWorlds(customFormatInstance, _WorkerAddresses)
+	
+	return gathered
+
+def _validate_chunk(chunk):
+	"""
+	It is run by the pool workers. It validates each document of the
+	chunk against its JSON Schema, and it returns the results along
+	with the values gathered by the extensions for the cross-document
+	checks
+	"""
+	fgv = _WorkerFGV
+	if fgv is None:
+		raise RuntimeError("The schema set was not restored in the pool worker")
+	
+	# The validators are not reset at the end, as the returned
+	# worlds are pickled once this function has returned
+	fgv._resetDynamicValidators(KeyIndex.DynamicValidators(fgv))
+	phased = PhasedValidation(fgv)
+	doc_results = []
+	for jsonObj in chunk:
+		passed = phased.validate_document(jsonObj)
+		doc_results.append((jsonObj['errors'], jsonObj.get('schema_id'), jsonObj.get('schema_hash'), passed))
+	
+	return doc_results, _gather(fgv)
+
+class ParallelValidation(object):
+	"""
+	It validates large batches on a pool of processes, which restore
+	the loaded schemas from a snapshot. Each worker validates a
+	contiguous chunk of documents against their JSON Schemas, and the
+	values gathered by the extensions (translated to the addresses of the
+	schema fragments of this process, as they are used as keys) are
+	merged in order, so the cross-document checks (second pass) are run
+	once with the whole set.
+	
+	The server processes run threads, so the workers are not forked
+	from them: they come from a fork server (or they are spawned, where
+	it is not available), and they are started when the first large
+	batch arrives.
+	
+	The results match the ones from jsonValidate. Duplicated unique or
+	primary key values are the exception, as the reported errors depend
+	on the order the documents were seen, so those batches are
+	validated again serially. The same happens when primary keys are
+	populated from remote sources.
+	"""
+	DEFAULT_MIN_DOCUMENTS = 256
+	DEFAULT_CHUNKS_PER_PROCESS = 4
+	
+	# Preferred first
+	StartMethods = ('forkserver', 'spawn')
+	
+	def __init__(self, processes, min_documents=DEFAULT_MIN_DOCUMENTS, chunks_per_process=DEFAULT_CHUNKS_PER_PROCESS):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		self.processes = processes
+		self.min_documents = max(min_documents, 1)
+		self.chunks_per_process = max(chunks_per_process, 1)
+		self.fgv = None
+		self._worker_args = None
+		self._pool = None
+		self._pool_pid = None
+	
+	@classmethod
+	def FromConfig(cls, local_config):
+		"""
+		It returns None when there are not at least two processes
+		"""
+		parallel_config = local_config.get('parallel_validation', {})
+		processes = parallel_config.get('processes', 0)
+		if processes == 'auto':
+			processes = os.cpu_count() or 1
+		processes = int(processes)
+		if processes < 2:
+			return None
+		
+		return cls(
+			processes,
+			min_documents=int(parallel_config.get('min-documents', cls.DEFAULT_MIN_DOCUMENTS)),
+			chunks_per_process=int(parallel_config.get('chunks-per-process', cls.DEFAULT_CHUNKS_PER_PROCESS))
+		)
+	
+	def reset(self, fgv):
+		"""
+		It must be called each time the schema set is (re)loaded, as
+		the workers restore it. Schema sets which cannot be snapshotted
+		are validated serially
+		"""
+		try:
+			snapshot = ValidatorSnapshot.Capture(fgv, {})
+		except Exception:
+			self.logger.exception("Unable to snapshot the schema set for the pool, so validations are serial")
+			worker_args = None
+		else:
+			worker_args = (type(fgv), fgv.config, snapshot.payload)
+		
+		# The pool is closed once the new schema set is in place, so
+		# no pool restoring the previous one survives
+		self.fgv = fgv
+		self._worker_args = worker_args
+		self.close()
+	
+	@classmethod
+	def _GetContext(cls):
+		available_methods = multiprocessing.get_all_start_methods()
+		for start_method in cls.StartMethods:
+			if start_method in available_methods:
+				context = multiprocessing.get_context(start_method)
+				if start_method == 'forkserver':
+					context.set_forkserver_preload([__name__])
+				return context
+	
+	def close(self):
+		# A pool inherited from a forked parent is not ours
+		if (self._pool is not None) and (self._pool_pid == os.getpid()):
+			self._pool.terminate()
+			self._pool.join()
+		self._pool = None
+		self._pool_pid = None
+	
+	def _get_pool(self):
+		if (self._pool is None) or (self._pool_pid != os.getpid()):
+			self._pool = self._GetContext().Pool(processes=self.processes, initializer=_init_worker, initargs=self._worker_args)
+			self._pool_pid = os.getpid()
+		
+		return self._pool
+	
+	def _split(self, cached_jsons):
+		num_chunks = min(len(cached_jsons), self.processes * self.chunks_per_process)
+		chunk_size, remainder = divmod(len(cached_jsons), num_chunks)
+		chunks = []
+		start = 0
+		for i_chunk in range(num_chunks):
+			end = start + chunk_size + (1  if i_chunk < remainder  else 0)
+			chunks.append(cached_jsons[start:end])
+			start = end
+		
+		return chunks
+	
+	def _merge(self, fgv, chunk_results):
+		"""
+		It returns False when the batch must be validated serially
+		"""
+		for doc_results, _ in chunk_results:
+			for errors, _, _, _ in doc_results:
+				if KeyIndex.HasDuplicates(errors):
+					return False
+		
+		return KeyIndex.Merge(fgv, map(lambda chunk_result: chunk_result[1], chunk_results))
+	
+	def jsonValidate(self, *cached_jsons, fgv=None):
+		"""
+		It is a drop-in replacement of jsonValidate. The documents are
+		validated against fgv (by default, the schema set of the pool),
+		which is done serially when the pool holds another one
+		"""
+		if fgv is None:
+			fgv = self.fgv
+		# Small batches are not worth it, and paths can be directories
+		if (fgv is not self.fgv) or (len(cached_jsons) < self.min_documents) or (self._worker_args is None) or not all(map(lambda cached_json: isinstance(cached_json, dict) and cached_json.get('json') is not None, cached_jsons)) or not KeyIndex.CanMerge(fgv):
+			return fgv.jsonValidate(*cached_jsons)
+		
+		chunks = self._split(list(cached_jsons))
+		try:
+			chunk_results = self._get_pool().map(_validate_chunk, chunks)
+		except Exception:
+			self.logger.exception("Parallel validation failed, validating serially")
+			self.close()
+			return fgv.jsonValidate(*cached_jsons)
+		
+		# The workers could have restored a newer schema set
+		if fgv is not self.fgv:
+			return fgv.jsonValidate(*cached_jsons)
+		
+		dynSchemaValList = KeyIndex.DynamicValidators(fgv)
+		fgv._resetDynamicValidators(dynSchemaValList)
+		try:
+			if not self._merge(fgv, chunk_results):
+				fgv._resetDynamicValidators(dynSchemaValList)
+				return fgv.jsonValidate(*cached_jsons)
+			
+			# Same order as jsonValidate: first the documents which
+			# failed the first pass, then the other ones
+			report = []
+			survivors = []
+			doc_results = ( doc_result  for chunk_doc_results, _ in chunk_results  for doc_result in chunk_doc_results )
+			for jsonObj, (errors, schema_id, schema_hash, passed) in zip(cached_jsons, doc_results):
+				jsonObj['errors'].extend(errors)
+				if schema_id is not None:
+					jsonObj['schema_id'] = schema_id
+					jsonObj['schema_hash'] = schema_hash
+				
+				if passed:
+					survivors.append(jsonObj)
+				else:
+					report.append(jsonObj)
+			
+			if dynSchemaValList:
+				fgv.warmUpCaches(dynSchemaValList)
+				_, _, secondPassErrors = fgv.doSecondPass(dynSchemaValList)
+				for jsonObj in survivors:
+					report.append(jsonObj)
+					errorList = secondPassErrors.get(jsonObj['file'])
+					if errorList:
+						jsonObj['errors'].extend(errorList)
+			
+			return report
+		finally:
+			fgv._resetDynamicValidators(dynSchemaValList)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os
+import logging
+
+import jsonschema as JSV
+
+from .codec import JSONCodec
+
+class PhasedValidation(object):
+	"""
+	It mirrors what jsonValidate from a FairGTracksValidator instance
+	does, but yielding the result of each document as soon as it has
+	been validated against its JSON Schema. The cross-document checks
+	(unique, primary and foreign keys, foreign properties) are done
+	afterwards, once all the documents have been seen, yielding the
+	additional errors of the documents which failed them.
+	"""
+	# Phases labelling the yielded results
+	DOCUMENT_PHASE = 'document'
+	KEYS_PHASE = 'keys'
+	
+	def __init__(self, fgv):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		self.fgv = fgv
+	
+	def validate_document(self, jsonObj):
+		"""
+		It validates the document against its JSON Schema, filling in
+		the errors, and it returns whether the document must go through
+		the cross-document checks
+		"""
+		fgv = self.fgv
+		jsonDoc = jsonObj['json']
+		errors = jsonObj['errors']
+		
+		if (fgv.jsonRootTag is not None) and (fgv.jsonRootTag in jsonDoc):
+			jsonRoot = jsonDoc[fgv.jsonRootTag]
+		else:
+			jsonRoot = jsonDoc
+		
+		jsonSchemaId = None
+		for altSchemaKey in fgv.ALT_SCHEMA_KEYS  if isinstance(jsonRoot,dict)  else []:
+			if altSchemaKey in jsonRoot:
+				jsonSchemaId = jsonRoot[altSchemaKey]
+				break
+		
+		if jsonSchemaId is None:
+			errors.append({
+				'reason': 'no_id',
+				'description': "No hint to identify the correct JSON Schema to be used to validate"
+			})
+			return False
+		
+		schemaObj = fgv.schemaHash.get(jsonSchemaId)
+		if schemaObj is None:
+			errors.append({
+				'reason': 'schema_unknown',
+				'description': "Schema with URI {0} was not loaded".format(jsonSchemaId)
+			})
+			return False
+		
+		for customFormatInstance in schemaObj['customFormatInstances']:
+			customFormatInstance.setCurrentJSONFilename(jsonObj['file'])
+		
+		jsonSchema = schemaObj['schema']
+		jsonObj['schema_hash'] = schemaObj['schema_hash']
+		jsonObj['schema_id'] = jsonSchemaId
+		
+		cachedSchemasResolver = JSV.RefResolver(base_uri=jsonSchemaId, referrer=jsonSchema, store=fgv.refSchemaCache)
+		validator = schemaObj['validator'](jsonSchema, format_checker=fgv.customFormatCheckerInstance, resolver=cachedSchemasResolver)
+		for valError in validator.iter_errors(jsonDoc):
+			if isinstance(valError.validator_value,dict):
+				schema_error_reason = valError.validator_value.get('reason','schema_error')
+			else:
+				schema_error_reason = 'schema_error'
+			
+			errPath = "/"+"/".join(map(lambda e: str(e),valError.path))
+			errors.append({
+				'reason': schema_error_reason,
+				'description': "Path: {0} . Message: {1}".format(errPath,valError.message),
+				'path': errPath
+			})
+		
+		return len(errors) == 0
+	
+	def _iter_json_objs(self, *args):
+		"""
+		It expands the directories, and it reads the files,
+		as jsonValidate does
+		"""
+		jsonPossibles = list(args)
+		while len(jsonPossibles) > 0:
+			jsonPossible = jsonPossibles.pop(0)
+			if isinstance(jsonPossible,dict):
+				yield jsonPossible
+			elif os.path.isdir(jsonPossible):
+				jsonDir = jsonPossible
+				try:
+					newJsonPossibles = []
+					for relJsonFile in sorted(os.listdir(jsonDir)):
+						# Skipping hidden files / directories
+						if relJsonFile[0]=='.':
+							continue
+						
+						newJsonFile = os.path.join(jsonDir,relJsonFile)
+						if os.path.isdir(newJsonFile) or '.json' in relJsonFile:
+							newJsonPossibles.append(newJsonFile)
+					
+					# Depth first, so documents are yielded as
+					# soon as possible
+					jsonPossibles[0:0] = newJsonPossibles
+				except IOError as ioe:
+					self.logger.error("Unable to open/process JSON directory {0}. Reason: {1}".format(jsonDir,ioe.strerror))
+					yield {'file': jsonDir,'json': None,'errors': [{'reason': 'fatal', 'description': 'Unable to open/process JSON directory'}]}
+			else:
+				jsonFile = jsonPossible
+				try:
+					with open(jsonFile,mode="r",encoding="utf-8") as jHandle:
+						jsonDoc = JSONCodec.load(jHandle)
+				except (IOError, ValueError) as e:
+					yield {'file': jsonFile,'json': None,'errors': [{'reason': 'fatal', 'description': 'Unable to open/parse JSON file'}]}
+				else:
+					yield {'file': jsonFile,'json': jsonDoc,'errors': []}
+	
+	def iter_validate(self, *args):
+		"""
+		It yields pairs of phase and validated object. Objects from the
+		document phase carry the errors found validating the document
+		against its JSON Schema, and objects from the keys phase only
+		the errors found by the cross-document checks
+		"""
+		fgv = self.fgv
+		
+		# All the dynamic validators are reset, as jsonValidate does,
+		# as external sources can populate them
+		dynSchemaValList = []
+		for schemaObj in fgv.schemaHash.values():
+			dynSchemaValList.extend(schemaObj['customFormatInstances'])
+		fgv._resetDynamicValidators(dynSchemaValList)
+		
+		try:
+			survivors = []
+			for jsonObj in self._iter_json_objs(*args):
+				if jsonObj.get('json') is not None:
+					if self.validate_document(jsonObj):
+						# Documents are not kept, as the extensions
+						# have already gathered what they need from them
+						survivors.append({ k: jsonObj.get(k)  for k in ('file','schema_id','schema_hash') })
+				elif len(jsonObj['errors']) == 0:
+					jsonObj['errors'].append({
+						'reason': 'ignored',
+						'description': "Programming error: the cached json is missing"
+					})
+				
+				yield self.DOCUMENT_PHASE, jsonObj
+			
+			if dynSchemaValList and survivors:
+				fgv.warmUpCaches(dynSchemaValList)
+				_, _, secondPassErrors = fgv.doSecondPass(dynSchemaValList)
+				for survivor in survivors:
+					errorList = secondPassErrors.get(survivor['file'])
+					if errorList:
+						survivor['errors'] = errorList
+						yield self.KEYS_PHASE, survivor
+		finally:
+			fgv._resetDynamicValidators(dynSchemaValList)
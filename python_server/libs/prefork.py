@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import errno
+import fcntl
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from werkzeug.serving import make_server
+
+def freeze_shared_state(ftv):
+	"""
+	It warms up the extension caches in the master process, and it
+	moves everything allocated so far to the permanent generation of the
+	garbage collector, so the forked workers do not touch (and copy)
+	those memory pages when they collect garbage. Schema sets loaded
+	later by the hot reloads are not shared, as each worker loads its own
+	"""
+	try:
+		ftv.warm_up()
+	except Exception:
+		# The workers will try it on their own
+		logging.getLogger(__name__).exception("Unable to warm up the caches before forking the workers")
+	
+	gc.collect()
+	if hasattr(gc, 'freeze'):
+		gc.freeze()
+
+class PreforkWSGIServer(object):
+	"""
+	A pre-fork standalone server. The master process opens the listening
+	socket, and it forks the workers, which share the loaded schemas and
+	warmed caches copy-on-write. Dead workers are restarted. When the
+	master receives a shutdown (either a signal or the multicast message
+	from the background cache rebuild) it terminates the workers.
+	
+	The listening socket is a blocking one, so the workers take turns to
+	accept the connections, holding a lock which is released by the
+	system when the worker holding it dies.
+	
+	Workers end through os._exit, skipping the atexit handlers, so
+	the metrics (when given) are explicitly flushed before.
+	"""
+	
+	# Workers dying faster than this are restarted with a delay,
+	# in order to avoid a fork bomb
+	MIN_WORKER_LIFETIME = 1.0
+	# The multicast shutdown message is delivered as a simulated
+	# SIGINT, which does not interrupt a blocking wait
+	SUPERVISION_INTERVAL = 0.5
+	MAX_RESPAWN_DELAY = 30
+	WORKER_SHUTDOWN_TIMEOUT = 10
+	
+	def __init__(self, app, host, port, workers, backlog=128, metrics=None):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		
+		self.app = app
+		self.host = host
+		self.port = port
+		self.num_workers = workers
+		self.backlog = backlog
+		self.metrics = metrics
+		self.workers = {}
+		self.master_pid = os.getpid()
+		self.keep_going = True
+		self.respawn_delay = 0
+		self.accept_lock = None
+	
+	def _open_socket(self):
+		addrinfo = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)
+		family, socktype, proto, _, sockaddr = addrinfo[0]
+		sock = socket.socket(family, socktype, proto)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		sock.bind(sockaddr)
+		sock.listen(self.backlog)
+		
+		return sock
+	
+	def _spawn_worker(self, sock):
+		pid = os.fork()
+		if pid == 0:
+			exit_code = 0
+			try:
+				self._worker_loop(sock)
+			except SystemExit as se:
+				exit_code = se.code  if isinstance(se.code, int)  else 0
+			except:
+				self.logger.exception("Worker {} failed".format(os.getpid()))
+				exit_code = 1
+			finally:
+				if self.metrics is not None:
+					try:
+						self.metrics.flush(force=True)
+					except:
+						self.logger.exception("Worker {} was unable to flush its metrics".format(os.getpid()))
+				# Skipping the cleanups inherited from the master
+				os._exit(exit_code)
+		
+		self.workers[pid] = time.monotonic()
+		return pid
+	
+	def _worker_loop(self, sock):
+		stop_requested = []
+		def _stop_handler(signum, frame):
+			stop_requested.append(signum)
+		
+		# Workers finish the request they are attending before exiting
+		signal.signal(signal.SIGTERM, _stop_handler)
+		signal.signal(signal.SIGINT, _stop_handler)
+		
+		server = make_server(self.host, self.port, self.app, fd=sock.fileno())
+		# The duplicated socket is not needed anymore
+		sock.close()
+		
+		# All the workers are told about each new connection, so the
+		# ones losing the race would block on accept
+		plain_get_request = server.get_request
+		def _get_request():
+			fcntl.lockf(self.accept_lock, fcntl.LOCK_EX)
+			try:
+				readable, _, _ = select.select([server.socket], [], [], 0)
+				if len(readable) == 0:
+					raise BlockingIOError(errno.EAGAIN, "The connection was accepted by another worker")
+				
+				return plain_get_request()
+			finally:
+				fcntl.lockf(self.accept_lock, fcntl.LOCK_UN)
+		
+		server.get_request = _get_request
+		
+		def _service_actions():
+			if stop_requested or (os.getppid() != self.master_pid):
+				raise SystemExit(0)
+		
+		server.service_actions = _service_actions
+		server.serve_forever()
+	
+	def _stop_workers(self):
+		for pid in self.workers.keys():
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+		
+		deadline = time.monotonic() + self.WORKER_SHUTDOWN_TIMEOUT
+		while len(self.workers) > 0 and time.monotonic() < deadline:
+			try:
+				pid, _ = os.waitpid(-1, os.WNOHANG)
+			except ChildProcessError:
+				break
+			
+			if pid == 0:
+				time.sleep(0.1)
+			else:
+				self.workers.pop(pid, None)
+		
+		for pid in self.workers.keys():
+			try:
+				os.kill(pid, signal.SIGKILL)
+				os.waitpid(pid, 0)
+			except (ProcessLookupError, ChildProcessError):
+				pass
+		
+		self.workers.clear()
+	
+	def _sigterm_handler(self, signum, frame):
+		self.keep_going = False
+		sys.exit(0)
+	
+	def run(self):
+		sock = self._open_socket()
+		# POSIX record locks belong to the process, so the
+		# file is shared by the workers, but not the lock
+		self.accept_lock = tempfile.TemporaryFile()
+		self.logger.info("Pre-fork server listening on {}:{} with {} workers".format(self.host, self.port, self.num_workers))
+		
+		# The SIGINT handler (installed by the background
+		# multicast receiver) is kept, as it is the one
+		# attending the shutdown messages
+		signal.signal(signal.SIGTERM, self._sigterm_handler)
+		try:
+			while self.keep_going:
+				while len(self.workers) < self.num_workers:
+					self._spawn_worker(sock)
+				
+				try:
+					pid, status = os.waitpid(-1, os.WNOHANG)
+				except ChildProcessError:
+					continue
+				
+				if pid == 0:
+					time.sleep(self.SUPERVISION_INTERVAL)
+					continue
+				
+				started = self.workers.pop(pid, None)
+				if started is None:
+					# Other children, like the background cache rebuild
+					continue
+				
+				self.logger.warning("Worker {} exited with status {}, restarting it".format(pid, status))
+				if time.monotonic() - started < self.MIN_WORKER_LIFETIME:
+					self.respawn_delay = min(max(self.respawn_delay * 2, 1), self.MAX_RESPAWN_DELAY)
+					time.sleep(self.respawn_delay)
+				else:
+					self.respawn_delay = 0
+		finally:
+			self._stop_workers()
+			sock.close()
+			self.accept_lock.close()
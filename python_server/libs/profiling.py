@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os
+import re
+import cProfile
+import hmac
+import logging
+import random
+import threading
+import uuid
+
+class RequestProfiler(object):
+	"""
+	It is a debug facility to find out why a request was slow. Profiled
+	requests get a Server-Timing header with the time spent on each
+	phase, and the validation of their documents is run under cProfile,
+	whose statistics are saved in the profiles directory, named after
+	the request id.
+	
+	Requests are profiled when they carry the profiling header with the
+	configured key, and also a fraction of them, chosen at random. The
+	Server-Timing header can also be enabled for all the requests, which
+	is cheap, as only the phases are timed.
+	"""
+	PROFILE_HEADER = 'X-FTV-Profile'
+	REQUEST_ID_HEADER = 'X-Request-Id'
+	# The request id is part of the name of the profile
+	RequestIdPattern = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+	
+	# The lock wait is reported along with the phases
+	LOCK_WAIT = 'lock-wait'
+	
+	# The placeholder from older configuration templates
+	TemplateHeaderKey = 'Change this profiling key!'
+	
+	def __init__(self, profiles_dir, header_key=None, sample_rate=0.0, server_timing=False):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		self.profiles_dir = profiles_dir
+		self.header_key = header_key
+		self.sample_rate = sample_rate
+		self.server_timing = server_timing
+		self._local = threading.local()
+	
+	@classmethod
+	def FromConfig(cls, local_config, default_profiles_dir):
+		"""
+		It returns None when profiling is not enabled
+		"""
+		profiling_config = local_config.get('profiling', {})
+		if not profiling_config.get('enabled', False):
+			return None
+		
+		# Anybody could profile requests with a well known key
+		header_key = profiling_config.get('header-key')
+		if (header_key is not None) and ((len(str(header_key).strip()) == 0) or (header_key == cls.TemplateHeaderKey)):
+			logging.getLogger(cls.__name__).error("Profiling through the {} header is not enabled, as its key is either empty or the one from the configuration template".format(cls.PROFILE_HEADER))
+			header_key = None
+		
+		return cls(
+			profiling_config.get('dir', default_profiles_dir),
+			header_key=header_key,
+			sample_rate=float(profiling_config.get('sample-rate', 0.0)),
+			server_timing=bool(profiling_config.get('server-timing', False))
+		)
+	
+	def begin(self, request_id=None, header_value=None):
+		"""
+		It decides whether the request of the current thread is traced
+		and profiled. It returns the request id when it is traced
+		"""
+		profile = (self.header_key is not None) and (header_value is not None) and hmac.compare_digest(header_value, self.header_key)
+		if not profile and (self.sample_rate > 0):
+			profile = random.random() < self.sample_rate
+		
+		if not (profile or self.server_timing):
+			self._local.trace = None
+			return None
+		
+		if (request_id is None) or (self.RequestIdPattern.search(request_id) is None):
+			request_id = uuid.uuid4().hex
+		
+		self._local.trace = {
+			'request_id': request_id,
+			'profile': profile,
+			'timings': {}
+		}
+		
+		return request_id
+	
+	def end(self):
+		"""
+		It returns the timings, in seconds, recorded for the request
+		of the current thread, or None when it was not traced
+		"""
+		trace = getattr(self._local, 'trace', None)
+		self._local.trace = None
+		
+		return None  if trace is None  else trace['timings']
+	
+	def record(self, name, seconds):
+		trace = getattr(self._local, 'trace', None)
+		if trace is not None:
+			timings = trace['timings']
+			timings[name] = timings.get(name, 0.0) + seconds
+	
+	def record_metric(self, metric_name, seconds, labels):
+		"""
+		It is fed by the metric timers
+		"""
+		if metric_name == 'ftv_phase_duration_seconds':
+			self.record(labels['phase'], seconds)
+		elif metric_name == 'ftv_lock_wait_seconds':
+			self.record(self.LOCK_WAIT, seconds)
+	
+	def profile_call(self, func, *args):
+		"""
+		It runs the function under cProfile when the request
+		of the current thread is being profiled
+		"""
+		trace = getattr(self._local, 'trace', None)
+		if (trace is None) or not trace['profile']:
+			return func(*args)
+		
+		profiler = cProfile.Profile()
+		try:
+			return profiler.runcall(func, *args)
+		finally:
+			profile_path = os.path.join(self.profiles_dir, '{}.prof'.format(trace['request_id']))
+			try:
+				os.makedirs(self.profiles_dir, exist_ok=True)
+				profiler.dump_stats(profile_path)
+				self.logger.info("Profile of request {} saved at {}".format(trace['request_id'], profile_path))
+			except OSError as e:
+				self.logger.error("Unable to save the profile of request {}: {}".format(trace['request_id'], e))
+	
+	@staticmethod
+	def ServerTiming(timings):
+		"""
+		It renders the timings as a Server-Timing header value,
+		in milliseconds
+		"""
+		return ', '.join(map(lambda timing: '{};dur={:.3f}'.format(timing[0], timing[1] * 1000), timings.items()))
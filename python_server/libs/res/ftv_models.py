@@ -26,9 +26,31 @@ config_model = NS.model('FTVConfig', {
 	'schemas': fields.List(fields.String, required=True, description='The schema URLs in the configuration file')
 })
 
+validation_cache_model = NS.model('FTVValidationCache', {
+	'entries': fields.Integer(required=True, description = 'Number of cached validation results'),
+	'max_entries': fields.Integer(required=True, description = 'Max number of cached validation results'),
+	'ttl': fields.Float(required=True, description = 'Seconds a validation result is kept'),
+	'hits': fields.Integer(required=True, description = 'Documents whose validation result was cached'),
+	'misses': fields.Integer(required=True, description = 'Cacheable documents which had to be validated'),
+	'bypassed': fields.Integer(required=True, description = 'Documents which cannot be cached, as their schema has cross-document constraints'),
+	'evictions': fields.Integer(required=True, description = 'Validation results discarded to honour the max number of entries'),
+	'expirations': fields.Integer(required=True, description = 'Validation results discarded because they were too old')
+})
+
+schema_store_model = NS.model('FTVSchemaStore', {
+	'objects': fields.Integer(required=True, description = 'Number of cached JSON Schemas in the store'),
+	'bytes': fields.Integer(required=True, description = 'Bytes used by the cached JSON Schemas'),
+	'orphaned_objects': fields.Integer(required=True, description = 'Cached JSON Schemas no longer referenced from the cache manifest, to be collected on next rebuild'),
+	'orphaned_bytes': fields.Integer(required=True, description = 'Bytes used by the orphaned JSON Schemas'),
+	'legacy_objects': fields.Integer(required=True, description = 'Cached JSON Schemas still in the flat layout of previous releases'),
+	'temporary_files': fields.Integer(required=True, description = 'Temporary files left in the store')
+})
+
 ftv_info_model = NS.model('FTVInfo', {
 	'version': fields.String(required=True, description = 'API Version'),
-	'config': fields.Nested(config_model, required=True, description = 'Public configuration bits')
+	'config': fields.Nested(config_model, required=True, description = 'Public configuration bits'),
+	'validation_cache': fields.Nested(validation_cache_model, required=False, description = 'Validation result cache statistics, only when it is enabled'),
+	'schema_store': fields.Nested(schema_store_model, required=False, description = 'Statistics of the store of cached JSON Schemas, when the schema set was loaded')
 })
 
 ########################
@@ -79,6 +101,15 @@ validation_model = VALIDATE_NS.model('Validation', {
 	'errors': fields.List(fields.Nested(schema_error_model),required=False, description = 'The list of detected errors when the JSON is processed'),
 })
 
+validation_session_model = VALIDATE_NS.model('ValidationSession', {
+	'session_id': fields.String(required=True, description = 'The id of the validation session'),
+	'documents': fields.Integer(required=True, description = 'Number of documents in the validation session'),
+	'validated': fields.Integer(required=True, description = 'Number of documents from the validation session which passed the validation'),
+	'failed': fields.Integer(required=True, description = 'Number of documents from the validation session which failed the validation'),
+	'results': fields.List(fields.Nested(validation_model, skip_none=True),required=True, description = 'The validation results of the documents from the session. On changes, only the ones of the added or replaced documents, and the ones whose result changed'),
+	'removed': fields.List(fields.String,required=False, description = 'The labels of the removed documents'),
+})
+
 #file_upload = reqparse.RequestParser()
 file_upload = VALIDATE_NS.parser()
 file_upload.add_argument('file',
@@ -89,4 +120,27 @@ file_upload.add_argument('file',
 	#action='append',
 	required=True,	
 	help='JSON to be validated'
-)
\ No newline at end of file
+)
+
+
+JOBS_NS = Namespace('jobs','Asynchronous validation jobs')
+
+job_model = JOBS_NS.model('ValidationJob', {
+	'job_id': fields.String(required=True, description = 'The id of the validation job'),
+	'status': fields.String(required=True, description = 'The status of the validation job', enum=['queued', 'running', 'done', 'failed']),
+	'created': fields.DateTime(required=True, description = 'When the validation job was submitted'),
+	'started': fields.DateTime(required=False, description = 'When the validation job started'),
+	'finished': fields.DateTime(required=False, description = 'When the validation job finished'),
+	'documents_total': fields.Integer(required=False, description = 'Number of documents to be validated, once the inputs have been read'),
+	'documents_done': fields.Integer(required=False, description = 'Number of documents already validated against their JSON Schemas'),
+	'results': fields.Integer(required=False, description = 'Number of available results, once the validation job is done'),
+	'error': fields.String(required=False, description = 'Why the validation job failed'),
+})
+
+job_results_model = JOBS_NS.model('ValidationJobResults', {
+	'job_id': fields.String(required=True, description = 'The id of the validation job'),
+	'offset': fields.Integer(required=True, description = 'The position of the first result of the page'),
+	'limit': fields.Integer(required=True, description = 'The max number of results of the page'),
+	'total': fields.Integer(required=True, description = 'Number of available results'),
+	'results': fields.List(fields.Nested(validation_model, skip_none=True),required=True, description = 'The validation results from the page'),
+})
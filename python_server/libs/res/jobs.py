@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import sys, os
+
+from .ftv_models import FTVResource, JOBS_NS, job_model, job_results_model
+from .marshalling import fast_marshal_with
+
+from flask import request, current_app
+
+from ..archive_reader import ArchiveReader
+
+# Now, the routes
+
+class JobSubmission(FTVResource):
+	'''Submits validation jobs'''
+	@JOBS_NS.doc('job_submit')
+	@JOBS_NS.marshal_with(job_model, code=202, description='Validation job queued', skip_none=True)
+	@JOBS_NS.response(400, 'There is nothing to validate')
+	@JOBS_NS.response(404, 'Validation jobs are not enabled')
+	@JOBS_NS.response(503, 'Too many pending validation jobs')
+	def post(self):
+		'''It queues the validation of either the input JSON, the input array of JSONs, the input archive full of JSONs or the input JSON files and archives from the form, returning the validation job'''
+		inputs = []
+		if request.mimetype == 'multipart/form-data':
+			for formfiles in request.files.listvalues():
+				for formfile in formfiles:
+					inputs.append((formfile.filename, formfile.mimetype, formfile.save))
+		elif request.content_length:
+			inputs.append((None, request.mimetype, request.stream))
+		
+		if len(inputs) == 0:
+			JOBS_NS.abort(400, 'There is nothing to validate')
+		
+		retval = self.ftv.submit_validation_job(
+			inputs,
+			current_app.config.get('ARCHIVE_MAX_MEMBER_SIZE', ArchiveReader.DEFAULT_MAX_MEMBER_SIZE),
+			current_app.config.get('ARCHIVE_MAX_TOTAL_SIZE', ArchiveReader.DEFAULT_MAX_TOTAL_SIZE)
+		)
+		if isinstance(retval,tuple) and (retval[1] == 202):
+			job = retval[0]
+			return job, 202, {'Location': self.api.url_for(JobStatus, job_id=job['job_id'])}
+		
+		return retval
+
+@JOBS_NS.param('job_id', 'The validation job id')
+@JOBS_NS.response(404, 'Validation job not found')
+class JobStatus(FTVResource):
+	'''Shows the status of a validation job'''
+	@JOBS_NS.doc('job')
+	@JOBS_NS.marshal_with(job_model, skip_none=True)
+	def get(self, job_id):
+		'''It returns the status and the progress of the validation job'''
+		return self.ftv.get_validation_job(job_id)
+	
+	@JOBS_NS.doc('job_delete')
+	@JOBS_NS.response(204, 'Validation job removed')
+	def delete(self, job_id):
+		'''It removes the validation job, along with its results'''
+		return self.ftv.delete_validation_job(job_id)
+
+resultsParser = JOBS_NS.parser()
+resultsParser.add_argument('offset', type=int, location='args', default=0, help='The position of the first result')
+resultsParser.add_argument('limit', type=int, location='args', required=False, help='The max number of results')
+
+@JOBS_NS.param('job_id', 'The validation job id')
+@JOBS_NS.response(404, 'Validation job not found')
+@JOBS_NS.response(409, 'Validation job has not finished')
+class JobResults(FTVResource):
+	'''Shows the results of a validation job'''
+	@JOBS_NS.doc('job_results')
+	@JOBS_NS.expect(resultsParser)
+	@fast_marshal_with(JOBS_NS, job_results_model, skip_none=True)
+	def get(self, job_id):
+		'''It returns a page of the results of the validation job, in the same order the synchronous endpoints use'''
+		pArgs = resultsParser.parse_args()
+		return self.ftv.get_validation_job_results(job_id, pArgs.get('offset'), pArgs.get('limit'))
+
+ROUTES={
+	'ns': JOBS_NS,
+	'path': '/jobs',
+	'routes': [
+		(JobSubmission,''),
+		(JobStatus,'/<string:job_id>'),
+		(JobResults,'/<string:job_id>/results'),
+	]
+}
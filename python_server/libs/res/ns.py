@@ -4,17 +4,29 @@
 
 import sys, os
 
+from flask import Response
+
 from .ftv_models import FTVResource, NS, ftv_info_model
 
 # Now, the routes
 class FTVInfo(FTVResource):
 	'''Shows FAIRtracks validator info, like API version'''
 	@NS.doc('ftv_info')
-	@NS.marshal_with(ftv_info_model)
+	@NS.marshal_with(ftv_info_model,skip_none=True)
 	def get(self):
 		'''List all schemas'''
 		return self.ftv.ftv_info()
 
+class FTVMetrics(FTVResource):
+	'''Shows the metrics gathered from all the server processes'''
+	@NS.doc('ftv_metrics')
+	@NS.produces(['text/plain'])
+	@NS.response(200, 'Metrics in Prometheus text format')
+	@NS.response(404, 'Metrics are not enabled')
+	def get(self):
+		'''It returns the metrics, in Prometheus text format'''
+		return Response(self.ftv.get_metrics(), mimetype='text/plain; version=0.0.4')
+
 shutParser = NS.parser()
 shutParser.add_argument('shutdown_key', type=str, location='json', required=True, help='The shutdown key')
 
@@ -36,6 +48,7 @@ ROUTES={
 	# Nothing done (yet!)
 	'routes': [
 		(FTVInfo, 'info'),
+		(FTVMetrics, 'metrics'),
 		(FTVShutdown, 'shutdown'),
 	]
 }
\ No newline at end of file
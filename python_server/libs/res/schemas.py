@@ -5,36 +5,52 @@
 import sys, os
 
 from .ftv_models import FTVResource, SCHEMAS_NS, schema_info_model, schema_source_model
+from .marshalling import fast_marshal_with
 
 # Now, the routes
 class SchemasList(FTVResource):
 	'''Shows a list of all the setup schemas'''
 	@SCHEMAS_NS.doc('list_schemas')
-	@SCHEMAS_NS.marshal_list_with(schema_info_model,skip_none=True)
+	@fast_marshal_with(SCHEMAS_NS, schema_info_model, as_list=True, skip_none=True)
 	def get(self):
 		'''List all schemas'''
 		return self.ftv.list_schemas()
 
 class AbstractSchemasInvalidate(FTVResource):
 	'''It invalidates the cached schemas'''
-	def invalidate(self,invalidation_key,invalidateExtensionsCache):
+	def invalidate(self,invalidation_key,invalidateExtensionsCache,revalidate=False,schema_hashes=None,source_urls=None):
 		'''It invalidates the cached JSON schemas, forcing to fetch them again'''
-		http_code = 201  if self.ftv.invalidate_cache(invalidation_key,invalidateExtensionsCache) else 403
+		http_code = 201  if self.ftv.invalidate_cache(invalidation_key,invalidateExtensionsCache,revalidate,schema_hashes,source_urls) else 403
 		return [], http_code
 
 invParser = SCHEMAS_NS.parser()
 invParser.add_argument('invalidation_key', type=str, location='json', required=True, help='The invalidation key')
 
+def string_list(value):
+	'''Either a list of strings or a single one'''
+	if isinstance(value, str):
+		return [ value ]
+	if isinstance(value, list) and all(map(lambda elem: isinstance(elem, str), value)):
+		return value
+	raise ValueError('It must be either a string or a list of strings')
+
+targetedInvParser = invParser.copy()
+targetedInvParser.add_argument('schema_hashes', type=string_list, location='json', help='The hashes of the cached schemas to fetch again')
+targetedInvParser.add_argument('source_urls', type=string_list, location='json', help='The source URLs of the cached schemas to fetch again')
+
 @SCHEMAS_NS.param('invalidation_key', 'The invalidation key', _in='body')
+@SCHEMAS_NS.param('schema_hashes', 'When it is set, only these cached schemas are fetched again', _in='body')
+@SCHEMAS_NS.param('source_urls', 'When it is set, only the cached schemas from these URLs are fetched again', _in='body')
 class NGSchemasInvalidate(AbstractSchemasInvalidate):
 	'''It invalidates the cached schemas'''
 	@SCHEMAS_NS.response(201, 'Invalidation and re-caching in progress')
 	@SCHEMAS_NS.response(403, 'Wrong invalidation key')
+	@SCHEMAS_NS.response(404, 'No cached schema matches the given hashes or source URLs')
 	@SCHEMAS_NS.doc('ng_schemas_invalidate')
 	def delete(self):
-		'''It invalidates the cached JSON schemas, forcing to fetch them again'''
-		pArgs = invParser.parse_args()
-		return self.invalidate(pArgs.get('invalidation_key'), False)
+		'''It invalidates the cached JSON schemas (all of them, or the given ones), forcing to fetch them again'''
+		pArgs = targetedInvParser.parse_args()
+		return self.invalidate(pArgs.get('invalidation_key'), False, schema_hashes=pArgs.get('schema_hashes'), source_urls=pArgs.get('source_urls'))
 	
 @SCHEMAS_NS.param('invalidation_key', 'The invalidation key', _in='body')
 class NGSchemasFullInvalidate(AbstractSchemasInvalidate):
@@ -47,12 +63,23 @@ class NGSchemasFullInvalidate(AbstractSchemasInvalidate):
 		pArgs = invParser.parse_args()
 		return self.invalidate(pArgs.get('invalidation_key'),True)
 
+@SCHEMAS_NS.param('invalidation_key', 'The invalidation key', _in='body')
+class NGSchemasRevalidate(AbstractSchemasInvalidate):
+	'''It revalidates the cached schemas'''
+	@SCHEMAS_NS.response(201, 'Revalidation and re-caching in progress')
+	@SCHEMAS_NS.response(403, 'Wrong invalidation key')
+	@SCHEMAS_NS.doc('ng_schemas_revalidate')
+	def delete(self):
+		'''It revalidates the cached JSON schemas through conditional requests, only fetching again the modified ones'''
+		pArgs = invParser.parse_args()
+		return self.invalidate(pArgs.get('invalidation_key'),False,True)
+
 @SCHEMAS_NS.response(404, 'Schema not found')
 @SCHEMAS_NS.param('schema_hash', 'The schema hash')
 class SchemaInfo(FTVResource):
 	'''Return the detailed information of a gene'''
 	@SCHEMAS_NS.doc('schema')
-	@SCHEMAS_NS.marshal_with(schema_info_model,skip_none=True)
+	@fast_marshal_with(SCHEMAS_NS, schema_info_model, skip_none=True)
 	def get(self,schema_hash):
 		'''It gets detailed schema processing information'''
 		return self.ftv.get_schema_info(schema_hash)
@@ -62,7 +89,7 @@ class SchemaInfo(FTVResource):
 class Schema(FTVResource):
 	'''Return the detailed information of a gene'''
 	@SCHEMAS_NS.doc('schema_source')
-	@SCHEMAS_NS.marshal_with(schema_source_model)
+	@fast_marshal_with(SCHEMAS_NS, schema_source_model)
 	def get(self,schema_hash):
 		'''It gets the cached schema (if available)'''
 		return self.ftv.get_schema(schema_hash)
@@ -74,6 +101,7 @@ ROUTES={
 		(SchemasList,''),
 		(NGSchemasInvalidate,'/invalidate'),
 		(NGSchemasFullInvalidate,'/invalidate/full'),
+		(NGSchemasRevalidate,'/revalidate'),
 		(SchemaInfo,'/<string:schema_hash>'),
 		(Schema,'/<string:schema_hash>/schema')
 	]
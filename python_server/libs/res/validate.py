@@ -4,22 +4,118 @@
 
 import sys, os
 
-from .ftv_models import FTVResource, VALIDATE_NS, validation_input_model, validation_model, file_upload
+from .ftv_models import FTVResource, VALIDATE_NS, validation_input_model, validation_model, validation_session_model, file_upload
+from .marshalling import fast_marshal_with
 
-from flask import request
+from flask import request, current_app, Response, stream_with_context
 #from flask_accept import accept
 
-# These are needed to handle incoming archives
-import zipfile
-import tarfile
-import gzip
-import io
-import tempfile
-import shutil
-import json
+# This is needed to handle incoming archives
+from ..archive_reader import ArchiveReader, ArchiveError
 
-# And this is needed to guess a bit
-import filetype
+# Uploads are spooled, so they are not kept in memory
+from ..upload_spool import UploadSpool
+from ..codec import JSONCodec
+
+def phase(name):
+	"""
+	It times a phase of the request
+	"""
+	return current_app.extensions['ftv_metrics'].phase(name)
+
+def request_json():
+	"""
+	It returns the parsed request body, or None when it is not
+	JSON content (or it is not valid)
+	"""
+	if not request.is_json:
+		return None
+	
+	with phase('receive'):
+		request.get_data(cache=True)
+	with phase('parse'):
+		return request.get_json(silent=True)
+
+def spool_request_body():
+	"""
+	It returns the request body, spooled to a temporary file
+	when it is large
+	"""
+	with phase('receive'):
+		return UploadSpool.Spool(request.stream, current_app.config.get('UPLOAD_SPOOL_SIZE', UploadSpool.DEFAULT_MAX_MEMORY))
+
+def sniff_mime(fh):
+	with phase('sniff'):
+		return UploadSpool.SniffMime(fh)
+
+def read_archive(archive_fh, mime_type, label_prefix=''):
+	"""
+	It reads the JSON members of the archive from its file handle. It
+	returns the (label, JSON) pairs to be validated and the results of
+	the members which could not be read. It raises ArchiveError when
+	the archive cannot be processed
+	"""
+	reader = ArchiveReader(
+		archive_fh,
+		mime_type,
+		max_member_size=current_app.config.get('ARCHIVE_MAX_MEMBER_SIZE', ArchiveReader.DEFAULT_MAX_MEMBER_SIZE),
+		max_total_size=current_app.config.get('ARCHIVE_MAX_TOTAL_SIZE', ArchiveReader.DEFAULT_MAX_TOTAL_SIZE)
+	)
+	json_data = []
+	failed_retval = []
+	# The members are parsed as they are extracted
+	with phase('extract'):
+		for member_path, json_doc, error in reader:
+			if error is None:
+				json_data.append((label_prefix + member_path, json_doc))
+			else:
+				failed_retval.append({'file': label_prefix + member_path, 'validated': False, 'errors': [error]})
+	current_app.extensions['ftv_metrics'].inc('ftv_archive_bytes_total', reader.total_size)
+	
+	return json_data, failed_retval
+
+def unpack_validate_response(retval_tuple):
+	"""
+	Validation methods return either the results or a tuple with
+	the response, the HTTP code and, optionally, the headers
+	"""
+	if isinstance(retval_tuple,tuple):
+		return retval_tuple[0], retval_tuple[1], retval_tuple[2]  if len(retval_tuple) >= 3  else {}
+	
+	return retval_tuple, 200, {}
+
+def read_session_changes():
+	"""
+	Changes to a validation session come either as a JSON object,
+	whose keys are the labels of the documents to be added or replaced
+	(or removed, when the value is null), or as an archive, whose
+	members are added or replaced. It returns the (label, JSON) pairs,
+	the labels to be removed and the results of the members which could
+	not be read, or None when the input is not understood. It raises
+	ArchiveError when the archive cannot be processed
+	"""
+	json_data = request_json()
+	if isinstance(json_data,dict):
+		upserts = [ (label, json_doc)  for label, json_doc in json_data.items()  if json_doc is not None ]
+		removals = [ label  for label, json_doc in json_data.items()  if json_doc is None ]
+		return upserts, removals, []
+	elif json_data is not None:
+		return None
+	
+	with spool_request_body() as body_fh:
+		if UploadSpool.Size(body_fh) == 0:
+			return [], [], []
+		
+		mime_type = sniff_mime(body_fh)
+		if not ArchiveReader.IsArchive(mime_type):
+			return None
+		
+		upserts, failed_retval = read_archive(body_fh, mime_type)
+	
+	return upserts, [], failed_retval
+
+def session_changes_error(description):
+	return {'results': [{'validated': False, 'errors': [{'reason': 'fatal', 'description': description}]}]}, 400
 
 # Now, the routes
 
@@ -27,7 +123,7 @@ class Validation(FTVResource):
 	'''Validates a JSON against the recorded JSON Schemas'''
 	@VALIDATE_NS.doc('validate')
 	@VALIDATE_NS.expect(validation_input_model)
-	@VALIDATE_NS.marshal_with(validation_model, code=200, description='Success', skip_none=True)
+	@fast_marshal_with(VALIDATE_NS, validation_model, code=200, description='Success', skip_none=True)
 	#@VALIDATE_NS.doc(body=validation_input_model)
 	@VALIDATE_NS.response(400, 'Input is not JSON content')
 #	@accept('application/json')
@@ -37,19 +133,10 @@ class Validation(FTVResource):
 		http_code = 400
 		retval_headers = {}
 		
-		json_data = request.get_json(silent=True)
+		json_data = request_json()
 		if json_data is not None:
 			# It means the input is JSON (as expected), but nothing more
-			http_code = 200
-			
-			retval_tuple = self.ftv.validate(json_data)[0]
-			if isinstance(retval_tuple,tuple):
-				retval = retval_tuple[0]
-				http_code = retval_tuple[1]
-				if len(retval_tuple) >= 3:
-					retval_headers = retval_tuple[2]
-			else:
-				retval = retval_tuple
+			retval, http_code, retval_headers = unpack_validate_response(self.ftv.validate(json_data)[0])
 		else:
 			retval = {'validated': False, 'errors': [{'reason': 'fatal', 'description': 'There were problems processing incoming JSON (is it a valid one?)'}]}
 		
@@ -59,7 +146,7 @@ class ArrayValidation(FTVResource):
 	'''Validates a JSON against the recorded JSON Schemas'''
 	@VALIDATE_NS.doc('validate_array')
 	@VALIDATE_NS.expect([validation_input_model])
-	@VALIDATE_NS.marshal_list_with(validation_model, code=200, description='Success', skip_none=True)
+	@fast_marshal_with(VALIDATE_NS, validation_model, as_list=True, code=200, description='Success', skip_none=True)
 	@VALIDATE_NS.response(400, 'Input is not a JSON array content')
 #	@accept('application/json')
 	def post(self):
@@ -68,19 +155,10 @@ class ArrayValidation(FTVResource):
 		http_code = 400
 		retval_headers = {}
 		
-		json_data = request.get_json(silent=True)
+		json_data = request_json()
 		if isinstance(json_data,list):
 			# It means the input is a JSON array (as expected), but nothing more
-			http_code = 200
-			retval_tuple = self.ftv.validate(*json_data)
-			
-			if isinstance(retval_tuple,tuple):
-				retval = retval_tuple[0]
-				http_code = retval_tuple[1]
-				if len(retval_tuple) >= 3:
-					retval_headers = retval_tuple[2]
-			else:
-				retval = retval_tuple
+			retval, http_code, retval_headers = unpack_validate_response(self.ftv.validate(*json_data))
 		else:
 			retval.append({'validated': False, 'errors': [{'reason': 'fatal', 'description': 'There were problems processing incoming JSON array (is it a valid one?)'}]})
 		
@@ -89,7 +167,7 @@ class ArrayValidation(FTVResource):
 class ArchiveValidation(FTVResource):
 	'''Validates a JSON against the recorded JSON Schemas'''
 	@VALIDATE_NS.doc('validate_archive')
-	@VALIDATE_NS.marshal_list_with(validation_model, code=200, description='Success', skip_none=True)
+	@fast_marshal_with(VALIDATE_NS, validation_model, as_list=True, code=200, description='Success', skip_none=True)
 	@VALIDATE_NS.response(400, 'The input was not a supported, valid archive')
 #	@accept('application/zip','application/x-tar','application/x-gtar','application/x-gtar-compressed')
 	def post(self):
@@ -97,74 +175,31 @@ class ArchiveValidation(FTVResource):
 		retval = []
 		http_code = 400
 		retval_headers = {}
-		workdir = None
-		
-		raw_data = request.get_data()
-		mime_type = filetype.guess_mime(raw_data)
-		
-		if mime_type == 'application/zip':
-			with zipfile.ZipFile(io.BytesIO(raw_data)) as inzip:
-				# We need a temporary directory
-				workdir = tempfile.mkdtemp(prefix="ftv", suffix="upz")
-				try:
-					# The internal library knows how to deal with directories
-					inzip.extractall(path=workdir)
-				except:
-					# Something wrong happened
-					shutil.rmtree(workdir,ignore_errors=True)
-					workdir = None
-					retval.append({'validated': False, 'errors': [{'reason': 'fatal', 'description': 'There were problems processing incoming zip archive (is it a valid one?)'}]})
 		
-		elif mime_type in ('application/x-tar','application/x-gtar','application/x-gtar-compressed','application/gzip','application/x-bzip2'):
-			with tarfile.open(fileobj=io.BytesIO(raw_data)) as intar:
-				# We need a temporary directory
-				workdir = tempfile.mkdtemp(prefix="ftv", suffix="upt")
-				# Beware this operation can be unsafe, as
-				# tarfile library is unsafe. i.e. a tar
-				# could be used as a Trojan horse to
-				# hijack the server
-				try:
-					# The internal library knows how to deal with directories
-					intar.extractall(path=workdir)
-				except:
-					# Something wrong happened
-					shutil.rmtree(workdir,ignore_errors=True)
-					workdir = None
-					retval.append({'validated': False, 'errors': [{'reason': 'fatal', 'description': 'There were problems processing incoming tar archive (is it a valid one?)'}]})
+		try:
+			with spool_request_body() as body_fh:
+				mime_type = sniff_mime(body_fh)
+				json_data, failed_retval = read_archive(body_fh, mime_type)
+		except ArchiveError as ae:
+			retval.append({'validated': False, 'errors': [{'reason': 'fatal', 'description': str(ae)}]})
 		else:
-			retval.append({'validated': False, 'errors': [{'reason': 'fatal', 'description': 'Unsupported or mis-identified input archive (mime {}, size {})'.format(mime_type,len(raw_data))}]})
-			
-			
-		if workdir is not None:
-			retval_tuple = self.ftv.validate((workdir,None))
-			
-			if isinstance(retval_tuple,tuple):
-				retval = retval_tuple[0]
-				http_code = retval_tuple[1]
-				if len(retval_tuple) >= 3:
-					retval_headers = retval_tuple[2]
+			if json_data:
+				retval, http_code, retval_headers = unpack_validate_response(self.ftv.validate(*json_data))
 			else:
-				retval = retval_tuple
-			
-			# Temporary directory and its contents
-			# are not needed any more
-			shutil.rmtree(workdir,ignore_errors=True)
+				http_code = 200
 			
 			if http_code < 500:
 				# If some element had failures, then the
 				# returned code is still 200
 				http_code = 200
-				for ele in retval:
-					# As parsed objects could have absolute paths,
-					# We have to trim them
-					ele['file'] = os.path.relpath(ele['file'],workdir)
+				retval.extend(failed_retval)
 		
 		return retval , http_code , retval_headers
 
 class MultipartValidation(FTVResource):
 	'''Validates a JSON against the recorded JSON Schemas'''
 	@VALIDATE_NS.doc('validate_multipart')
-	@VALIDATE_NS.marshal_list_with(validation_model, code=200, description='Success', skip_none=True)
+	@fast_marshal_with(VALIDATE_NS, validation_model, as_list=True, code=200, description='Success', skip_none=True)
 	@VALIDATE_NS.response(400, 'Some of the validations failed')
 	@VALIDATE_NS.expect(file_upload)
 	#@VALIDATE_NS.produces(['image/png'])
@@ -177,50 +212,28 @@ class MultipartValidation(FTVResource):
 		http_code = 400
 		
 		json_data = []
-		workdir_data = []
-		if request.files is not None:
-			for formfiles in request.files.listvalues():
+		with phase('receive'):
+			files = request.files
+		if files is not None:
+			for formfiles in files.listvalues():
 				for formfile in formfiles:
 					client_file = formfile.filename
-					file_content = formfile.read()
-					mime_type = filetype.guess_mime(file_content)
+					# Form files are already spooled
+					file_fh = formfile.stream
+					mime_type = sniff_mime(file_fh)
 					
-					if mime_type == 'application/zip':
-						with zipfile.ZipFile(io.BytesIO(file_content)) as inzip:
-							# We need a temporary directory
-							workdir = tempfile.mkdtemp(prefix="ftv", suffix="upz")
-							try:
-								# The internal library knows how to deal with directories
-								inzip.extractall(path=workdir)
-								workdir_data.append((client_file,workdir))
-								json_data.append((workdir,None))
-							except:
-								# Something wrong happened
-								shutil.rmtree(workdir,ignore_errors=True)
-								workdir = None
-								retval.append({'file': client_file,'validated': False, 'errors': [{'reason': 'fatal', 'description': 'There were problems processing incoming zip archive (is it a valid one?)'}]})
-					elif mime_type in ('application/x-tar','application/x-gtar','application/x-gtar-compressed','application/gzip','application/x-bzip2'):
-						with tarfile.open(fileobj=io.BytesIO(file_content)) as intar:
-							# We need a temporary directory
-							workdir = tempfile.mkdtemp(prefix="ftv", suffix="upt")
-							# Beware this operation can be unsafe, as
-							# tarfile library is unsafe. i.e. a tar
-							# could be used as a Trojan horse to
-							# hijack the server
-							try:
-								# The internal library knows how to deal with directories
-								intar.extractall(path=workdir)
-								workdir_data.append((client_file,workdir))
-								json_data.append((workdir,None))
-							except:
-								# Something wrong happened
-								shutil.rmtree(workdir,ignore_errors=True)
-								workdir = None
-								retval.append({'file': client_file,'validated': False, 'errors': [{'reason': 'fatal', 'description': 'There were problems processing incoming tar archive (is it a valid one?)'}]})
+					if ArchiveReader.IsArchive(mime_type):
+						try:
+							# Members are labelled with the name of the archive
+							archive_json_data, archive_failed_retval = read_archive(file_fh, mime_type, client_file + '::')
+							json_data.extend(archive_json_data)
+							failed_retval.extend(archive_failed_retval)
+						except ArchiveError as ae:
+							failed_retval.append({'file': client_file,'validated': False, 'errors': [{'reason': 'fatal', 'description': str(ae)}]})
 					elif (mime_type == 'application/json')  or ((mime_type is None) and (formfile.mimetype in ('application/json','application/octet-stream'))) :
 						try:
-							jsonStr = file_content.decode("utf-8")
-							jsonDoc = json.loads(jsonStr)
+							with phase('parse'):
+								jsonDoc = JSONCodec.load(file_fh)
 							json_data.append((client_file,jsonDoc))
 						except BaseException as e:
 							# Recording the error
@@ -231,31 +244,9 @@ class MultipartValidation(FTVResource):
 			failed_retval.append({'validated': False, 'errors': [{'reason': 'fatal', 'description': 'There were problems processing incoming files from form'}]})
 		
 		if json_data:
-			retval_tuple = self.ftv.validate(*json_data)
-			
-			if isinstance(retval_tuple,tuple):
-				retval = retval_tuple[0]
-				http_code = retval_tuple[1]
-				if len(retval_tuple) >= 3:
-					retval_headers = retval_tuple[2]
-			else:
-				retval = retval_tuple
-			
-			# Cleaning up resources
-			for _,workdir in workdir_data:
-				shutil.rmtree(workdir,ignore_errors=True)
+			retval, http_code, retval_headers = unpack_validate_response(self.ftv.validate(*json_data))
 			
 			if http_code < 500:
-				for ele in retval:
-					# As parsed objects could have absolute paths,
-					# We have to trim them
-					for client_archive, workdir in workdir_data:
-						if ele['file'].startswith(workdir):
-							client_path = os.path.relpath(ele['file'],workdir)
-							
-							ele['file'] = client_archive + '::' + client_path
-							break
-				
 				# If some element had failures, then the
 				# returned code is still 200
 				http_code = 200
@@ -266,6 +257,119 @@ class MultipartValidation(FTVResource):
 		
 		return retval , http_code
 
+class StreamValidation(FTVResource):
+	'''Validates JSONs against the recorded JSON Schemas, streaming the results'''
+	@VALIDATE_NS.doc('validate_stream')
+	@VALIDATE_NS.produces(['application/x-ndjson'])
+	@VALIDATE_NS.response(200, 'Success, one JSON result per line')
+	@VALIDATE_NS.response(400, 'Input is neither JSON content nor a supported, valid archive')
+	def post(self):
+		'''It validates either the input JSON, the input array of JSONs or the input archive full of JSONs, emitting one line per result'''
+		failed_retval = []
+		json_data = request_json()
+		if isinstance(json_data,list):
+			stream = self.ftv.validate_stream(*json_data)
+		elif json_data is not None:
+			stream = self.ftv.validate_stream(json_data)
+		else:
+			with spool_request_body() as body_fh:
+				mime_type = sniff_mime(body_fh)
+				if not ArchiveReader.IsArchive(mime_type):
+					return [{'validated': False, 'errors': [{'reason': 'fatal', 'description': 'Input is neither JSON content nor a supported archive (mime {}, size {})'.format(mime_type,UploadSpool.Size(body_fh))}]}], 400
+				
+				try:
+					json_data, failed_retval = read_archive(body_fh, mime_type)
+				except ArchiveError as ae:
+					return [{'validated': False, 'errors': [{'reason': 'fatal', 'description': str(ae)}]}], 400
+			
+			stream = self.ftv.validate_stream(*json_data)
+		
+		if isinstance(stream,tuple):
+			return stream
+		
+		def ndjson_lines():
+			# Members which could not be read go first
+			for failed in failed_retval:
+				failed['phase'] = 'document'
+				yield JSONCodec.dumps(failed) + '\n'
+			
+			for result in stream:
+				if result['phase'] == 'summary':
+					result['documents'] += len(failed_retval)
+					result['failed'] += len(failed_retval)
+				
+				# Mimicking skip_none from the marshalled endpoints
+				line = { k: v  for k, v in result.items()  if v is not None }
+				yield JSONCodec.dumps(line) + '\n'
+		
+		response = Response(stream_with_context(ndjson_lines()), mimetype='application/x-ndjson')
+		# Either finished or interrupted, the locks
+		# held by the stream are released
+		response.call_on_close(stream.close)
+		
+		return response
+
+class SessionCreation(FTVResource):
+	'''Creates validation sessions, which keep their documents across requests'''
+	@VALIDATE_NS.doc('validate_session_create')
+	@fast_marshal_with(VALIDATE_NS, validation_session_model, code=201, description='Session created', skip_none=True)
+	@VALIDATE_NS.response(400, 'Input is neither a JSON object nor a supported, valid archive')
+	@VALIDATE_NS.response(404, 'Validation sessions are not enabled')
+	@VALIDATE_NS.response(413, 'The documents are larger than what a session can hold')
+	def post(self):
+		'''It creates a validation session, validating the documents from either the input JSON object (keyed by label) or the input archive'''
+		try:
+			changes = read_session_changes()
+		except ArchiveError as ae:
+			return session_changes_error(str(ae))
+		
+		if changes is None:
+			return session_changes_error('Input is neither a JSON object (labels to documents) nor a supported archive')
+		
+		upserts, _, failed_retval = changes
+		retval, http_code, retval_headers = unpack_validate_response(self.ftv.create_validation_session(upserts))
+		if http_code < 500:
+			retval['results'].extend(failed_retval)
+		
+		return retval, http_code, retval_headers
+
+@VALIDATE_NS.param('session_id', 'The validation session id')
+@VALIDATE_NS.response(404, 'Validation session not found')
+class SessionValidation(FTVResource):
+	'''Validates documents along with the ones already in the validation session'''
+	@VALIDATE_NS.doc('validate_session')
+	@fast_marshal_with(VALIDATE_NS, validation_session_model, code=200, description='Success', skip_none=True)
+	def get(self, session_id):
+		'''It returns the validation results of all the documents in the session'''
+		return self.ftv.get_validation_session(session_id)
+	
+	@VALIDATE_NS.doc('validate_session_update')
+	@fast_marshal_with(VALIDATE_NS, validation_session_model, code=200, description='Success', skip_none=True)
+	@VALIDATE_NS.response(400, 'Input is neither a JSON object nor a supported, valid archive')
+	@VALIDATE_NS.response(413, 'The documents are larger than what a session can hold')
+	def patch(self, session_id):
+		'''It adds, replaces or removes (null values) the documents from either the input JSON object (keyed by label) or the input archive, returning the results which changed'''
+		try:
+			changes = read_session_changes()
+		except ArchiveError as ae:
+			return session_changes_error(str(ae))
+		
+		if changes is None:
+			return session_changes_error('Input is neither a JSON object (labels to documents) nor a supported archive')
+		
+		upserts, removals, failed_retval = changes
+		retval, http_code, retval_headers = unpack_validate_response(self.ftv.update_validation_session(session_id, upserts, removals))
+		if http_code < 500:
+			retval['results'].extend(failed_retval)
+		
+		return retval, http_code, retval_headers
+	
+	@VALIDATE_NS.doc('validate_session_delete')
+	@VALIDATE_NS.response(204, 'Validation session removed')
+	def delete(self, session_id):
+		'''It removes the validation session'''
+		return self.ftv.delete_validation_session(session_id)
+
 ROUTES={
 	'ns': VALIDATE_NS,
 	'path': '/validate',
@@ -274,5 +378,8 @@ ROUTES={
 		(ArrayValidation,'/array'),
 		(ArchiveValidation,'/archive'),
 		(MultipartValidation,'/multipart'),
+		(StreamValidation,'/stream'),
+		(SessionCreation,'/session'),
+		(SessionValidation,'/session/<string:session_id>'),
 	]
 }
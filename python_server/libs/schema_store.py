@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import logging
+import os
+import re
+import time
+
+class SchemaStore(object):
+	"""
+	Content addressed store of the fetched JSON Schemas, where each one
+	is saved in a file named after its normalized hash. Files are spread
+	among subdirectories named after the first characters of the hash,
+	so directory lookups keep being fast as the store grows, and they
+	are only written through renames, so readers never see partial ones.
+	
+	Objects are referenced from the cache manifest, and the ones no
+	longer referenced are removed by a mark and sweep collection, which
+	is run by the process rebuilding the cache. Files saved at the top of
+	the store by previous releases are still found, and the collection
+	moves the referenced ones to their subdirectory.
+	"""
+	ShardWidth = 2
+	ObjectPattern = re.compile('^[0-9a-f]{2,}$')
+	ShardPattern = re.compile('^[0-9a-f]{2}$')
+	# Prefix of the temporary files written to the store
+	TempPrefix = '.'
+	# Temporary files younger than this, in seconds, could still be
+	# being written, so they are not collected
+	TEMP_GRACE = 3600
+	
+	def __init__(self, store_dir, file_mode=0o644):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		self.store_dir = store_dir
+		self.file_mode = file_mode
+	
+	def path(self, schema_hash):
+		"""
+		The path where the object is saved
+		"""
+		return os.path.join(self.store_dir, schema_hash[0:self.ShardWidth], schema_hash)
+	
+	def lookup(self, schema_hash):
+		"""
+		It returns the path of the object, also when it was saved by a
+		previous release, or None when it is not in the store
+		"""
+		full_path = self.path(schema_hash)
+		if os.path.isfile(full_path):
+			return full_path
+		
+		legacy_path = os.path.join(self.store_dir, schema_hash)
+		if os.path.isfile(legacy_path):
+			return legacy_path
+		
+		return None
+	
+	def put(self, tmp_path, schema_hash):
+		"""
+		It moves a temporary file from the store directory to the object
+		path, returning the latter
+		"""
+		full_path = self.path(schema_hash)
+		os.makedirs(os.path.dirname(full_path), exist_ok=True)
+		os.chmod(tmp_path, self.file_mode)
+		os.replace(tmp_path, full_path)
+		
+		return full_path
+	
+	def remove(self, schema_hash):
+		"""
+		It returns whether the object was in the store
+		"""
+		full_path = self.lookup(schema_hash)
+		if full_path is None:
+			return False
+		
+		os.remove(full_path)
+		return True
+	
+	def scan(self):
+		"""
+		It yields the (schema hash, path, size) of each object,
+		as well as (None, path, size) for each temporary file
+		"""
+		try:
+			top_entries = list(os.scandir(self.store_dir))
+		except FileNotFoundError:
+			return
+		
+		for elem in top_entries:
+			try:
+				if elem.is_dir(follow_symlinks=False) and self.ShardPattern.search(elem.name):
+					for shard_elem in os.scandir(elem.path):
+						if shard_elem.is_file(follow_symlinks=False) and self.ObjectPattern.search(shard_elem.name):
+							yield shard_elem.name, shard_elem.path, shard_elem.stat(follow_symlinks=False).st_size
+				elif elem.is_file(follow_symlinks=False):
+					if self.ObjectPattern.search(elem.name):
+						yield elem.name, elem.path, elem.stat(follow_symlinks=False).st_size
+					elif elem.name.startswith(self.TempPrefix):
+						yield None, elem.path, elem.stat(follow_symlinks=False).st_size
+			except FileNotFoundError:
+				# It was removed meanwhile
+				pass
+	
+	def stats(self, referenced_hashes):
+		"""
+		Figures about the objects in the store. The orphaned ones are
+		the ones not referenced, which are going to be collected
+		"""
+		stats = {
+			'objects': 0,
+			'bytes': 0,
+			'orphaned_objects': 0,
+			'orphaned_bytes': 0,
+			'legacy_objects': 0,
+			'temporary_files': 0,
+		}
+		for schema_hash, full_path, size in self.scan():
+			if schema_hash is None:
+				stats['temporary_files'] += 1
+				continue
+			
+			stats['objects'] += 1
+			stats['bytes'] += size
+			if schema_hash not in referenced_hashes:
+				stats['orphaned_objects'] += 1
+				stats['orphaned_bytes'] += size
+			elif os.path.dirname(full_path) == self.store_dir:
+				stats['legacy_objects'] += 1
+		
+		return stats
+	
+	def collect_garbage(self, referenced_hashes):
+		"""
+		Mark and sweep: the objects which are not referenced are removed,
+		as well as the stale temporary files and the empty subdirectories.
+		The referenced objects saved by previous releases are moved to their
+		subdirectory. It must be called by the only process writing to
+		the store. It returns the number of removed files and their bytes
+		"""
+		removed = {
+			'objects': 0,
+			'bytes': 0
+		}
+		stale_before = time.time() - self.TEMP_GRACE
+		for schema_hash, full_path, size in self.scan():
+			try:
+				if schema_hash is None:
+					if os.stat(full_path).st_mtime >= stale_before:
+						continue
+				elif schema_hash in referenced_hashes:
+					if os.path.dirname(full_path) == self.store_dir:
+						# Moving it keeps its modification time, so
+						# it still matches its cache fingerprint
+						self.put(full_path, schema_hash)
+					continue
+				
+				os.remove(full_path)
+			except FileNotFoundError:
+				continue
+			
+			removed['objects'] += 1
+			removed['bytes'] += size
+		
+		for elem in os.scandir(self.store_dir):
+			if elem.is_dir(follow_symlinks=False) and self.ShardPattern.search(elem.name):
+				try:
+					os.rmdir(elem.path)
+				except OSError:
+					# It is not empty
+					pass
+		
+		if removed['objects'] > 0:
+			self.logger.info("Removed {} unreferenced files ({} bytes) from {}".format(removed['objects'], removed['bytes'], self.store_dir))
+		
+		return removed
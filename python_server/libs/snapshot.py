@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os, sys
+import stat
+import tempfile
+import json
+import logging
+import pickle
+import hashlib
+
+from importlib import metadata
+
+import jsonschema as JSV
+from extended_json_schema_validator.extend_validator_helpers import PLAIN_VALIDATOR_MAPPER
+from extended_json_schema_validator.extensions.unique_check import UniqueKey
+from extended_json_schema_validator.extensions.pk_check import PrimaryKey
+from extended_json_schema_validator.extensions.fk_check import ForeignKey
+from fairtracks_validator.extensions.foreign_property_check import ForeignProperty
+from fairtracks_validator.extensions.curie_search import CurieSearch
+from fairtracks_validator.extensions.ontology_term import OntologyTerm
+
+from .term_index import IndexedOntologyTerm
+
+class UnsupportedExtensionError(Exception):
+	pass
+
+class ValidatorSnapshot(object):
+	"""
+	A serialized copy of the schema set loaded by a FairGTracksValidator
+	instance, just after loadJSONSchemas (so before any warm up or
+	validation). It is stored next to the cache manifest, and it is only
+	usable when it was built with the same versions of the libraries and
+	its key (computed from the hashes and source URLs of the cached
+	schemas) matches.
+	
+	The file starts with a plain JSON header, which is checked before
+	anything is unpickled: the versions, the key and the digest of the
+	pickled payload. Snapshots not owned by the user running the
+	process (or root), or writable by anyone, are not unpickled.
+	
+	The dynamically built validator classes cannot be pickled, so
+	they are built again from the unpickled extension instances.
+	Also, several extensions key their bootstrapped state with the
+	id() of the schema fragments declaring them, so those keys are
+	translated to the addresses of the unpickled fragments. As that
+	depends on the internals of each extension, only the known ones
+	are supported.
+	"""
+	SnapshotFile = 'validator_snapshot.pickle'
+	FORMAT_VERSION = 2
+	# The first line of the file, followed by the JSON header line
+	Magic = b'FTVSNAP\n'
+	MAX_HEADER_SIZE = 64 * 1024
+	
+	# Libraries whose versions invalidate the snapshot
+	KeyDistributions = [
+		'fairtracks_validator',
+		'extended_json_schema_validator',
+		'jsonschema'
+	]
+	
+	# The worlds (dictionaries) of each supported extension, with
+	# the depth of their keys built from the id() of schema fragments,
+	# and whether those keys are the ForeignKey ones, which also have
+	# the position of the declaration
+	ExtensionWorlds = {
+		UniqueKey: { 'UniqueWorld': (0, False) },
+		PrimaryKey: { 'UniqueWorld': (0, False) },
+		ForeignKey: { 'FKWorld': (1, True) },
+		ForeignProperty: { 'FPWorld': (1, False) },
+		CurieSearch: {},
+		OntologyTerm: {},
+		IndexedOntologyTerm: {},
+	}
+	
+	def __init__(self, key, payload):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		self.key = key
+		self.payload = payload
+	
+	@classmethod
+	def GetVersions(cls):
+		"""
+		The versions a snapshot was built with, which must match
+		the ones of the process restoring it
+		"""
+		versions = {
+			'format': cls.FORMAT_VERSION,
+			'python': '.'.join(map(str, sys.version_info[:2]))
+		}
+		for distribution in cls.KeyDistributions:
+			try:
+				versions[distribution] = metadata.version(distribution)
+			except metadata.PackageNotFoundError:
+				versions[distribution] = None
+		
+		return versions
+	
+	@classmethod
+	def GetKey(cls, curated_schemas):
+		"""
+		The key is computed from the hashes of the schemas and the
+		source URL used to load each one of them
+		"""
+		schema_sources = sorted(map(lambda schema_item: [str(schema_item[0]), schema_item[1]['info']['source_urls'][0]], curated_schemas.items()))
+		
+		return hashlib.sha256(json.dumps(schema_sources, separators=(',',':')).encode('utf-8')).hexdigest()
+	
+	@classmethod
+	def _IndexSchemaFragments(cls, refSchemaCache):
+		"""
+		It maps the id() of every dictionary inside the loaded schemas
+		to the dictionary itself
+		"""
+		fragments = {}
+		pending = list(refSchemaCache.values())
+		while len(pending) > 0:
+			fragment = pending.pop()
+			if isinstance(fragment, dict):
+				fragments[id(fragment)] = fragment
+				pending.extend(fragment.values())
+			elif isinstance(fragment, list):
+				pending.extend(fragment)
+		
+		return fragments
+	
+	@classmethod
+	def _WorldSpecs(cls, customFormatInstance):
+		world_specs = cls.ExtensionWorlds.get(type(customFormatInstance))
+		if world_specs is None:
+			raise UnsupportedExtensionError("Extension {} is not supported".format(type(customFormatInstance).__name__))
+		
+		return world_specs
+	
+	@classmethod
+	def GetExtensionWorlds(cls, customFormatInstance):
+		"""
+		The worlds of an extension instance, which hold the state
+		gathered from the schemas and from the validated documents
+		"""
+		return [ getattr(customFormatInstance, attr_name)  for attr_name in cls._WorldSpecs(customFormatInstance).keys() ]
+	
+	@staticmethod
+	def _KeyAddress(world_key, fk_keys):
+		"""
+		It returns the address and, for ForeignKey keys, the position
+		"""
+		if fk_keys:
+			address, sep, position = world_key.partition('_')  if isinstance(world_key, str)  else ('', '', '')
+			if (sep != '_') or not (address.isdigit() and position.isdigit()):
+				raise ValueError("Unexpected foreign key {}".format(world_key))
+			return int(address), position
+		
+		if not isinstance(world_key, int):
+			raise ValueError("Unexpected key {}".format(world_key))
+		
+		return world_key, None
+	
+	@classmethod
+	def _WorldAddresses(cls, world, depth, fk_keys):
+		"""
+		It yields the addresses used in the keys at the given depth
+		"""
+		if depth > 0:
+			for world_val in world.values():
+				yield from cls._WorldAddresses(world_val, depth - 1, fk_keys)
+		else:
+			for world_key in world.keys():
+				yield cls._KeyAddress(world_key, fk_keys)[0]
+	
+	@classmethod
+	def _RemappedWorld(cls, world, depth, fk_keys, remap):
+		"""
+		It returns a copy of the world with the addresses of the keys
+		translated, sharing the definitions
+		"""
+		if depth > 0:
+			return { world_key: cls._RemappedWorld(world_val, depth - 1, fk_keys, remap)  for world_key, world_val in world.items() }
+		
+		remapped = {}
+		for world_key, world_val in world.items():
+			address, position = cls._KeyAddress(world_key, fk_keys)
+			new_address = remap.get(address)
+			if new_address is None:
+				raise ValueError("Key {} does not belong to any snapshotted schema fragment".format(world_key))
+			
+			remapped[new_address  if position is None  else str(new_address) + '_' + position] = world_val
+		
+		return remapped
+	
+	@classmethod
+	def _RemapWorld(cls, world, depth, fk_keys, remap):
+		if depth > 0:
+			for world_val in world.values():
+				cls._RemapWorld(world_val, depth - 1, fk_keys, remap)
+			return
+		
+		remapped = cls._RemappedWorld(world, depth, fk_keys, remap)
+		# The world is updated in place, as it could be shared
+		world.clear()
+		world.update(remapped)
+	
+	@classmethod
+	def RemapExtensionWorlds(cls, customFormatInstance, remap):
+		"""
+		It returns copies of the worlds of an extension instance, in the
+		same order as GetExtensionWorlds, with the addresses of their
+		keys translated through remap
+		"""
+		return [ cls._RemappedWorld(getattr(customFormatInstance, attr_name), depth, fk_keys, remap)  for attr_name, (depth, fk_keys) in cls._WorldSpecs(customFormatInstance).items() ]
+	
+	@classmethod
+	def Capture(cls, fgv, curated_schemas):
+		"""
+		This method serializes the state of a FairGTracksValidator
+		instance just after loadJSONSchemas
+		"""
+		p_schemaHash = {}
+		addresses = set()
+		for jsonSchemaURI, schemaObj in fgv.schemaHash.items():
+			# The validator class is built again on load
+			p_schemaHash[jsonSchemaURI] = { k: v  for k, v in schemaObj.items()  if k != 'validator' }
+			for cFI in schemaObj['customFormatInstances']:
+				for attr_name, (depth, fk_keys) in cls._WorldSpecs(cFI).items():
+					addresses.update(cls._WorldAddresses(getattr(cFI, attr_name), depth, fk_keys))
+		
+		fragments = cls._IndexSchemaFragments(fgv.refSchemaCache)
+		missing_addresses = addresses - fragments.keys()
+		if len(missing_addresses) > 0:
+			raise ValueError("{} keys of the extensions do not belong to any schema fragment".format(len(missing_addresses)))
+		anchors = { address: fragments[address]  for address in addresses }
+		
+		state = {
+			'anchors': anchors,
+			'schemaHash': p_schemaHash,
+			'refSchemaCache': fgv.refSchemaCache,
+			# The schema sources and the errors found while loading them,
+			# shared with the unpickled schemas
+			'schemas': { schema_hash: (curated_schema.get('source'), curated_schema['info'].get('errors',[]))  for schema_hash, curated_schema in curated_schemas.items() }
+		}
+		
+		return cls(cls.GetKey(curated_schemas), pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+	
+	def save(self, schemaCacheDir, file_mode=0o644):
+		"""
+		The snapshot is atomically written, so concurrent readers either
+		see the previous one or the new one
+		"""
+		header = {
+			'versions': self.GetVersions(),
+			'key': self.key,
+			'payload_size': len(self.payload),
+			'payload_sha256': hashlib.sha256(self.payload).hexdigest()
+		}
+		tmp_fd, tmp_path = tempfile.mkstemp(dir=schemaCacheDir, prefix='.snapshot-')
+		try:
+			with os.fdopen(tmp_fd, 'wb') as sh:
+				sh.write(self.Magic)
+				sh.write(json.dumps(header, sort_keys=True).encode('utf-8') + b'\n')
+				sh.write(self.payload)
+			os.chmod(tmp_path, file_mode)
+			os.replace(tmp_path, os.path.join(schemaCacheDir, self.SnapshotFile))
+		except:
+			os.unlink(tmp_path)
+			raise
+	
+	@classmethod
+	def _ReadHeader(cls, sh):
+		if sh.read(len(cls.Magic)) != cls.Magic:
+			return None
+		
+		try:
+			header = json.loads(sh.readline(cls.MAX_HEADER_SIZE))
+		except ValueError:
+			return None
+		
+		return header  if isinstance(header, dict)  else None
+	
+	@classmethod
+	def Load(cls, schemaCacheDir, curated_schemas):
+		"""
+		It returns the unpickled snapshot state, or None when there is no
+		snapshot, it was built with other versions of the libraries, its
+		key does not match the one from the curated schemas or it
+		cannot be trusted
+		"""
+		logger = logging.getLogger(cls.__name__)
+		snapshot_path = os.path.join(schemaCacheDir, cls.SnapshotFile)
+		if not os.path.isfile(snapshot_path):
+			return None
+		
+		with open(snapshot_path, 'rb') as sh:
+			header = cls._ReadHeader(sh)
+			if header is None:
+				logger.warning("Validator snapshot {} has an unknown format, so it is not restored".format(snapshot_path))
+				return None
+			
+			versions = cls.GetVersions()
+			if header.get('versions') != versions:
+				logger.warning("Validator snapshot {} was built with {}, but this process runs {}, so it is not restored".format(snapshot_path, header.get('versions'), versions))
+				return None
+			
+			if header.get('key') != cls.GetKey(curated_schemas):
+				logger.debug("Validator snapshot {} does not match the cached schemas".format(snapshot_path))
+				return None
+			
+			st = os.fstat(sh.fileno())
+			if (st.st_uid not in (os.geteuid(), 0)) or (st.st_mode & stat.S_IWOTH):
+				logger.warning("Validator snapshot {} is either owned by another user or writable by anyone, so it is not restored".format(snapshot_path))
+				return None
+			
+			payload_size = header.get('payload_size')
+			payload = sh.read()
+			if (len(payload) != payload_size) or (hashlib.sha256(payload).hexdigest() != header.get('payload_sha256')):
+				logger.warning("Validator snapshot {} is corrupted, so it is not restored".format(snapshot_path))
+				return None
+		
+		return pickle.loads(payload)
+	
+	@classmethod
+	def Restore(cls, fgv, state, curated_schemas):
+		"""
+		It populates a freshly created FairGTracksValidator instance with
+		an unpickled state, as loadJSONSchemas would have done
+		"""
+		# Translating the addresses used by the extensions
+		remap = { address: id(fragment)  for address, fragment in state['anchors'].items() }
+		
+		schemaHash = state['schemaHash']
+		for jsonSchemaURI, schemaObj in schemaHash.items():
+			customFormatInstances = schemaObj['customFormatInstances']
+			# Validators which must be instantiated are built again,
+			# as extendValidator would have done
+			plain_validator = PLAIN_VALIDATOR_MAPPER[schemaObj['schema'][fgv.SCHEMA_KEY]]
+			instancedCustomValidators = fgv.customValidators.copy()
+			instancedCustomValidators.pop(None, None)
+			for cFI in customFormatInstances:
+				# The setup of this process is the one to be honoured
+				cFI.config = fgv.config
+				cFI.isRW = fgv.isRW
+				for attr_name, (depth, fk_keys) in cls._WorldSpecs(cFI).items():
+					cls._RemapWorld(getattr(cFI, attr_name), depth, fk_keys, remap)
+				
+				for triggerAttribute, triggeredValidation in cFI.getValidators():
+					instancedCustomValidators[triggerAttribute] = triggeredValidation
+			
+			extendedValidators = plain_validator.VALIDATORS.copy()
+			extendedValidators.update(instancedCustomValidators)
+			extendedChecker = plain_validator.TYPE_CHECKER.redefine_many(fgv.customTypes)
+			schemaObj['validator'] = JSV.validators.extend(plain_validator, validators=extendedValidators, type_checker=extendedChecker)
+		
+		fgv.schemaHash = schemaHash
+		fgv.refSchemaCache = state['refSchemaCache']
+		# It is only needed while bootstrapping the extensions
+		fgv.refSchemaSet = {}
+		
+		# The curated schemas share the unpickled sources and errors
+		schemas = state['schemas']
+		for schema_hash, curated_schema in curated_schemas.items():
+			schema_source, errors = schemas[schema_hash]
+			curated_schema['source'] = schema_source
+			curated_schema['info']['errors'] = errors
+		
+		return len(schemaHash)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+import owlready2
+from jsonschema.exceptions import ValidationError
+
+from fairtracks_validator.fairtracks_validator import FairGTracksValidator
+from fairtracks_validator.extensions.ontology_term import OntologyTerm
+
+class TermIndex(object):
+	"""
+	Read-only on-disk index of the terms of an ontology, built from
+	its owlready2 world. It holds three sorted string tables (the IRIs,
+	the reversed IRIs and the labels), each one being an array of
+	offsets followed by the UTF-8 encoded strings. The file is memory
+	mapped, so lookups are binary searches on pages shared by all the
+	processes, instead of queries on a database opened by each one.
+	
+	The header records the size and modification time of the world
+	database it was built from, so stale indexes are not used.
+	"""
+	Magic = b'FTVTERM1'
+	# Magic, size and modification time (in ns) of the world database
+	HeaderFormat = struct.Struct('<8sQq')
+	# Number of strings, position of the offsets and position of the strings
+	TableFormat = struct.Struct('<QQQ')
+	OffsetFormat = struct.Struct('<Q')
+	
+	IRI_TABLE = 0
+	REVERSED_IRI_TABLE = 1
+	LABEL_TABLE = 2
+	NUM_TABLES = 3
+	
+	def __init__(self, index_path, mm, source_signature, tables, inode=None):
+		self.index_path = index_path
+		self.mm = mm
+		self.source_signature = source_signature
+		self.tables = tables
+		# It tells whether the file was replaced
+		self.inode = inode
+	
+	@staticmethod
+	def SourceSignature(source_path):
+		st = os.stat(source_path)
+		return (st.st_size, st.st_mtime_ns)
+	
+	@classmethod
+	def Write(cls, index_path, source_signature, iris, labels, file_mode=0o644):
+		"""
+		The index is atomically written, so concurrent readers either
+		see the previous one or the new one
+		"""
+		tables = [
+			sorted(set(map(lambda iri: iri.encode('utf-8'), iris))),
+			sorted(set(map(lambda iri: iri[::-1].encode('utf-8'), iris))),
+			sorted(set(map(lambda label: label.encode('utf-8'), labels))),
+		]
+		
+		tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), prefix='.term_index-')
+		try:
+			with os.fdopen(tmp_fd, 'wb') as ih:
+				table_descs = []
+				pos = cls.HeaderFormat.size + cls.NUM_TABLES * cls.TableFormat.size
+				ih.seek(pos)
+				for table in tables:
+					offsets_pos = pos
+					strings_pos = offsets_pos + (len(table) + 1) * cls.OffsetFormat.size
+					offset = 0
+					for key in table:
+						ih.write(cls.OffsetFormat.pack(offset))
+						offset += len(key)
+					ih.write(cls.OffsetFormat.pack(offset))
+					ih.write(b''.join(table))
+					
+					table_descs.append((len(table), offsets_pos, strings_pos))
+					pos = strings_pos + offset
+				
+				ih.seek(0)
+				ih.write(cls.HeaderFormat.pack(cls.Magic, *source_signature))
+				for table_desc in table_descs:
+					ih.write(cls.TableFormat.pack(*table_desc))
+			os.chmod(tmp_path, file_mode)
+			os.replace(tmp_path, index_path)
+		except:
+			os.unlink(tmp_path)
+			raise
+	
+	@classmethod
+	def Open(cls, index_path, source_signature=None):
+		"""
+		It returns None when the index does not exist, it is not right or
+		it was not built from the world database with the given signature
+		"""
+		try:
+			with open(index_path, 'rb') as ih:
+				inode = os.fstat(ih.fileno()).st_ino
+				mm = mmap.mmap(ih.fileno(), 0, access=mmap.ACCESS_READ)
+		except (OSError, ValueError):
+			# Missing or empty
+			return None
+		
+		try:
+			magic, source_size, source_mtime_ns = cls.HeaderFormat.unpack_from(mm, 0)
+			if magic != cls.Magic:
+				raise ValueError(magic)
+			if (source_signature is not None) and ((source_size, source_mtime_ns) != tuple(source_signature)):
+				raise ValueError(source_signature)
+			
+			tables = [ cls.TableFormat.unpack_from(mm, cls.HeaderFormat.size + i_table * cls.TableFormat.size)  for i_table in range(cls.NUM_TABLES) ]
+		except (struct.error, ValueError):
+			mm.close()
+			return None
+		
+		return cls(index_path, mm, (source_size, source_mtime_ns), tables, inode=inode)
+	
+	def _key(self, table, i_key):
+		_, offsets_pos, strings_pos = table
+		start, = self.OffsetFormat.unpack_from(self.mm, offsets_pos + i_key * self.OffsetFormat.size)
+		end, = self.OffsetFormat.unpack_from(self.mm, offsets_pos + (i_key + 1) * self.OffsetFormat.size)
+		return self.mm[strings_pos + start:strings_pos + end]
+	
+	def _lower_bound(self, table, key):
+		lo = 0
+		hi = table[0]
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._key(table, mid) < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		
+		return lo
+	
+	def _contains(self, i_table, key):
+		table = self.tables[i_table]
+		i_key = self._lower_bound(table, key)
+		return (i_key < table[0]) and (self._key(table, i_key) == key)
+	
+	def _has_prefix(self, i_table, prefix):
+		table = self.tables[i_table]
+		i_key = self._lower_bound(table, prefix)
+		return (i_key < table[0]) and self._key(table, i_key).startswith(prefix)
+	
+	def lookup(self, match_type, term):
+		"""
+		Match types are the ones from OntologyTerm
+		"""
+		if match_type == 'suffix':
+			return self._has_prefix(self.REVERSED_IRI_TABLE, term[::-1].encode('utf-8'))
+		elif match_type == 'label':
+			return self._contains(self.LABEL_TABLE, term.encode('utf-8'))
+		else:
+			return self._contains(self.IRI_TABLE, term.encode('utf-8'))
+	
+	def stats(self):
+		return {
+			'iris': self.tables[self.IRI_TABLE][0],
+			'labels': self.tables[self.LABEL_TABLE][0],
+			'bytes': len(self.mm)
+		}
+
+class IndexedOntologyTerm(OntologyTerm):
+	"""
+	The 'term' format, whose exact, suffix and label lookups are
+	answered from a TermIndex of each ontology. The process building
+	the caches writes the indexes next to the owlready2 worlds, and
+	read-only processes only map the indexes, so they do not open the
+	worlds (nor hold their own copy of the ontologies) unless a term has
+	to be checked against its ancestors, which is still done by owlready2.
+	Lookups whose term has glob characters, as well as the ontologies
+	without an up to date index, are also done by owlready2.
+	
+	It is disabled through the 'term-index' key of the 'ontology' block.
+	"""
+	IndexFilePattern = 'term_index_{0}.idx'
+	
+	# The mapped indexes, shared by all the instances, as the worlds are
+	TermIndexes = dict()
+	
+	@property
+	def termIndexEnabled(self):
+		return self.config.get(self.KeyAttributeName,{}).get('term-index',True)
+	
+	@classmethod
+	def GetIRIHash(cls, iri):
+		iri_hash = cls.IRI_HASH.get(iri)
+		if iri_hash is None:
+			cls.IRI_HASH[iri] = iri_hash = hashlib.sha1(iri.encode('utf-8')).hexdigest()
+		
+		return iri_hash
+	
+	@classmethod
+	def GetTermIndexPath(cls, iri_hash, cachePath=None):
+		# Next to the world, wherever it is
+		return os.path.join(os.path.dirname(cls.GetWorldDBPath(iri_hash, cachePath)), cls.IndexFilePattern.format(iri_hash))
+	
+	@classmethod
+	def OpenTermIndex(cls, iri, cachePath=None):
+		"""
+		It maps the index of the ontology, when it is up to date,
+		reusing the already mapped one unless the file was replaced
+		(i.e. the cache directory was rebuilt). It returns None otherwise
+		"""
+		iri_hash = cls.GetIRIHash(iri)
+		index_path = cls.GetTermIndexPath(iri_hash, cachePath)
+		try:
+			source_signature = TermIndex.SourceSignature(cls.GetWorldDBPath(iri_hash, cachePath))
+			inode = os.stat(index_path).st_ino
+		except OSError:
+			cls.TermIndexes.pop(iri_hash, None)
+			return None
+		
+		termIndex = cls.TermIndexes.get(iri_hash)
+		if (termIndex is None) or (termIndex.inode != inode) or (termIndex.source_signature != source_signature):
+			# The previous mapping is released once nobody uses it
+			termIndex = TermIndex.Open(index_path, source_signature)
+			if termIndex is None:
+				cls.TermIndexes.pop(iri_hash, None)
+			else:
+				cls.TermIndexes[iri_hash] = termIndex
+		
+		return termIndex
+	
+	@classmethod
+	def BuildTermIndex(cls, iri, cachePath=None, logger=logging):
+		"""
+		It (re)builds the index of an already loaded ontology, when it is
+		not up to date. Both IRIs and labels are gathered as owlready2
+		searches find them
+		"""
+		iri_hash = cls.GetIRIHash(iri)
+		worldDB = cls.TermWorlds.get(iri_hash)
+		if worldDB is None:
+			return None
+		
+		termIndex = cls.OpenTermIndex(iri, cachePath)
+		if termIndex is not None:
+			return termIndex
+		
+		iris = [ row[0]  for row in worldDB.graph.execute("SELECT DISTINCT resources.iri FROM resources, objs WHERE resources.storid = objs.s")  if isinstance(row[0], str) ]
+		labels = [ row[0]  for row in worldDB.graph.execute("SELECT DISTINCT o FROM datas WHERE p = ?", (owlready2.label.storid,))  if isinstance(row[0], str) ]
+		
+		umask = os.umask(0)
+		os.umask(umask)
+		index_path = cls.GetTermIndexPath(iri_hash, cachePath)
+		TermIndex.Write(index_path, TermIndex.SourceSignature(cls.GetWorldDBPath(iri_hash, cachePath)), iris, labels, file_mode=0o666 & ~umask)
+		logger.debug("Term index of {} built with {} IRIs and {} labels".format(iri, len(iris), len(labels)))
+		
+		return cls.OpenTermIndex(iri, cachePath)
+	
+	def invalidateCaches(self):
+		super().invalidateCaches()
+		for iri_hash in list(self.TermIndexes.keys()):
+			termIndex = self.TermIndexes.pop(iri_hash)
+			if os.path.exists(termIndex.index_path):
+				os.unlink(termIndex.index_path)
+	
+	def warmUpCaches(self):
+		if not self.termIndexEnabled:
+			return super().warmUpCaches()
+		
+		cachePath = self.config.get('cacheDir')
+		doReasoner = self.config.get(self.KeyAttributeName,{}).get('do-reasoning',False)
+		for ontology in self.ontologies:
+			if self.isRW:
+				self.GetOntology(ontology, doReasoner=doReasoner, cachePath=cachePath, logger=self.logger, warmUp=True)
+				self.BuildTermIndex(ontology, cachePath=cachePath, logger=self.logger)
+			elif self.OpenTermIndex(ontology, cachePath) is None:
+				# Without an index, the world is used
+				self.GetOntology(ontology, doReasoner=doReasoner, cachePath=cachePath, logger=self.logger, warmUp=False)
+	
+	@staticmethod
+	def _hasGlobChars(term, matchType):
+		# Suffix lookups are GLOB patterns, the other ones only when
+		# they have an asterisk
+		globChars = '*?['  if matchType == 'suffix'  else '*'
+		return any(map(lambda globChar: globChar in term, globChars))
+	
+	def isValid(self,validator,ontlist,term,schema):
+		matchType = str(schema.get(self.MatchTypeAttrName,'exact'))
+		if (not self.termIndexEnabled) or schema.get(self.AncestorsAttrName) or (matchType not in self.VALID_MATCHES) or self._hasGlobChars(term, matchType):
+			return super().isValid(validator,ontlist,term,schema)
+		
+		termIndexes = []
+		for ontology in ontlist:
+			termIndex = self.TermIndexes.get(self.GetIRIHash(ontology))
+			if termIndex is None:
+				termIndex = self.OpenTermIndex(ontology, self.config.get('cacheDir'))
+				if termIndex is None:
+					return super().isValid(validator,ontlist,term,schema)
+			termIndexes.append(termIndex)
+		
+		if not any(map(lambda termIndex: termIndex.lookup(matchType, term), termIndexes)):
+			raise ValidationError("Term {0} was not found in these ontologies: {1}".format(term,' '.join(ontlist)))
+		
+		return True
+
+class IndexedFairGTracksValidator(FairGTracksValidator):
+	"""
+	FairGTracksValidator whose 'term' format is backed by term indexes
+	"""
+	CustomFormats = [ IndexedOntologyTerm  if customFormat is OntologyTerm  else customFormat  for customFormat in FairGTracksValidator.CustomFormats ]
+	
+	CustomValidators = { key: [ IndexedOntologyTerm  if customValidator is OntologyTerm  else customValidator  for customValidator in customValidators ]  for key, customValidators in FairGTracksValidator.CustomValidators.items() }
+	
+	def __init__(self, customFormats=CustomFormats, customTypes=FairGTracksValidator.CustomTypes, customValidators=CustomValidators, config={}, isRW=True):
+		super().__init__(customFormats=customFormats, customTypes=customTypes, customValidators=customValidators, config=config, isRW=isRW)
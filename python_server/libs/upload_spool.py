@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import io
+import os
+import tempfile
+
+from flask import Request, current_app
+
+# And this is needed to guess a bit
+import filetype
+
+from .codec import JSONCodec
+
+class UploadSpool(object):
+	"""
+	Uploaded contents are copied in chunks to a spool, which is kept in
+	memory while it is small, and moved to an anonymous temporary file
+	once it grows beyond max_memory bytes. So, the memory used by an
+	upload does not depend on its size.
+	
+	Spools are real file objects (either io.BytesIO or a temporary
+	file), as zipfile and tarfile need seekable file handles.
+	"""
+	DEFAULT_MAX_MEMORY = 1024 * 1024
+	CHUNK_SIZE = 64 * 1024
+	# It is the number of leading bytes filetype looks at
+	SNIFF_SIZE = 8192
+	
+	@classmethod
+	def Spool(cls, stream, max_memory=DEFAULT_MAX_MEMORY):
+		"""
+		It returns the spool, rewound, with the contents of the
+		stream
+		"""
+		spool = io.BytesIO()
+		while True:
+			chunk = stream.read(cls.CHUNK_SIZE)
+			if not chunk:
+				break
+			
+			if isinstance(spool, io.BytesIO) and (spool.tell() + len(chunk) > max_memory):
+				spooled = tempfile.TemporaryFile(mode='w+b')
+				spooled.write(spool.getvalue())
+				spool.close()
+				spool = spooled
+			spool.write(chunk)
+		
+		spool.seek(0)
+		return spool
+	
+	@classmethod
+	def SniffMime(cls, fh):
+		"""
+		It guesses the MIME type of the file from its leading bytes,
+		keeping the file position
+		"""
+		position = fh.tell()
+		head = fh.read(cls.SNIFF_SIZE)
+		fh.seek(position)
+		
+		return filetype.guess_mime(head)
+	
+	@classmethod
+	def Size(cls, fh):
+		position = fh.tell()
+		size = fh.seek(0, os.SEEK_END)
+		fh.seek(position)
+		
+		return size
+
+class SpoolingRequest(Request):
+	"""
+	Files from multipart forms are spooled to temporary files when the
+	request is larger than the configured threshold, instead of using
+	the default 500KB one. JSON bodies are parsed through the codec
+	(from Flask 2.2 on, also through the JSON provider of the app)
+	"""
+	json_module = JSONCodec
+	
+	def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+		max_memory = current_app.config.get('UPLOAD_SPOOL_SIZE', UploadSpool.DEFAULT_MAX_MEMORY)
+		
+		if (total_content_length is None) or (total_content_length > max_memory):
+			return tempfile.TemporaryFile(mode='w+b')
+		
+		return io.BytesIO()
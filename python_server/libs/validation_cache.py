@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import collections
+import hashlib
+import threading
+import time
+
+from extended_json_schema_validator.extensions.unique_check import UniqueKey
+from extended_json_schema_validator.extensions.pk_check import PrimaryKey
+from extended_json_schema_validator.extensions.fk_check import ForeignKey
+from fairtracks_validator.fairtracks_validator import FairGTracksValidator
+from fairtracks_validator.extensions.foreign_property_check import ForeignProperty
+from fairtracks_validator.extensions.curie_search import CurieSearch
+from fairtracks_validator.extensions.ontology_term import OntologyTerm
+
+from .term_index import IndexedOntologyTerm
+
+class ValidationResultCache(object):
+	"""
+	A size bounded LRU cache, with TTL, of validation results. The key is
+	built from the normalized hash of the validated document and the
+	digest of the loaded schema set.
+	
+	Only documents validated against schemas without cross-document
+	constraints (unique, primary_key, foreign_keys, foreignProperty) are
+	cached, as their result only depends on their own contents. The other
+	ones are always validated, together with the cache misses of the same
+	request. Schemas using any extension not listed here are never cached.
+	"""
+	DEFAULT_MAX_ENTRIES = 10000
+	
+	# The extensions which never check across documents. Subclasses
+	# are not trusted, so they must be listed on their own
+	LocalExtensions = (
+		CurieSearch,
+		OntologyTerm,
+		IndexedOntologyTerm,
+	)
+	
+	# The extensions which check across documents, along with the
+	# attribute where they record the constraints found in the schema
+	CrossDocumentExtensions = {
+		UniqueKey: 'UniqueWorld',
+		PrimaryKey: 'UniqueWorld',
+		ForeignKey: 'FKWorld',
+		ForeignProperty: 'FPWorld',
+	}
+	DEFAULT_TTL = 3600
+	
+	def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._entries = collections.OrderedDict()
+		# The schema set, its digest and which of its schemas are cacheable
+		self._schema_set = (None, None, {})
+		self.hits = 0
+		self.misses = 0
+		self.bypassed = 0
+		self.evictions = 0
+		self.expirations = 0
+	
+	@classmethod
+	def FromConfig(cls, local_config):
+		"""
+		It returns None when the cache is not enabled
+		"""
+		cache_config = local_config.get('validation_cache', {})
+		if not cache_config.get('enabled', False):
+			return None
+		
+		return cls(max_entries=int(cache_config.get('max-entries', cls.DEFAULT_MAX_ENTRIES)), ttl=float(cache_config.get('ttl', cls.DEFAULT_TTL)))
+	
+	def reset(self, fgv):
+		"""
+		It must be called each time the schema set is (re)loaded, before
+		any validation, as the extensions record their constraints when
+		they are bootstrapped, and the validations add more entries
+		"""
+		cacheable_schemas = {}
+		schema_hashes = []
+		for jsonSchemaURI, schemaObj in fgv.getValidSchemas().items():
+			schema_hashes.append(schemaObj['schema_hash'])
+			cacheable_schemas[jsonSchemaURI] = all(map(self._is_local, schemaObj['customFormatInstances']))
+		
+		with self._lock:
+			self._schema_set = (fgv, hashlib.sha1(','.join(sorted(schema_hashes)).encode('utf-8')).hexdigest(), cacheable_schemas)
+			self._entries.clear()
+	
+	@classmethod
+	def _is_local(cls, customFormatInstance):
+		"""
+		Every schema gets an instance of each extension, so the ones
+		checking across documents are only a problem when they found
+		any constraint in the schema
+		"""
+		extension_class = type(customFormatInstance)
+		if extension_class in cls.LocalExtensions:
+			return True
+		
+		world_attr = cls.CrossDocumentExtensions.get(extension_class)
+		if world_attr is None:
+			return False
+		
+		return len(getattr(customFormatInstance, world_attr)) == 0
+	
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+	
+	def key(self, fgv, json_doc):
+		"""
+		It returns the cache key of the document, or None when
+		its validation result cannot be cached
+		"""
+		schema_set_fgv, schema_set_digest, cacheable_schemas = self._schema_set
+		# The requests which started before a hot reload still use
+		# the previous schema set
+		if (fgv is not schema_set_fgv) or not isinstance(json_doc, dict):
+			return None
+		
+		if (fgv.jsonRootTag is not None) and (fgv.jsonRootTag in json_doc):
+			json_root = json_doc[fgv.jsonRootTag]
+		else:
+			json_root = json_doc
+		
+		json_schema_id = None
+		if isinstance(json_root, dict):
+			for alt_schema_key in fgv.ALT_SCHEMA_KEYS:
+				if alt_schema_key in json_root:
+					json_schema_id = json_root[alt_schema_key]
+					break
+		
+		# Documents without a known schema are reported the same way
+		# each time, so only the ones using a schema with cross-document
+		# constraints are skipped
+		if (json_schema_id is not None) and not isinstance(json_schema_id, str):
+			return None
+		if not cacheable_schemas.get(json_schema_id, True):
+			return None
+		
+		return FairGTracksValidator.GetNormalizedJSONHash(json_doc) + '_' + schema_set_digest
+	
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				expires_at, result = entry
+				if expires_at > time.monotonic():
+					self._entries.move_to_end(key)
+					self.hits += 1
+					return result
+				
+				del self._entries[key]
+				self.expirations += 1
+			
+			self.misses += 1
+			return None
+	
+	def put(self, key, result):
+		with self._lock:
+			self._entries[key] = (time.monotonic() + self.ttl, result)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+	
+	def count_bypassed(self, num_bypassed=1):
+		with self._lock:
+			self.bypassed += num_bypassed
+	
+	def stats(self):
+		with self._lock:
+			return {
+				'entries': len(self._entries),
+				'max_entries': self.max_entries,
+				'ttl': self.ttl,
+				'hits': self.hits,
+				'misses': self.misses,
+				'bypassed': self.bypassed,
+				'evictions': self.evictions,
+				'expirations': self.expirations
+			}
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os
+import re
+import json
+import logging
+import datetime
+import multiprocessing
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import uuid
+
+import concurrent.futures
+
+from .archive_reader import ArchiveReader, ArchiveError
+from .upload_spool import UploadSpool
+from .codec import JSONCodec
+
+class JobQueueFullError(Exception):
+	pass
+
+# The jobs instance used by the pool workers, which is
+# inherited when they are forked
+_WorkerJobs = None
+
+def _run_job(job_id):
+	_WorkerJobs.run(job_id)
+
+class ValidationJobs(object):
+	"""
+	Validation jobs let clients upload large batches without holding
+	the connection (and the server process) while they are validated.
+	The uploads are stored in a directory per job, and a bounded queue
+	feeds a pool of forked processes, which share the loaded schemas.
+	
+	The status of each job, along with its progress, is kept in a file
+	in its directory, and the results are spooled to disk, with an index
+	of their offsets, so they can be fetched by pages from any server
+	process. Jobs are removed once they have not been updated for longer
+	than the TTL.
+	"""
+	JobFile = 'job.json'
+	InputsDir = 'inputs'
+	ResultsFile = 'results.ndjson'
+	ResultsIndexFile = 'results.idx'
+	JobIdPattern = re.compile('^[0-9a-f]{32}$')
+	OffsetLayout = struct.Struct('=Q')
+	
+	QUEUED = 'queued'
+	RUNNING = 'running'
+	DONE = 'done'
+	FAILED = 'failed'
+	
+	DEFAULT_WORKERS = 1
+	DEFAULT_MAX_QUEUED = 16
+	DEFAULT_TTL = 86400
+	DEFAULT_PAGE_SIZE = 100
+	MAX_PAGE_SIZE = 1000
+	# Seconds between progress updates
+	PROGRESS_INTERVAL = 1.0
+	COPY_CHUNK_SIZE = 1024 * 1024
+	
+	def __init__(self, jobs_dir, workers=DEFAULT_WORKERS, max_queued=DEFAULT_MAX_QUEUED, ttl=DEFAULT_TTL, page_size=DEFAULT_PAGE_SIZE):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		self.jobs_dir = jobs_dir
+		self.workers = max(workers, 1)
+		self.max_queued = max(max_queued, 1)
+		self.ttl = ttl
+		self.page_size = min(max(page_size, 1), self.MAX_PAGE_SIZE)
+		os.makedirs(self.jobs_dir, exist_ok=True)
+		
+		self.ftv = None
+		self._lock = threading.Lock()
+		self._executor = None
+		self._executor_pid = None
+		self._pending = 0
+	
+	@classmethod
+	def FromConfig(cls, local_config, default_jobs_dir):
+		"""
+		It returns None when the jobs are not enabled
+		"""
+		jobs_config = local_config.get('validation_jobs', {})
+		if not jobs_config.get('enabled', False):
+			return None
+		
+		return cls(
+			jobs_config.get('dir', default_jobs_dir),
+			workers=int(jobs_config.get('workers', cls.DEFAULT_WORKERS)),
+			max_queued=int(jobs_config.get('max-queued', cls.DEFAULT_MAX_QUEUED)),
+			ttl=float(jobs_config.get('ttl', cls.DEFAULT_TTL)),
+			page_size=int(jobs_config.get('page-size', cls.DEFAULT_PAGE_SIZE))
+		)
+	
+	def reset(self, ftv):
+		"""
+		It must be called each time the schema set is (re)loaded, as the
+		workers are forked with it. Already queued jobs are finished by
+		the previous workers
+		"""
+		with self._lock:
+			self._shutdown()
+			self.ftv = ftv
+	
+	def close(self):
+		"""
+		The workers exit once the already queued jobs are finished
+		"""
+		with self._lock:
+			self._shutdown()
+	
+	def _shutdown(self):
+		# An executor inherited from a forked parent is not ours
+		if (self._executor is not None) and (self._executor_pid == os.getpid()):
+			self._executor.shutdown(wait=False)
+		self._executor = None
+		self._executor_pid = None
+	
+	def _get_executor(self):
+		if (self._executor is None) or (self._executor_pid != os.getpid()):
+			global _WorkerJobs
+			_WorkerJobs = self
+			self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+			self._executor_pid = os.getpid()
+		
+		return self._executor
+	
+	def _job_dir(self, job_id):
+		if not isinstance(job_id, str) or (self.JobIdPattern.search(job_id) is None):
+			return None
+		
+		return os.path.join(self.jobs_dir, job_id)
+	
+	@staticmethod
+	def _now():
+		return datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+	
+	def _read_job(self, job_dir):
+		try:
+			with open(os.path.join(job_dir, self.JobFile), mode='r', encoding='utf-8') as jh:
+				return json.load(jh)
+		except (OSError, ValueError):
+			return None
+	
+	def _write_job(self, job_dir, job):
+		fd, tmp_filename = tempfile.mkstemp(dir=job_dir, prefix='.', suffix='.tmp')
+		try:
+			with os.fdopen(fd, mode='w', encoding='utf-8') as th:
+				json.dump(job, th)
+			os.replace(tmp_filename, os.path.join(job_dir, self.JobFile))
+		except:
+			os.unlink(tmp_filename)
+			raise
+	
+	def submit(self, inputs, max_member_size=ArchiveReader.DEFAULT_MAX_MEMBER_SIZE, max_total_size=ArchiveReader.DEFAULT_MAX_TOTAL_SIZE):
+		"""
+		inputs is a list of (filename, mime type, source) tuples, where
+		the filename is None for request bodies, and the source is either
+		a file-like object or a callable saving the content to the given
+		path. It returns the status of the new job, and it raises
+		JobQueueFullError when there are too many pending jobs
+		"""
+		self.collect_garbage()
+		
+		with self._lock:
+			executor = self._get_executor()
+			if self._pending >= self.max_queued:
+				raise JobQueueFullError('There are {} pending validation jobs'.format(self._pending))
+			self._pending += 1
+		
+		job_id = uuid.uuid4().hex
+		job_dir = self._job_dir(job_id)
+		try:
+			inputs_dir = os.path.join(job_dir, self.InputsDir)
+			os.makedirs(inputs_dir)
+			
+			job_inputs = []
+			for i_input, (filename, mime_type, source) in enumerate(inputs):
+				input_path = os.path.join(inputs_dir, str(i_input))
+				if callable(source):
+					source(input_path)
+				else:
+					with open(input_path, mode='wb') as ih:
+						shutil.copyfileobj(source, ih, self.COPY_CHUNK_SIZE)
+				job_inputs.append({'filename': filename, 'mimetype': mime_type})
+			
+			job = {
+				'job_id': job_id,
+				'status': self.QUEUED,
+				'created': self._now(),
+				'inputs': job_inputs,
+				'limits': {
+					'max-member-size': max_member_size,
+					'max-total-size': max_total_size
+				}
+			}
+			self._write_job(job_dir, job)
+			
+			future = executor.submit(_run_job, job_id)
+		except:
+			with self._lock:
+				self._pending -= 1
+			shutil.rmtree(job_dir, ignore_errors=True)
+			raise
+		
+		future.add_done_callback(lambda future: self._job_finished(job_id, future))
+		
+		return self.status(job)
+	
+	def _job_finished(self, job_id, future):
+		with self._lock:
+			self._pending -= 1
+		
+		# The worker could have died, or the job was cancelled
+		try:
+			future.result()
+		except BaseException as e:
+			job_dir = self._job_dir(job_id)
+			job = self._read_job(job_dir)
+			if (job is not None) and (job['status'] in (self.QUEUED, self.RUNNING)):
+				self.logger.error("Validation job {} was interrupted: {}".format(job_id, e))
+				job['status'] = self.FAILED
+				job['finished'] = self._now()
+				job['error'] = 'The validation was interrupted'
+				self._write_job(job_dir, job)
+	
+	def _read_inputs(self, job_dir, job):
+		"""
+		It reads the inputs the same way the synchronous endpoints do.
+		It returns the pieces to be validated, and the results of the
+		inputs which could not be read
+		"""
+		json_data = []
+		failed_retval = []
+		limits = job['limits']
+		for i_input, job_input in enumerate(job['inputs']):
+			filename = job_input['filename']
+			with open(os.path.join(job_dir, self.InputsDir, str(i_input)), mode='rb') as ih:
+				mime_type = UploadSpool.SniffMime(ih)
+				if ArchiveReader.IsArchive(mime_type):
+					# Members from uploaded files are labelled with their name
+					label_prefix = ''  if filename is None  else filename + '::'
+					try:
+						for member_path, json_doc, error in ArchiveReader(ih, mime_type, max_member_size=limits['max-member-size'], max_total_size=limits['max-total-size']):
+							if error is None:
+								json_data.append((label_prefix + member_path, json_doc))
+							else:
+								failed_retval.append({'file': label_prefix + member_path, 'validated': False, 'errors': [error]})
+					except ArchiveError as ae:
+						failed_retval.append({'file': filename, 'validated': False, 'errors': [{'reason': 'fatal', 'description': str(ae)}]})
+				elif (mime_type == 'application/json') or ((mime_type is None) and (job_input['mimetype'] in ('application/json','application/octet-stream'))):
+					try:
+						json_doc = JSONCodec.load(ih)
+					except ValueError:
+						failed_retval.append({'file': filename, 'validated': False, 'errors':[{'reason': 'fatal', 'description': 'Unable to open/parse JSON file'}]})
+					else:
+						if filename is not None:
+							json_data.append((filename, json_doc))
+						elif isinstance(json_doc, list):
+							# Request bodies hold either a document or an array of them
+							json_data.extend(json_doc)
+						else:
+							json_data.append(json_doc)
+				else:
+					failed_retval.append({'file': filename, 'validated': False, 'errors':[{'reason': 'fatal', 'description': 'Unable to open/parse file: unrecognized format (mime {}, size {})'.format(mime_type, UploadSpool.Size(ih))}]})
+		
+		return json_data, failed_retval
+	
+	def run(self, job_id):
+		"""
+		It is run by the pool workers
+		"""
+		job_dir = self._job_dir(job_id)
+		job = self._read_job(job_dir)
+		# Removed meanwhile
+		if job is None:
+			return
+		
+		try:
+			job['status'] = self.RUNNING
+			job['started'] = self._now()
+			self._write_job(job_dir, job)
+			
+			json_data, failed_retval = self._read_inputs(job_dir, job)
+			job['documents_total'] = len(json_data) + len(failed_retval)
+			job['documents_done'] = 0
+			self._write_job(job_dir, job)
+			
+			num_results = self._spool_results(job_dir, job, json_data, failed_retval)
+			
+			job['status'] = self.DONE
+			job['results'] = num_results
+		except Exception as e:
+			self.logger.exception("Validation job {} failed".format(job_id))
+			job['status'] = self.FAILED
+			job['error'] = str(e)
+		
+		job['finished'] = self._now()
+		if os.path.isdir(job_dir):
+			self._write_job(job_dir, job)
+			# Inputs are not needed anymore
+			shutil.rmtree(os.path.join(job_dir, self.InputsDir), ignore_errors=True)
+		
+		# Pool workers do not run the exit handlers
+		self.ftv.metrics.flush(force=True)
+	
+	def _spool_results(self, job_dir, job, json_data, failed_retval):
+		"""
+		Results are written in the same order the synchronous endpoints
+		use: first the documents which failed the validation against
+		their JSON Schemas, then the other ones, and last the inputs
+		which could not be read. It returns the number of results
+		"""
+		keys_errors = {}
+		last_update = time.monotonic()
+		with tempfile.TemporaryFile(dir=job_dir) as failed_spool, tempfile.TemporaryFile(dir=job_dir) as survivors_spool:
+			for result in self.ftv.iter_job_results(*json_data):
+				phase = result.pop('phase')
+				if phase == 'document':
+					spool = failed_spool  if not result['validated']  else survivors_spool
+					spool.write(JSONCodec.dumpb(result) + b'\n')
+					job['documents_done'] += 1
+					if time.monotonic() - last_update >= self.PROGRESS_INTERVAL:
+						self._write_job(job_dir, job)
+						last_update = time.monotonic()
+				elif phase == 'keys':
+					keys_errors[result['file']] = result['errors']
+			
+			job['documents_done'] += len(failed_retval)
+			
+			num_results = 0
+			with open(os.path.join(job_dir, self.ResultsFile), mode='wb') as rh, open(os.path.join(job_dir, self.ResultsIndexFile), mode='wb') as ih:
+				def write_result(result):
+					ih.write(self.OffsetLayout.pack(rh.tell()))
+					rh.write(JSONCodec.dumpb(result) + b'\n')
+				
+				failed_spool.seek(0)
+				for line in failed_spool:
+					write_result(JSONCodec.loads(line))
+					num_results += 1
+				
+				survivors_spool.seek(0)
+				for line in survivors_spool:
+					result = JSONCodec.loads(line)
+					errors = keys_errors.get(result['file'])
+					if errors:
+						result['errors'].extend(errors)
+						result['validated'] = False
+					write_result(result)
+					num_results += 1
+				
+				for failed in failed_retval:
+					write_result(failed)
+					num_results += 1
+		
+		return num_results
+	
+	def status(self, job):
+		"""
+		It returns the public fields of the job
+		"""
+		return { k: v  for k, v in job.items()  if k not in ('inputs', 'limits') }
+	
+	def get(self, job_id):
+		"""
+		It returns the status of the job, or None when it does not exist
+		"""
+		job_dir = self._job_dir(job_id)
+		if job_dir is None:
+			return None
+		
+		job = self._read_job(job_dir)
+		return None  if job is None  else self.status(job)
+	
+	def results(self, job_id, offset=0, limit=None):
+		"""
+		It returns the job status along with a page of its results,
+		which are only available once the job is done
+		"""
+		job_dir = self._job_dir(job_id)
+		job = None  if job_dir is None  else self._read_job(job_dir)
+		if (job is None) or (job['status'] != self.DONE):
+			return job, None
+		
+		if (limit is None) or (limit <= 0):
+			limit = self.page_size
+		limit = min(limit, self.MAX_PAGE_SIZE)
+		offset = max(offset, 0)
+		
+		results = []
+		if offset < job['results']:
+			with open(os.path.join(job_dir, self.ResultsIndexFile), mode='rb') as ih:
+				ih.seek(offset * self.OffsetLayout.size)
+				first_offset = self.OffsetLayout.unpack(ih.read(self.OffsetLayout.size))[0]
+			
+			with open(os.path.join(job_dir, self.ResultsFile), mode='rb') as rh:
+				rh.seek(first_offset)
+				for line in rh:
+					results.append(JSONCodec.loads(line))
+					if len(results) >= limit:
+						break
+		
+		return self.status(job), {
+			'job_id': job_id,
+			'offset': offset,
+			'limit': limit,
+			'total': job['results'],
+			'results': results
+		}
+	
+	def delete(self, job_id):
+		"""
+		It returns whether the job existed. Running jobs finish,
+		but their results are discarded
+		"""
+		job_dir = self._job_dir(job_id)
+		if (job_dir is None) or not os.path.isdir(job_dir):
+			return False
+		
+		shutil.rmtree(job_dir, ignore_errors=True)
+		return True
+	
+	def collect_garbage(self):
+		"""
+		It removes the jobs which have not been updated for longer than
+		the TTL, which are either finished or abandoned ones
+		"""
+		deadline = time.time() - self.ttl
+		for entry in os.scandir(self.jobs_dir):
+			job_dir = self._job_dir(entry.name)
+			if (job_dir is None) or not entry.is_dir():
+				continue
+			
+			try:
+				last_update = os.stat(os.path.join(job_dir, self.JobFile)).st_mtime
+			except FileNotFoundError:
+				# Jobs being submitted do not have it yet
+				last_update = entry.stat().st_mtime
+			
+			if last_update < deadline:
+				self.logger.info("Removing expired validation job {}".format(entry.name))
+				shutil.rmtree(job_dir, ignore_errors=True)
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os
+import re
+import json
+import logging
+import hashlib
+import collections
+import datetime
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from RWFileLock import RWFileLock, LockError
+
+from .codec import JSONCodec
+from .key_index import KeyIndex
+from .phased_validation import PhasedValidation
+
+class SessionError(Exception):
+	pass
+
+class SessionLimitError(SessionError):
+	pass
+
+class ValidationSession(object):
+	"""
+	The in-memory state of a validation session in this process. It
+	keeps the documents, in the order they were added, along with the
+	result of validating each one of them against its JSON Schema and
+	the values each one contributes to the cross-document checks. So,
+	only the added or replaced documents are validated again, and the
+	cross-document checks are run from the merged values.
+	"""
+	def __init__(self, session_id, fgv, version=0):
+		self.session_id = session_id
+		self.fgv = fgv
+		self.version = version
+		self.entries = collections.OrderedDict()
+		self.size = 0
+		self.report = []
+		self.last_access = time.monotonic()
+	
+	def upsert(self, label, json_doc, size):
+		fgv = self.fgv
+		jsonObj = {'file': label, 'json': json_doc, 'errors': []}
+		dynSchemaValList = KeyIndex.DynamicValidators(fgv)
+		fgv._resetDynamicValidators(dynSchemaValList)
+		try:
+			passed = PhasedValidation(fgv).validate_document(jsonObj)
+			gathered = KeyIndex.Gather(fgv, copied=True)
+		finally:
+			fgv._resetDynamicValidators(dynSchemaValList)
+		
+		prev_entry = self.entries.get(label)
+		if prev_entry is not None:
+			self.size -= prev_entry['size']
+		
+		# Replaced documents keep their position
+		self.entries[label] = {
+			'json': json_doc,
+			'size': size,
+			'errors': jsonObj['errors'],
+			'schema_id': jsonObj.get('schema_id'),
+			'schema_hash': jsonObj.get('schema_hash'),
+			'passed': passed,
+			'gathered': gathered
+		}
+		self.size += size
+	
+	def remove(self, label):
+		entry = self.entries.pop(label, None)
+		if entry is None:
+			return False
+		
+		self.size -= entry['size']
+		return True
+	
+	def _full_report(self):
+		return self.fgv.jsonValidate(*[ {'file': label, 'json': entry['json'], 'errors': []}  for label, entry in self.entries.items() ])
+	
+	def refresh_report(self):
+		"""
+		It computes the report of the whole session, which is the
+		same jsonValidate would return validating all the documents
+		"""
+		fgv = self.fgv
+		if (len(self.entries) == 0) or not KeyIndex.CanMerge(fgv) or any(map(lambda entry: KeyIndex.HasDuplicates(entry['errors']), self.entries.values())):
+			self.report = self._full_report()  if len(self.entries) > 0  else []
+			return self.report
+		
+		dynSchemaValList = KeyIndex.DynamicValidators(fgv)
+		fgv._resetDynamicValidators(dynSchemaValList)
+		try:
+			if not KeyIndex.Merge(fgv, map(lambda entry: entry['gathered'], self.entries.values())):
+				self.report = self._full_report()
+				return self.report
+			
+			# Same order as jsonValidate: first the documents which
+			# failed the first pass, then the other ones
+			report = []
+			survivors = []
+			for label, entry in self.entries.items():
+				jsonObj = {'file': label, 'errors': list(entry['errors'])}
+				if entry['schema_id'] is not None:
+					jsonObj['schema_id'] = entry['schema_id']
+					jsonObj['schema_hash'] = entry['schema_hash']
+				
+				if entry['passed']:
+					survivors.append(jsonObj)
+				else:
+					report.append(jsonObj)
+			
+			if dynSchemaValList:
+				fgv.warmUpCaches(dynSchemaValList)
+				_, _, secondPassErrors = fgv.doSecondPass(dynSchemaValList)
+				for jsonObj in survivors:
+					report.append(jsonObj)
+					errorList = secondPassErrors.get(jsonObj['file'])
+					if errorList:
+						jsonObj['errors'].extend(errorList)
+			
+			self.report = report
+			return report
+		finally:
+			fgv._resetDynamicValidators(dynSchemaValList)
+
+class ValidationSessions(object):
+	"""
+	Validation sessions keep a set of documents across requests, so the
+	cross-document checks (unique, primary and foreign keys, foreign
+	properties) of the documents from a request are done against all
+	the documents of the session, and clients only send what changed.
+	
+	The documents of each session are stored on disk, one file per
+	document, so any server process can serve any session. The state
+	kept in memory by each process is rebuilt when the session was
+	changed by other process, when the schema set was reloaded, or
+	when it was evicted to honour the memory cap. Sessions are removed
+	once they have been idle for longer than the TTL.
+	"""
+	SessionFile = 'session.json'
+	LockFile = 'session.lock'
+	DocumentsDir = 'documents'
+	SessionIdPattern = re.compile('^[0-9a-f]{32}$')
+	
+	DEFAULT_TTL = 3600
+	DEFAULT_MAX_MEMORY_IN_MB = 256
+	
+	def __init__(self, sessions_dir, ttl=DEFAULT_TTL, max_memory=DEFAULT_MAX_MEMORY_IN_MB * 1024 * 1024):
+		self.logger = logging.getLogger(self.__class__.__name__)
+		self.sessions_dir = sessions_dir
+		self.ttl = ttl
+		self.max_memory = max_memory
+		os.makedirs(self.sessions_dir, exist_ok=True)
+		
+		# The extensions of the validator instance are shared,
+		# so only one session is processed at a time
+		self._lock = threading.RLock()
+		self._sessions = collections.OrderedDict()
+	
+	@classmethod
+	def FromConfig(cls, local_config, default_sessions_dir):
+		"""
+		It returns None when the sessions are not enabled
+		"""
+		sessions_config = local_config.get('validation_sessions', {})
+		if not sessions_config.get('enabled', False):
+			return None
+		
+		return cls(
+			sessions_config.get('dir', default_sessions_dir),
+			ttl=float(sessions_config.get('ttl', cls.DEFAULT_TTL)),
+			max_memory=round(float(sessions_config.get('max-memory', cls.DEFAULT_MAX_MEMORY_IN_MB)) * 1024 * 1024)
+		)
+	
+	def _session_dir(self, session_id):
+		if not isinstance(session_id, str) or (self.SessionIdPattern.search(session_id) is None):
+			return None
+		
+		return os.path.join(self.sessions_dir, session_id)
+	
+	def _session_lock(self, session_dir):
+		"""
+		It returns None when the session does not exist
+		"""
+		if not os.path.isdir(session_dir):
+			return None
+		
+		try:
+			return RWFileLock(filename=os.path.join(session_dir, self.LockFile))
+		except FileNotFoundError:
+			# It was removed meanwhile
+			return None
+	
+	def _document_path(self, session_dir, label):
+		return os.path.join(session_dir, self.DocumentsDir, hashlib.sha1(label.encode('utf-8')).hexdigest() + '.json')
+	
+	@staticmethod
+	def _atomic_write(filename, raw_data):
+		fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.', suffix='.tmp')
+		try:
+			with os.fdopen(fd, mode='wb') as th:
+				th.write(raw_data)
+			os.replace(tmp_filename, filename)
+		except:
+			os.unlink(tmp_filename)
+			raise
+	
+	def _read_manifest(self, session_dir):
+		try:
+			with open(os.path.join(session_dir, self.SessionFile), mode='r', encoding='utf-8') as sh:
+				return json.load(sh)
+		except (OSError, ValueError):
+			return None
+	
+	def _write_manifest(self, session_dir, manifest):
+		self._atomic_write(os.path.join(session_dir, self.SessionFile), json.dumps(manifest).encode('utf-8'))
+	
+	@staticmethod
+	def _serialize(json_doc):
+		return JSONCodec.dumpb(json_doc)
+	
+	def _remember(self, session):
+		"""
+		It keeps the session in memory, evicting the least recently
+		used ones when the memory cap is exceeded
+		"""
+		session.last_access = time.monotonic()
+		self._sessions[session.session_id] = session
+		self._sessions.move_to_end(session.session_id)
+		
+		total_size = sum(map(lambda memory_session: memory_session.size, self._sessions.values()))
+		while (total_size > self.max_memory) and (len(self._sessions) > 1):
+			_, evicted = self._sessions.popitem(last=False)
+			total_size -= evicted.size
+	
+	def _forget(self, session_id):
+		self._sessions.pop(session_id, None)
+	
+	def _open(self, fgv, session_id, session_dir):
+		"""
+		It must be called holding the lock of the session. It returns
+		the up to date in-memory state of the session, along with its
+		manifest, or None when the session does not exist
+		"""
+		manifest = self._read_manifest(session_dir)
+		if manifest is None:
+			self._forget(session_id)
+			return None, None
+		
+		session = self._sessions.get(session_id)
+		if (session is None) or (session.fgv is not fgv) or (session.version != manifest['version']):
+			session = ValidationSession(session_id, fgv, version=manifest['version'])
+			for label in manifest['labels']:
+				with open(self._document_path(session_dir, label), mode='rb') as dh:
+					raw_doc = dh.read()
+				session.upsert(label, JSONCodec.loads(raw_doc), len(raw_doc))
+			session.refresh_report()
+		
+		# Keeping it alive
+		os.utime(os.path.join(session_dir, self.SessionFile))
+		
+		return session, manifest
+	
+	def create(self, fgv, upserts):
+		"""
+		It creates a new session with the documents, returning the
+		session and the labels of the documents whose result changed
+		"""
+		self.collect_garbage()
+		
+		session_id = uuid.uuid4().hex
+		session_dir = self._session_dir(session_id)
+		os.makedirs(os.path.join(session_dir, self.DocumentsDir))
+		self._write_manifest(session_dir, {
+			'version': 0,
+			'labels': [],
+			'created': datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+		})
+		
+		try:
+			session, changed, _ = self.update(fgv, session_id, upserts, [])
+		except:
+			self.delete(session_id)
+			raise
+		
+		return session, changed
+	
+	def get(self, fgv, session_id):
+		"""
+		It returns the session, or None when it does not exist
+		"""
+		session_dir = self._session_dir(session_id)
+		sessionLock = None  if session_dir is None  else self._session_lock(session_dir)
+		if sessionLock is None:
+			return None
+		
+		with self._lock, sessionLock.exclusive_blocking_lock():
+			try:
+				session, _ = self._open(fgv, session_id, session_dir)
+			except:
+				self._forget(session_id)
+				raise
+			
+			if session is not None:
+				self._remember(session)
+			
+			return session
+	
+	def update(self, fgv, session_id, upserts, removals):
+		"""
+		It adds or replaces the (label, document) pairs from upserts,
+		and it removes the documents whose labels are in removals.
+		It returns the session, the labels of the documents whose
+		result changed (along with the added or replaced ones) and the
+		labels of the removed documents, or None when the session
+		does not exist
+		"""
+		session_dir = self._session_dir(session_id)
+		sessionLock = None  if session_dir is None  else self._session_lock(session_dir)
+		if sessionLock is None:
+			return None
+		
+		with self._lock, sessionLock.exclusive_blocking_lock():
+			try:
+				session, manifest = self._open(fgv, session_id, session_dir)
+				if session is None:
+					return None
+				
+				prev_results = { jsonObj['file']: jsonObj  for jsonObj in session.report }
+				
+				serialized = collections.OrderedDict()
+				for label, json_doc in upserts:
+					serialized[label] = (json_doc, self._serialize(json_doc))
+				removals = [ label  for label in removals  if (label in session.entries) and (label not in serialized) ]
+				
+				new_size = session.size
+				for label in removals:
+					new_size -= session.entries[label]['size']
+				for label, (_, raw_doc) in serialized.items():
+					prev_entry = session.entries.get(label)
+					if prev_entry is not None:
+						new_size -= prev_entry['size']
+					new_size += len(raw_doc)
+				if new_size > self.max_memory:
+					raise SessionLimitError('Session documents would take {} bytes, more than the {} bytes allowed'.format(new_size, self.max_memory))
+				
+				# First, the documents are stored
+				for label, (_, raw_doc) in serialized.items():
+					self._atomic_write(self._document_path(session_dir, label), raw_doc)
+				for label in removals:
+					try:
+						os.unlink(self._document_path(session_dir, label))
+					except FileNotFoundError:
+						pass
+				
+				for label, (json_doc, raw_doc) in serialized.items():
+					session.upsert(label, json_doc, len(raw_doc))
+				for label in removals:
+					session.remove(label)
+				
+				session.version += 1
+				manifest['version'] = session.version
+				manifest['labels'] = list(session.entries.keys())
+				self._write_manifest(session_dir, manifest)
+				
+				session.refresh_report()
+			except:
+				# The in-memory state could be inconsistent
+				self._forget(session_id)
+				raise
+			
+			self._remember(session)
+			
+			changed = []
+			for jsonObj in session.report:
+				label = jsonObj['file']
+				prev_jsonObj = prev_results.get(label)
+				if (label in serialized) or (prev_jsonObj is None) or (prev_jsonObj['errors'] != jsonObj['errors']) or (prev_jsonObj.get('schema_hash') != jsonObj.get('schema_hash')):
+					changed.append(label)
+			
+			return session, changed, removals
+	
+	def delete(self, session_id):
+		"""
+		It returns whether the session existed
+		"""
+		session_dir = self._session_dir(session_id)
+		sessionLock = None  if session_dir is None  else self._session_lock(session_dir)
+		if sessionLock is None:
+			return False
+		
+		with self._lock, sessionLock.exclusive_blocking_lock():
+			self._forget(session_id)
+			existed = os.path.exists(os.path.join(session_dir, self.SessionFile))
+			shutil.rmtree(session_dir, ignore_errors=True)
+		
+		return existed
+	
+	def _last_access(self, session_dir):
+		"""
+		Directories of half created or half removed sessions
+		do not have a manifest
+		"""
+		try:
+			return os.stat(os.path.join(session_dir, self.SessionFile)).st_mtime
+		except FileNotFoundError:
+			try:
+				return os.stat(session_dir).st_mtime
+			except FileNotFoundError:
+				return time.time()
+	
+	def collect_garbage(self):
+		"""
+		It removes the sessions which have been idle for longer than
+		the TTL, both from memory and from disk
+		"""
+		with self._lock:
+			now = time.monotonic()
+			for session_id, session in list(self._sessions.items()):
+				if now - session.last_access > self.ttl:
+					self._forget(session_id)
+		
+		deadline = time.time() - self.ttl
+		for entry in os.scandir(self.sessions_dir):
+			session_dir = self._session_dir(entry.name)
+			if (session_dir is None) or not entry.is_dir():
+				continue
+			
+			if self._last_access(session_dir) >= deadline:
+				continue
+			
+			# Sessions in use are skipped
+			sessionLock = self._session_lock(session_dir)
+			if sessionLock is None:
+				continue
+			try:
+				sessionLock.w_lock()
+			except LockError:
+				continue
+			
+			try:
+				# It could have been used meanwhile
+				if self._last_access(session_dir) >= deadline:
+					continue
+				
+				self.logger.info("Removing idle validation session {}".format(entry.name))
+				with self._lock:
+					self._forget(entry.name)
+				shutil.rmtree(session_dir, ignore_errors=True)
+			finally:
+				if sessionLock.isLocked:
+					sessionLock.unlock()
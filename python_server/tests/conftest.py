@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import concurrent.futures
+import glob
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import time
+import zipfile
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+	sys.path.insert(0, SERVER_DIR)
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(SERVER_DIR), 'test-data')
+
+# Tests must not share the back channel with running servers
+TEST_MULTICAST_PORT = 5187
+INVALIDATION_KEY = 'test-invalidation-key'
+
+# Datasets whose ontologies and CURIE namespaces must be fetched
+ONLINE_DATASETS = ('fairtracks_simple',)
+
+def dataset_names(offline=False):
+	"""
+	The datasets under test-data, skipping the ones which cannot be
+	validated without network access when offline is requested
+	"""
+	names = sorted(map(os.path.basename, filter(os.path.isdir, glob.glob(os.path.join(TEST_DATA_DIR, '*')))))
+	if offline:
+		names = [ name  for name in names  if name not in ONLINE_DATASETS ]
+	
+	return names
+
+def dataset_schemas(name):
+	"""
+	The JSON Schemas of a dataset under test-data, either in its schemas
+	subdirectory or next to the documents (skipping the wrong ones)
+	"""
+	dataset_dir = os.path.join(TEST_DATA_DIR, name)
+	schema_paths = sorted(glob.glob(os.path.join(dataset_dir, 'schemas', '*.json')))
+	if len(schema_paths) == 0:
+		schema_paths = sorted(filter(lambda path: not path.endswith('_wrong.json'), glob.glob(os.path.join(dataset_dir, '*.json'))))
+	
+	return schema_paths
+
+def dataset_documents(name, kind):
+	"""
+	The (file name, parsed contents) of the good_validation or
+	bad_validation documents of a dataset
+	"""
+	documents = []
+	for doc_path in sorted(glob.glob(os.path.join(TEST_DATA_DIR, name, kind, '*.json'))):
+		with open(doc_path, mode='r', encoding='utf-8') as dh:
+			documents.append((os.path.basename(doc_path), json.load(dh)))
+	
+	return documents
+
+def schema_source_urls(schema_paths):
+	return [ 'file://' + schema_path  for schema_path in schema_paths ]
+
+def comparable_results(results):
+	"""
+	Validation results without the members which depend on the request
+	"""
+	return [ { key: value  for key, value in result.items()  if key != 'file' }  for result in results ]
+
+def make_archive(members, archive_format):
+	"""
+	It builds an archive with the (member path, raw contents) in memory
+	"""
+	archive = io.BytesIO()
+	if archive_format == 'zip':
+		with zipfile.ZipFile(archive, mode='w', compression=zipfile.ZIP_DEFLATED) as inzip:
+			for member_path, contents in members:
+				inzip.writestr(member_path, contents)
+	else:
+		tar_mode = 'w:' + archive_format[len('tar.'):]  if archive_format != 'tar'  else 'w'
+		with tarfile.open(fileobj=archive, mode=tar_mode) as intar:
+			for member_path, contents in members:
+				tinfo = tarfile.TarInfo(member_path)
+				tinfo.size = len(contents)
+				intar.addfile(tinfo, io.BytesIO(contents))
+	
+	return archive.getvalue()
+
+def inline_relabelled(results, labels):
+	"""
+	The results of inline documents, labelled by their position, as
+	they would be with the given labels
+	"""
+	relabelled = json.dumps(results)
+	for i_label, label in enumerate(labels):
+		relabelled = relabelled.replace(json.dumps('(inline{})'.format(i_label))[1:-1], json.dumps(label)[1:-1])
+	
+	return json.loads(relabelled)
+
+def init_extensions_cache(cache_path):
+	"""
+	The extensions keep the first cache path they are given for the whole
+	process, and the CURIE cache needs to be created writable once, as
+	the servers open it read-only
+	"""
+	from fairtracks_validator.extensions.curie_search import CurieSearch
+	
+	CurieSearch.GetCurieCache(cachePath=cache_path, warmUp=True)
+
+@pytest.fixture(scope='session', autouse=True)
+def extensions_cache(tmp_path_factory):
+	cache_path = str(tmp_path_factory.mktemp('extensions_cache'))
+	init_extensions_cache(cache_path)
+	
+	return cache_path
+
+def _run_isolated_scenario(extensions_cache_path, scenario, args):
+	init_extensions_cache(extensions_cache_path)
+	return scenario(*args)
+
+@pytest.fixture
+def run_isolated(extensions_cache):
+	"""
+	It runs a scenario in a fresh interpreter, returning its result.
+	Scenarios rebuilding the caches need it, as the rebuilding process
+	is detached through a fork, which does not get along with the
+	standard streams and the logging handlers of the test runner
+	"""
+	def _run_isolated(scenario, *args, timeout=300):
+		with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+			return executor.submit(_run_isolated_scenario, extensions_cache, scenario, args).result(timeout=timeout)
+	
+	return _run_isolated
+
+def _run_server_scenario(local_config, scenario, args):
+	client, ftv = make_app(local_config)
+	try:
+		return scenario(client, ftv, *args)
+	finally:
+		# The validation job workers are forked children, which would
+		# be waited for when this process exits
+		if ftv.validation_jobs is not None:
+			ftv.validation_jobs.close()
+
+@pytest.fixture
+def run_server(run_isolated):
+	"""
+	It starts a server in a fresh interpreter, and it runs the scenario
+	with its test client and its validator, returning its result
+	"""
+	def _run_server(local_config, scenario, *args, timeout=300):
+		return run_isolated(_run_server_scenario, local_config, scenario, args, timeout=timeout)
+	
+	return _run_server
+
+@pytest.fixture
+def make_config(tmp_path):
+	"""
+	It builds the configuration of a server using the JSON Schemas
+	copied to a temporary directory, so tests can change them
+	"""
+	def _make_config(schema_paths, **extra):
+		schemas_dir = tmp_path / 'schemas'
+		schemas_dir.mkdir(exist_ok=True)
+		copied_paths = []
+		for schema_path in schema_paths:
+			copied_path = str(schemas_dir / os.path.basename(schema_path))
+			shutil.copyfile(schema_path, copied_path)
+			copied_paths.append(copied_path)
+		
+		local_config = {
+			'cacheDir': str(tmp_path / 'cache'),
+			'schemas': schema_source_urls(copied_paths),
+			'invalidation_key': INVALIDATION_KEY,
+			'backchannel': {
+				'multicast-port': TEST_MULTICAST_PORT
+			},
+		}
+		local_config.update(extra)
+		
+		return local_config
+	
+	return _make_config
+
+def make_app(local_config):
+	"""
+	The resources are registered in module level namespaces, so the
+	requests to the apps created after the first one in a process are
+	still attended by the first one. Tests using more than one server
+	through their clients must use run_server
+	"""
+	from libs.app import init_validator_app
+	
+	app, ftv = init_validator_app(local_config)
+	return app.test_client(), ftv
+
+def wait_for_reload(client, ftv, loaded_epoch, timeout=120):
+	"""
+	It keeps on attending requests until the server adopts the schema
+	set rebuilt in background
+	"""
+	deadline = time.monotonic() + timeout
+	while ftv.hot_reloader.loaded_epoch == loaded_epoch:
+		assert time.monotonic() < deadline, "The schema set was not reloaded within {} seconds".format(timeout)
+		client.get('/schemas')
+		time.sleep(0.1)
+
+def can_lock_exclusively(lock_path):
+	"""
+	It tells whether another process is able to take the exclusive
+	lock of a cache lock file right now
+	"""
+	probe = subprocess.run([
+		sys.executable,
+		'-c',
+		'import fcntl, os, sys; fcntl.lockf(os.open(sys.argv[1], os.O_RDWR), fcntl.LOCK_EX | fcntl.LOCK_NB)',
+		lock_path
+	], capture_output=True)
+	
+	return probe.returncode == 0
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import json
+
+import filetype
+import pytest
+
+from libs.archive_reader import ArchiveError, ArchiveReader
+
+from conftest import dataset_documents, dataset_names, dataset_schemas, inline_relabelled, make_archive
+
+ARCHIVE_FORMATS = ('zip', 'tar', 'tar.gz', 'tar.bz2')
+
+def _dataset_members(name):
+	"""
+	The (member path, raw contents) of all the documents of a dataset,
+	in the order they are validated
+	"""
+	members = []
+	for kind in ('good_validation', 'bad_validation'):
+		for basename, document in dataset_documents(name, kind):
+			members.append(('{}/{}'.format(kind, basename), json.dumps(document).encode('utf-8')))
+	
+	return members
+
+def _archive_scenario(client, ftv, members):
+	r = client.post('/validate/array', json=[ json.loads(contents)  for _, contents in members ])
+	assert r.status_code == 200
+	results = {'array': r.get_json()}
+	
+	for archive_format in ARCHIVE_FORMATS:
+		r = client.post('/validate/archive', data=make_archive(members, archive_format), content_type='application/octet-stream')
+		assert r.status_code == 200
+		results[archive_format] = r.get_json()
+	
+	return results
+
+@pytest.mark.parametrize('name', dataset_names(offline=True))
+def test_archive_results_match_array(name, make_config, run_server):
+	members = _dataset_members(name)
+	results = run_server(make_config(dataset_schemas(name)), _archive_scenario, members)
+	
+	# Results (and the errors about other documents) are labelled
+	# with the member paths instead of the positions
+	expected = inline_relabelled(results['array'], [ member_path  for member_path, _ in members ])
+	for archive_format in ARCHIVE_FORMATS:
+		assert results[archive_format] == expected, archive_format
+
+@pytest.mark.parametrize('archive_format', ARCHIVE_FORMATS)
+def test_only_candidate_members_are_read(archive_format):
+	archive = make_archive([
+		('docs/a.json', b'{"a": 1}'),
+		('docs/.hidden.json', b'{"hidden": true}'),
+		('.git/b.json', b'{"hidden": true}'),
+		('docs/README', b'not JSON'),
+		('docs/broken.json', b'{"a": '),
+	], archive_format)
+	
+	members = list(ArchiveReader(archive, filetype.guess_mime(archive)))
+	
+	assert [ (member_path, json_doc)  for member_path, json_doc, error in members ] == [('docs/a.json', {'a': 1}), ('docs/broken.json', None)]
+	assert members[0][2] is None
+	assert members[1][2]['reason'] == 'fatal'
+
+def test_member_and_total_sizes_are_capped():
+	archive = make_archive([
+		('small.json', b'{"a": 1}'),
+		('large.json', json.dumps({'a': 'x' * 1024}).encode('utf-8')),
+	], 'zip')
+	
+	members = list(ArchiveReader(archive, ArchiveReader.ZIP_MIME_TYPE, max_member_size=512))
+	assert [ error is None  for _, _, error in members ] == [True, False]
+	
+	with pytest.raises(ArchiveError):
+		list(ArchiveReader(archive, ArchiveReader.ZIP_MIME_TYPE, max_total_size=512))
+
+def test_unsupported_archives_are_rejected():
+	with pytest.raises(ArchiveError):
+		list(ArchiveReader(b'PK\x03\x04 not really a zip', ArchiveReader.ZIP_MIME_TYPE))
+	
+	with pytest.raises(ArchiveError):
+		list(ArchiveReader(b'{}', 'application/json'))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+import yaml
+
+from conftest import SERVER_DIR
+from libs.ft_validator import FAIRTracksValidatorSingleton
+from libs.schema_store import SchemaStore
+from fairtracks_validator.fairtracks_validator import FairGTracksValidator
+
+# Both documents have the same length
+SCHEMA_RAW = b'{"type": "object", "required": ["a"]}'
+TAMPERED_RAW = b'{"type": "object", "required": ["b"]}'
+# The same normalized contents, with other raw bytes
+REFORMATTED_RAW = b'{"type":"object", "required": ["a"] }'
+
+def _write(path, raw):
+	with open(path, mode='wb') as fh:
+		fh.write(raw)
+
+def _rewrite_keeping_mtime(path, raw):
+	"""
+	The contents change, but neither the size nor the modification time
+	"""
+	st = os.stat(path)
+	assert len(raw) == st.st_size
+	_write(path, raw)
+	os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+	assert os.stat(path).st_mtime_ns == st.st_mtime_ns
+
+def test_fingerprint(tmp_path):
+	path = str(tmp_path / 'schema.json')
+	_write(path, SCHEMA_RAW)
+	
+	fingerprint = FAIRTracksValidatorSingleton._cache_fingerprint(path)
+	
+	assert fingerprint == {
+		'size': len(SCHEMA_RAW),
+		'mtime_ns': os.stat(path).st_mtime_ns,
+		'raw_sha256': hashlib.sha256(SCHEMA_RAW).hexdigest(),
+	}
+	# The digest computed while downloading is taken as is
+	assert FAIRTracksValidatorSingleton._cache_fingerprint(path, 'precomputed')['raw_sha256'] == 'precomputed'
+
+@pytest.mark.parametrize('check_digest', [False, True])
+def test_untouched_files_match(tmp_path, check_digest):
+	path = str(tmp_path / 'schema.json')
+	_write(path, SCHEMA_RAW)
+	fingerprint = FAIRTracksValidatorSingleton._cache_fingerprint(path)
+	
+	assert FAIRTracksValidatorSingleton._matches_cache_fingerprint(path, fingerprint, check_digest=check_digest)
+	
+	_write(path, SCHEMA_RAW + b' ')
+	assert not FAIRTracksValidatorSingleton._matches_cache_fingerprint(path, fingerprint, check_digest=check_digest)
+
+def test_copied_files_match_by_digest(tmp_path):
+	path = str(tmp_path / 'schema.json')
+	_write(path, SCHEMA_RAW)
+	fingerprint = FAIRTracksValidatorSingleton._cache_fingerprint(path)
+	copied_mtime_ns = fingerprint['mtime_ns'] - 10 ** 9
+	os.utime(path, ns=(copied_mtime_ns, copied_mtime_ns))
+	
+	assert not FAIRTracksValidatorSingleton._matches_cache_fingerprint(path, dict(fingerprint), check_digest=False)
+	assert FAIRTracksValidatorSingleton._matches_cache_fingerprint(path, fingerprint, check_digest=True)
+	# The fingerprint follows the new modification time
+	assert fingerprint['mtime_ns'] == copied_mtime_ns
+
+def test_tampered_files_are_caught_by_digest(tmp_path):
+	path = str(tmp_path / 'schema.json')
+	_write(path, SCHEMA_RAW)
+	fingerprint = FAIRTracksValidatorSingleton._cache_fingerprint(path)
+	
+	_rewrite_keeping_mtime(path, TAMPERED_RAW)
+	
+	# Size and modification time cannot tell
+	assert FAIRTracksValidatorSingleton._matches_cache_fingerprint(path, fingerprint, check_digest=False)
+	assert not FAIRTracksValidatorSingleton._matches_cache_fingerprint(path, fingerprint, check_digest=True)
+
+def _make_cache(tmp_path, raws):
+	"""
+	A schema cache with the raw JSON Schemas recorded in its manifest,
+	as the server leaves it
+	"""
+	cache_dir = str(tmp_path / 'cache')
+	schema_cache_dir = os.path.join(cache_dir, 'schema_cache')
+	store = SchemaStore(schema_cache_dir)
+	os.makedirs(schema_cache_dir)
+	
+	schema_infos = []
+	for i_raw, raw in enumerate(raws):
+		schema_hash = FairGTracksValidator.GetNormalizedJSONHash(json.loads(raw))
+		temp_path = os.path.join(schema_cache_dir, SchemaStore.TempPrefix + schema_hash)
+		_write(temp_path, raw)
+		full_path = store.put(temp_path, schema_hash)
+		schema_infos.append({
+			'source_urls': ['https://example.org/schema{}.json'.format(i_raw)],
+			'schema_hash': schema_hash,
+			'cache_fingerprint': FAIRTracksValidatorSingleton._cache_fingerprint(full_path),
+		})
+	
+	with open(os.path.join(schema_cache_dir, FAIRTracksValidatorSingleton.CacheManifestFile), mode='w', encoding='utf-8') as mh:
+		json.dump({'schemas': schema_infos}, mh)
+	
+	return {'cacheDir': cache_dir}, store, schema_infos
+
+def _statuses(local_config):
+	return [ report['status']  for report in FAIRTracksValidatorSingleton.VerifySchemaCache(local_config) ]
+
+def test_verify_clean_cache(tmp_path):
+	local_config, _, _ = _make_cache(tmp_path, [SCHEMA_RAW, b'{"type": "string"}'])
+	
+	assert _statuses(local_config) == ['ok', 'ok']
+	assert FAIRTracksValidatorSingleton.VerifySchemaCache({}) == []
+
+@pytest.mark.parametrize('raw, status', [
+	(TAMPERED_RAW, 'hash_mismatch'),
+	(REFORMATTED_RAW, 'fingerprint_mismatch'),
+	(b'{"type": "object", "required": ["a"]', 'corrupted'),
+], ids=['tampered', 'reformatted', 'corrupted'])
+def test_verify_damaged_cache(tmp_path, raw, status):
+	local_config, store, schema_infos = _make_cache(tmp_path, [SCHEMA_RAW, b'{"type": "string"}'])
+	full_path = store.lookup(schema_infos[0]['schema_hash'])
+	if len(raw) == len(SCHEMA_RAW):
+		_rewrite_keeping_mtime(full_path, raw)
+	else:
+		_write(full_path, raw)
+	
+	assert _statuses(local_config) == [status, 'ok']
+
+def test_verify_missing_and_stray_files(tmp_path):
+	local_config, store, schema_infos = _make_cache(tmp_path, [SCHEMA_RAW, b'{"type": "string"}'])
+	store.remove(schema_infos[0]['schema_hash'])
+	stray_path = os.path.join(store.store_dir, 'stray.json')
+	_write(stray_path, b'{}')
+	
+	reports = FAIRTracksValidatorSingleton.VerifySchemaCache(local_config)
+	
+	assert [ report['status']  for report in reports ] == ['unreadable', 'ok', 'stray']
+	assert reports[-1]['file'] == stray_path
+
+def test_verify_unreadable_manifest(tmp_path):
+	local_config, store, _ = _make_cache(tmp_path, [SCHEMA_RAW])
+	_write(os.path.join(store.store_dir, FAIRTracksValidatorSingleton.CacheManifestFile), b'{"schemas": [')
+	
+	assert _statuses(local_config) == ['unreadable_manifest']
+
+def test_trusted_cache_rejects_tampered_schemas(tmp_path):
+	_, store, schema_infos = _make_cache(tmp_path, [SCHEMA_RAW])
+	ftv = FAIRTracksValidatorSingleton.__new__(FAIRTracksValidatorSingleton)
+	ftv.schema_store = store
+	ftv.trusted_cache = True
+	
+	assert ftv._read_cached_schema(dict(schema_infos[0]))['source'] == json.loads(SCHEMA_RAW)
+	
+	_rewrite_keeping_mtime(store.lookup(schema_infos[0]['schema_hash']), TAMPERED_RAW)
+	assert ftv._read_cached_schema(dict(schema_infos[0])) is None
+
+def _run_verify(tmp_path, local_config):
+	"""
+	The verify verb of the server script, with the configuration
+	file it finds next to it
+	"""
+	script_path = str(tmp_path / 'fairtracks_validator.fcgi.py')
+	if not os.path.exists(script_path):
+		os.symlink(os.path.join(SERVER_DIR, 'fairtracks_validator.fcgi.py'), script_path)
+	with open(script_path + '.yaml', mode='w', encoding='utf-8') as ch:
+		yaml.safe_dump(local_config, ch)
+	
+	env = dict(os.environ, PYTHONPATH=SERVER_DIR)
+	proc = subprocess.run([sys.executable, script_path, 'verify'], stdout=subprocess.PIPE, env=env, timeout=120)
+	
+	return proc.returncode, [ json.loads(line)  for line in proc.stdout.decode('utf-8').splitlines() ]
+
+def test_verify_verb(tmp_path):
+	local_config, store, schema_infos = _make_cache(tmp_path, [SCHEMA_RAW, b'{"type": "string"}'])
+	
+	returncode, reports = _run_verify(tmp_path, local_config)
+	assert returncode == 0
+	assert [ report['status']  for report in reports ] == ['ok', 'ok']
+	
+	_write(store.lookup(schema_infos[1]['schema_hash']), b'{"type": ')
+	returncode, reports = _run_verify(tmp_path, local_config)
+	assert returncode == 1
+	assert [ report['status']  for report in reports ] == ['ok', 'corrupted']
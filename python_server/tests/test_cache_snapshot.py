@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import errno
+import logging
+import os
+import shutil
+
+import pytest
+from fairtracks_validator.extensions.curie_search import CurieSearch
+from fairtracks_validator.extensions.ontology_term import OntologyTerm
+
+from libs.cache_snapshot import CacheSnapshot
+from libs.ft_validator import FAIRTracksValidatorSingleton
+from libs.term_index import IndexedOntologyTerm
+
+SOURCE_FILES = {
+	'schema_cache/manifest.json': b'{"schemas": []}',
+	'schema_cache/ab/' + 'ab' * 32: b'{"type": "object"}',
+	'Ontologies/owlready2_0123.sqlite3': b'world database',
+	'Ontologies/metadata_0123.json': b'{}',
+	'Ontologies/owlready2_4567.sqlite3': b'another world database',
+	'CURIE/CURIE_cache.sqlite3': b'curie database',
+}
+SKIPPED_FILES = {
+	'schema_cache.lock': b'',
+	'Ontologies/extensions.lock': b'',
+	'background-update.log': b'log',
+}
+
+@pytest.fixture
+def cache_dir(tmp_path):
+	src_dir = tmp_path / 'cache'
+	for rel_path, contents in list(SOURCE_FILES.items()) + list(SKIPPED_FILES.items()):
+		path = src_dir / rel_path
+		path.parent.mkdir(parents=True, exist_ok=True)
+		path.write_bytes(contents)
+	os.symlink('CURIE_cache.sqlite3', str(src_dir / 'CURIE' / 'latest.sqlite3'))
+	os.makedirs(str(src_dir / 'empty'))
+	
+	return str(src_dir)
+
+def _tree(root_dir):
+	"""
+	The contents of the regular files and the targets of the
+	symbolic links, by relative path
+	"""
+	tree = {}
+	for dirpath, dirnames, filenames in os.walk(root_dir):
+		for name in dirnames + filenames:
+			path = os.path.join(dirpath, name)
+			rel_path = os.path.relpath(path, root_dir)
+			if os.path.islink(path):
+				tree[rel_path] = ('link', os.readlink(path))
+			elif os.path.isdir(path):
+				tree[rel_path] = ('dir', None)
+			else:
+				with open(path, mode='rb') as fh:
+					tree[rel_path] = ('file', fh.read())
+	
+	return tree
+
+def _expected_tree(src_dir):
+	return { rel_path: entry  for rel_path, entry in _tree(src_dir).items()  if rel_path not in SKIPPED_FILES }
+
+def _same_file(path_a, path_b):
+	return os.stat(path_a).st_ino == os.stat(path_b).st_ino
+
+def _unsupported(error_code):
+	def _raise(*args):
+		raise OSError(error_code, os.strerror(error_code))
+	
+	return _raise
+
+def _fake_reflink(src_path, dst_path):
+	shutil.copy2(src_path, dst_path)
+
+def test_reflinks_are_tried_first(cache_dir, monkeypatch):
+	monkeypatch.setattr(CacheSnapshot, 'Reflink', staticmethod(_fake_reflink))
+	snapshot = CacheSnapshot(cache_dir, cache_dir + '_transient')
+	snapshot.create()
+	
+	assert snapshot.method == CacheSnapshot.REFLINK
+	assert snapshot.counts == {CacheSnapshot.REFLINK: len(SOURCE_FILES)}
+	assert _tree(snapshot.dst_dir) == _expected_tree(cache_dir)
+
+def test_hardlinks_when_reflinks_are_unsupported(cache_dir, monkeypatch):
+	monkeypatch.setattr(CacheSnapshot, 'Reflink', staticmethod(_unsupported(errno.EOPNOTSUPP)))
+	snapshot = CacheSnapshot(cache_dir, cache_dir + '_transient')
+	snapshot.create()
+	
+	assert snapshot.method == CacheSnapshot.HARDLINK
+	assert snapshot.counts == {CacheSnapshot.HARDLINK: len(SOURCE_FILES)}
+	assert _tree(snapshot.dst_dir) == _expected_tree(cache_dir)
+	for rel_path in SOURCE_FILES.keys():
+		assert _same_file(os.path.join(cache_dir, rel_path), os.path.join(snapshot.dst_dir, rel_path)), rel_path
+
+def test_copies_when_links_are_unsupported(cache_dir, monkeypatch):
+	monkeypatch.setattr(CacheSnapshot, 'Reflink', staticmethod(_unsupported(errno.ENOTTY)))
+	monkeypatch.setattr(os, 'link', _unsupported(errno.EXDEV))
+	snapshot = CacheSnapshot(cache_dir, cache_dir + '_transient')
+	snapshot.create()
+	
+	assert snapshot.method == CacheSnapshot.COPY
+	assert snapshot.counts == {CacheSnapshot.COPY: len(SOURCE_FILES)}
+	assert _tree(snapshot.dst_dir) == _expected_tree(cache_dir)
+	for rel_path in SOURCE_FILES.keys():
+		assert not _same_file(os.path.join(cache_dir, rel_path), os.path.join(snapshot.dst_dir, rel_path)), rel_path
+
+def test_unexpected_errors_are_not_hidden(cache_dir, monkeypatch):
+	monkeypatch.setattr(CacheSnapshot, 'Reflink', staticmethod(_unsupported(errno.ENOSPC)))
+	snapshot = CacheSnapshot(cache_dir, cache_dir + '_transient')
+	
+	with pytest.raises(OSError):
+		snapshot.create()
+
+def test_real_snapshot(cache_dir):
+	"""
+	Whatever the filesystem supports, the snapshot has the same contents
+	"""
+	snapshot = CacheSnapshot(cache_dir, cache_dir + '_transient')
+	snapshot.create()
+	
+	assert snapshot.method in (CacheSnapshot.REFLINK, CacheSnapshot.HARDLINK, CacheSnapshot.COPY)
+	assert sum(snapshot.counts.values()) == len(SOURCE_FILES)
+	assert _tree(snapshot.dst_dir) == _expected_tree(cache_dir)
+
+def test_only_the_matching_files_are_detached(cache_dir, monkeypatch):
+	monkeypatch.setattr(CacheSnapshot, 'Reflink', staticmethod(_unsupported(errno.EOPNOTSUPP)))
+	snapshot = CacheSnapshot(cache_dir, cache_dir + '_transient')
+	snapshot.create()
+	detached = ('Ontologies/owlready2_0123.sqlite3', 'Ontologies/metadata_0123.json')
+	
+	num_detached = CacheSnapshot.Detach(snapshot.dst_dir, ['owlready2_0123.sqlite3*', 'metadata_0123.json'])
+	
+	assert num_detached == len(detached)
+	assert _tree(snapshot.dst_dir) == _expected_tree(cache_dir)
+	for rel_path in SOURCE_FILES.keys():
+		assert _same_file(os.path.join(cache_dir, rel_path), os.path.join(snapshot.dst_dir, rel_path)) == (rel_path not in detached), rel_path
+	assert not any(map(lambda name: name.startswith('.detach-'), os.listdir(os.path.join(snapshot.dst_dir, 'Ontologies'))))
+	
+	# Writing in place to the detached copies does not change the source
+	for rel_path in detached:
+		with open(os.path.join(snapshot.dst_dir, rel_path), mode='r+b') as fh:
+			fh.write(b'rewritten')
+	for rel_path, contents in SOURCE_FILES.items():
+		with open(os.path.join(cache_dir, rel_path), mode='rb') as fh:
+			assert fh.read() == contents, rel_path
+	
+	# Once detached, nothing is detached again
+	assert CacheSnapshot.Detach(snapshot.dst_dir, ['owlready2_0123.sqlite3*', 'metadata_0123.json']) == 0
+
+ONTOLOGY_IRI = 'http://example.org/ontology.owl'
+
+def _extension(extension_class, **attrs):
+	extension = extension_class.__new__(extension_class)
+	extension.__dict__.update(attrs)
+	
+	return extension
+
+@pytest.mark.parametrize('extensions, detached', [
+	([], ()),
+	([_extension(CurieSearch)], ('CURIE/CURIE_cache.sqlite3',)),
+	([_extension(IndexedOntologyTerm, ontologies=[ONTOLOGY_IRI])], ('Ontologies/owlready2_0123.sqlite3', 'Ontologies/metadata_0123.json')),
+	([_extension(OntologyTerm, ontologies=[ONTOLOGY_IRI]), _extension(CurieSearch)], ('Ontologies/owlready2_0123.sqlite3', 'Ontologies/metadata_0123.json', 'CURIE/CURIE_cache.sqlite3')),
+], ids=['none', 'curie', 'ontology', 'both'])
+def test_only_the_caches_of_the_warmed_up_extensions_are_detached(cache_dir, monkeypatch, extensions, detached):
+	monkeypatch.setattr(CacheSnapshot, 'Reflink', staticmethod(_unsupported(errno.EOPNOTSUPP)))
+	monkeypatch.setitem(IndexedOntologyTerm.IRI_HASH, ONTOLOGY_IRI, '0123')
+	snapshot = CacheSnapshot(cache_dir, cache_dir + '_transient')
+	snapshot.create()
+	ftv = FAIRTracksValidatorSingleton.__new__(FAIRTracksValidatorSingleton)
+	ftv.logger = logging.getLogger('test')
+	ftv.cacheDir = snapshot.dst_dir
+	
+	ftv._detach_extension_caches(extensions)
+	
+	for rel_path in SOURCE_FILES.keys():
+		assert _same_file(os.path.join(cache_dir, rel_path), os.path.join(snapshot.dst_dir, rel_path)) == (rel_path not in detached), rel_path
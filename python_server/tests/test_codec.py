@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import glob
+import io
+import json
+import math
+import os
+
+import pytest
+
+from conftest import TEST_DATA_DIR
+import libs.codec
+from libs.codec import JSONCodec
+
+BACKENDS = ('orjson', 'json')
+
+CORPUS = sorted(glob.glob(os.path.join(TEST_DATA_DIR, '**', '*.json'), recursive=True))
+
+# Values each backend handles on its own way
+EDGE_CASES = [
+	{'a': float('nan'), 'b': 'é', 'c': [float('inf'), -float('inf'), 1.5]},
+	{'big': 2 ** 70, 'negative': -(2 ** 70), 'text': 'ñandú ☃ \U0001f600'},
+	{1: 'integer key', 'nested': {'x': None, 'y': True, 'z': [{}, []]}},
+	['\x00 \n \t " \\ /', '', 0, -0.0, 0.1, 123456789.125],
+	{'order': 1, 'of': 2, 'the': 3, 'keys': 4},
+]
+
+def _with_backend(monkeypatch, backend, fn, *args, **kwargs):
+	if backend == 'orjson':
+		pytest.importorskip('orjson')
+	
+	with monkeypatch.context() as m:
+		if backend == 'json':
+			m.setattr(libs.codec, 'orjson', None)
+		return fn(*args, **kwargs)
+
+def _by_backend(monkeypatch, fn, *args, **kwargs):
+	return { backend: _with_backend(monkeypatch, backend, fn, *args, **kwargs)  for backend in BACKENDS }
+
+def _same_values(a, b):
+	"""
+	Equality where NaN equals NaN
+	"""
+	return json.dumps(a, sort_keys=True) == json.dumps(b, sort_keys=True)
+
+def test_corpus_is_not_empty():
+	assert len(CORPUS) > 0
+
+@pytest.mark.parametrize('json_path', CORPUS, ids=lambda json_path: os.path.relpath(json_path, TEST_DATA_DIR))
+def test_backends_agree_on_the_corpus(json_path, monkeypatch):
+	with open(json_path, mode='rb') as jh:
+		raw = jh.read()
+	expected = json.loads(raw)
+	
+	loaded = _by_backend(monkeypatch, JSONCodec.loads, raw)
+	assert loaded['orjson'] == loaded['json'] == expected
+	for backend in BACKENDS:
+		assert _with_backend(monkeypatch, backend, JSONCodec.load, io.StringIO(raw.decode('utf-8'))) == expected, backend
+	
+	for indent in (None, True):
+		dumped = _by_backend(monkeypatch, JSONCodec.dumpb, expected, indent=indent)
+		assert dumped['orjson'] == dumped['json'], indent
+		assert json.loads(dumped['json']) == expected
+		assert _by_backend(monkeypatch, JSONCodec.dumps, expected, indent=indent) == { backend: value.decode('utf-8')  for backend, value in dumped.items() }
+
+@pytest.mark.parametrize('obj', EDGE_CASES)
+def test_backends_agree_on_edge_cases(obj, monkeypatch):
+	for indent in (None, True):
+		dumped = _by_backend(monkeypatch, JSONCodec.dumpb, obj, indent=indent)
+		assert dumped['orjson'] == dumped['json'], indent
+		
+		# What is rendered is valid JSON
+		json.loads(dumped['json'], parse_constant=lambda constant: pytest.fail('{} was rendered'.format(constant)))
+		loaded = _by_backend(monkeypatch, JSONCodec.loads, dumped['json'])
+		assert _same_values(loaded['orjson'], loaded['json'])
+
+def test_non_finite_floats_and_non_ascii_characters(monkeypatch):
+	for backend, dumped in _by_backend(monkeypatch, JSONCodec.dumpb, {'a': float('nan'), 'b': 'é'}).items():
+		assert dumped == '{"a":null,"b":"é"}'.encode('utf-8'), backend
+	
+	# Other parameters go through the standard library, which renders the same
+	for backend, dumped in _by_backend(monkeypatch, JSONCodec.dumps, {'b': 'é', 'a': float('inf')}, sort_keys=True).items():
+		assert dumped == '{"a":null,"b":"é"}', backend
+
+def test_lenient_parsing(monkeypatch):
+	# Both backends accept what the standard library accepts
+	for backend, loaded in _by_backend(monkeypatch, JSONCodec.loads, b'{"a": NaN, "b": -Infinity, "c": 123456789012345678901234567890}').items():
+		assert math.isnan(loaded['a']), backend
+		assert loaded['b'] == -float('inf'), backend
+		assert loaded['c'] == 123456789012345678901234567890, backend
+	
+	# Integers beyond 64 bits are not parsed as floats
+	for big in (2 ** 64, -(2 ** 63) - 1, 10 ** 30):
+		for backend, loaded in _by_backend(monkeypatch, JSONCodec.loads, '[{}, 1.5]'.format(big)).items():
+			assert loaded == [big, 1.5], backend
+			assert isinstance(loaded[0], int), backend
+	
+	for backend, loaded in _by_backend(monkeypatch, JSONCodec.loads, memoryview(b'["\\ud800"]')).items():
+		assert loaded == ['\ud800'], backend
+	
+	for backend in BACKENDS:
+		with pytest.raises(json.JSONDecodeError):
+			_with_backend(monkeypatch, backend, JSONCodec.loads, b'{"a": ')
+
+def test_request_bodies_are_parsed_through_the_codec(monkeypatch):
+	from flask import Flask, request
+	from libs.app import CodecJSONProvider
+	from libs.upload_spool import SpoolingRequest
+	
+	parsed = []
+	monkeypatch.setattr(JSONCodec, 'loads', classmethod(lambda cls, data: parsed.append(data) or ['parsed']))
+	app = Flask('codec_test')
+	app.request_class = SpoolingRequest
+	if CodecJSONProvider is not None:
+		app.json = CodecJSONProvider(app)
+	app.add_url_rule('/', 'echo', lambda: {'body': request.get_json()}, methods=['POST'])
+	
+	r = app.test_client().post('/', data=b'[1]', content_type='application/json')
+	assert json.loads(r.get_data()) == {'body': ['parsed']}
+	assert len(parsed) == 1
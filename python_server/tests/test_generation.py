@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from RWFileLock import RWFileLock
+
+from conftest import can_lock_exclusively
+from libs.ft_validator import FAIRTracksValidatorSingleton
+from libs.generation import CacheGeneration
+from libs.metrics import Metrics
+
+RESULTS = [{'file': 'doc.json', 'validated': True, 'errors': []}]
+
+@pytest.fixture
+def generation_path(tmp_path):
+	return str(tmp_path / 'cache.generation')
+
+def _crashed_writer(generation_path):
+	"""
+	A process which dies in the middle of a write
+	"""
+	pid = os.fork()
+	if pid == 0:
+		try:
+			with CacheGeneration(generation_path).write():
+				os._exit(0)
+		finally:
+			os._exit(1)
+	
+	_, status = os.waitpid(pid, 0)
+	assert os.WIFEXITED(status) and (os.WEXITSTATUS(status) == 0)
+
+def test_writes_bump_the_sequence_and_the_epoch(generation_path):
+	generation = CacheGeneration(generation_path)
+	assert (generation.sequence, generation.epoch) == (0, 0)
+	assert os.path.getsize(generation_path) == CacheGeneration.Layout.size
+	
+	with generation.write():
+		# Odd while writing, for every process sharing the file
+		assert generation.sequence == 1
+		assert CacheGeneration(generation_path).sequence == 1
+		assert generation.epoch == 0
+	
+	assert (generation.sequence, generation.epoch) == (2, 1)
+	assert (CacheGeneration(generation_path).sequence, CacheGeneration(generation_path).epoch) == (2, 1)
+
+def test_reads_racing_a_write_are_retried(generation_path):
+	reader = CacheGeneration(generation_path)
+	writer = CacheGeneration(generation_path)
+	
+	seq = reader.read_begin()
+	assert not reader.read_retry(seq)
+	with writer.write():
+		pass
+	assert reader.read_retry(seq)
+	
+	seq = reader.read_begin()
+	assert not reader.read_retry(seq)
+
+def test_reads_wait_for_the_write(generation_path):
+	reader = CacheGeneration(generation_path)
+	writer = CacheGeneration(generation_path)
+	writing = threading.Event()
+	
+	def _slow_write():
+		with writer.write():
+			writing.set()
+			time.sleep(0.3)
+	
+	write_thread = threading.Thread(target=_slow_write)
+	write_thread.start()
+	try:
+		writing.wait()
+		assert reader.read_begin(timeout=0) is None
+		start = time.monotonic()
+		seq = reader.read_begin(timeout=5)
+		assert time.monotonic() - start < 5
+	finally:
+		write_thread.join()
+	
+	assert seq == 2
+	assert not reader.read_retry(seq)
+
+def test_crashed_writers_are_recovered(generation_path):
+	_crashed_writer(generation_path)
+	generation = CacheGeneration(generation_path)
+	assert generation.sequence == 1
+	assert generation.read_begin(timeout=0.1) is None
+	
+	generation.recover()
+	assert generation.sequence == 2
+	assert generation.read_begin(timeout=0) == 2
+	# Nothing to recover
+	generation.recover()
+	assert generation.sequence == 2
+	
+	# Writers also deal with the crashed ones
+	_crashed_writer(generation_path)
+	with generation.write():
+		assert generation.sequence == 5
+	assert generation.sequence == 6
+
+def _validator(tmp_path, validate):
+	"""
+	A validator whose validations are done by the validate function
+	"""
+	ftv = FAIRTracksValidatorSingleton.__new__(FAIRTracksValidatorSingleton)
+	ftv.offline = False
+	ftv.rebuild_wait = 0.2
+	ftv.metrics = Metrics()
+	ftv.generation = CacheGeneration(str(tmp_path / 'cache.generation'))
+	ftv.SchemaCacheLock = RWFileLock(filename=str(tmp_path / 'schema_cache.lock'))
+	ftv.ExtensionsCacheLock = RWFileLock(filename=str(tmp_path / 'extensions.lock'))
+	ftv._validate = validate
+	
+	return ftv
+
+def test_validation_is_repeated_after_a_racing_write(tmp_path):
+	writer = CacheGeneration(str(tmp_path / 'cache.generation'))
+	calls = []
+	
+	def _validate(*json_data):
+		calls.append(json_data)
+		if len(calls) == 1:
+			with writer.write():
+				pass
+		return RESULTS
+	
+	ftv = _validator(tmp_path, _validate)
+	
+	assert ftv.validate('doc.json') == RESULTS
+	assert calls == [('doc.json',), ('doc.json',)]
+
+def test_validation_falls_back_to_the_locks(tmp_path):
+	writer = CacheGeneration(str(tmp_path / 'cache.generation'))
+	locked = []
+	
+	def _validate(*json_data):
+		locked.append(not can_lock_exclusively(str(tmp_path / 'schema_cache.lock')) and not can_lock_exclusively(str(tmp_path / 'extensions.lock')))
+		# A rebuild finishes on each attempt
+		with writer.write():
+			pass
+		return RESULTS
+	
+	ftv = _validator(tmp_path, _validate)
+	
+	assert ftv.validate('doc.json') == RESULTS
+	# Only the last attempt held the shared locks
+	assert locked == [False] * FAIRTracksValidatorSingleton.MAX_VALIDATION_RETRIES + [True]
+
+def test_validation_recovers_crashed_writers(tmp_path):
+	_crashed_writer(str(tmp_path / 'cache.generation'))
+	ftv = _validator(tmp_path, lambda *json_data: RESULTS)
+	
+	assert ftv.validate('doc.json') == RESULTS
+	assert ftv.generation.sequence == 2
+	assert ftv.generation.read_begin(timeout=0) == 2
+
+def test_validation_is_unavailable_while_rebuilding(tmp_path):
+	_crashed_writer(str(tmp_path / 'cache.generation'))
+	ftv = _validator(tmp_path, lambda *json_data: RESULTS)
+	
+	# Another process is rebuilding the cache
+	holder = subprocess.Popen([
+		sys.executable,
+		'-c',
+		'import fcntl, os, sys, time; fcntl.lockf(os.open(sys.argv[1], os.O_RDWR | os.O_CREAT), fcntl.LOCK_EX); print("locked", flush=True); time.sleep(60)',
+		str(tmp_path / 'schema_cache.lock')
+	], stdout=subprocess.PIPE)
+	try:
+		assert holder.stdout.readline() == b'locked\n'
+		assert ftv.validate('doc.json') == FAIRTracksValidatorSingleton.BEING_UPDATED_RESPONSE
+	finally:
+		holder.kill()
+		holder.wait()
+	
+	# The writer has not been recovered while the locks were not held
+	assert ftv.generation.sequence == 1
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import json
+import os
+import threading
+import time
+
+import pytest
+from jsonschema.exceptions import ValidationError
+
+from libs.ft_validator import FAIRTracksValidatorSingleton, IncompleteCacheError
+from libs.generation import CacheGeneration
+from libs.hot_reload import HotReloader, PinnedAttribute
+from libs.metrics import Metrics
+
+from conftest import INVALIDATION_KEY, TEST_DATA_DIR, can_lock_exclusively, dataset_schemas, make_app, wait_for_reload
+
+UNIQUE_SCHEMA = os.path.join(TEST_DATA_DIR, 'unique_simple', 'unique_schema.json')
+
+def _change_schema(local_config):
+	schema_path = local_config['schemas'][0][len('file://'):]
+	with open(schema_path, mode='r', encoding='utf-8') as sh:
+		jss = json.load(sh)
+	jss['description'] = 'changed'
+	with open(schema_path, mode='w', encoding='utf-8') as sh:
+		json.dump(jss, sh)
+	
+	return jss
+
+def _rebuild_and_reload(client, ftv, local_config):
+	jss = _change_schema(local_config)
+	loaded_epoch = ftv.hot_reloader.loaded_epoch
+	r = client.delete('/schemas/invalidate', json={'invalidation_key': INVALIDATION_KEY})
+	assert r.status_code == 201
+	wait_for_reload(client, ftv, loaded_epoch)
+	
+	return jss
+
+def _reload_scenario(local_config):
+	client, ftv = make_app(local_config)
+	prev_fgv = ftv.fgv
+	prev_schemas = client.get('/schemas').get_json()
+	
+	jss = _rebuild_and_reload(client, ftv, local_config)
+	
+	r = client.post('/validate', json={'@schema': jss['$id']})
+	return {
+		'fgv_changed': ftv.fgv is not prev_fgv,
+		'prev_schemas': prev_schemas,
+		'schemas': client.get('/schemas').get_json(),
+		'validate_status': r.status_code,
+	}
+
+def test_hot_reload_adopts_rebuilt_schemas(make_config, run_isolated):
+	result = run_isolated(_reload_scenario, make_config([UNIQUE_SCHEMA]))
+	
+	assert result['fgv_changed']
+	assert len(result['schemas']) == 1
+	assert result['schemas'][0]['schema_hash'] != result['prev_schemas'][0]['schema_hash']
+	assert result['validate_status'] == 200
+
+def _locks_scenario(local_config):
+	client, ftv = make_app(local_config)
+	_rebuild_and_reload(client, ftv, local_config)
+	
+	# Whether another process, as the next rebuild does, could lock
+	# the files of the current cache directory while the server holds
+	# its locks, and after it releases them
+	excluded = {}
+	for lock, lock_file in ((ftv.SchemaCacheLock, 'schema_cache.lock'), (ftv.ExtensionsCacheLock, 'extensions_cache.lock')):
+		lock_path = os.path.join(ftv.cacheDir, lock_file)
+		with lock.shared_lock():
+			while_held = can_lock_exclusively(lock_path)
+		excluded[lock_file] = (while_held, can_lock_exclusively(lock_path))
+	
+	return excluded
+
+def test_locks_follow_the_replaced_cache_dir(make_config, run_isolated):
+	excluded = run_isolated(_locks_scenario, make_config([UNIQUE_SCHEMA]))
+	
+	assert excluded == {
+		'schema_cache.lock': (False, True),
+		'extensions_cache.lock': (False, True),
+	}
+
+def _cache_listing(cache_dir):
+	listing = {}
+	for dirpath, dirnames, filenames in os.walk(cache_dir):
+		for filename in filenames:
+			full_path = os.path.join(dirpath, filename)
+			st = os.stat(full_path)
+			listing[os.path.relpath(full_path, cache_dir)] = (st.st_size, st.st_mtime_ns)
+	
+	return listing
+
+def test_load_state_neither_fetches_nor_writes(make_config):
+	local_config = make_config([UNIQUE_SCHEMA], schema_fetch={'revalidate': True})
+	client, ftv = make_app(local_config)
+	listing = _cache_listing(ftv.cacheDir)
+	# Any fetch would fail now
+	os.unlink(local_config['schemas'][0][len('file://'):])
+	
+	state, epoch = ftv.load_state()
+	
+	assert _cache_listing(ftv.cacheDir) == listing
+	assert not state.fgv.isRW
+	assert [ schema_info['schema_hash']  for schema_info in state.manifest['schemas'] ] == [ schema_info['schema_hash']  for schema_info in ftv.manifest['schemas'] ]
+	assert all(map(lambda schema_info: len(schema_info.get('errors',[])) == 0, state.manifest['schemas']))
+
+def test_load_state_keeps_failed_fetches(make_config):
+	local_config = make_config([UNIQUE_SCHEMA])
+	local_config['schemas'].append('file:///nonexistent/schema.json')
+	client, ftv = make_app(local_config)
+	
+	state, epoch = ftv.load_state()
+	
+	failed = [ schema_info  for schema_info in state.manifest['schemas']  if schema_info['source_urls'] == ['file:///nonexistent/schema.json'] ]
+	assert len(failed) == 1
+	assert len(failed[0]['errors']) > 0
+
+def test_load_state_fails_on_missing_schemas(make_config):
+	local_config = make_config([UNIQUE_SCHEMA])
+	client, ftv = make_app(local_config)
+	ftv.schema_store.remove(ftv.manifest['schemas'][0]['schema_hash'])
+	
+	with pytest.raises(IncompleteCacheError):
+		ftv.load_state()
+
+def test_load_state_fails_on_missing_ontologies(make_config):
+	# The server does not materialize the ontologies, which is done
+	# by the rebuilds, so they are missing
+	local_config = make_config(dataset_schemas('fairtracks_simple'))
+	client, ftv = make_app(local_config)
+	
+	with pytest.raises(ValidationError):
+		ftv.load_state()
+
+class _State(object):
+	"""
+	A loaded schema set, whose attributes tell which one it is
+	"""
+	def __init__(self, label):
+		for attr_name in FAIRTracksValidatorSingleton.ReloadedAttributes:
+			setattr(self, attr_name, '{} {}'.format(label, attr_name))
+
+def _reloading_validator(tmp_path):
+	"""
+	A validator which loads the new schema set each time the cache
+	generation changes
+	"""
+	ftv = FAIRTracksValidatorSingleton.__new__(FAIRTracksValidatorSingleton)
+	ftv.metrics = Metrics()
+	ftv.generation = CacheGeneration(str(tmp_path / 'cache.generation'))
+	ftv.validation_cache = None
+	ftv.parallel_validation = None
+	ftv.validation_jobs = None
+	ftv._init_locks = lambda: None
+	ftv.adopt_state(_State('old'))
+	ftv.load_state = lambda: (_State('new'), ftv.generation.epoch)
+	
+	return ftv
+
+def test_requests_in_flight_keep_their_schema_set(tmp_path):
+	ftv = _reloading_validator(tmp_path)
+	reloader = HotReloader(ftv)
+	pinned = threading.Event()
+	reloaded = threading.Event()
+	seen = []
+	
+	def _long_request():
+		reloader.begin_request()
+		try:
+			pinned.set()
+			reloaded.wait(timeout=30)
+			seen.append(ftv.fgv)
+		finally:
+			reloader.end_request()
+		seen.append(ftv.fgv)
+	
+	request_thread = threading.Thread(target=_long_request)
+	request_thread.start()
+	try:
+		assert pinned.wait(timeout=30)
+		with CacheGeneration(str(tmp_path / 'cache.generation')).write():
+			pass
+		
+		# The reload does not wait for the request in flight
+		reloader.check()
+		deadline = time.monotonic() + 30
+		while (reloader.loaded_epoch != ftv.generation.epoch) and (time.monotonic() < deadline):
+			time.sleep(0.01)
+		assert reloader.loaded_epoch == ftv.generation.epoch
+		
+		reloader.begin_request()
+		try:
+			assert [ getattr(ftv, attr_name)  for attr_name in ftv.ReloadedAttributes ] == list(vars(_State('new')).values())
+		finally:
+			reloader.end_request()
+	finally:
+		reloaded.set()
+		request_thread.join()
+	
+	assert seen == ['old fgv', 'new fgv']
+
+def test_forked_processes_are_not_pinned(tmp_path):
+	ftv = _reloading_validator(tmp_path)
+	
+	PinnedAttribute.Pin(ftv, ftv.ReloadedAttributes)
+	try:
+		ftv.adopt_state(_State('new'))
+		assert ftv.fgv == 'old fgv'
+		
+		pid = os.fork()
+		if pid == 0:
+			try:
+				os._exit(0  if ftv.fgv == 'new fgv'  else 1)
+			finally:
+				os._exit(2)
+		_, status = os.waitpid(pid, 0)
+	finally:
+		PinnedAttribute.Unpin()
+	
+	assert os.WIFEXITED(status) and (os.WEXITSTATUS(status) == 0)
+	assert ftv.fgv == 'new fgv'
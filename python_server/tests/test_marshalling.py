@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import datetime
+
+import pytest
+from flask_restx import Model, fields, marshal
+
+from libs.res import ftv_models
+from libs.res.marshalling import FastMarshaller
+
+MODELS = sorted(( (name, model)  for name, model in vars(ftv_models).items()  if isinstance(model, Model) ), key=lambda item: item[0])
+
+WILDCARD_SAMPLE = {
+	'reason': 'schema_error',
+	'path': '/name',
+	'line': 3,
+	'nested': {'a': [1, 2]},
+	'empty': {},
+}
+
+def _sample_value(field):
+	field = field()  if isinstance(field, type)  else field
+	if isinstance(field, fields.Nested):
+		return _sample_object(field.nested)
+	elif isinstance(field, fields.List):
+		return [ _sample_value(field.container), _sample_value(field.container) ]
+	elif isinstance(field, fields.DateTime):
+		return datetime.datetime(2026, 10, 18, 12, 30)
+	elif isinstance(field, fields.Boolean):
+		return True
+	elif isinstance(field, fields.Integer):
+		return 42
+	elif isinstance(field, fields.Float):
+		return 0.5
+	elif isinstance(field, fields.String):
+		return 'value'
+	
+	return {'raw': [1, 'two']}
+
+def _sample_object(model):
+	resolved = getattr(model, 'resolved', model)
+	if any(map(lambda field: isinstance(field, fields.Wildcard), resolved.values())):
+		return dict(WILDCARD_SAMPLE)
+	
+	return { key: _sample_value(field)  for key, field in resolved.items() }
+
+def _samples(model):
+	"""
+	Complete objects, objects with all their members missing or null,
+	and mixes of them
+	"""
+	full = _sample_object(model)
+	keys = list(full.keys())
+	samples = [
+		full,
+		{ key: None  for key in keys },
+		{ key: value  for i_key, (key, value) in enumerate(full.items())  if i_key % 2 == 0 },
+		{ key: (value  if i_key % 2 == 1  else None)  for i_key, (key, value) in enumerate(full.items()) },
+	]
+	samples.append({})
+	
+	return samples
+
+@pytest.mark.parametrize('skip_none', [False, True])
+@pytest.mark.parametrize('name, model', MODELS, ids=[ name  for name, _ in MODELS ])
+def test_fast_marshaller_matches_flask_restx(name, model, skip_none):
+	marshaller = FastMarshaller(model, skip_none)
+	samples = _samples(model)
+	
+	for sample in samples:
+		marshalled = marshaller(sample)
+		assert marshalled == marshal(sample, model, skip_none=skip_none)
+		# Even the order of the members is the same
+		assert list(marshalled.keys()) == list(marshal(sample, model, skip_none=skip_none).keys())
+	assert marshaller(samples) == marshal(samples, model, skip_none=skip_none)
+
+def test_wildcards_stop_at_the_first_null_member():
+	error = {'reason': 'schema_error', 'path': None, 'description': 'Message', 'extra': {}}
+	
+	# Walked from the last member
+	assert FastMarshaller(ftv_models.schema_error_model)(error) == {'extra': {}, 'description': 'Message'}
+	assert FastMarshaller(ftv_models.schema_error_model, skip_none=True)(error) == {'description': 'Message'}
+	# A null last member is kept, and it does not stop the walk
+	last_null = {'reason': 'schema_error', 'path': None}
+	assert FastMarshaller(ftv_models.schema_error_model)(last_null) == {'path': None, 'reason': 'schema_error'} == marshal(last_null, ftv_models.schema_error_model)
+	assert FastMarshaller(ftv_models.schema_source_model)({}) == {'*': None}
+	assert FastMarshaller(ftv_models.schema_source_model, skip_none=True)({}) == {}
+	
+	# The nested errors follow the same rules
+	result = {'file': 'doc.json', 'validated': False, 'errors': [error]}
+	assert FastMarshaller(ftv_models.validation_model, skip_none=True)(result) == marshal(result, ftv_models.validation_model, skip_none=True)
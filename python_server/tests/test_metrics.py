@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+
+from libs.metrics import Metrics
+from libs.prefork import PreforkWSGIServer
+
+from test_prefork import _free_port, _wait_for_server
+
+def _dead_pid():
+	proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+	proc.wait()
+	
+	return proc.pid
+
+def _write_values(metrics_dir, pid, counters=[], histograms=[]):
+	with open(os.path.join(metrics_dir, '{}.json'.format(pid)), mode='w', encoding='utf-8') as mh:
+		json.dump({'counters': counters, 'histograms': histograms}, mh)
+
+def _counter(counters, name, **labels):
+	return counters.get((name, tuple(sorted(labels.items()))), 0)
+
+def _child_inc(metrics, amount):
+	"""
+	A process which reports its own values, and then dies
+	"""
+	pid = os.fork()
+	if pid == 0:
+		try:
+			metrics.inc('ftv_documents_total', amount, outcome='validated')
+			metrics.flush(force=True)
+		finally:
+			os._exit(0)
+	
+	os.waitpid(pid, 0)
+
+def test_disabled_metrics_record_nothing(tmp_path):
+	metrics = Metrics.FromConfig({}, str(tmp_path / 'metrics'))
+	
+	assert not metrics.enabled
+	metrics.inc('ftv_documents_total', outcome='validated')
+	metrics.observe('ftv_lock_wait_seconds', 0.1, lock='cache')
+	with metrics.phase('validate'):
+		pass
+	metrics.flush(force=True)
+	assert not os.path.exists(str(tmp_path / 'metrics'))
+
+def test_values_from_all_the_processes_are_summed(tmp_path):
+	metrics_dir = str(tmp_path)
+	metrics = Metrics(metrics_dir)
+	metrics.inc('ftv_documents_total', 2, outcome='validated')
+	metrics.observe('ftv_lock_wait_seconds', 0.003, lock='cache')
+	
+	# A living process (the parent one) and a dead one
+	buckets = [0] * (len(Metrics.DurationBuckets) + 1)
+	buckets[-1] = 1
+	_write_values(metrics_dir, os.getppid(), counters=[['ftv_documents_total', [['outcome', 'validated']], 3]], histograms=[['ftv_lock_wait_seconds', [['lock', 'cache']], buckets, 500.0, 1]])
+	dead_pid = _dead_pid()
+	_write_values(metrics_dir, dead_pid, counters=[['ftv_documents_total', [['outcome', 'validated']], 5], ['ftv_documents_total', [['outcome', 'failed']], 1]])
+	
+	counters, histograms = metrics.collect()
+	
+	assert _counter(counters, 'ftv_documents_total', outcome='validated') == 10
+	assert _counter(counters, 'ftv_documents_total', outcome='failed') == 1
+	histogram_buckets, histogram_sum, histogram_count = histograms[('ftv_lock_wait_seconds', (('lock', 'cache'),))]
+	assert histogram_count == 2
+	assert histogram_sum == pytest.approx(500.003)
+	assert histogram_buckets[Metrics.DurationBuckets.index(0.005)] == 1
+	assert histogram_buckets[-1] == 1
+	
+	rendered = metrics.render()
+	assert 'ftv_documents_total{outcome="validated"} 10\n' in rendered
+	assert 'ftv_lock_wait_seconds_bucket{lock="cache",le="+Inf"} 2\n' in rendered
+	assert 'ftv_lock_wait_seconds_count{lock="cache"} 2\n' in rendered
+
+def test_dead_processes_are_archived(tmp_path):
+	metrics_dir = str(tmp_path)
+	metrics = Metrics(metrics_dir)
+	dead_pid = _dead_pid()
+	_write_values(metrics_dir, dead_pid, counters=[['ftv_documents_total', [['outcome', 'validated']], 5]])
+	_write_values(metrics_dir, os.getppid(), counters=[['ftv_documents_total', [['outcome', 'validated']], 3]])
+	
+	counters, _ = metrics.collect()
+	
+	assert _counter(counters, 'ftv_documents_total', outcome='validated') == 8
+	assert sorted(os.listdir(metrics_dir)) == sorted([Metrics.ArchiveFile, Metrics.LockFile, '{}.json'.format(os.getpid()), '{}.json'.format(os.getppid())])
+	with open(os.path.join(metrics_dir, Metrics.ArchiveFile), mode='r', encoding='utf-8') as ah:
+		assert json.load(ah) == {'counters': [['ftv_documents_total', [['outcome', 'validated']], 5]], 'histograms': []}
+	
+	# Nothing is archived twice
+	_write_values(metrics_dir, _dead_pid(), counters=[['ftv_documents_total', [['outcome', 'validated']], 1]])
+	counters, _ = metrics.collect()
+	assert _counter(counters, 'ftv_documents_total', outcome='validated') == 9
+	counters, _ = metrics.collect()
+	assert _counter(counters, 'ftv_documents_total', outcome='validated') == 9
+
+def test_counters_never_go_backwards(tmp_path):
+	metrics = Metrics(str(tmp_path))
+	metrics.inc('ftv_documents_total', 1, outcome='validated')
+	
+	seen = []
+	for amount in range(1, 6):
+		# Forked processes do not report what they inherited
+		_child_inc(metrics, amount)
+		counters, _ = metrics.collect()
+		seen.append(_counter(counters, 'ftv_documents_total', outcome='validated'))
+	
+	assert seen == sorted(seen)
+	assert seen[-1] == 1 + sum(range(1, 6))
+	# Only the own file and the archive remain
+	assert sorted(os.listdir(str(tmp_path))) == sorted([Metrics.ArchiveFile, Metrics.LockFile, '{}.json'.format(os.getpid())])
+
+def _counting_server(metrics_dir, port):
+	# Only the explicit flushes save the values
+	metrics = Metrics(metrics_dir, flush_interval=3600)
+	
+	def _app(environ, start_response):
+		metrics.inc('ftv_documents_total', outcome='validated')
+		start_response('200 OK', [('Content-Type', 'text/plain'), ('X-Worker-Pid', str(os.getpid()))])
+		return [b'counted']
+	
+	PreforkWSGIServer(_app, '127.0.0.1', port, 2, metrics=metrics).run()
+
+def test_prefork_workers_flush_on_exit(tmp_path):
+	metrics_dir = str(tmp_path)
+	port = _free_port()
+	num_requests = 20
+	
+	master = multiprocessing.get_context('fork').Process(target=_counting_server, args=(metrics_dir, port))
+	master.start()
+	try:
+		_wait_for_server(port)
+		for _ in range(num_requests):
+			conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+			try:
+				conn.request('GET', '/')
+				assert conn.getresponse().read() == b'counted'
+			finally:
+				conn.close()
+	finally:
+		os.kill(master.pid, signal.SIGTERM)
+		master.join(timeout=30)
+	
+	assert master.exitcode == 0
+	counters, _ = Metrics(metrics_dir).collect()
+	assert _counter(counters, 'ftv_documents_total', outcome='validated') == num_requests
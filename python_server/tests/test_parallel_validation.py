@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import copy
+
+import pytest
+
+from libs.parallel_validation import ParallelValidation
+
+from conftest import dataset_documents, dataset_names, dataset_schemas, make_app
+
+def _batch(name, kinds=('good_validation', 'bad_validation'), repetitions=1):
+	"""
+	The documents of a dataset, the way the server feeds them
+	to the validator
+	"""
+	batch = []
+	for i_rep in range(repetitions):
+		for kind in kinds:
+			for basename, document in dataset_documents(name, kind):
+				batch.append({'file': '{}/{}/{}'.format(i_rep, kind, basename), 'json': copy.deepcopy(document), 'errors': []})
+	
+	return batch
+
+def _summary(report):
+	return [ (jsonObj['file'], jsonObj.get('schema_id'), jsonObj.get('schema_hash'), jsonObj['errors'])  for jsonObj in report ]
+
+@pytest.mark.parametrize('name', dataset_names(offline=True))
+def test_parallel_report_matches_serial(name, make_config):
+	client, ftv = make_app(make_config(dataset_schemas(name)))
+	parallel_validation = ParallelValidation(2, min_documents=1, chunks_per_process=2)
+	parallel_validation.reset(ftv.fgv)
+	try:
+		# Batches with duplicated keys are validated serially again
+		for batch in (_batch(name, kinds=('good_validation',)), _batch(name, kinds=('good_validation',), repetitions=3), _batch(name), list(reversed(_batch(name)))):
+			expected = _summary(ftv.fgv.jsonValidate(*copy.deepcopy(batch)))
+			assert _summary(parallel_validation.jsonValidate(*batch)) == expected
+		
+		assert parallel_validation._pool is not None
+	finally:
+		parallel_validation.close()
+
+def _validate_scenario(client, ftv, documents):
+	r = client.post('/validate/array', json=documents)
+	assert r.status_code == 200
+	
+	pool_started = (ftv.parallel_validation is not None) and (ftv.parallel_validation._pool is not None)
+	return r.get_json(), pool_started
+
+def test_server_validates_on_the_pool(make_config, run_server):
+	local_config = make_config(dataset_schemas('foreign_key_example'))
+	documents = [ document  for _, document in dataset_documents('foreign_key_example', 'good_validation') ] + [ {'@schema': 'foreign_key_example/1.0', 'unexpected': True} ]
+	
+	expected, pool_started = run_server(local_config, _validate_scenario, documents)
+	assert not pool_started
+	
+	results, pool_started = run_server(dict(local_config, parallel_validation={'processes': 2, 'min-documents': 1}), _validate_scenario, documents)
+	assert pool_started
+	assert results == expected
+
+def test_parallel_validation_is_disabled_by_default(make_config):
+	assert ParallelValidation.FromConfig(make_config(dataset_schemas('unique_simple'))) is None
+
+class _SerialSchemaSet(object):
+	"""
+	A schema set which records the documents it validates
+	"""
+	def __init__(self):
+		self.config = {}
+		self.validated = []
+	
+	def jsonValidate(self, *cached_jsons):
+		self.validated.append([ cached_json['file']  for cached_json in cached_jsons ])
+		return list(cached_jsons)
+
+class _ReplacingPool(object):
+	"""
+	A pool whose workers restored the schema set of a hot reload
+	"""
+	def __init__(self, parallel_validation, fgv):
+		self.parallel_validation = parallel_validation
+		self.fgv = fgv
+	
+	def map(self, func, chunks):
+		self.parallel_validation.fgv = self.fgv
+		return [ ([], [])  for _ in chunks ]
+
+def _pooled(fgv):
+	parallel_validation = ParallelValidation(2, min_documents=1)
+	parallel_validation.fgv = fgv
+	parallel_validation._worker_args = (type(fgv), fgv.config, None)
+	
+	return parallel_validation
+
+def _documents():
+	return [ {'file': 'doc{}.json'.format(i_doc), 'json': {'i': i_doc}, 'errors': []}  for i_doc in range(4) ]
+
+def test_other_schema_sets_are_validated_serially():
+	pinned = _SerialSchemaSet()
+	parallel_validation = _pooled(_SerialSchemaSet())
+	
+	report = parallel_validation.jsonValidate(*_documents(), fgv=pinned)
+	
+	assert [ jsonObj['file']  for jsonObj in report ] == [ 'doc{}.json'.format(i_doc)  for i_doc in range(4) ]
+	assert pinned.validated == [[ jsonObj['file']  for jsonObj in report ]]
+	assert parallel_validation._pool is None
+
+def test_results_from_a_replaced_schema_set_are_discarded(monkeypatch):
+	pinned = _SerialSchemaSet()
+	parallel_validation = _pooled(pinned)
+	monkeypatch.setattr(parallel_validation, '_get_pool', lambda: _ReplacingPool(parallel_validation, _SerialSchemaSet()))
+	
+	report = parallel_validation.jsonValidate(*_documents(), fgv=pinned)
+	
+	assert len(report) == 4
+	assert all(map(lambda jsonObj: jsonObj['errors'] == [], report))
+	assert len(pinned.validated) == 1
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import concurrent.futures
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from libs.prefork import PreforkWSGIServer, freeze_shared_state
+
+from conftest import TEST_DATA_DIR, dataset_documents, dataset_schemas, init_extensions_cache, make_app
+
+NUM_WORKERS = 3
+NUM_REQUESTS = 300
+CONCURRENCY = 24
+
+def _free_port():
+	with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+		sock.bind(('127.0.0.1', 0))
+		return sock.getsockname()[1]
+
+def _serve(extensions_cache_path, local_config, port):
+	init_extensions_cache(extensions_cache_path)
+	client, ftv = make_app(local_config)
+	app = client.application
+	
+	# Telling which worker attended each request
+	def _tagged_app(environ, start_response):
+		def _start_response(status, headers, *args):
+			return start_response(status, headers + [('X-Worker-Pid', str(os.getpid()))], *args)
+		
+		return app(environ, _start_response)
+	
+	freeze_shared_state(ftv)
+	PreforkWSGIServer(_tagged_app, '127.0.0.1', port, NUM_WORKERS).run()
+
+def _post(port, path, body):
+	conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+	try:
+		conn.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+		response = conn.getresponse()
+		return response.status, response.getheader('X-Worker-Pid'), json.loads(response.read())
+	finally:
+		conn.close()
+
+def _wait_for_server(port, timeout=120):
+	deadline = time.monotonic() + timeout
+	while True:
+		try:
+			with socket.create_connection(('127.0.0.1', port), timeout=1):
+				return
+		except OSError:
+			assert time.monotonic() < deadline, "The server did not start within {} seconds".format(timeout)
+			time.sleep(0.2)
+
+def test_workers_share_the_load(make_config, extensions_cache):
+	local_config = make_config(dataset_schemas('unique_simple'))
+	body = json.dumps([ document  for _, document in dataset_documents('unique_simple', 'bad_validation') ])
+	port = _free_port()
+	
+	master = multiprocessing.get_context('spawn').Process(target=_serve, args=(extensions_cache, local_config, port))
+	master.start()
+	try:
+		_wait_for_server(port)
+		with concurrent.futures.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+			answers = list(executor.map(lambda _: _post(port, '/validate/array', body), range(NUM_REQUESTS)))
+	finally:
+		os.kill(master.pid, signal.SIGTERM)
+		master.join(timeout=30)
+	
+	assert master.exitcode == 0
+	statuses = [ status  for status, _, _ in answers ]
+	assert statuses == [200] * NUM_REQUESTS
+	# Every worker answered the same
+	assert all(map(lambda answer: answer[2] == answers[0][2], answers))
+	assert any(map(lambda result: not result['validated'], answers[0][2]))
+	assert len(set(map(lambda answer: answer[1], answers))) == NUM_WORKERS
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import logging
+import os
+
+import pytest
+import yaml
+
+from libs.profiling import RequestProfiler
+
+from conftest import SERVER_DIR
+
+TEMPLATE_PATH = os.path.join(SERVER_DIR, 'fairtracks_validator.fcgi.py.yaml.template')
+
+def _profiler(tmp_path, **profiling_config):
+	return RequestProfiler.FromConfig({'profiling': dict(enabled=True, **profiling_config)}, str(tmp_path))
+
+@pytest.mark.parametrize('header_key', ['', '   ', RequestProfiler.TemplateHeaderKey])
+def test_well_known_header_keys_are_refused(header_key, tmp_path, caplog):
+	with caplog.at_level(logging.ERROR, logger='RequestProfiler'):
+		profiler = _profiler(tmp_path, **{'header-key': header_key})
+	
+	assert profiler.header_key is None
+	assert profiler.begin(header_value=header_key) is None
+	assert any(map(lambda record: RequestProfiler.PROFILE_HEADER in record.getMessage(), caplog.records))
+
+def test_secret_header_key_profiles(tmp_path):
+	profiler = _profiler(tmp_path, **{'header-key': 's3cr3t-pr0f1l1ng'})
+	
+	assert profiler.begin(header_value='another') is None
+	assert profiler.begin(header_value='s3cr3t-pr0f1l1ng') is not None
+
+def test_template_does_not_enable_header_profiling(tmp_path):
+	with open(TEMPLATE_PATH, mode='r', encoding='utf-8') as th:
+		local_config = yaml.safe_load(th)
+	local_config['profiling']['enabled'] = True
+	
+	profiler = RequestProfiler.FromConfig(local_config, str(tmp_path))
+	
+	assert profiler.header_key is None
+	assert profiler.begin(header_value='') is None
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import hashlib
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import dataset_names, dataset_schemas
+from libs.ft_validator import FAIRTracksValidatorSingleton
+from libs.metrics import Metrics
+from libs.schema_store import SchemaStore
+
+class _RoutedHTTPHandler(http.server.BaseHTTPRequestHandler):
+	"""
+	It answers through the route of the server matching the path,
+	recording the path and the headers of each request
+	"""
+	protocol_version = 'HTTP/1.1'
+	
+	def do_GET(self):
+		server = self.server
+		host = self.headers.get('Host')
+		with server.lock:
+			server.requests.append((self.path, self.headers))
+			server.in_flight[host] = server.in_flight.get(host, 0) + 1
+			server.max_in_flight[host] = max(server.max_in_flight.get(host, 0), server.in_flight[host])
+			server.max_total_in_flight = max(server.max_total_in_flight, sum(server.in_flight.values()))
+		try:
+			route = server.routes.get(self.path)
+			if route is None:
+				self.send_error(404)
+			else:
+				route(self)
+		except (BrokenPipeError, ConnectionResetError):
+			# The client gave up
+			pass
+		finally:
+			with server.lock:
+				server.in_flight[host] -= 1
+	
+	def log_message(self, format, *args):
+		pass
+
+def send_body(handler, body, status=200, headers={}):
+	handler.send_response(status)
+	handler.send_header('Content-Length', str(len(body)))
+	for header_name, header_value in headers.items():
+		handler.send_header(header_name, header_value)
+	handler.end_headers()
+	handler.wfile.write(body)
+
+def body_route(body, status=200, headers={}, delay=0):
+	def _route(handler):
+		if delay > 0:
+			time.sleep(delay)
+		send_body(handler, body, status=status, headers=headers)
+	
+	return _route
+
+@pytest.fixture
+def http_server():
+	"""
+	A local HTTP server, whose answers are set through its routes,
+	from each path to a function getting the request handler
+	"""
+	server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _RoutedHTTPHandler)
+	server.daemon_threads = True
+	server.lock = threading.Lock()
+	server.routes = {}
+	server.requests = []
+	server.in_flight = {}
+	server.max_in_flight = {}
+	server.max_total_in_flight = 0
+	server.port = server.server_address[1]
+	server.url = 'http://127.0.0.1:{}'.format(server.port)
+	
+	server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+	server_thread.start()
+	yield server
+	
+	server.shutdown()
+	server.server_close()
+
+def make_fetcher(tmp_path, **fetch_config):
+	"""
+	A validator which is only able to fetch schemas into its cache,
+	as no server is initialized
+	"""
+	ftv = FAIRTracksValidatorSingleton.__new__(FAIRTracksValidatorSingleton)
+	ftv.logger = logging.getLogger(FAIRTracksValidatorSingleton.__name__)
+	ftv.max_retries = fetch_config.get('max-retries', FAIRTracksValidatorSingleton.DEFAULT_MAX_RETRIES)
+	ftv.fetch_max_workers = fetch_config.get('max-workers', FAIRTracksValidatorSingleton.DEFAULT_FETCH_MAX_WORKERS)
+	ftv.fetch_max_per_host = fetch_config.get('max-per-host', FAIRTracksValidatorSingleton.DEFAULT_FETCH_MAX_PER_HOST)
+	ftv.fetch_deadline = fetch_config.get('deadline', FAIRTracksValidatorSingleton.DEFAULT_FETCH_DEADLINE)
+	ftv.fetch_max_size = round(fetch_config.get('max-size', FAIRTracksValidatorSingleton.DEFAULT_FETCH_MAX_SIZE_IN_MB) * 1024 * 1024)
+	ftv.cache_file_mode = 0o644
+	ftv.schemaCacheDir = str(tmp_path)
+	os.makedirs(ftv.schemaCacheDir, exist_ok=True)
+	ftv.schema_store = SchemaStore(ftv.schemaCacheDir, file_mode=ftv.cache_file_mode)
+	ftv.metrics = Metrics()
+	
+	return ftv
+
+def _temporary_files(store_dir):
+	return [ name  for name in os.listdir(store_dir)  if name.startswith(SchemaStore.TempPrefix) ]
+
+def _comparable_fetch(curated_schema):
+	"""
+	A fetched schema without the members which depend on the moment
+	"""
+	info = curated_schema['info']
+	cache_fingerprint = info.get('cache_fingerprint', {})
+	return {
+		'source': curated_schema.get('source'),
+		'schema_hash': info.get('schema_hash'),
+		'source_urls': info['source_urls'],
+		'errors': info.get('errors', []),
+		'raw': (cache_fingerprint.get('size'), cache_fingerprint.get('raw_sha256')),
+	}
+
+@pytest.fixture
+def schema_routes(http_server):
+	"""
+	Every schema from the offline datasets, plus a missing and a broken one
+	"""
+	source_urls = []
+	for name in dataset_names(offline=True):
+		for schema_path in dataset_schemas(name):
+			path = '/{}/{}'.format(name, os.path.basename(schema_path))
+			with open(schema_path, mode='rb') as sh:
+				http_server.routes[path] = body_route(sh.read())
+			source_urls.append(http_server.url + path)
+	
+	http_server.routes['/broken.json'] = body_route(b'{"$schema": ')
+	source_urls.extend([http_server.url + '/broken.json', http_server.url + '/missing.json'])
+	
+	return source_urls
+
+def test_concurrent_fetches_match_serial_ones(tmp_path, schema_routes):
+	concurrent_fetches = make_fetcher(tmp_path / 'concurrent')._fetch_schemas([ (source_url, None)  for source_url in schema_routes ])
+	serial_fetches = make_fetcher(tmp_path / 'serial', **{'max-workers': 1})._fetch_schemas([ (source_url, None)  for source_url in schema_routes ])
+	
+	assert sorted(concurrent_fetches.keys()) == sorted(schema_routes)
+	assert { source_url: _comparable_fetch(curated_schema)  for source_url, curated_schema in concurrent_fetches.items() } == { source_url: _comparable_fetch(curated_schema)  for source_url, curated_schema in serial_fetches.items() }
+	
+	assert concurrent_fetches[schema_routes[-2]]['info']['errors'][0]['reason'] == 'json'
+	assert concurrent_fetches[schema_routes[-1]]['info']['errors'][0]['reason'] == 'network'
+	for source_url in schema_routes[:-2]:
+		assert 'errors' not in concurrent_fetches[source_url]['info'], source_url
+		with open(make_fetcher(tmp_path / 'concurrent').schema_store.lookup(concurrent_fetches[source_url]['info']['schema_hash']), mode='r', encoding='utf-8') as jh:
+			assert json.load(jh) == concurrent_fetches[source_url]['source']
+
+def test_connections_per_host_are_bounded(tmp_path, http_server):
+	paths = [ '/slow{}.json'.format(i_path)  for i_path in range(6) ]
+	for path in paths:
+		http_server.routes[path] = body_route(b'{}', delay=0.3)
+	# Both names lead to the same server, but they are different hosts
+	source_urls = []
+	for host in ('127.0.0.1', 'localhost'):
+		source_urls.extend([ ('http://{}:{}{}'.format(host, http_server.port, path), None)  for path in paths ])
+	
+	fetched_schemas = make_fetcher(tmp_path, **{'max-workers': 8, 'max-per-host': 2})._fetch_schemas(source_urls)
+	
+	assert all(map(lambda curated_schema: 'errors' not in curated_schema['info'], fetched_schemas.values()))
+	assert len(http_server.requests) == 12
+	assert max(http_server.max_in_flight.values()) == 2
+	# The hosts were fetched at the same time
+	assert http_server.max_total_in_flight > 2
+
+def _trickle_route(handler):
+	handler.send_response(200)
+	handler.send_header('Content-Length', '1000')
+	handler.end_headers()
+	for _ in range(1000):
+		handler.wfile.write(b' ')
+		handler.wfile.flush()
+		time.sleep(0.05)
+
+def _stalled_route(handler):
+	handler.send_response(200)
+	handler.send_header('Content-Length', '1000')
+	handler.end_headers()
+	handler.wfile.write(b'{')
+	handler.wfile.flush()
+	time.sleep(60)
+
+def test_fetches_abort_on_the_deadline(tmp_path, http_server):
+	deadline = 1.5
+	http_server.routes.update({
+		'/fast.json': body_route(b'{"fast": true}'),
+		'/trickle.json': _trickle_route,
+		'/stalled.json': _stalled_route,
+	})
+	source_urls = [ (http_server.url + path, None)  for path in ('/fast.json', '/trickle.json', '/stalled.json') ]
+	ftv = make_fetcher(tmp_path, deadline=deadline)
+	
+	start = time.monotonic()
+	fetched_schemas = ftv._fetch_schemas(source_urls)
+	elapsed = time.monotonic() - start
+	
+	# The slow fetches did not outlive the call
+	assert elapsed < deadline * 2 + 1
+	assert not any(map(lambda thread: thread.name.startswith('schema-fetch'), threading.enumerate()))
+	assert _temporary_files(ftv.schemaCacheDir) == []
+	
+	assert fetched_schemas[http_server.url + '/fast.json']['source'] == {'fast': True}
+	for path in ('/trickle.json', '/stalled.json'):
+		curated_schema = fetched_schemas[http_server.url + path]
+		assert 'source' not in curated_schema
+		assert [ error['reason']  for error in curated_schema['info']['errors'] ] == ['network']
+	
+	# Only the fast schema reached the store
+	assert [ schema_hash  for schema_hash, _, _ in ftv.schema_store.scan() ] == [fetched_schemas[http_server.url + '/fast.json']['info']['schema_hash']]
+
+SCHEMA_BODY = b'{"$schema": "http://json-schema.org/draft-07/schema#", "type": "object"}'
+ETAG = '"v1"'
+LAST_MODIFIED = 'Sun, 18 Oct 2026 10:00:00 GMT'
+
+def _conditional_route(handler):
+	"""
+	It answers 304 when the request carries the current validators
+	"""
+	if (handler.headers.get('If-None-Match') == ETAG) or (handler.headers.get('If-Modified-Since') == LAST_MODIFIED):
+		send_body(handler, b'', status=304, headers={'ETag': ETAG})
+	else:
+		send_body(handler, SCHEMA_BODY, headers={'ETag': ETAG, 'Last-Modified': LAST_MODIFIED})
+
+def _cached_fetch(ftv, source_url):
+	cached_schema = ftv._fetch_schema(source_url)
+	assert 'errors' not in cached_schema['info']
+	assert cached_schema['info']['http_validators'][source_url]['etag'] == ETAG
+	
+	return cached_schema
+
+def test_not_modified_schemas_keep_the_cached_copy(tmp_path, http_server):
+	http_server.routes['/schema.json'] = _conditional_route
+	source_url = http_server.url + '/schema.json'
+	ftv = make_fetcher(tmp_path)
+	cached_schema = _cached_fetch(ftv, source_url)
+	cached_info = cached_schema['info']
+	stored_path = ftv.schema_store.lookup(cached_info['schema_hash'])
+	stored_mtime_ns = os.stat(stored_path).st_mtime_ns
+	
+	revalidated = ftv._fetch_schema(source_url, cached_schema=cached_schema)
+	
+	# The conditional request carried both validators
+	path, headers = http_server.requests[-1]
+	assert path == '/schema.json'
+	assert headers.get('If-None-Match') == ETAG
+	assert headers.get('If-Modified-Since') == LAST_MODIFIED
+	
+	revalidated_info = revalidated['info']
+	assert revalidated['source'] == cached_schema['source'] == json.loads(SCHEMA_BODY)
+	assert revalidated_info['schema_hash'] == cached_info['schema_hash']
+	assert revalidated_info['cache_fingerprint'] == cached_info['cache_fingerprint']
+	assert revalidated_info['fetched_at'] == cached_info['fetched_at']
+	assert 'errors' not in revalidated_info
+	# The validators missing from the 304 answer are kept
+	assert revalidated_info['http_validators'][source_url]['last_modified'] == LAST_MODIFIED
+	assert revalidated_info['http_validators'][source_url]['checked_at'] >= cached_info['http_validators'][source_url]['checked_at']
+	
+	# Nothing was written to the store
+	assert os.stat(stored_path).st_mtime_ns == stored_mtime_ns
+	assert len(list(ftv.schema_store.scan())) == 1
+	assert _temporary_files(ftv.schemaCacheDir) == []
+
+def test_server_errors_keep_the_cached_copy(tmp_path, http_server):
+	http_server.routes['/schema.json'] = _conditional_route
+	source_url = http_server.url + '/schema.json'
+	# No retries, so there is no backoff
+	ftv = make_fetcher(tmp_path, **{'max-retries': 0})
+	cached_schema = _cached_fetch(ftv, source_url)
+	
+	http_server.routes['/schema.json'] = body_route(b'Unavailable', status=503)
+	revalidated = ftv._fetch_schema(source_url, cached_schema=cached_schema)
+	
+	assert revalidated['source'] == cached_schema['source']
+	assert revalidated['info']['schema_hash'] == cached_schema['info']['schema_hash']
+	assert revalidated['info']['cache_fingerprint'] == cached_schema['info']['cache_fingerprint']
+	assert revalidated['info']['http_validators'] == cached_schema['info']['http_validators']
+	assert 'errors' not in revalidated['info']
+	assert _temporary_files(ftv.schemaCacheDir) == []
+	
+	# Without a cached copy, it is an error
+	fetched = ftv._fetch_schema(source_url)
+	assert 'source' not in fetched
+	assert [ error['reason']  for error in fetched['info']['errors'] ] == ['network']
+
+def test_fresh_schemas_are_not_requested(tmp_path, http_server):
+	http_server.routes['/schema.json'] = body_route(SCHEMA_BODY, headers={'Cache-Control': 'public, max-age=3600'})
+	source_url = http_server.url + '/schema.json'
+	ftv = make_fetcher(tmp_path)
+	cached_schema = ftv._fetch_schema(source_url)
+	assert cached_schema['info']['http_validators'][source_url]['max_age'] == 3600
+	
+	revalidated = ftv._fetch_schema(source_url, cached_schema=cached_schema)
+	
+	assert len(http_server.requests) == 1
+	assert revalidated['info']['schema_hash'] == cached_schema['info']['schema_hash']
+
+DOWNLOAD_BODY = json.dumps({'description': 'x' * 5000}).encode('utf-8')
+
+def attempts_route(*routes):
+	"""
+	Each request is answered by the next route, and the last one
+	answers the remaining requests
+	"""
+	attempts = []
+	
+	def _route(handler):
+		attempts.append(handler.path)
+		routes[min(len(attempts), len(routes)) - 1](handler)
+	
+	return _route
+
+def _interrupted_route(handler):
+	# The connection is closed halfway
+	handler.send_response(200)
+	handler.send_header('Content-Length', str(len(DOWNLOAD_BODY)))
+	handler.send_header('ETag', ETAG)
+	handler.end_headers()
+	handler.wfile.write(DOWNLOAD_BODY[0:len(DOWNLOAD_BODY) // 2])
+	handler.close_connection = True
+
+def _range_route(handler):
+	start = int(handler.headers['Range'][len('bytes='):-1])
+	send_body(handler, DOWNLOAD_BODY[start:], status=206, headers={
+		'Content-Range': 'bytes {0}-{1}/{2}'.format(start, len(DOWNLOAD_BODY) - 1, len(DOWNLOAD_BODY)),
+		'ETag': ETAG,
+	})
+
+def _unsized_route(handler):
+	# The end of the contents is the end of the connection
+	handler.send_response(200)
+	handler.end_headers()
+	handler.wfile.write(DOWNLOAD_BODY)
+	handler.close_connection = True
+
+@pytest.fixture
+def backoffs(monkeypatch):
+	"""
+	The calls to _can_backoff and the sleeps, which do not wait
+	"""
+	recorded = {'can_backoff': [], 'sleeps': []}
+	can_backoff = FAIRTracksValidatorSingleton._can_backoff
+	
+	def _recorded_can_backoff(retries, deadline=None):
+		recorded['can_backoff'].append((retries, deadline))
+		return can_backoff(retries, deadline)
+	
+	monkeypatch.setattr(FAIRTracksValidatorSingleton, '_can_backoff', staticmethod(_recorded_can_backoff))
+	monkeypatch.setattr(time, 'sleep', recorded['sleeps'].append)
+	
+	return recorded
+
+def _download(ftv, source_url, tmp_path, **kwargs):
+	with open(str(tmp_path / 'download.json'), mode='w+b') as dh:
+		headers, received, raw_digest = ftv.retriable_streamed_http_download(urllib.request.Request(source_url), dh, **kwargs)
+		dh.seek(0)
+		return dh.read(), received, raw_digest
+
+def test_interrupted_downloads_are_resumed(tmp_path, http_server, backoffs):
+	http_server.routes['/schema.json'] = attempts_route(_interrupted_route, _range_route)
+	ftv = make_fetcher(tmp_path)
+	
+	contents, received, raw_digest = _download(ftv, http_server.url + '/schema.json', tmp_path)
+	
+	assert contents == DOWNLOAD_BODY
+	assert received == len(DOWNLOAD_BODY)
+	assert raw_digest == hashlib.sha256(DOWNLOAD_BODY).hexdigest()
+	
+	assert len(http_server.requests) == 2
+	_, first_headers = http_server.requests[0]
+	_, resumed_headers = http_server.requests[1]
+	assert first_headers.get('Range') is None
+	assert resumed_headers.get('Range') == 'bytes={}-'.format(len(DOWNLOAD_BODY) // 2)
+	assert resumed_headers.get('If-Range') == ETAG
+	assert backoffs['can_backoff'] == [(1, None)]
+	assert backoffs['sleeps'] == [2]
+
+def test_ignored_ranges_restart_the_download(tmp_path, http_server, backoffs):
+	http_server.routes['/schema.json'] = attempts_route(_interrupted_route, body_route(DOWNLOAD_BODY, headers={'ETag': ETAG}))
+	ftv = make_fetcher(tmp_path)
+	
+	contents, received, raw_digest = _download(ftv, http_server.url + '/schema.json', tmp_path)
+	
+	# The partial contents were discarded
+	assert contents == DOWNLOAD_BODY
+	assert received == len(DOWNLOAD_BODY)
+	assert raw_digest == hashlib.sha256(DOWNLOAD_BODY).hexdigest()
+	assert http_server.requests[1][1].get('Range') is not None
+
+@pytest.mark.parametrize('route', [body_route(DOWNLOAD_BODY), _unsized_route], ids=['declared', 'undeclared'])
+def test_oversized_schemas_are_rejected(tmp_path, http_server, backoffs, route):
+	http_server.routes['/schema.json'] = route
+	ftv = make_fetcher(tmp_path, **{'max-size': 1024 / (1024 * 1024)})
+	assert ftv.fetch_max_size == 1024
+	
+	fetched = ftv._fetch_schema(http_server.url + '/schema.json')
+	
+	assert 'source' not in fetched
+	assert [ error['reason']  for error in fetched['info']['errors'] ] == ['too_large']
+	assert len(http_server.requests) == 1
+	assert _temporary_files(ftv.schemaCacheDir) == []
+	assert list(ftv.schema_store.scan()) == []
+
+def test_server_errors_are_retried_with_backoff(tmp_path, http_server, backoffs):
+	unavailable = body_route(b'Unavailable', status=503)
+	http_server.routes['/schema.json'] = attempts_route(unavailable, unavailable, body_route(DOWNLOAD_BODY))
+	ftv = make_fetcher(tmp_path, **{'max-retries': 3})
+	
+	contents, _, _ = _download(ftv, http_server.url + '/schema.json', tmp_path)
+	
+	assert contents == DOWNLOAD_BODY
+	assert backoffs['can_backoff'] == [(1, None), (2, None)]
+	assert backoffs['sleeps'] == [2, 4]
+
+def test_no_backoff_beyond_the_deadline(tmp_path, http_server, backoffs):
+	http_server.routes['/schema.json'] = body_route(b'Unavailable', status=503)
+	ftv = make_fetcher(tmp_path, **{'max-retries': 3})
+	# Room for the first backoff (2 seconds), but not for the second one (4 seconds)
+	deadline = time.monotonic() + 3
+	
+	with pytest.raises(urllib.error.HTTPError) as excinfo:
+		_download(ftv, http_server.url + '/schema.json', tmp_path, deadline=deadline)
+	
+	assert excinfo.value.code == 503
+	assert backoffs['can_backoff'] == [(1, deadline), (2, deadline)]
+	assert backoffs['sleeps'] == [2]
+	assert len(http_server.requests) == 2
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os
+import stat
+import time
+
+import pytest
+
+import libs.ft_validator
+from libs.ft_validator import FAIRTracksValidatorSingleton
+from libs.schema_store import SchemaStore
+
+def _hash(prefix):
+	return (prefix * 64)[0:64]
+
+def _put(store, schema_hash, contents=b'{}'):
+	tmp_path = os.path.join(store.store_dir, '.fetch-' + schema_hash)
+	with open(tmp_path, mode='wb') as th:
+		th.write(contents)
+	
+	return store.put(tmp_path, schema_hash)
+
+def _write(path, contents=b'{}', age=0):
+	with open(path, mode='wb') as fh:
+		fh.write(contents)
+	if age > 0:
+		past = time.time() - age
+		os.utime(path, (past, past))
+	
+	return path
+
+def test_objects_are_sharded(tmp_path):
+	store = SchemaStore(str(tmp_path), file_mode=0o640)
+	schema_hash = _hash('ab')
+	
+	full_path = _put(store, schema_hash, b'{"a": 1}')
+	
+	assert full_path == os.path.join(str(tmp_path), 'ab', schema_hash) == store.path(schema_hash)
+	assert store.lookup(schema_hash) == full_path
+	assert stat.S_IMODE(os.stat(full_path).st_mode) == 0o640
+	assert os.listdir(str(tmp_path)) == ['ab']
+	assert list(store.scan()) == [(schema_hash, full_path, len(b'{"a": 1}'))]
+	
+	assert store.remove(schema_hash)
+	assert store.lookup(schema_hash) is None
+	assert not store.remove(schema_hash)
+
+def test_legacy_objects_are_found(tmp_path):
+	store = SchemaStore(str(tmp_path))
+	schema_hash = _hash('cd')
+	legacy_path = _write(os.path.join(str(tmp_path), schema_hash))
+	
+	assert store.lookup(schema_hash) == legacy_path
+	assert store.path(schema_hash) != legacy_path
+	
+	# The sharded copy is preferred
+	sharded_path = _put(store, schema_hash)
+	assert store.lookup(schema_hash) == sharded_path
+	assert store.remove(schema_hash)
+	assert store.lookup(schema_hash) == legacy_path
+
+def _populate(store):
+	store_dir = store.store_dir
+	paths = {
+		'referenced': _put(store, _hash('01'), b'{"referenced": true}'),
+		'orphaned': _put(store, _hash('02'), b'{"orphaned": true}'),
+		'legacy_referenced': _write(os.path.join(store_dir, _hash('03')), b'{"legacy": true}', age=10),
+		'legacy_orphaned': _write(os.path.join(store_dir, _hash('04')), b'{"legacy": false}'),
+		'stale_temporary': _write(os.path.join(store_dir, '.fetch-stale.json'), age=SchemaStore.TEMP_GRACE + 60),
+		'young_temporary': _write(os.path.join(store_dir, '.fetch-young.json')),
+		# Files which are not objects are not touched
+		'manifest': _write(os.path.join(store_dir, 'manifest.json')),
+	}
+	os.makedirs(os.path.join(store_dir, '05'))
+	
+	return paths, set([_hash('01'), _hash('03')])
+
+def test_stats(tmp_path):
+	store = SchemaStore(str(tmp_path))
+	paths, referenced_hashes = _populate(store)
+	
+	sizes = { key: os.path.getsize(path)  for key, path in paths.items() }
+	assert store.stats(referenced_hashes) == {
+		'objects': 4,
+		'bytes': sizes['referenced'] + sizes['orphaned'] + sizes['legacy_referenced'] + sizes['legacy_orphaned'],
+		'orphaned_objects': 2,
+		'orphaned_bytes': sizes['orphaned'] + sizes['legacy_orphaned'],
+		'legacy_objects': 1,
+		'temporary_files': 2,
+	}
+
+def test_garbage_is_collected(tmp_path):
+	store = SchemaStore(str(tmp_path))
+	paths, referenced_hashes = _populate(store)
+	legacy_mtime_ns = os.stat(paths['legacy_referenced']).st_mtime_ns
+	sizes = { key: os.path.getsize(path)  for key, path in paths.items() }
+	
+	removed = store.collect_garbage(referenced_hashes)
+	
+	assert removed == {
+		'objects': 3,
+		'bytes': sizes['orphaned'] + sizes['legacy_orphaned'] + sizes['stale_temporary']
+	}
+	for key in ('orphaned', 'legacy_orphaned', 'stale_temporary', 'legacy_referenced'):
+		assert not os.path.exists(paths[key]), key
+	for key in ('referenced', 'young_temporary', 'manifest'):
+		assert os.path.exists(paths[key]), key
+	
+	# The referenced legacy object was moved to its subdirectory,
+	# keeping its modification time
+	moved_path = store.lookup(_hash('03'))
+	assert moved_path == store.path(_hash('03'))
+	assert os.stat(moved_path).st_mtime_ns == legacy_mtime_ns
+	with open(moved_path, mode='rb') as mh:
+		assert mh.read() == b'{"legacy": true}'
+	
+	# Empty subdirectories are removed
+	assert sorted(os.listdir(str(tmp_path))) == sorted(['.fetch-young.json', '01', '03', 'manifest.json'])
+	assert store.stats(referenced_hashes) == {
+		'objects': 2,
+		'bytes': sizes['referenced'] + sizes['legacy_referenced'],
+		'orphaned_objects': 0,
+		'orphaned_bytes': 0,
+		'legacy_objects': 0,
+		'temporary_files': 1,
+	}
+	
+	# Nothing else is collected the next time
+	assert store.collect_garbage(referenced_hashes) == {'objects': 0, 'bytes': 0}
+
+def test_young_temporary_files_are_kept_for_the_grace_period(tmp_path, monkeypatch):
+	store = SchemaStore(str(tmp_path))
+	temporary_path = _write(os.path.join(str(tmp_path), '.fetch-young.json'), age=60)
+	
+	store.collect_garbage(set())
+	assert os.path.exists(temporary_path)
+	
+	monkeypatch.setattr(SchemaStore, 'TEMP_GRACE', 30)
+	store.collect_garbage(set())
+	assert not os.path.exists(temporary_path)
+
+def test_missing_store(tmp_path):
+	store = SchemaStore(str(tmp_path / 'missing'))
+	
+	assert store.lookup(_hash('ab')) is None
+	assert list(store.scan()) == []
+	assert store.stats(set())['objects'] == 0
+
+def test_validator_collects_what_the_manifest_does_not_reference(tmp_path):
+	store = SchemaStore(str(tmp_path))
+	paths, referenced_hashes = _populate(store)
+	ftv = FAIRTracksValidatorSingleton.__new__(FAIRTracksValidatorSingleton)
+	ftv.schema_store = store
+	# Failed fetches have no hash
+	ftv.manifest = {'schemas': [ {'source_urls': ['https://example.org/{}.json'.format(i_hash)], 'schema_hash': schema_hash}  for i_hash, schema_hash in enumerate(sorted(referenced_hashes)) ] + [{'source_urls': ['https://example.org/failed.json']}]}
+	
+	ftv.collect_store_garbage()
+	
+	for key in ('orphaned', 'legacy_orphaned', 'stale_temporary'):
+		assert not os.path.exists(paths[key]), key
+	for schema_hash in referenced_hashes:
+		assert store.lookup(schema_hash) is not None
+	assert ftv.schema_store_stats == store.stats(referenced_hashes)
+	assert ftv.schema_store_stats['orphaned_objects'] == 0
+
+@pytest.mark.parametrize('isRW', [False, True], ids=['reader', 'rebuild'])
+def test_only_the_rebuild_collects_garbage(monkeypatch, isRW):
+	monkeypatch.setattr(libs.ft_validator, 'IndexedFairGTracksValidator', lambda config, isRW: None)
+	calls = []
+	ftv = FAIRTracksValidatorSingleton.__new__(FAIRTracksValidatorSingleton)
+	ftv.config = {}
+	ftv.isRW = isRW
+	ftv.use_snapshot = False
+	ftv.validation_cache = None
+	ftv.parallel_validation = None
+	ftv.validation_jobs = None
+	for method_name in ('init_cache', 'collect_store_garbage', 'restoreValidatorSnapshot', 'validateCachedJSONSchemas'):
+		setattr(ftv, method_name, lambda method_name=method_name: calls.append(method_name) or True)
+	
+	ftv._init_server()
+	
+	if isRW:
+		assert calls == ['init_cache', 'collect_store_garbage', 'validateCachedJSONSchemas']
+	else:
+		# Other processes could still be fetching into the store
+		assert calls == ['init_cache', 'restoreValidatorSnapshot']
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import json
+import logging
+import os
+
+import pytest
+
+from libs.snapshot import ValidatorSnapshot
+
+from conftest import dataset_documents, dataset_names, dataset_schemas, make_app
+
+def _validate_dataset(client, name):
+	results = []
+	for kind in ('good_validation', 'bad_validation'):
+		documents = dataset_documents(name, kind)
+		r = client.post('/validate/array', json=[ document  for _, document in documents ])
+		assert r.status_code == 200
+		results.append(r.get_json())
+		for _, document in documents:
+			r = client.post('/validate', json=document)
+			assert r.status_code == 200
+			results.append(r.get_json())
+	
+	return results
+
+class _RestoredHandler(logging.Handler):
+	def __init__(self):
+		super().__init__(level=logging.DEBUG)
+		self.restored = False
+	
+	def emit(self, record):
+		if record.getMessage().startswith('Restored '):
+			self.restored = True
+
+def _validate_scenario(local_config, name):
+	handler = _RestoredHandler()
+	logger = logging.getLogger('FAIRTracksValidatorSingleton')
+	logger.setLevel(logging.DEBUG)
+	logger.addHandler(handler)
+	client, ftv = make_app(local_config)
+	
+	return {
+		'restored': handler.restored,
+		'saved': os.path.isfile(os.path.join(ftv.schemaCacheDir, ValidatorSnapshot.SnapshotFile)),
+		'schemas': client.get('/schemas').get_json(),
+		'results': _validate_dataset(client, name),
+	}
+
+@pytest.mark.parametrize('name', dataset_names(offline=True))
+def test_restored_snapshot_validates_as_cold_load(name, make_config, run_isolated):
+	local_config = make_config(dataset_schemas(name), schema_cache={'snapshot': True})
+	# The first process loads the schemas, and it saves the snapshot
+	cold = run_isolated(_validate_scenario, local_config, name)
+	assert not cold['restored']
+	assert cold['saved']
+	
+	restored = run_isolated(_validate_scenario, local_config, name)
+	assert restored['restored']
+	
+	assert restored['schemas'] == cold['schemas']
+	assert restored['results'] == cold['results']
+
+def test_snapshot_is_opt_in(make_config):
+	client, ftv = make_app(make_config(dataset_schemas('foreign_key_example')))
+	
+	assert not os.path.exists(os.path.join(ftv.schemaCacheDir, ValidatorSnapshot.SnapshotFile))
+
+def _saved_snapshot(make_config):
+	client, ftv = make_app(make_config(dataset_schemas('foreign_key_example'), schema_cache={'snapshot': True}))
+	snapshot_path = os.path.join(ftv.schemaCacheDir, ValidatorSnapshot.SnapshotFile)
+	assert ValidatorSnapshot.Load(ftv.schemaCacheDir, ftv._schemas) is not None
+	
+	return ftv, snapshot_path
+
+def _rewrite_header(snapshot_path, change):
+	with open(snapshot_path, 'rb') as sh:
+		magic = sh.read(len(ValidatorSnapshot.Magic))
+		header = json.loads(sh.readline())
+		payload = sh.read()
+	change(header)
+	with open(snapshot_path, 'wb') as sh:
+		sh.write(magic + json.dumps(header).encode('utf-8') + b'\n' + payload)
+
+def test_snapshot_from_other_versions_is_rejected(make_config):
+	ftv, snapshot_path = _saved_snapshot(make_config)
+	_rewrite_header(snapshot_path, lambda header: header['versions'].update({'fairtracks_validator': '0.0.1'}))
+	
+	assert ValidatorSnapshot.Load(ftv.schemaCacheDir, ftv._schemas) is None
+
+def test_corrupted_snapshot_is_rejected(make_config):
+	ftv, snapshot_path = _saved_snapshot(make_config)
+	with open(snapshot_path, 'r+b') as sh:
+		sh.seek(-1, os.SEEK_END)
+		last = sh.read(1)
+		sh.seek(-1, os.SEEK_END)
+		sh.write(bytes([last[0] ^ 0xff]))
+	
+	assert ValidatorSnapshot.Load(ftv.schemaCacheDir, ftv._schemas) is None
+
+def test_world_writable_snapshot_is_rejected(make_config):
+	ftv, snapshot_path = _saved_snapshot(make_config)
+	os.chmod(snapshot_path, 0o666)
+	
+	assert ValidatorSnapshot.Load(ftv.schemaCacheDir, ftv._schemas) is None
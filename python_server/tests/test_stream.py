@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import json
+import os
+
+import pytest
+
+from conftest import can_lock_exclusively, dataset_documents, dataset_names, dataset_schemas, inline_relabelled, make_archive
+
+def _ndjson(response):
+	assert response.status_code == 200
+	assert response.mimetype == 'application/x-ndjson'
+	
+	return [ json.loads(line)  for line in response.get_data(as_text=True).splitlines() ]
+
+def _member_path(i_doc):
+	return 'doc{}.json'.format(i_doc)
+
+def _stream_scenario(client, ftv, documents):
+	r = client.post('/validate/array', json=documents)
+	assert r.status_code == 200
+	results = {'array': r.get_json()}
+	
+	results['stream'] = _ndjson(client.post('/validate/stream', json=documents))
+	results['archive_stream'] = _ndjson(client.post('/validate/stream', data=make_archive([ (_member_path(i_doc), json.dumps(document).encode('utf-8'))  for i_doc, document in enumerate(documents) ], 'zip'), content_type='application/octet-stream'))
+	
+	results['single'] = []
+	for document in documents:
+		r = client.post('/validate', json=document)
+		assert r.status_code == 200
+		results['single'].append((r.get_json(), _ndjson(client.post('/validate/stream', json=document))))
+	
+	return results
+
+def _merged_lines(lines):
+	"""
+	It merges the document and keys lines of each file, as they
+	would be reported by /validate/array
+	"""
+	merged = {}
+	for line in lines:
+		if line['phase'] == 'document':
+			assert line['file'] not in merged
+			merged[line['file']] = { k: v  for k, v in line.items()  if k != 'phase' }
+		else:
+			assert line['phase'] == 'keys'
+			assert not line['validated']
+			result = merged[line['file']]
+			assert (result['schema_id'], result['schema_hash']) == (line['schema_id'], line['schema_hash'])
+			result['validated'] = False
+			result['errors'] = result['errors'] + line['errors']
+	
+	return merged
+
+def _assert_stream_matches(lines, array_results):
+	phases = [ line['phase']  for line in lines ]
+	# Documents come first, then the failed cross-document checks
+	# and the summary at last
+	assert phases == sorted(phases[:-1], key=['document','keys'].index) + ['summary']
+	assert _merged_lines(lines[:-1]) == { result['file']: result  for result in array_results }
+	
+	num_failed = len([ result  for result in array_results  if not result['validated'] ])
+	assert lines[-1] == {
+		'phase': 'summary',
+		'documents': len(array_results),
+		'validated': len(array_results) - num_failed,
+		'failed': num_failed
+	}
+
+@pytest.mark.parametrize('name', dataset_names(offline=True))
+def test_stream_matches_plain_validation(name, make_config, run_server):
+	documents = []
+	for kind in ('good_validation', 'bad_validation'):
+		documents.extend([ document  for _, document in dataset_documents(name, kind) ])
+	# Besides, a document without schema
+	documents.append({})
+	
+	results = run_server(make_config(dataset_schemas(name)), _stream_scenario, documents)
+	
+	_assert_stream_matches(results['stream'], results['array'])
+	_assert_stream_matches(results['archive_stream'], inline_relabelled(results['array'], list(map(_member_path, range(len(documents))))))
+	for result, lines in results['single']:
+		_assert_stream_matches(lines, [result])
+
+def _interrupted_scenario(client, ftv, documents):
+	lock_path = os.path.join(ftv.cacheDir, 'schema_cache.lock')
+	r = client.post('/validate/stream', json=documents, buffered=False)
+	first_line = json.loads(next(iter(r.response)))
+	while_streaming = can_lock_exclusively(lock_path)
+	r.close()
+	
+	return first_line, while_streaming, can_lock_exclusively(lock_path)
+
+def test_interrupted_stream_releases_the_locks(make_config, run_server):
+	name = 'unique_simple'
+	documents = [ document  for _, document in dataset_documents(name, 'good_validation') ]
+	
+	first_line, while_streaming, after_close = run_server(make_config(dataset_schemas(name)), _interrupted_scenario, documents)
+	
+	assert first_line['phase'] == 'document'
+	assert not while_streaming
+	assert after_close
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import json
+import os
+import re
+
+from conftest import INVALIDATION_KEY, dataset_documents, dataset_schemas, make_app, wait_for_reload
+
+DATASET = 'foreign_key_example'
+
+def _validate_dataset(client):
+	results = []
+	for kind in ('good_validation', 'bad_validation'):
+		r = client.post('/validate/array', json=[ document  for _, document in dataset_documents(DATASET, kind) ])
+		assert r.status_code == 200
+		results.append(r.get_json())
+	
+	return results
+
+def _schemas_by_url(client):
+	return { schema_info['source_urls'][0]: schema_info  for schema_info in client.get('/schemas').get_json() }
+
+def _invalidate(client, ftv, **targets):
+	loaded_epoch = ftv.hot_reloader.loaded_epoch
+	r = client.delete('/schemas/invalidate', json=dict(invalidation_key=INVALIDATION_KEY, **targets))
+	assert r.status_code == 201
+	wait_for_reload(client, ftv, loaded_epoch)
+
+def _incremental_rebuilds(ftv):
+	"""
+	The number of changed schemas from each incremental rebuild
+	logged in the current cache directory
+	"""
+	with open(os.path.join(ftv.cacheDir, 'background-update.log'), mode='r', encoding='utf-8') as lh:
+		return [ int(match)  for match in re.findall(r'Incremental rebuild with (\d+) changed', lh.read()) ]
+
+def _targeted_scenario(local_config, orphan_hash):
+	# An object left in the store, which no manifest references
+	orphan_path = os.path.join(local_config['cacheDir'], 'schema_cache', orphan_hash[0:2], orphan_hash)
+	os.makedirs(os.path.dirname(orphan_path))
+	with open(orphan_path, mode='w', encoding='utf-8') as oh:
+		json.dump({}, oh)
+	
+	client, ftv = make_app(local_config)
+	steps = {'initial': _schemas_by_url(client)}
+	# Only the rebuilds collect the garbage
+	steps['orphan_kept'] = os.path.exists(orphan_path)
+	
+	r = client.delete('/schemas/invalidate', json={'invalidation_key': INVALIDATION_KEY, 'schema_hashes': ['0' * 64]})
+	steps['unknown_status'] = r.status_code
+	
+	# The first schema changes, and only it is invalidated
+	changed_url = local_config['schemas'][0]
+	schema_path = changed_url[len('file://'):]
+	with open(schema_path, mode='r', encoding='utf-8') as sh:
+		jss = json.load(sh)
+	jss['description'] = 'changed'
+	with open(schema_path, mode='w', encoding='utf-8') as sh:
+		json.dump(jss, sh)
+	_invalidate(client, ftv, source_urls=[changed_url])
+	steps['by_url'] = _schemas_by_url(client)
+	steps['results'] = _validate_dataset(client)
+	steps['rebuilds'] = _incremental_rebuilds(ftv)
+	steps['orphan_collected'] = not os.path.exists(orphan_path)
+	
+	# An unchanged schema is invalidated by its hash
+	unchanged_url = local_config['schemas'][1]
+	_invalidate(client, ftv, schema_hashes=[steps['by_url'][unchanged_url]['schema_hash']])
+	steps['by_hash'] = _schemas_by_url(client)
+	steps['rebuilds'].extend(_incremental_rebuilds(ftv))
+	
+	return steps
+
+def _cold_scenario(local_config):
+	client, ftv = make_app(local_config)
+	
+	return _schemas_by_url(client), _validate_dataset(client)
+
+def test_only_targeted_schemas_are_refetched(make_config, run_isolated):
+	local_config = make_config(dataset_schemas(DATASET))
+	assert len(local_config['schemas']) == 2
+	changed_url, unchanged_url = local_config['schemas']
+	
+	steps = run_isolated(_targeted_scenario, local_config, 'ab' * 32)
+	
+	assert steps['unknown_status'] == 404
+	assert steps['orphan_kept']
+	assert steps['orphan_collected']
+	# Only the schemas whose hash changed are warmed up again
+	assert steps['rebuilds'] == [1, 0]
+	
+	initial, by_url, by_hash = steps['initial'], steps['by_url'], steps['by_hash']
+	assert by_url[changed_url]['schema_hash'] != initial[changed_url]['schema_hash']
+	assert by_url[changed_url]['fetched_at'] != initial[changed_url]['fetched_at']
+	assert by_url[unchanged_url] == initial[unchanged_url]
+	
+	assert by_hash[unchanged_url]['schema_hash'] == initial[unchanged_url]['schema_hash']
+	assert by_hash[unchanged_url]['fetched_at'] != initial[unchanged_url]['fetched_at']
+	assert by_hash[changed_url] == by_url[changed_url]
+	
+	# The reloaded server validates as one loading the changed schemas from scratch
+	cold_schemas, cold_results = run_isolated(_cold_scenario, dict(local_config, cacheDir=local_config['cacheDir'] + '-cold'))
+	assert { url: schema_info['schema_hash']  for url, schema_info in cold_schemas.items() } == { url: schema_info['schema_hash']  for url, schema_info in by_url.items() }
+	assert steps['results'] == cold_results
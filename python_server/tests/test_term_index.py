@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import os
+import uuid
+
+import owlready2
+import pytest
+from jsonschema.exceptions import ValidationError
+
+from fairtracks_validator.extensions.ontology_term import OntologyTerm
+from libs.term_index import IndexedOntologyTerm, TermIndex
+
+TERMS = (
+	('Cell', 'cell'),
+	('CellLine', 'cell line'),
+	('HeLa_Cell', 'HeLa cell'),
+	('Tissue', 'tissue'),
+	('Liver', 'liver tissue'),
+	('Ubiquitous', 'célula ubicua'),
+)
+
+def _build_world(iri, cachePath, extra_terms=()):
+	"""
+	It materializes a small ontology where the term format would do it,
+	so no network is needed
+	"""
+	iri_hash = IndexedOntologyTerm.GetIRIHash(iri)
+	worldDB = IndexedOntologyTerm.TermWorlds.get(iri_hash)
+	if worldDB is None:
+		worldDB = owlready2.World(filename=IndexedOntologyTerm.GetWorldDBPath(iri_hash, cachePath), exclusive=False)
+		IndexedOntologyTerm.TermWorlds[iri_hash] = worldDB
+	onto = worldDB.get_ontology(iri)
+	with onto:
+		for name, label in TERMS + tuple(extra_terms):
+			term_class = type(name, (owlready2.Thing,), {})
+			term_class.label = [label]
+	worldDB.save()
+	IndexedOntologyTerm.ONTO_CACHE[iri_hash] = onto
+	
+	return onto
+
+@pytest.fixture
+def ontology(tmp_path):
+	iri = 'http://example.org/{}/test.owl'.format(uuid.uuid4().hex)
+	cachePath = str(tmp_path)
+	onto = _build_world(iri, cachePath)
+	yield iri, cachePath, onto
+	
+	iri_hash = IndexedOntologyTerm.GetIRIHash(iri)
+	IndexedOntologyTerm.TermIndexes.pop(iri_hash, None)
+	IndexedOntologyTerm.ONTO_CACHE.pop(iri_hash, None)
+	IndexedOntologyTerm.TermWorlds.pop(iri_hash).close()
+
+def _lookups(iri):
+	"""
+	Terms found and not found by each match type
+	"""
+	lookups = []
+	for name, label in TERMS:
+		lookups.extend([
+			('exact', iri + '#' + name),
+			('exact', iri + '#' + name + 'X'),
+			('exact', name),
+			('suffix', name),
+			('suffix', '#' + name),
+			('suffix', name[1:]),
+			('suffix', name[:-1]),
+			('label', label),
+			('label', label.upper()),
+			('label', label[:-1]),
+		])
+	lookups.extend([('exact', iri), ('suffix', 'test.owl'), ('label', '')])
+	
+	return lookups
+
+def _owlready2_lookup(onto, match_type, term):
+	searchType = OntologyTerm.VALID_MATCHES[match_type]
+	return len(onto.search(**{searchType: '*' + term  if match_type == 'suffix'  else term})) > 0
+
+def test_index_lookups_match_owlready2(ontology):
+	iri, cachePath, onto = ontology
+	termIndex = IndexedOntologyTerm.BuildTermIndex(iri, cachePath=cachePath)
+	assert termIndex is not None
+	
+	for match_type, term in _lookups(iri):
+		assert termIndex.lookup(match_type, term) == _owlready2_lookup(onto, match_type, term), (match_type, term)
+
+def test_term_format_answers_as_owlready2(ontology):
+	iri, cachePath, onto = ontology
+	IndexedOntologyTerm.BuildTermIndex(iri, cachePath=cachePath)
+	indexedTerm = IndexedOntologyTerm('http://example.org/schema.json', config={'cacheDir': cachePath}, isRW=False)
+	plainTerm = OntologyTerm('http://example.org/schema.json', config={'cacheDir': cachePath}, isRW=False)
+	
+	def _is_valid(termValidator, match_type, term):
+		try:
+			return termValidator.isValid(None, [iri], term, {'matchType': match_type})
+		except ValidationError:
+			return False
+	
+	for match_type, term in _lookups(iri) + [('suffix', '*Cell'), ('exact', iri + '#*')]:
+		assert _is_valid(indexedTerm, match_type, term) == _is_valid(plainTerm, match_type, term), (match_type, term)
+
+def test_stale_indexes_are_rebuilt(ontology):
+	iri, cachePath, onto = ontology
+	termIndex = IndexedOntologyTerm.BuildTermIndex(iri, cachePath=cachePath)
+	assert not termIndex.lookup('label', 'brand new term')
+	
+	_build_world(iri, cachePath, extra_terms=(('BrandNew', 'brand new term'),))
+	assert IndexedOntologyTerm.OpenTermIndex(iri, cachePath) is None
+	
+	termIndex = IndexedOntologyTerm.BuildTermIndex(iri, cachePath=cachePath)
+	assert termIndex.lookup('label', 'brand new term')
+	assert termIndex.lookup('exact', iri + '#BrandNew')
+	assert IndexedOntologyTerm.OpenTermIndex(iri, cachePath) is termIndex
+
+def test_broken_indexes_are_ignored(tmp_path):
+	index_path = str(tmp_path / 'term_index.idx')
+	TermIndex.Write(index_path, (1, 2), ['http://example.org/a', 'http://example.org/b'], ['a'])
+	
+	termIndex = TermIndex.Open(index_path)
+	assert termIndex.stats()['iris'] == 2
+	assert termIndex.lookup('suffix', '/b')
+	assert TermIndex.Open(index_path, (1, 3)) is None
+	
+	with open(index_path, 'r+b') as ih:
+		ih.write(b'NOTATERM')
+	assert TermIndex.Open(index_path) is None
+	
+	with open(index_path, 'wb'):
+		pass
+	assert TermIndex.Open(index_path) is None
+	assert TermIndex.Open(os.path.join(str(tmp_path), 'missing.idx')) is None
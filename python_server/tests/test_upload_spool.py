@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import io
+import json
+
+import pytest
+
+from libs.upload_spool import UploadSpool
+
+from conftest import dataset_documents, dataset_names, dataset_schemas, inline_relabelled, make_archive
+
+# Small enough to spool every upload to a temporary file
+TINY_SPOOL_SIZE_IN_MB = 0.0001
+
+def _multipart_scenario(client, ftv, documents):
+	r = client.post('/validate/array', json=[ document  for _, document in documents ])
+	assert r.status_code == 200
+	results = {'array': r.get_json()}
+	
+	# Half of the documents go as files, and the other half in an archive
+	half = len(documents) // 2
+	form_files = [ (io.BytesIO(json.dumps(document).encode('utf-8')), label)  for label, document in documents[:half] ]
+	form_files.append((io.BytesIO(make_archive([ (label, json.dumps(document).encode('utf-8'))  for label, document in documents[half:] ], 'zip')), 'bundle.zip'))
+	r = client.post('/validate/multipart', data={'file': form_files}, content_type='multipart/form-data')
+	assert r.status_code == 200
+	results['multipart'] = r.get_json()
+	
+	r = client.post('/validate/archive', data=make_archive([ (label, json.dumps(document).encode('utf-8'))  for label, document in documents ], 'tar.gz'), content_type='application/octet-stream')
+	assert r.status_code == 200
+	results['archive'] = r.get_json()
+	
+	return results
+
+@pytest.mark.parametrize('upload_spool_size', [None, TINY_SPOOL_SIZE_IN_MB])
+@pytest.mark.parametrize('name', dataset_names(offline=True))
+def test_uploads_match_array(name, upload_spool_size, make_config, run_server):
+	documents = []
+	for kind in ('good_validation', 'bad_validation'):
+		documents.extend([ (kind + '_' + basename, document)  for basename, document in dataset_documents(name, kind) ])
+	
+	extra = {}  if upload_spool_size is None  else {'upload_spool_size': upload_spool_size}
+	results = run_server(make_config(dataset_schemas(name), **extra), _multipart_scenario, documents)
+	
+	labels = [ label  for label, _ in documents ]
+	half = len(documents) // 2
+	assert results['multipart'] == inline_relabelled(results['array'], labels[:half] + [ 'bundle.zip::' + label  for label in labels[half:] ])
+	assert results['archive'] == inline_relabelled(results['array'], labels)
+
+def test_small_uploads_stay_in_memory():
+	spool = UploadSpool.Spool(io.BytesIO(b'{"a": 1}'), max_memory=1024)
+	
+	assert isinstance(spool, io.BytesIO)
+	assert spool.read() == b'{"a": 1}'
+
+def test_large_uploads_are_spooled_to_disk():
+	contents = bytes(range(256)) * (3 * UploadSpool.CHUNK_SIZE // 256 + 1)
+	spool = UploadSpool.Spool(io.BytesIO(contents), max_memory=UploadSpool.CHUNK_SIZE)
+	try:
+		assert not isinstance(spool, io.BytesIO)
+		assert UploadSpool.Size(spool) == len(contents)
+		assert spool.tell() == 0
+		assert spool.read() == contents
+	finally:
+		spool.close()
+
+def test_mime_sniffing_keeps_the_position():
+	spool = io.BytesIO(make_archive([('a.json', b'{}')], 'zip'))
+	
+	assert UploadSpool.SniffMime(spool) == 'application/zip'
+	assert spool.tell() == 0
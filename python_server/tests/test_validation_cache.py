@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import json
+
+import pytest
+
+from libs.validation_cache import ValidationResultCache
+
+from conftest import dataset_documents, dataset_names, dataset_schemas
+
+# A schema without extensions, so its documents are cached
+PLAIN_SCHEMA = {
+	'$schema': 'http://json-schema.org/draft-07/schema#',
+	'$id': 'plain_example/1.0',
+	'type': 'object',
+	'properties': {
+		'@schema': {'type': 'string'},
+		'name': {'type': 'string'}
+	},
+	'required': ['name']
+}
+
+PLAIN_DOCUMENTS = [
+	{'@schema': 'plain_example/1.0', 'name': 'uno'},
+	{'@schema': 'plain_example/1.0', 'name': 2},
+	{'@schema': 'plain_example/1.0', 'name': 'tres'},
+	{'@schema': 'plain_example/1.0'},
+	{'@schema': 'unknown_example/1.0', 'name': 'cinco'},
+]
+
+def _requests(name):
+	"""
+	Batches mixing the documents of a dataset, which are not cached, with
+	the ones of the plain schema, in several orders, so the cache hits
+	are merged with the documents validated by each batch
+	"""
+	good = [ document  for _, document in dataset_documents(name, 'good_validation') ]
+	bad = [ document  for _, document in dataset_documents(name, 'bad_validation') ]
+	mixed = [ document  for group in zip(bad, PLAIN_DOCUMENTS, good)  for document in group ] + good + PLAIN_DOCUMENTS + bad
+	
+	return [
+		PLAIN_DOCUMENTS,
+		list(reversed(PLAIN_DOCUMENTS)),
+		good + PLAIN_DOCUMENTS,
+		PLAIN_DOCUMENTS + bad,
+		mixed,
+		list(reversed(mixed)),
+	] + [ [document]  for document in PLAIN_DOCUMENTS ]
+
+def _validate_scenario(client, ftv, requests, rounds):
+	results = []
+	for _ in range(rounds):
+		for documents in requests:
+			r = client.post('/validate/array', json=documents)
+			assert r.status_code == 200
+			results.append(r.get_json())
+	
+	stats = ftv.validation_cache.stats()  if ftv.validation_cache is not None  else None
+	return results, stats
+
+@pytest.mark.parametrize('name', dataset_names(offline=True))
+def test_cached_results_match_validation(name, make_config, run_server, tmp_path):
+	plain_schema_path = tmp_path / 'plain_schema.json'
+	plain_schema_path.write_text(json.dumps(PLAIN_SCHEMA))
+	local_config = make_config(dataset_schemas(name) + [str(plain_schema_path)])
+	requests = _requests(name)
+	
+	expected, _ = run_server(local_config, _validate_scenario, requests, 1)
+	# The first round fills in the cache, and the next ones use it
+	results, stats = run_server(dict(local_config, validation_cache={'enabled': True}), _validate_scenario, requests, 3)
+	
+	assert results == expected * 3
+	num_plain = sum(map(lambda documents: len([ document  for document in documents  if document in PLAIN_DOCUMENTS ]), requests))
+	assert stats['entries'] == len(PLAIN_DOCUMENTS)
+	assert stats['misses'] == len(PLAIN_DOCUMENTS)
+	assert stats['hits'] == 3 * num_plain - len(PLAIN_DOCUMENTS)
+	assert stats['bypassed'] == 3 * (sum(map(len, requests)) - num_plain)
+
+class _SchemaSet(object):
+	"""
+	A loaded schema set with a single schema, without extensions
+	"""
+	jsonRootTag = None
+	ALT_SCHEMA_KEYS = ['@schema']
+	
+	def __init__(self, schema_hash):
+		self.schema_hash = schema_hash
+	
+	def getValidSchemas(self):
+		return {'plain_example/1.0': {'schema_hash': self.schema_hash, 'customFormatInstances': []}}
+
+def test_replaced_schema_sets_are_not_cached():
+	previous = _SchemaSet('previous')
+	current = _SchemaSet('current')
+	cache = ValidationResultCache()
+	cache.reset(previous)
+	previous_key = cache.key(previous, PLAIN_DOCUMENTS[0])
+	assert previous_key is not None
+	
+	cache.reset(current)
+	# The requests which pinned the previous schema set bypass the cache
+	assert cache.key(previous, PLAIN_DOCUMENTS[0]) is None
+	current_key = cache.key(current, PLAIN_DOCUMENTS[0])
+	assert current_key not in (None, previous_key)
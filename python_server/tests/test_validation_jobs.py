@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import io
+import json
+import time
+
+import pytest
+
+from conftest import dataset_documents, dataset_names, dataset_schemas, make_app, make_archive
+
+# Small pages, so the results of every dataset span several of them
+PAGE_SIZE = 3
+
+def _job_results(client, r, timeout=120):
+	"""
+	It waits for the submitted job, and it fetches all its
+	results, page by page
+	"""
+	assert r.status_code == 202
+	job = r.get_json()
+	assert job['status'] in ('queued', 'running', 'done')
+	assert r.headers['Location'].endswith('/jobs/' + job['job_id'])
+	
+	deadline = time.monotonic() + timeout
+	while job['status'] in ('queued', 'running'):
+		assert time.monotonic() < deadline, "The validation job did not finish within {} seconds".format(timeout)
+		time.sleep(0.1)
+		r = client.get('/jobs/' + job['job_id'])
+		assert r.status_code == 200
+		job = r.get_json()
+	assert job['status'] == 'done'
+	
+	results = []
+	while True:
+		r = client.get('/jobs/{}/results'.format(job['job_id']), query_string={'offset': len(results)})
+		assert r.status_code == 200
+		page = r.get_json()
+		assert (page['offset'], page['limit'], page['total']) == (len(results), PAGE_SIZE, job['results'])
+		if len(page['results']) == 0:
+			break
+		results.extend(page['results'])
+	
+	assert len(results) == job['results'] == job['documents_total'] == job['documents_done']
+	
+	r = client.delete('/jobs/' + job['job_id'])
+	assert r.status_code == 204
+	r = client.get('/jobs/' + job['job_id'])
+	assert r.status_code == 404
+	
+	return results
+
+def _form_files(documents):
+	return [ (io.BytesIO(json.dumps(document).encode('utf-8')), label)  for label, document in documents ]
+
+def _jobs_scenario(client, ftv, documents):
+	results = {}
+	array = [ document  for _, document in documents ]
+	archive = make_archive([ (label, json.dumps(document).encode('utf-8'))  for label, document in documents ] + [('broken.json', b'{"a": ')], 'tar.gz')
+	
+	r = client.post('/validate/array', json=array)
+	assert r.status_code == 200
+	results['array'] = (r.get_json(), _job_results(client, client.post('/jobs', json=array)))
+	
+	r = client.post('/validate/archive', data=archive, content_type='application/octet-stream')
+	assert r.status_code == 200
+	results['archive'] = (r.get_json(), _job_results(client, client.post('/jobs', data=archive, content_type='application/octet-stream')))
+	
+	r = client.post('/validate/multipart', data={'file': _form_files(documents)}, content_type='multipart/form-data')
+	assert r.status_code == 200
+	results['multipart'] = (r.get_json(), _job_results(client, client.post('/jobs', data={'file': _form_files(documents)}, content_type='multipart/form-data')))
+	
+	r = client.post('/validate', json=array[0])
+	assert r.status_code == 200
+	results['single'] = ([r.get_json()], _job_results(client, client.post('/jobs', json=array[0])))
+	
+	return results
+
+@pytest.mark.parametrize('name', dataset_names(offline=True))
+def test_job_results_match_synchronous_validation(name, make_config, run_server):
+	documents = []
+	for kind in ('good_validation', 'bad_validation'):
+		documents.extend([ (kind + '_' + basename, document)  for basename, document in dataset_documents(name, kind) ])
+	local_config = make_config(dataset_schemas(name), validation_jobs={'enabled': True, 'page-size': PAGE_SIZE})
+	
+	results = run_server(local_config, _jobs_scenario, documents)
+	
+	for endpoint, (expected, job_results) in results.items():
+		assert job_results == expected, endpoint
+
+def _nothing_scenario(client, ftv):
+	return client.post('/jobs').status_code, client.get('/jobs/{}'.format('0' * 32)).status_code
+
+def test_unknown_and_empty_jobs(make_config, run_server):
+	local_config = make_config(dataset_schemas('unique_simple'), validation_jobs={'enabled': True})
+	
+	assert run_server(local_config, _nothing_scenario) == (400, 404)
+
+def test_jobs_are_disabled_by_default(make_config):
+	client, ftv = make_app(make_config(dataset_schemas('unique_simple')))
+	
+	assert ftv.validation_jobs is None
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# coding: utf-8
+
+import collections
+import json
+
+import pytest
+
+from conftest import dataset_documents, dataset_names, dataset_schemas, inline_relabelled, make_app, make_archive
+
+def _array_results(client, documents):
+	"""
+	The results of validating all the documents of the session at once
+	"""
+	if len(documents) == 0:
+		return []
+	
+	r = client.post('/validate/array', json=list(documents.values()))
+	assert r.status_code == 200
+	
+	return inline_relabelled(r.get_json(), list(documents.keys()))
+
+def _check_session(client, session_id, documents, changes_answer=None):
+	r = client.get('/validate/session/' + session_id)
+	assert r.status_code == 200
+	session = r.get_json()
+	expected = _array_results(client, documents)
+	
+	assert session['results'] == expected
+	assert session['documents'] == len(documents)
+	assert session['failed'] == len([ result  for result in expected  if not result['validated'] ])
+	assert session['validated'] == session['documents'] - session['failed']
+	
+	if changes_answer is not None:
+		# The changed results are the ones of the whole session
+		changed = { result['file']: result  for result in changes_answer['results'] }
+		for key in ('session_id', 'documents', 'validated', 'failed'):
+			assert changes_answer[key] == session[key], key
+		assert changed == { result['file']: result  for result in expected  if result['file'] in changed }
+	
+	return session
+
+def _session_scenario(client, ftv, good_documents, bad_documents):
+	steps = []
+	documents = collections.OrderedDict(good_documents)
+	r = client.post('/validate/session', json=documents)
+	assert r.status_code == 201
+	answer = r.get_json()
+	session_id = answer['session_id']
+	_check_session(client, session_id, documents, answer)
+	steps.append('created')
+	
+	# The bad documents are added one by one, and then removed
+	for label, document in bad_documents:
+		r = client.patch('/validate/session/' + session_id, json={label: document})
+		assert r.status_code == 200
+		documents[label] = document
+		assert label in map(lambda result: result['file'], r.get_json()['results'])
+		_check_session(client, session_id, documents, r.get_json())
+		steps.append('added ' + label)
+	
+	for label, _ in good_documents[:1] + bad_documents:
+		r = client.patch('/validate/session/' + session_id, json={label: None})
+		assert r.status_code == 200
+		del documents[label]
+		assert r.get_json()['removed'] == [label]
+		_check_session(client, session_id, documents, r.get_json())
+		steps.append('removed ' + label)
+	
+	# Replaced documents keep their position
+	if len(good_documents) > 1:
+		label, document = good_documents[1]
+		r = client.patch('/validate/session/' + session_id, json={label: dict(document)})
+		assert r.status_code == 200
+		_check_session(client, session_id, documents, r.get_json())
+		steps.append('replaced ' + label)
+	
+	# Sessions are rebuilt from disk
+	ftv.validation_sessions._forget(session_id)
+	_check_session(client, session_id, documents)
+	steps.append('reopened')
+	
+	r = client.delete('/validate/session/' + session_id)
+	assert r.status_code == 204
+	r = client.get('/validate/session/' + session_id)
+	assert r.status_code == 404
+	
+	return steps
+
+@pytest.mark.parametrize('name', dataset_names(offline=True))
+def test_sessions_match_array_validation(name, make_config, run_server):
+	good_documents = [ ('good_' + basename, document)  for basename, document in dataset_documents(name, 'good_validation') ]
+	bad_documents = [ ('bad_' + basename, document)  for basename, document in dataset_documents(name, 'bad_validation') ]
+	local_config = make_config(dataset_schemas(name), validation_sessions={'enabled': True})
+	
+	steps = run_server(local_config, _session_scenario, good_documents, bad_documents)
+	
+	assert len(steps) == 3 + len(bad_documents) * 2 + (1  if len(good_documents) > 1  else 0)
+
+def _archive_session_scenario(client, ftv, members):
+	r = client.post('/validate/session', data=make_archive(members, 'zip'), content_type='application/octet-stream')
+	assert r.status_code == 201
+	created = r.get_json()
+	
+	r = client.get('/validate/session/' + created['session_id'])
+	assert r.status_code == 200
+	
+	return created, r.get_json()
+
+def test_sessions_from_archives(make_config, run_server):
+	name = 'foreign_key_example'
+	members = [ (basename, json.dumps(document).encode('utf-8'))  for basename, document in dataset_documents(name, 'good_validation') ]
+	members.append(('broken.json', b'{"a": '))
+	
+	created, session = run_server(make_config(dataset_schemas(name), validation_sessions={'enabled': True}), _archive_session_scenario, members)
+	
+	# Members which cannot be read are reported, but not kept
+	assert [ result['file']  for result in created['results']  if not result['validated'] ] == ['broken.json']
+	assert sorted(map(lambda result: result['file'], session['results'])) == sorted(map(lambda member: member[0], members[:-1]))
+	assert session['failed'] == 0
+
+def test_sessions_are_disabled_by_default(make_config):
+	client, ftv = make_app(make_config(dataset_schemas('unique_simple')))
+	
+	assert ftv.validation_sessions is None